@@ -1,12 +1,11 @@
 import os
 import sys
-import ast
 import json
 import time
-import boto3
 import logging
-import tempfile
-import subprocess
+import builtins
+import functools
+from contextlib import nullcontext
 from typing import Dict, Any, Optional
 
 BEDROCK_RUNTIME: str = "bedrock-runtime"
@@ -15,6 +14,89 @@ BEDROCK_RUNTIME: str = "bedrock-runtime"
 logging.basicConfig(format='[%(asctime)s] p%(process)s {%(filename)s:%(lineno)d} %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# When cold start mode is enabled (default), the clients and the code generation prompt
+# are built during the Lambda init phase, which runs with boosted CPU, and the import time
+# breakdown of this module is logged on the first invocation. Rarely used modules (ast,
+# tempfile, subprocess) are always imported lazily by the functions that need them.
+COLD_START_MODE: bool = os.environ.get("COLD_START_MODE", "true").lower() == "true"
+# Projection requested from the knowledge base lambda. Code generation only needs the
+# text and score of each chunk, so the location, metadata and raw response are not returned
+KB_PROJECTION: str = os.environ.get("KB_PROJECTION", "minimal")
+# Rerank mode requested from the knowledge base lambda. 'mmr' drops the low scoring and
+# redundant chunks so that fewer tokens reach the code generation prompt
+KB_RERANK: str = os.environ.get("KB_RERANK", "mmr")
+
+class _ImportTimer:
+    """
+    Records the self and cumulative time of every new module imported while active,
+    in the same format as `python -X importtime`
+    """
+    def __init__(self):
+        self.records: list = []
+        self._depth: int = 0
+        self._child_us: list = [0]
+        self._original_import = None
+
+    def __enter__(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.__import__ = self._original_import
+        return False
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        self._depth += 1
+        self._child_us.append(0)
+        st = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            cumulative_us = int((time.perf_counter() - st) * 1e6)
+            child_us = self._child_us.pop()
+            self._depth -= 1
+            self._child_us[-1] += cumulative_us
+            self.records.append((cumulative_us - child_us, cumulative_us, self._depth, name))
+
+    def format(self) -> str:
+        lines = ["import time: self [us] | cumulative | imported package"]
+        for self_us, cumulative_us, depth, name in self.records:
+            lines.append(f"import time: {self_us:>9} | {cumulative_us:>10} | {'  ' * depth}{name}")
+        return "\n".join(lines)
+
+_import_timer = _ImportTimer()
+with _import_timer if COLD_START_MODE else nullcontext():
+    import boto3
+    from botocore.exceptions import NoRegionError
+    try:
+        # utils/admission_control.py, copied next to app.py in the container image by create_lambda
+        from admission_control import AdmissionController
+    except ImportError:
+        AdmissionController = None
+
+# Clients and prompt templates are cached in module scope so that they are reused
+# across warm invocations of the same execution environment
+_clients: Dict[str, Any] = {}
+_prompt_templates: Dict[str, str] = {}
+_cold_start: bool = True
+# Admission controller of the converse calls of this execution environment, with the budgets of the
+# admission_control section of config.yaml passed as JSON in the ADMISSION_BUDGETS environment variable
+_admission_controller = AdmissionController(json.loads(os.environ["ADMISSION_BUDGETS"])) \
+    if AdmissionController is not None and os.environ.get("ADMISSION_BUDGETS") else None
+
+def _get_client(service_name: str):
+    """
+    Return a cached boto3 client for the given service
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        client = boto3.client(service_name, region_name=os.environ.get("REGION"))
+        _clients[service_name] = client
+    return client
+
 def get_named_parameter(event, name):
     """
     Extract named parameter from event
@@ -46,13 +128,15 @@ def query_knowledge_base(query: str) -> tuple:
     """
     Queries another Lambda function to get information from the knowledge base
     """
-    lambda_client = boto3.client('lambda', region_name=os.environ.get("REGION"))
+    lambda_client = _get_client('lambda')
     payload = {
         'body': json.dumps({
             'query': query,
             'kb_id': os.environ.get("KB_ID"),
             'region': os.environ.get("REGION"),
-            'num_results': 5
+            'num_results': 5,
+            'projection': KB_PROJECTION,
+            'rerank': KB_RERANK
         })
     }
     response = lambda_client.invoke(
@@ -75,12 +159,16 @@ def query_knowledge_base(query: str) -> tuple:
 
 def _get_prompt_template(prompt_id: str) -> str:
     """
-    Get prompt template from Bedrock prompt manager
+    Get prompt template from Bedrock prompt manager, cached per prompt id
     """
+    if prompt_id in _prompt_templates:
+        return _prompt_templates[prompt_id]
     try:
-        bedrock_agent = boto3.client(service_name="bedrock-agent", region_name=os.environ["REGION"])
+        bedrock_agent = _get_client("bedrock-agent")
         response = bedrock_agent.get_prompt(promptIdentifier=prompt_id)
-        return response['variants'][0]['templateConfiguration']['text']['text']
+        template = response['variants'][0]['templateConfiguration']['text']['text']
+        _prompt_templates[prompt_id] = template
+        return template
     except Exception as e:
         logger.error(f"Error getting prompt template: {str(e)}")
         raise
@@ -96,14 +184,18 @@ def _invoke_bedrock_converse(
     """
     Simple function to invoke Bedrock's converse API.
     """
-    bedrock_client = boto3.client(BEDROCK_RUNTIME)
+    bedrock_client = _get_client(BEDROCK_RUNTIME)
     inference_config = {
         "temperature": temperature,
         "maxTokens": max_tokens,
         "topP": top_p,
     }
+    converse = bedrock_client.converse
+    if _admission_controller is not None:
+        # waits for the budget of the model and retries the call when it is throttled
+        converse = functools.partial(_admission_controller.call, "converse", converse, model=endpoint_name)
     st = time.perf_counter()
-    response = bedrock_client.converse(
+    response = converse(
         modelId=endpoint_name,
         messages=messages,
         system=system_prompts,
@@ -152,6 +244,7 @@ def save_generated_code(code_content: str) -> str:
     """
     Save the generated code to a temporary file
     """
+    import tempfile
     try:
         temp_dir = tempfile.mkdtemp()
         file_path = os.path.join(temp_dir, 'generated_code.py')
@@ -165,6 +258,7 @@ def save_generated_code(code_content: str) -> str:
 
 # add logger statements here
 def execute_generated_code(file_path: str) -> Dict:
+    import subprocess
     try:
         temp_dir = os.path.dirname(file_path)
         # print out the content of the file to double check 
@@ -177,7 +271,8 @@ def execute_generated_code(file_path: str) -> Dict:
             capture_output=True,
             text=True,
             timeout=int(os.environ["code_execution_timeout"]),
-            env={**os.environ, 'PYTHONPATH': temp_dir}
+            # the generated code sees the libraries of the function, in its task root, layers or image
+            env={**os.environ, 'PYTHONPATH': os.pathsep.join([temp_dir] + [p for p in sys.path if p])}
         )
         print(f"Result from executing the generated code: {result.stdout}, {result.stderr}")
         execution_result = {
@@ -205,7 +300,37 @@ def execute_generated_code(file_path: str) -> Dict:
             'return_code': -1,
             'success': False}
 
+def _warm_init() -> None:
+    """
+    Build the clients and fetch the code generation prompt during the init phase
+    so that the first invocation does not pay for them
+    """
+    st = time.perf_counter()
+    try:
+        for service_name in ('lambda', 'bedrock-agent', BEDROCK_RUNTIME):
+            _get_client(service_name)
+    except NoRegionError:
+        # outside Lambda without a configured region, for example in tests and benchmarks
+        logger.warning("No region configured, skipping the init phase warming")
+        return
+    prompt_id = os.environ.get("CODE_GEN_PROMPT_ID")
+    if prompt_id:
+        try:
+            _get_prompt_template(prompt_id)
+        except Exception as e:
+            # the prompt is fetched again on the first generate_code call
+            logger.warning(f"Could not fetch the prompt template during init: {e}")
+    logger.info(f"Init phase warming completed in {time.perf_counter() - st:.3f} seconds")
+
+if COLD_START_MODE:
+    _warm_init()
+
 def lambda_handler(event, context):
+    global _cold_start
+    if _cold_start:
+        _cold_start = False
+        if COLD_START_MODE:
+            logger.info(f"Cold start import time breakdown:\n{_import_timer.format()}")
     try:
         print(f"Received event: {event}")
         query = get_named_parameter(event, 'query')
@@ -242,6 +367,7 @@ def lambda_handler(event, context):
                     logger.error(f"Error parsing chunks with json.loads: {e}")
                     try:
                         # If json.loads fails, try ast.literal_eval
+                        import ast
                         chunks = ast.literal_eval(chunks_str)
                     except Exception as e:
                         logger.error(f"Error parsing chunks with ast.literal_eval: {e}")
@@ -279,6 +405,8 @@ def lambda_handler(event, context):
         else:
             raise ValueError(f"Unknown function: {function}")
         print(f"Received response data: {response_data}")
+        if _admission_controller is not None:
+            logger.info(f"Admission control metrics: {json.dumps(_admission_controller.metrics())}")
         return populate_function_response(event, response_data)
     except Exception as e:
         error_message = f"Error processing request: {str(e)}"
@@ -1,29 +1,571 @@
 # This lambda function contains code to 
 # set the bedrock client, and then query the search
 # results from a knowledge base based on the user query. 
+import os
+import re
 import json
+import time
 import logging
+import hashlib
+import threading
+import functools
 import boto3
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from botocore.config import Config
+# utils/retrieval_fusion.py, packaged next to this file by create_kb_lambda
+from retrieval_fusion import DEFAULT_RRF_K, reciprocal_rank_fusion
+try:
+    # utils/admission_control.py, copied next to app.py in the container image by create_lambda
+    from admission_control import AdmissionController
+except ImportError:
+    AdmissionController = None
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Default region for the bedrock client
+DEFAULT_REGION: str = 'us-east-1'
+DEFAULT_NUM_RESULTS: str = 5
+# Size of the connection pool of each bedrock client. Connections are kept alive
+# and reused across the warm invocations of this lambda
+MAX_POOL_CONNECTIONS: int = int(os.environ.get('MAX_POOL_CONNECTIONS', 10))
+# Maximum number of queries accepted in a single batch request
+MAX_BATCH_QUERIES: int = int(os.environ.get('MAX_BATCH_QUERIES', 20))
+# Maximum number of knowledge bases queried by a single fan-out request
+MAX_KNOWLEDGE_BASES: int = int(os.environ.get('MAX_KNOWLEDGE_BASES', 5))
+# Constant of the reciprocal rank fusion of the chunks from several knowledge bases, see retrieval_fusion.py
+RRF_K: int = int(os.environ.get('RRF_K', DEFAULT_RRF_K))
+
+# Bedrock agent runtime clients cached per region in module scope so that they are
+# created once per execution environment instead of once per invocation
+_bedrock_clients: Dict[str, boto3.client] = {}
+# Admission controller of the retrieve and invoke_model calls of this execution environment, with the
+# budgets of the admission_control section of config.yaml passed as JSON in ADMISSION_BUDGETS
+admission_controller = AdmissionController(json.loads(os.environ['ADMISSION_BUDGETS'])) \
+    if AdmissionController is not None and os.environ.get('ADMISSION_BUDGETS') else None
+
+# Projection modes of the retrieved chunks returned by this lambda. 'minimal' only returns
+# the chunk id, text and score, 'standard' adds the location and metadata of each chunk and
+# 'debug' also returns the raw response from the retrieve API
+PROJECTIONS: tuple = ('minimal', 'standard', 'debug')
+DEFAULT_PROJECTION: str = os.environ.get('DEFAULT_PROJECTION', 'standard')
+
+# Thread pool that runs the retrieve calls of a batch request concurrently. It is sized
+# like the connection pool of the client so that every thread can hold a connection
+_executor: Optional[ThreadPoolExecutor] = None
+
+# Search type used for every retrieve call, part of the retrieval cache key
+SEARCH_TYPE: str = 'HYBRID'
+
+# Backend answering the retrieve calls. 'bedrock' queries the knowledge base, 'local' searches
+# the indexes built by utils/local_vector_store.py and packaged with this lambda under
+# LOCAL_INDEX_DIR, one directory per knowledge base id. The local backend needs numpy
+# (for example from a lambda layer) and is meant for small corpora like the API specs.
+RETRIEVER_BACKEND: str = os.environ.get('RETRIEVER_BACKEND', 'bedrock')
+LOCAL_INDEX_DIR: str = os.environ.get('LOCAL_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local_index'))
+
+# Post retrieval reranking of the chunks. 'none' returns every retrieved chunk, 'mmr' cuts the
+# chunks after the first large drop in score and then drops the chunks that are redundant with
+# a more relevant one using Maximal Marginal Relevance. The retrieve API does not return the
+# chunk embeddings, so the similarity between chunks falls back to the cosine of their term
+# vectors, computed in pure Python (see lexical_mmr_select).
+RERANK_MODES: tuple = ('none', 'mmr')
+DEFAULT_RERANK: str = os.environ.get('DEFAULT_RERANK', 'none')
+# Trade off between relevance (1.0) and diversity (0.0) in the MMR selection
+MMR_LAMBDA: float = float(os.environ.get('MMR_LAMBDA', 0.7))
+# Chunks at least this similar to an already selected chunk are dropped
+MMR_REDUNDANCY_THRESHOLD: float = float(os.environ.get('MMR_REDUNDANCY_THRESHOLD', 0.85))
+# The chunks are cut at the first drop in score of at least this fraction of the top score
+SCORE_GAP_RATIO: float = float(os.environ.get('SCORE_GAP_RATIO', 0.4))
+# Minimum number of chunks returned after reranking
+MIN_RERANK_RESULTS: int = int(os.environ.get('MIN_RERANK_RESULTS', 2))
+# Words, camel case parts of identifiers and numbers
+_TERM_PATTERN = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|[0-9]+')
+
+# Retrieval cache settings. The cache is invalidated when a new ingestion job completes:
+# KnowledgeBasesForAmazonBedrock.synchronize_data overwrites an SSM parameter per knowledge
+# base, and the version of that parameter is used as the generation of the cached entries.
+# The TTL bounds the staleness of the entries if the generation cannot be read.
+# The local backend is faster than a cache lookup, so the cache is only used with bedrock
+RETRIEVAL_CACHE_ENABLED: bool = os.environ.get('RETRIEVAL_CACHE', 'true').lower() == 'true' and RETRIEVER_BACKEND == 'bedrock'
+RETRIEVAL_CACHE_SIZE: int = int(os.environ.get('RETRIEVAL_CACHE_SIZE', 256))
+RETRIEVAL_CACHE_TTL_SECONDS: float = float(os.environ.get('RETRIEVAL_CACHE_TTL_SECONDS', 3600))
+# Optional DynamoDB table shared by all the execution environments of this lambda
+RETRIEVAL_CACHE_TABLE: Optional[str] = os.environ.get('RETRIEVAL_CACHE_TABLE')
+KB_GENERATION_PARAMETER_PREFIX: str = os.environ.get('KB_GENERATION_PARAMETER_PREFIX', '/bedrock-kb')
+# How often the generation of a knowledge base is read from SSM
+GENERATION_CHECK_INTERVAL_SECONDS: float = float(os.environ.get('GENERATION_CHECK_INTERVAL_SECONDS', 30))
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Return the module level thread pool, created on first use and reused across invocations
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_POOL_CONNECTIONS, thread_name_prefix='retrieve')
+    return _executor
+
 def get_bedrock_client(region: str) -> boto3.client:
     """
-    Create and return a Bedrock client with the specified configuration
+    Return the cached Bedrock client for the region, creating it with the specified configuration
+    on first use
+    """
+    client = _bedrock_clients.get(region)
+    if client is None:
+        config = Config(
+            region_name=region,
+            retries={
+                'max_attempts': 3,
+                'mode': 'standard'
+            },
+            tcp_keepalive=True,
+            max_pool_connections=MAX_POOL_CONNECTIONS
+        )
+        client = boto3.client('bedrock-agent-runtime', config=config)
+        _bedrock_clients[region] = client
+    return client
+
+def warm_bedrock_client(region: str) -> bool:
+    """
+    Create the client for the region, which loads the service model, resolves the endpoint and
+    the credentials, so that the next retrieve call does not pay for them. No request is sent:
+    botocore has no public API to open a connection of the client pool without an API call, so
+    the TLS connection is opened by the first retrieve call and reused by the following ones
+    Args:
+        region (str): AWS region
+    Returns:
+        bool: True if the client was created
+    """
+    try:
+        get_bedrock_client(region)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not create the bedrock client: {str(e)}")
+        return False
+
+class LocalRetrieveClient:
+    """
+    Answers retrieve calls from the local indexes under root_dir, in the format of the retrieve
+    API. The embeddings of every index are memory-mapped and searched by brute-force inner product.
+    The query is embedded with the same model as the index, see utils/local_vector_store.py.
+    """
+    def __init__(self, root_dir: str, region: str):
+        self.root_dir = root_dir
+        self.region = region
+        self._indexes: Dict[str, tuple] = {}
+        self._bedrock_runtime = None
+
+    def load(self, knowledge_base_id: str) -> tuple:
+        index = self._indexes.get(knowledge_base_id)
+        if index is None:
+            import numpy as np
+            index_dir = os.path.join(self.root_dir, knowledge_base_id)
+            with open(os.path.join(index_dir, 'manifest.json')) as f:
+                manifest = json.load(f)
+            with open(os.path.join(index_dir, 'chunks.json')) as f:
+                chunks = json.load(f)
+            embeddings = np.load(os.path.join(index_dir, 'embeddings.npy'), mmap_mode='r')
+            index = (manifest, chunks, embeddings)
+            self._indexes[knowledge_base_id] = index
+        return index
+
+    def load_all(self) -> int:
+        """
+        Load every index under the root directory and return the number of indexes
+        """
+        for name in os.listdir(self.root_dir):
+            if os.path.isfile(os.path.join(self.root_dir, name, 'manifest.json')):
+                self.load(name)
+        return len(self._indexes)
+
+    def _embed_query(self, query: str, manifest: dict):
+        import numpy as np
+        dimensions = manifest['dimensions']
+        if manifest['embedding_model'] == 'hashing':
+            embedding = np.zeros(dimensions, dtype=np.float32)
+            counts: Dict[str, int] = {}
+            for term in _TERM_PATTERN.findall(query):
+                term = term.lower()
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                digest = int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+                sign = 1.0 if digest & 1 else -1.0
+                embedding[(digest >> 1) % dimensions] += sign * (1.0 + np.log(count))
+        else:
+            if self._bedrock_runtime is None:
+                self._bedrock_runtime = boto3.client('bedrock-runtime', region_name=self.region)
+            body = {'inputText': query}
+            if 'v2' in manifest['embedding_model']:
+                body.update({'dimensions': dimensions, 'normalize': True})
+            invoke_model = self._bedrock_runtime.invoke_model
+            if admission_controller is not None:
+                invoke_model = functools.partial(admission_controller.call, 'invoke_model', invoke_model,
+                                                 model=manifest['embedding_model'])
+            response = invoke_model(modelId=manifest['embedding_model'], body=json.dumps(body))
+            embedding = np.asarray(json.loads(response['body'].read())['embedding'], dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def retrieve(self, knowledgeBaseId: str, retrievalQuery: dict, retrievalConfiguration: dict, **kwargs) -> dict:
+        import numpy as np
+        manifest, chunks, embeddings = self.load(knowledgeBaseId)
+        num_results = min(retrievalConfiguration['vectorSearchConfiguration']['numberOfResults'], len(chunks))
+        if num_results <= 0:
+            return {'retrievalResults': []}
+        scores = embeddings @ self._embed_query(retrievalQuery['text'], manifest)
+        top = np.argpartition(-scores, num_results - 1)[:num_results]
+        top = top[np.argsort(-scores[top])]
+        return {
+            'retrievalResults': [{
+                'content': {'text': chunks[i]['text'], 'type': 'TEXT'},
+                'location': chunks[i]['location'],
+                'score': round(float(scores[i]), 6),
+                'metadata': chunks[i]['metadata']
+            } for i in top]
+        }
+
+_local_retriever: Optional[LocalRetrieveClient] = None
+
+def get_retriever(region: str):
+    """
+    Return the client that answers the retrieve calls of the configured backend
+    """
+    global _local_retriever
+    if RETRIEVER_BACKEND != 'local':
+        return get_bedrock_client(region)
+    if _local_retriever is None:
+        _local_retriever = LocalRetrieveClient(LOCAL_INDEX_DIR, region)
+    return _local_retriever
+
+def warm_retriever(region: str) -> bool:
+    """
+    Create the bedrock client, or load the local indexes with the local backend
+    """
+    if RETRIEVER_BACKEND != 'local':
+        return warm_bedrock_client(region)
+    try:
+        return get_retriever(region).load_all() > 0
+    except Exception as e:
+        logger.warning(f"Could not load the local indexes from {LOCAL_INDEX_DIR}: {str(e)}")
+        return False
+
+def encode_body(body: dict) -> str:
     """
-    config = Config(
-        region_name=region,
-        retries={
-            'max_attempts': 3,
-            'mode': 'standard'
+    Compact JSON encoding of the response body, without the whitespace of the default separators
+    """
+    return json.dumps(body, separators=(',', ':'), default=str)
+
+def _build_response(status_code: int, body: dict) -> dict:
+    """
+    Build the lambda response with the JSON body and the standard headers
+    """
+    encoded_body = encode_body(body)
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'X-Payload-Bytes': str(len(encoded_body.encode('utf-8')))
+        },
+        'body': encoded_body
+    }
+
+def project_retrieval_results(response_ret: dict, projection: str = DEFAULT_PROJECTION) -> dict:
+    """
+    Convert the response of the retrieve API into the chunks returned by this lambda
+    Args:
+        response_ret (dict): Response from the retrieve API
+        projection (str): One of PROJECTIONS, decides which fields are returned for each chunk
+    Returns:
+        dict: Dictionary containing the projected chunks, and the raw response in 'debug' projection
+    """
+    contexts = []
+    for chunk in response_ret.get('retrievalResults', []):
+        metadata = chunk.get('metadata', {})
+        context = {
+            'id': metadata.get('x-amz-bedrock-kb-chunk-id'),
+            'text': chunk['content']['text'],
+            'score': chunk.get('score', 0)
+        }
+        if projection != 'minimal':
+            context['location'] = chunk['location']
+            context['metadata'] = metadata
+        contexts.append(context)
+    result = {
+        'chunks': contexts
+    }
+    if projection == 'debug':
+        result['raw_response'] = response_ret
+    return result
+
+def lexical_term_vector(text: str) -> Dict[str, float]:
+    """
+    L2 normalized term frequency vector of the text, so that the dot product of two
+    vectors is their cosine similarity. Lexical stand-in for the chunk embeddings, which
+    the retrieve API does not return
+    """
+    counts: Dict[str, float] = {}
+    for term in _TERM_PATTERN.findall(text):
+        term = term.lower()
+        counts[term] = counts.get(term, 0.0) + 1.0
+    norm = sum(c * c for c in counts.values()) ** 0.5
+    return {term: c / norm for term, c in counts.items()} if norm else {}
+
+def lexical_cosine_similarity(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """
+    Cosine similarity of two normalized term vectors, a dictionary lookup per term of the shorter one
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(term, 0.0) for term, weight in a.items())
+
+def score_gap_cutoff(results: List[dict], gap_ratio: float = SCORE_GAP_RATIO,
+                     min_results: int = MIN_RERANK_RESULTS) -> List[dict]:
+    """
+    Sort the retrieval results by score and cut them at the first drop in score between two
+    consecutive results of at least gap_ratio times the top score
+    Args:
+        results (List[dict]): Retrieval results from the retrieve API
+        gap_ratio (float): Fraction of the top score that a drop must reach to cut the results
+        min_results (int): Minimum number of results kept
+    Returns:
+        List[dict]: The results before the cut, sorted by descending score
+    """
+    ordered = sorted(results, key=lambda r: r.get('score', 0), reverse=True)
+    if not ordered:
+        return ordered
+    top_score = ordered[0].get('score', 0)
+    if top_score <= 0:
+        return ordered
+    for i in range(max(1, min_results), len(ordered)):
+        if ordered[i - 1].get('score', 0) - ordered[i].get('score', 0) >= gap_ratio * top_score:
+            return ordered[:i]
+    return ordered
+
+def lexical_mmr_select(results: List[dict], lambda_mult: float = MMR_LAMBDA,
+                       redundancy_threshold: float = MMR_REDUNDANCY_THRESHOLD,
+                       min_results: int = MIN_RERANK_RESULTS) -> List[dict]:
+    """
+    Order the retrieval results by Maximal Marginal Relevance and drop the ones that are
+    redundant with an already selected result. This is the lexical fallback of MMR, not a
+    vectorized one: the similarities are computed from term vectors in pure Python, so the
+    selection is O(n^2) in the number of results. That is cheap for the few results of a
+    retrieve call (num_results), but not meant for reranking large candidate lists.
+    Args:
+        results (List[dict]): Retrieval results from the retrieve API
+        lambda_mult (float): Weight of the relevance against the diversity of the next result
+        redundancy_threshold (float): Similarity to a selected result above which a result is dropped
+        min_results (int): Minimum number of results kept, even if they are redundant
+    Returns:
+        List[dict]: The selected results in selection order
+    """
+    if len(results) <= 1:
+        return list(results)
+    vectors = [lexical_term_vector(r['content']['text']) for r in results]
+    top_score = max(r.get('score', 0) for r in results)
+    relevance = [r.get('score', 0) / top_score if top_score > 0 else 1.0 for r in results]
+    # highest similarity of every candidate to the selected results, updated after each selection
+    max_similarity = [0.0] * len(results)
+    remaining = list(range(len(results)))
+    selected: List[int] = []
+    while remaining:
+        best = max(remaining, key=lambda i: lambda_mult * relevance[i] - (1 - lambda_mult) * max_similarity[i])
+        remaining.remove(best)
+        if max_similarity[best] >= redundancy_threshold and len(selected) >= min_results:
+            continue
+        selected.append(best)
+        for i in remaining:
+            max_similarity[i] = max(max_similarity[i], lexical_cosine_similarity(vectors[best], vectors[i]))
+    return [results[i] for i in selected]
+
+def rerank_retrieval_results(response_ret: dict, rerank: str = DEFAULT_RERANK) -> dict:
+    """
+    Apply the rerank mode to the results of a retrieve response
+    Args:
+        response_ret (dict): Response from the retrieve API
+        rerank (str): One of RERANK_MODES
+    Returns:
+        dict: The response with the reranked retrieval results
+    """
+    if rerank == 'none':
+        return response_ret
+    results = response_ret.get('retrievalResults', [])
+    reranked = lexical_mmr_select(score_gap_cutoff(results))
+    logger.info(f"Reranking kept {len(reranked)} of {len(results)} chunks")
+    return {**response_ret, 'retrievalResults': reranked}
+
+class RetrievalCache:
+    """
+    Cache of retrieve responses keyed by (kb_id, normalized query, num_results, search type).
+    Entries live in an in-memory LRU per execution environment and, if a table is configured,
+    in a DynamoDB table shared across execution environments. Every entry is stored with the
+    ingestion generation of its knowledge base and is only served while that generation is current.
+    """
+    def __init__(self, max_size: int = RETRIEVAL_CACHE_SIZE, ttl_seconds: float = RETRIEVAL_CACHE_TTL_SECONDS,
+                 table_name: Optional[str] = RETRIEVAL_CACHE_TABLE,
+                 generation_check_interval: float = GENERATION_CHECK_INTERVAL_SECONDS,
+                 clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.table_name = table_name
+        self.generation_check_interval = generation_check_interval
+        self._clock = clock
+        self._entries: OrderedDict = OrderedDict()
+        self._generations: Dict[str, Tuple[Optional[int], float]] = {}
+        # one lock per knowledge base, so that concurrent misses make a single SSM call
+        self._generation_locks: Dict[str, threading.Lock] = {}
+        self._clients: Dict[Tuple[str, str], boto3.client] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    @staticmethod
+    def make_key(kb_id: str, query: str, num_results: int, search_type: str = SEARCH_TYPE) -> str:
+        """
+        Cache key of a retrieve call. The query is lower cased and its whitespace collapsed.
+        """
+        normalized_query = " ".join(query.lower().split())
+        raw_key = json.dumps([kb_id, normalized_query, int(num_results), search_type])
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+    def _client(self, service_name: str, region: str):
+        # created under the lock, as the batch and fan-out threads share the boto3 default session
+        with self._lock:
+            client = self._clients.get((service_name, region))
+            if client is None:
+                client = boto3.client(service_name, region_name=region)
+                self._clients[(service_name, region)] = client
+            return client
+
+    def get_generation(self, kb_id: str, region: str) -> Optional[int]:
+        """
+        Current ingestion generation of the knowledge base, read from SSM at most once per
+        check interval. Returns 0 if the knowledge base was never synchronized and None
+        if the generation cannot be read.
+        """
+        with self._lock:
+            generation_lock = self._generation_locks.setdefault(kb_id, threading.Lock())
+        with generation_lock:
+            generation, checked_at = self._generations.get(kb_id, (None, None))
+            now = self._clock()
+            if checked_at is not None and now - checked_at < self.generation_check_interval:
+                return generation
+            ssm_client = self._client('ssm', region)
+            try:
+                parameter = ssm_client.get_parameter(Name=f"{KB_GENERATION_PARAMETER_PREFIX}/{kb_id}/ingestion-generation")
+                generation = parameter['Parameter']['Version']
+            except ssm_client.exceptions.ParameterNotFound:
+                generation = 0
+            except Exception as e:
+                logger.warning(f"Could not read the ingestion generation of {kb_id}, relying on the cache TTL: {str(e)}")
+                generation = None
+            self._generations[kb_id] = (generation, now)
+            return generation
+
+    def get(self, key: str, kb_id: str, region: str) -> Optional[dict]:
+        """
+        Return the cached retrieve response for the key if it is still valid
+        """
+        generation = self.get_generation(kb_id, region)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry['generation'] == generation and now - entry['stored_at'] < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.saved_ms += entry['retrieve_ms']
+                    return entry['response']
+                del self._entries[key]
+        if self.table_name:
+            entry = self._get_shared(key, region)
+            if entry is not None and entry['generation'] == generation:
+                with self._lock:
+                    self._store_local(key, entry)
+                    self.shared_hits += 1
+                    self.saved_ms += entry['retrieve_ms']
+                return entry['response']
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, kb_id: str, region: str, response: dict, retrieve_ms: float) -> None:
+        """
+        Store a retrieve response with the current generation of its knowledge base
+        """
+        entry = {
+            'response': {k: v for k, v in response.items() if k != 'ResponseMetadata'},
+            'generation': self.get_generation(kb_id, region),
+            'retrieve_ms': retrieve_ms,
+            'stored_at': self._clock()
         }
-    )
-    return boto3.client('bedrock-agent-runtime', config=config)
+        with self._lock:
+            self._store_local(key, entry)
+        if self.table_name:
+            self._put_shared(key, region, entry)
 
-def query_knowledge_base(query: str, kb_id: str, region: str, num_results: int = 5) -> Optional[dict]:
+    def _store_local(self, key: str, entry: dict) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _get_shared(self, key: str, region: str) -> Optional[dict]:
+        try:
+            item = self._client('dynamodb', region).get_item(
+                TableName=self.table_name,
+                Key={'cache_key': {'S': key}}
+            ).get('Item')
+            # items past their expiry can still be returned until DynamoDB deletes them
+            if item is None or float(item['expires_at']['N']) < time.time():
+                return None
+            return {
+                'response': json.loads(item['response']['S']),
+                'generation': int(item['generation']['N']) if 'generation' in item else None,
+                'retrieve_ms': float(item['retrieve_ms']['N']),
+                'stored_at': self._clock()
+            }
+        except Exception as e:
+            logger.warning(f"Error reading the shared retrieval cache: {str(e)}")
+            return None
+
+    def _put_shared(self, key: str, region: str, entry: dict) -> None:
+        item = {
+            'cache_key': {'S': key},
+            'response': {'S': json.dumps(entry['response'], separators=(',', ':'), default=str)},
+            'retrieve_ms': {'N': str(entry['retrieve_ms'])},
+            # expiry attribute for the DynamoDB time to live
+            'expires_at': {'N': str(int(time.time() + self.ttl_seconds))}
+        }
+        if entry['generation'] is not None:
+            item['generation'] = {'N': str(entry['generation'])}
+        try:
+            self._client('dynamodb', region).put_item(TableName=self.table_name, Item=item)
+        except Exception as e:
+            logger.warning(f"Error writing the shared retrieval cache: {str(e)}")
+
+    def stats(self) -> dict:
+        """
+        Hit ratio and retrieve latency saved by the cache since the execution environment started
+        """
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            'saved_ms': round(self.saved_ms, 2),
+            'entries': len(self._entries)
+        }
+
+retrieval_cache: Optional[RetrievalCache] = RetrievalCache() if RETRIEVAL_CACHE_ENABLED else None
+
+def query_knowledge_base(query: str, kb_id: str, region: str, num_results: int = 5,
+                         projection: str = DEFAULT_PROJECTION, rerank: str = DEFAULT_RERANK) -> Optional[dict]:
     """
     Query the knowledge base using Retrieve API and return results
     Args:
@@ -31,44 +573,151 @@ def query_knowledge_base(query: str, kb_id: str, region: str, num_results: int =
         kb_id (str): Knowledge base ID
         region (str): AWS region
         num_results (int): Number of results to retrieve
+        projection (str): One of PROJECTIONS, decides which fields are returned for each chunk
+        rerank (str): One of RERANK_MODES, applied to the retrieved chunks before the projection
     Returns:
         dict: Dictionary containing retrieved chunks and their scores
     """
     try:
         result: Optional[dict] = None
-        bedrock_client = get_bedrock_client(region)
-        
-        response_ret = bedrock_client.retrieve(
-            knowledgeBaseId=kb_id,
-            retrievalQuery={
-                'text': query
-            },
-            retrievalConfiguration={
-                'vectorSearchConfiguration': {
-                    'numberOfResults': num_results,
-                    'overrideSearchType': 'HYBRID'
+        response_ret = None
+        if retrieval_cache is not None:
+            cache_key = retrieval_cache.make_key(kb_id, query, num_results)
+            response_ret = retrieval_cache.get(cache_key, kb_id, region)
+        if response_ret is None:
+            retrieve = get_retriever(region).retrieve
+            if admission_controller is not None and RETRIEVER_BACKEND == 'bedrock':
+                # waits for the retrieve budget and retries the call when it is throttled
+                retrieve = functools.partial(admission_controller.call, 'retrieve', retrieve)
+            st = time.perf_counter()
+            response_ret = retrieve(
+                knowledgeBaseId=kb_id,
+                retrievalQuery={
+                    'text': query
+                },
+                retrievalConfiguration={
+                    'vectorSearchConfiguration': {
+                        'numberOfResults': num_results,
+                        'overrideSearchType': SEARCH_TYPE
+                    }
                 }
-            }
-        )
-        
-        contexts = []
-        if 'retrievalResults' in response_ret:
-            for chunk in response_ret['retrievalResults']:
-                contexts.append({
-                    'text': chunk['content']['text'],
-                    'location': chunk['location'],
-                    'score': chunk.get('score', 0),
-                    'metadata': chunk.get('metadata', {})
-                })
-        result = {
-            'chunks': contexts,
-            'raw_response': response_ret
-        }
+            )
+            if retrieval_cache is not None:
+                retrieval_cache.put(cache_key, kb_id, region, response_ret, (time.perf_counter() - st) * 1000)
+        result = project_retrieval_results(rerank_retrieval_results(response_ret, rerank), projection)
     except Exception as e:
         logger.error(f"Error querying knowledge base: {str(e)}")
         result = None
     return result
 
+def merge_chunks(results: List[dict]) -> List[dict]:
+    """
+    Merge the chunks of several query results into a single list without duplicates.
+    A chunk returned by several queries is kept once with its highest score and the
+    indices of the queries that returned it.
+    Args:
+        results (List[dict]): Per query results, each containing 'chunks'
+    Returns:
+        List[dict]: Deduplicated chunks sorted by descending score
+    """
+    merged: Dict[str, dict] = {}
+    for query_index, result in enumerate(results):
+        for chunk in result.get('chunks', []):
+            key = chunk.get('id') or chunk['text']
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = {**chunk, 'query_indices': [query_index]}
+            else:
+                existing['query_indices'].append(query_index)
+                if chunk['score'] > existing['score']:
+                    existing['score'] = chunk['score']
+    return sorted(merged.values(), key=lambda chunk: chunk['score'], reverse=True)
+
+def query_knowledge_base_batch(queries: List[str], kb_id: str, region: str, num_results: int = 5,
+                               projection: str = DEFAULT_PROJECTION, merge: bool = False,
+                               rerank: str = DEFAULT_RERANK) -> dict:
+    """
+    Run several queries against the knowledge base concurrently, sharing the pooled client
+    Args:
+        queries (List[str]): The queries to send to the knowledge base
+        kb_id (str): Knowledge base ID
+        region (str): AWS region
+        num_results (int): Number of results to retrieve per query
+        projection (str): One of PROJECTIONS, decides which fields are returned for each chunk
+        merge (bool): Whether to also return the merged and deduplicated chunks of all queries
+        rerank (str): One of RERANK_MODES, applied to the chunks of every query
+    Returns:
+        dict: Per query results in the order of the queries, each with its latency
+    """
+    # create the client before the threads use it
+    get_retriever(region)
+
+    def _run_query(query: str) -> dict:
+        st = time.perf_counter()
+        result = query_knowledge_base(query, kb_id, region, num_results, projection, rerank)
+        entry = {
+            'query': query,
+            'latency_ms': round((time.perf_counter() - st) * 1000, 2)
+        }
+        if result is None:
+            entry['error'] = 'Failed to query knowledge base'
+        else:
+            entry.update(result)
+        return entry
+
+    results = list(_get_executor().map(_run_query, queries))
+    batch_result = {
+        'results': results
+    }
+    if merge:
+        batch_result['merged_chunks'] = merge_chunks(results)
+    return batch_result
+
+def query_knowledge_bases(query: str, kb_ids: List[str], region: str, num_results: int = 5,
+                          projection: str = DEFAULT_PROJECTION, rerank: str = DEFAULT_RERANK) -> Optional[dict]:
+    """
+    Run the query against several knowledge bases concurrently and fuse their chunks
+    Args:
+        query (str): The query to send to the knowledge bases
+        kb_ids (List[str]): Knowledge base IDs
+        region (str): AWS region
+        num_results (int): Number of results to retrieve from each knowledge base
+        projection (str): One of PROJECTIONS, decides which fields are returned for each chunk
+        rerank (str): One of RERANK_MODES, applied to the chunks of each knowledge base before the fusion
+    Returns:
+        dict: Fused chunks tagged with their knowledge base and the latency of each knowledge base,
+        or None if no knowledge base could be queried
+    """
+    # create the client before the threads use it
+    get_retriever(region)
+
+    def _run_query(kb_id: str) -> Tuple[str, Optional[dict], float]:
+        st = time.perf_counter()
+        result = query_knowledge_base(query, kb_id, region, num_results, projection, rerank)
+        return kb_id, result, round((time.perf_counter() - st) * 1000, 2)
+
+    ranked_chunks: Dict[str, List[dict]] = {}
+    knowledge_bases = []
+    for kb_id, result, latency_ms in _get_executor().map(_run_query, kb_ids):
+        entry = {
+            'kb_id': kb_id,
+            'latency_ms': latency_ms
+        }
+        if result is None:
+            entry['error'] = 'Failed to query knowledge base'
+        else:
+            ranked_chunks[kb_id] = sorted(result['chunks'], key=lambda chunk: chunk['score'], reverse=True)
+            entry['num_chunks'] = len(result['chunks'])
+            if 'raw_response' in result:
+                entry['raw_response'] = result['raw_response']
+        knowledge_bases.append(entry)
+    if not ranked_chunks:
+        return None
+    return {
+        'chunks': reciprocal_rank_fusion(ranked_chunks, RRF_K),
+        'knowledge_bases': knowledge_bases
+    }
+
 def lambda_handler(event, context):
     """
     AWS Lambda handler function
@@ -76,75 +725,144 @@ def lambda_handler(event, context):
     try:
         # Extract parameters from event
         body = json.loads(event.get('body', '{}'))
+        region = body.get('region', DEFAULT_REGION) 
+
+        # A warm ping (for example from a scheduled rule) only creates the client (or loads the
+        # local indexes) and returns without doing a retrieve
+        if event.get('warm_ping') or body.get('warm_ping'):
+            region = event.get('region', region)
+            return _build_response(200, {
+                'status': 'warm',
+                'region': region,
+                'client_ready': warm_retriever(region)
+            })
+
+        # Report the hit ratio and latency saved by the retrieval cache of this execution environment
+        if event.get('cache_stats') or body.get('cache_stats'):
+            return _build_response(200, {
+                'cache_enabled': retrieval_cache is not None,
+                'cache_stats': retrieval_cache.stats() if retrieval_cache is not None else {},
+                'admission_control': admission_controller.metrics() if admission_controller is not None else []
+            })
+
         query = body.get('query')
+        queries = body.get('queries')
         kb_id = body.get('kb_id')
-        region = body.get('region', 'us-east-1') 
-        num_results = body.get('num_results', 5)  
+        kb_ids = body.get('kb_ids')
+        num_results = body.get('num_results', DEFAULT_NUM_RESULTS)  
+        projection = body.get('projection', DEFAULT_PROJECTION)
+        rerank = body.get('rerank', DEFAULT_RERANK)
         
         # Validate required parameters
-        if not query:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'error': 'Query parameter is required'
+        if queries is not None:
+            if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+                return _build_response(400, {
+                    'error': 'Queries parameter must be a non empty list of queries'
                 })
-            }
+            if len(queries) > MAX_BATCH_QUERIES:
+                return _build_response(400, {
+                    'error': f'At most {MAX_BATCH_QUERIES} queries are supported per request'
+                })
+        elif not query:
+            return _build_response(400, {
+                'error': 'Query parameter is required'
+            })
             
-        if not kb_id:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'error': 'Knowledge base ID is required'
+        if kb_ids is not None:
+            if not isinstance(kb_ids, list) or not kb_ids or not all(isinstance(k, str) and k for k in kb_ids):
+                return _build_response(400, {
+                    'error': 'Knowledge base IDs parameter must be a non empty list of knowledge base IDs'
                 })
-            }
+            if len(kb_ids) > MAX_KNOWLEDGE_BASES:
+                return _build_response(400, {
+                    'error': f'At most {MAX_KNOWLEDGE_BASES} knowledge bases are supported per request'
+                })
+            if queries is not None:
+                return _build_response(400, {
+                    'error': 'Batch queries are only supported on a single knowledge base'
+                })
+        elif not kb_id:
+            return _build_response(400, {
+                'error': 'Knowledge base ID is required'
+            })
+
+        if projection not in PROJECTIONS:
+            return _build_response(400, {
+                'error': f'Projection must be one of {list(PROJECTIONS)}'
+            })
+
+        if rerank not in RERANK_MODES:
+            return _build_response(400, {
+                'error': f'Rerank must be one of {list(RERANK_MODES)}'
+            })
+
+        # Query the knowledge base with all the queries of a batch request
+        if queries is not None:
+            result = query_knowledge_base_batch(
+                queries=queries,
+                kb_id=kb_id,
+                region=region,
+                num_results=num_results,
+                projection=projection,
+                merge=bool(body.get('merge', False)),
+                rerank=rerank
+            )
+            failed = sum(1 for r in result['results'] if 'error' in r)
+            if failed == len(queries):
+                return _build_response(500, {
+                    'error': 'Failed to query knowledge base'
+                })
+            response = _build_response(200, result)
+            logger.info(f"Returning results of {len(queries)} queries ({failed} failed) in "
+                        f"{response['headers']['X-Payload-Bytes']} payload bytes with the '{projection}' projection")
+            return response
+
+        # Query all the knowledge bases of a fan-out request and fuse their chunks
+        if kb_ids is not None:
+            result = query_knowledge_bases(
+                query=query,
+                kb_ids=list(dict.fromkeys(kb_ids)),
+                region=region,
+                num_results=num_results,
+                projection=projection,
+                rerank=rerank
+            )
+            if result is None:
+                return _build_response(500, {
+                    'error': 'Failed to query knowledge bases'
+                })
+            response = _build_response(200, result)
+            logger.info(f"Returning {len(result['chunks'])} fused chunks from {len(kb_ids)} knowledge bases in "
+                        f"{response['headers']['X-Payload-Bytes']} payload bytes with the '{projection}' projection")
+            return response
 
         # Query the knowledge base
         result = query_knowledge_base(
             query=query,
             kb_id=kb_id,
             region=region,
-            num_results=num_results
+            num_results=num_results,
+            projection=projection,
+            rerank=rerank
         )
         
         if result is None:
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'error': 'Failed to query knowledge base'
-                })
-            }
+            return _build_response(500, {
+                'error': 'Failed to query knowledge base'
+            })
 
         # Return successful response
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps(result)
-        }
+        response = _build_response(200, result)
+        logger.info(f"Returning {len(result['chunks'])} chunks in {response['headers']['X-Payload-Bytes']} "
+                    f"payload bytes with the '{projection}' projection")
+        if retrieval_cache is not None:
+            logger.info(f"Retrieval cache stats: {retrieval_cache.stats()}")
+        if admission_controller is not None:
+            logger.info(f"Admission control metrics: {json.dumps(admission_controller.metrics())}")
+        return response
 
     except Exception as e:
         logger.error(f"Error in lambda_handler: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'error': f'Internal server error: {str(e)}'
-            })
-        }
\ No newline at end of file
+        return _build_response(500, {
+            'error': f'Internal server error: {str(e)}'
+        })
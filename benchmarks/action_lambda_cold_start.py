@@ -0,0 +1,64 @@
+# This script measures the cold and warm handler latency of an action group
+# lambda function. Every run happens in a fresh python interpreter so that the
+# module import and init phase are paid again, the way they are on a Lambda cold start.
+# The handler is invoked with the save_generated_code function since it does not
+# require any network access.
+#
+#   python benchmarks/action_lambda_cold_start.py --runs 10
+#   python benchmarks/action_lambda_cold_start.py --cold-start-mode false
+import argparse
+from pathlib import Path
+from bench_utils import HOME_NETWORK_AGENT_LAMBDA_FILE, run_in_fresh_interpreter, print_latency_table
+
+# This code runs inside the fresh interpreter and prints the timings as a JSON line
+_CHILD_CODE = """
+import sys, json, time
+st = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from bench_utils import load_module, RESULT_PREFIX
+module = load_module(sys.argv[2])
+init_s = time.perf_counter() - st
+event = {
+    "actionGroup": "benchmark",
+    "function": "save_generated_code",
+    "parameters": [{"name": "code_content", "value": "print('hello')"}],
+}
+st = time.perf_counter()
+module.lambda_handler(event, None)
+cold_s = time.perf_counter() - st
+warm_s = []
+for _ in range(int(sys.argv[3])):
+    st = time.perf_counter()
+    module.lambda_handler(event, None)
+    warm_s.append(time.perf_counter() - st)
+print(RESULT_PREFIX + json.dumps({"init_s": init_s, "cold_s": cold_s, "warm_s": warm_s}))
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold and warm latency of an action group lambda handler")
+    parser.add_argument("--lambda-file", default=HOME_NETWORK_AGENT_LAMBDA_FILE)
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters")
+    parser.add_argument("--warm-calls", type=int, default=20, help="warm invocations per interpreter")
+    parser.add_argument("--cold-start-mode", default="true", choices=["true", "false"])
+    args = parser.parse_args()
+
+    bench_dir = str(Path(__file__).resolve().parent)
+    results = [
+        run_in_fresh_interpreter(_CHILD_CODE, [bench_dir, args.lambda_file, str(args.warm_calls)],
+                                 # the lambda runtime sets the region, the lambda creates its clients on import
+                                 env={"COLD_START_MODE": args.cold_start_mode, "REGION": "us-east-1",
+                                      "AWS_DEFAULT_REGION": "us-east-1"})
+        for _ in range(args.runs)
+    ]
+    init_ms = [r["init_s"] * 1000 for r in results]
+    cold_ms = [r["cold_s"] * 1000 for r in results]
+    print(f"lambda file: {args.lambda_file}, cold start mode: {args.cold_start_mode}, runs: {args.runs}")
+    print_latency_table({
+        "init (import)": init_ms,
+        "cold handler": cold_ms,
+        "init + cold handler": [i + c for i, c in zip(init_ms, cold_ms)],
+        "warm handler": [w * 1000 for r in results for w in r["warm_s"]],
+    })
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# This script compares blind retries of throttled calls with the client-side admission control
+# of utils/admission_control.py, on a local stand-in of a Bedrock API that admits a fixed number
+# of calls per second and raises a ThrottlingException above it. Interactive and batch workers
+# call the stand-in in a loop for a fixed duration: without admission control every throttled call
+# is retried at once, up to the maximum retries, and with it every call waits for a token of the
+# converse and model buckets, whose rates start above the capacity of the stand-in and are adjusted
+# with AIMD. The script prints the calls sent, throttles, throughput and latency per priority
+# class, the queue depth and final rate of the buckets, and the overhead of an uncontended acquire.
+#
+#   python benchmarks/admission_control.py --capacity 20 --interactive-workers 4 --batch-workers 12
+#   python benchmarks/admission_control.py --duration-s 10 --initial-rate 60 --max-retries 5
+import sys
+import time
+import argparse
+import threading
+from typing import Dict, List
+from bench_utils import BASE_DIR, percentile, print_latency_table
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.admission_control import AdmissionController, AdmissionTimeout, INTERACTIVE, BATCH, is_throttling
+
+MODEL_ID = "us.amazon.nova-pro-v1:0"
+
+class ThrottlingService:
+    """
+    Stand-in of the converse API that admits capacity calls per second, each taking service_time_s,
+    and raises a ThrottlingException for the calls above the capacity
+    """
+    def __init__(self, capacity: float, service_time_s: float):
+        self.capacity = capacity
+        self.service_time_s = service_time_s
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.calls = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def converse(self, **kwargs) -> dict:
+        from botocore.exceptions import ClientError
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.capacity)
+            self.updated_at = now
+            self.calls += 1
+            if self.tokens < 1.0:
+                self.throttled += 1
+                raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}},
+                                  "Converse")
+            self.tokens -= 1.0
+        time.sleep(self.service_time_s)
+        return {"output": {"message": {"role": "assistant", "content": [{"text": "ok"}]}}}
+
+def blind_call(service: ThrottlingService, max_retries: int) -> None:
+    """Retry a throttled call at once, as the callers without admission control do"""
+    for attempt in range(max_retries + 1):
+        try:
+            return service.converse(modelId=MODEL_ID, messages=[])
+        except Exception as e:
+            if not is_throttling(e) or attempt == max_retries:
+                raise
+
+def run(service: ThrottlingService, controller, args) -> Dict[str, dict]:
+    """Run the workers for the duration, and return the latencies and outcomes per priority class"""
+    results = {priority: {"latency_ms": [], "succeeded": 0, "failed": 0, "timeouts": 0}
+               for priority in (INTERACTIVE, BATCH)}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration_s
+
+    def worker(priority: str) -> None:
+        while time.monotonic() < deadline:
+            st = time.perf_counter()
+            outcome = "succeeded"
+            try:
+                if controller is None:
+                    blind_call(service, args.max_retries)
+                else:
+                    controller.call("converse", service.converse, model=MODEL_ID, priority=priority,
+                                    max_retries=args.max_retries, modelId=MODEL_ID, messages=[])
+            except AdmissionTimeout:
+                outcome = "timeouts"
+            except Exception:
+                # the caller gives up on the request and sends the next one
+                outcome = "failed"
+            with lock:
+                results[priority][outcome] += 1
+                if outcome == "succeeded":
+                    results[priority]["latency_ms"].append((time.perf_counter() - st) * 1000)
+
+    threads = [threading.Thread(target=worker, args=(INTERACTIVE,)) for _ in range(args.interactive_workers)]
+    threads += [threading.Thread(target=worker, args=(BATCH,)) for _ in range(args.batch_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def acquire_overhead_us(iterations: int) -> List[float]:
+    """Time of an uncontended acquire, with budgets that never make the call wait"""
+    controller = AdmissionController({"default": {"rate": 1e9, "burst": 1e9}, "models": {"amazon.nova-pro-v1:0": {
+        "rate": 1e9, "burst": 1e9}}})
+    timings = []
+    for _ in range(iterations):
+        st = time.perf_counter()
+        controller.acquire("converse", MODEL_ID)
+        controller.on_success("converse", MODEL_ID)
+        timings.append((time.perf_counter() - st) * 1e6)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Blind retries vs AIMD admission control on a throttling stand-in")
+    parser.add_argument("--capacity", type=float, default=20, help="calls per second admitted by the stand-in")
+    parser.add_argument("--service-time-s", type=float, default=0.05, help="duration of an admitted call")
+    parser.add_argument("--interactive-workers", type=int, default=4)
+    parser.add_argument("--batch-workers", type=int, default=12)
+    parser.add_argument("--duration-s", type=float, default=5)
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--initial-rate", type=float, default=40,
+                        help="initial rate of the buckets, above the capacity so that AIMD has to find it")
+    parser.add_argument("--max-wait-s", type=float, default=10)
+    args = parser.parse_args()
+
+    budget = {"rate": args.initial_rate, "burst": max(1.0, args.capacity / 2), "min_rate": 1.0,
+              "max_rate": args.initial_rate * 2}
+    print(f"stand-in capacity {args.capacity:g} calls/s, {args.interactive_workers} interactive and "
+          f"{args.batch_workers} batch workers for {args.duration_s:g}s, up to {args.max_retries} retries\n")
+
+    summaries = {}
+    latencies: Dict[str, List[float]] = {}
+    bucket_metrics = []
+    for name in ["blind retries", "admission (AIMD)"]:
+        service = ThrottlingService(args.capacity, args.service_time_s)
+        controller = None
+        if name != "blind retries":
+            controller = AdmissionController({"apis": {"converse": budget}, "models": {"amazon.nova-pro-v1:0": budget},
+                                              "max_wait_s": args.max_wait_s})
+        results = run(service, controller, args)
+        succeeded = sum(r["succeeded"] for r in results.values())
+        summaries[name] = {
+            "sent": service.calls,
+            "throttled": service.throttled,
+            "succeeded": succeeded,
+            "failed": sum(r["failed"] + r["timeouts"] for r in results.values()),
+            "throughput": succeeded / args.duration_s,
+            "p95": {p: percentile(r["latency_ms"], 95) if r["latency_ms"] else 0.0 for p, r in results.items()}
+        }
+        for priority, r in results.items():
+            latencies[f"{name.split()[0]} {priority}"] = r["latency_ms"]
+        if controller is not None:
+            bucket_metrics = controller.metrics()
+
+    print(f"{'run':<20}{'sent':>8}{'throttled':>11}{'succeeded':>11}{'failed':>8}{'calls/s':>9}"
+          f"{'p95 inter. ms':>15}{'p95 batch ms':>14}")
+    for name, s in summaries.items():
+        print(f"{name:<20}{s['sent']:>8}{s['throttled']:>11}{s['succeeded']:>11}{s['failed']:>8}{s['throughput']:>9.1f}"
+              f"{s['p95'][INTERACTIVE]:>15.1f}{s['p95'][BATCH]:>14.1f}")
+    print("\nlatency of the successful calls:")
+    print_latency_table(latencies)
+    print(f"\n{'bucket':<30}{'rate':>8}{'throttles':>11}{'max queue inter.':>18}{'max queue batch':>17}"
+          f"{'mean wait inter. s':>20}{'mean wait batch s':>19}")
+    for m in bucket_metrics:
+        print(f"{m['bucket']:<30}{m['rate']:>8.2f}{m['throttles']:>11}{m['max_queue_depth'][INTERACTIVE]:>18}"
+              f"{m['max_queue_depth'][BATCH]:>17}{m['mean_wait_s'][INTERACTIVE]:>20.3f}{m['mean_wait_s'][BATCH]:>19.3f}")
+    print("\nuncontended acquire and on_success:")
+    print_latency_table({"acquire": acquire_overhead_us(10000)}, unit="us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# This script replays a recorded agent EventStream through the event pipeline of
+# AgentsForAmazonBedrock.invoke and reports the events per second of the parser alone
+# and of the parser with each sink. The console output is discarded and the artifacts
+# are written to a temporary directory. It runs offline on a synthetic stream of
+# supervisor turns, or on a stream recorded as a JSON list of stream events.
+#
+#   python benchmarks/agent_event_pipeline.py --turns 50
+import io
+import sys
+import time
+import tempfile
+import argparse
+import contextlib
+from typing import Callable, List
+from bench_utils import BASE_DIR, synthetic_agent_event_stream
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.agent_events import parse_event_stream, ConsoleRenderer, MetricsAggregator, ArtifactWriter, EventSink
+
+def replay(stream: List[dict], make_sinks: Callable[[], List[EventSink]]) -> int:
+    """
+    Run the stream through the parser and the sinks, and return the number of parsed events
+    """
+    sinks = make_sinks()
+    count = 0
+    for event in parse_event_stream(stream):
+        count += 1
+        for sink in sinks:
+            sink.handle(event)
+    for sink in sinks:
+        sink.close()
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Events per second of the invoke event pipeline")
+    parser.add_argument("--turns", type=int, default=20, help="supervisor turns in the synthetic stream")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    stream = synthetic_agent_event_stream(args.turns)
+    artifact_dir = tempfile.mkdtemp(prefix="agent_response_")
+    pipelines = {
+        "parser only": lambda: [],
+        "+ metrics": lambda: [MetricsAggregator()],
+        "+ console (core)": lambda: [ConsoleRenderer(True, "core")],
+        "+ artifacts": lambda: [ArtifactWriter(artifact_dir)],
+        "all sinks": lambda: [ConsoleRenderer(True, "core"), MetricsAggregator(), ArtifactWriter(artifact_dir)],
+    }
+    print(f"{len(stream)} stream events ({args.turns} turns), {args.iterations} iterations")
+    print(f"{'pipeline':<20}{'events':>8}{'events/s':>14}{'us/event':>12}")
+    for name, make_sinks in pipelines.items():
+        elapsed, count = 0.0, 0
+        for _ in range(args.iterations):
+            with contextlib.redirect_stdout(io.StringIO()):
+                st = time.perf_counter()
+                count = replay(stream, make_sinks)
+                elapsed += time.perf_counter() - st
+        rate = count * args.iterations / elapsed
+        print(f"{name:<20}{count:>8}{rate:>14,.0f}{1e6 / rate:>12.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# This script measures how long the consumer of an agent EventStream is held by each event
+# when the artifacts (generated code and returned images) are written while the stream is
+# consumed, by the ArtifactWriter, or handed to the background thread of the
+# BackgroundArtifactWriter, with and without the images displayed by the console renderer.
+# The synthetic stream returns PNG images in every turn, the same ones unless --distinct-images
+# is set. Images are displayed with the non-interactive Agg backend of matplotlib, and the
+# artifacts are written to a temporary directory.
+#
+#   python benchmarks/artifact_writer.py --turns 10 --images-per-turn 2
+#   python benchmarks/artifact_writer.py --image-size 1024 --distinct-images
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+from typing import Callable, Dict, List
+from bench_utils import BASE_DIR, synthetic_agent_event_stream, print_latency_table
+
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault("MPLBACKEND", "Agg")
+from utils.agent_events import (parse_event_stream, ConsoleRenderer, ArtifactWriter, BackgroundArtifactWriter,
+                                FileEvent, EventSink)
+
+def consume(stream: List[dict], sinks: List[EventSink]) -> Dict[str, List[float]]:
+    """
+    Run the stream through the sinks and return the time in ms each event held the consumer,
+    for the events with files and for the others, and the time close took
+    """
+    latencies = {"file events": [], "other events": [], "close": []}
+    for event in parse_event_stream(stream):
+        st = time.perf_counter()
+        for sink in sinks:
+            sink.handle(event)
+        latencies["file events" if isinstance(event, FileEvent) else "other events"].append(
+            (time.perf_counter() - st) * 1000)
+    st = time.perf_counter()
+    for sink in sinks:
+        sink.close()
+    latencies["close"].append((time.perf_counter() - st) * 1000)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream consumption latency with the artifact writers")
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--images-per-turn", type=int, default=2)
+    parser.add_argument("--image-size", type=int, default=512, help="width and height of the images")
+    parser.add_argument("--distinct-images", action="store_true", help="return different images in every turn")
+    parser.add_argument("--iterations", type=int, default=3)
+    args = parser.parse_args()
+
+    stream = synthetic_agent_event_stream(args.turns, images_per_turn=args.images_per_turn,
+                                          image_size=args.image_size, distinct_images=args.distinct_images)
+    work_dir = tempfile.mkdtemp(prefix="agent_response_")
+    # the ArtifactWriter writes the files other than images to the working directory
+    os.chdir(work_dir)
+    pipelines: Dict[str, Callable[[int], List[EventSink]]] = {
+        "no artifacts": lambda i: [],
+        "sync": lambda i: [ArtifactWriter(f"sync_{i}")],
+        "sync + display": lambda i: [ConsoleRenderer(False), ArtifactWriter(f"sync_display_{i}")],
+        "background": lambda i: [BackgroundArtifactWriter("background", f"session_{i}")],
+        "background + display": lambda i: [ConsoleRenderer(False, display_images=True),
+                                           BackgroundArtifactWriter("background", f"session_display_{i}")],
+    }
+    mb = sum(len(f["bytes"]) for e in stream if "files" in e for f in e["files"]["files"]) / 1e6
+    print(f"{len(stream)} stream events ({args.turns} turns), {args.images_per_turn} images of "
+          f"{args.image_size}x{args.image_size} per turn ({mb:.1f} MB of images), {args.iterations} iterations\n")
+    totals = {}
+    tables: Dict[str, Dict[str, List[float]]] = {}
+    for name, make_sinks in pipelines.items():
+        st = time.perf_counter()
+        for i in range(args.iterations):
+            with contextlib.redirect_stdout(io.StringIO()):
+                for phase, values in consume(stream, make_sinks(i)).items():
+                    tables.setdefault(phase, {}).setdefault(name, []).extend(values)
+        totals[name] = (time.perf_counter() - st) * 1000 / args.iterations
+    for phase, rows in tables.items():
+        print(f"time the consumer is held by {phase}:")
+        print_latency_table(rows)
+        print()
+    print(f"{'pipeline':<28}{'stream consumed + closed ms':>30}")
+    for name, total_ms in totals.items():
+        print(f"{name:<28}{total_ms:>30.1f}")
+
+if __name__ == "__main__":
+    main()
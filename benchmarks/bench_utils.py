@@ -0,0 +1,199 @@
+# This file contains helper functions that are shared by the benchmark scripts
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import struct
+import statistics
+import subprocess
+import importlib.util
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, List, Optional
+
+BASE_DIR: Path = Path(__file__).resolve().parent.parent
+UTILS_DIR: Path = BASE_DIR / "utils"
+HOME_NETWORK_KB_LAMBDA_FILE: str = str(BASE_DIR / "0_home_network_assistant" / "home_network_kb_lambda_function.py")
+HOME_NETWORK_AGENT_LAMBDA_FILE: str = str(BASE_DIR / "0_home_network_assistant" / "home_network_agent_lambda_function.py")
+HOME_NETWORK_API_SPEC_FILE: str = str(BASE_DIR / "data" / "home_network_openapi_spec.json")
+
+# Prefix of the line that a child interpreter prints its JSON result on
+RESULT_PREFIX: str = "BENCHMARK_RESULT "
+
+def load_module(file_path: str, module_name: str = "lambda_function") -> ModuleType:
+    """
+    Load a python file as a module. The lambda functions live in directories
+    that are not python packages so they cannot be imported by name. The modules
+    of utils that are packaged next to the lambda functions, like retrieval_fusion.py,
+    are importable by name as in the lambda package.
+    """
+    if str(UTILS_DIR) not in sys.path:
+        sys.path.append(str(UTILS_DIR))
+    spec = importlib.util.spec_from_file_location(module_name, file_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_in_fresh_interpreter(code: str, args: List[str], env: Optional[Dict] = None) -> dict:
+    """
+    Run the code in a new python interpreter and return the JSON result it prints
+    on the line starting with RESULT_PREFIX
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", code, *args],
+        capture_output=True,
+        text=True,
+        env={**os.environ, **(env or {})},
+        check=True
+    )
+    line = next(l for l in result.stdout.splitlines() if l.startswith(RESULT_PREFIX))
+    return json.loads(line[len(RESULT_PREFIX):])
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest rank percentile of the values
+    """
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def print_latency_table(rows: Dict[str, List[float]], unit: str = "ms") -> None:
+    """
+    Print the median, p90, min and max of every named list of latencies
+    """
+    print(f"{'phase':<28}{'n':>6}{'median ' + unit:>14}{'p90 ' + unit:>12}{'min ' + unit:>12}{'max ' + unit:>12}")
+    for name, values in rows.items():
+        if not values:
+            continue
+        print(f"{name:<28}{len(values):>6}{statistics.median(values):>14.3f}{percentile(values, 90):>12.3f}"
+              f"{min(values):>12.3f}{max(values):>12.3f}")
+
+def chunk_text(text: str, chunk_chars: int = 2000, overlap_chars: int = 400) -> List[str]:
+    """
+    Fixed size chunks with overlap, approximating the 512 token / 20% overlap
+    chunking strategy of the knowledge bases
+    """
+    stride = chunk_chars - overlap_chars
+    return [text[i:i + chunk_chars] for i in range(0, max(1, len(text) - overlap_chars), stride)]
+
+def synthetic_retrieve_response(spec_file: str, num_results: int = 5, kb_id: str = "LOCALKB") -> dict:
+    """
+    Build a response in the format of the bedrock agent runtime retrieve API from the chunks
+    of an API spec, so that payload and post processing benchmarks can run offline
+    """
+    spec_name = Path(spec_file).name
+    chunks = chunk_text(Path(spec_file).read_text())
+    results = []
+    for i in range(num_results):
+        uri = f"s3://{kb_id.lower()}-bucket/{spec_name}"
+        results.append({
+            "content": {"text": chunks[i % len(chunks)], "type": "TEXT"},
+            "location": {"type": "S3", "s3Location": {"uri": uri}},
+            "score": round(0.9 - 0.07 * i, 4),
+            "metadata": {
+                "x-amz-bedrock-kb-source-uri": uri,
+                "x-amz-bedrock-kb-chunk-id": f"1%3A0%3A{kb_id}{i:04d}",
+                "x-amz-bedrock-kb-data-source-id": f"{kb_id}DS",
+            },
+        })
+    return {
+        "ResponseMetadata": {
+            "RequestId": "00000000-0000-0000-0000-000000000000",
+            "HTTPStatusCode": 200,
+            "HTTPHeaders": {"content-type": "application/json", "x-amzn-requestid": "00000000-0000-0000-0000-000000000000"},
+            "RetryAttempts": 0,
+        },
+        "retrievalResults": results,
+    }
+
+class SimulatedRetrieveClient:
+    """
+    Stand-in for the bedrock agent runtime client that answers retrieve calls with a
+    synthetic response after a fixed service latency. It lets the concurrency of the
+    knowledge base lambda be benchmarked without a knowledge base.
+    """
+    def __init__(self, spec_file: str = HOME_NETWORK_API_SPEC_FILE, latency_ms: float = 150.0):
+        self.spec_file = spec_file
+        self.latency_ms = latency_ms
+
+    def retrieve(self, knowledgeBaseId: str, retrievalQuery: dict, retrievalConfiguration: dict, **kwargs) -> dict:
+        time.sleep(self.latency_ms / 1000)
+        num_results = retrievalConfiguration['vectorSearchConfiguration']['numberOfResults']
+        return synthetic_retrieve_response(self.spec_file, num_results, knowledgeBaseId)
+
+def _trace_event(trace: dict, sub_agent: Optional[str] = None) -> dict:
+    supervisor_arn = "arn:aws:bedrock:us-east-1:123456789012:agent-alias/SUPERVISOR/TSTALIASID"
+    caller_chain = [{"agentAliasArn": supervisor_arn}]
+    if sub_agent is not None:
+        caller_chain.append({"agentAliasArn": f"arn:aws:bedrock:us-east-1:123456789012:agent-alias/{sub_agent}/ALIAS1"})
+    return {"trace": {"agentId": "SUPERVISOR", "sessionId": "benchmark", "callerChain": caller_chain, "trace": trace}}
+
+def _usage(input_tokens: int, output_tokens: int) -> dict:
+    return {"metadata": {"usage": {"inputTokens": input_tokens, "outputTokens": output_tokens}}}
+
+def synthetic_png(width: int, height: int, seed: int = 0) -> bytes:
+    """
+    RGB PNG image of random noise, which does not compress, like the plots of the code interpreter
+    """
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+
+    def _png_chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + _png_chunk(b"IDAT", zlib.compress(raw, 1)) + _png_chunk(b"IEND", b""))
+
+def synthetic_agent_event_stream(turns: int = 1, spec_file: str = HOME_NETWORK_API_SPEC_FILE,
+                                 images_per_turn: int = 0, image_size: int = 512,
+                                 distinct_images: bool = False) -> List[dict]:
+    """
+    Build the stream events of a supervisor agent run in the format of the invoke_agent
+    EventStream. Every turn routes to a collaborator that queries the knowledge base and
+    generates code, so that the event pipeline can be benchmarked without an agent. With
+    images_per_turn, every turn also returns PNG files of image_size pixels squared, the
+    same images in every turn unless distinct_images is True.
+    """
+    chunks = chunk_text(Path(spec_file).read_text())
+    code = "import requests\\n\\ndef get_camera_status(device_id):\\n    return requests.get(f'/devices/cameras/{device_id}/status').json()\\n"
+    events = []
+    for turn in range(turns):
+        events += [
+            _trace_event({"routingClassifierTrace": {"modelInvocationInput": {
+                "text": "route", "foundationModel": "anthropic.claude-3-haiku-20240307-v1:0"}}}),
+            _trace_event({"routingClassifierTrace": {"modelInvocationOutput": {
+                **_usage(850, 12), "rawResponse": {"content": json.dumps({"content": [{"text": "<a>undecidable</a>"}]})}}}}),
+            _trace_event({"orchestrationTrace": {"modelInvocationOutput": _usage(2400, 180)}}),
+            _trace_event({"orchestrationTrace": {"rationale": {"text": "The user asks about the porch camera, routing to the home network assistant."}}}),
+            _trace_event({"orchestrationTrace": {"invocationInput": {"agentCollaboratorInvocationInput": {
+                "agentCollaboratorName": "home-network-assistant",
+                "agentCollaboratorAliasArn": "arn:aws:bedrock:us-east-1:123456789012:agent-alias/HOMENET/ALIAS1",
+                "input": {"text": "Write code to get the signal strength of the porch camera"}}}}}),
+            _trace_event({"orchestrationTrace": {"modelInvocationOutput": _usage(1900, 95)}}, "HOMENET"),
+            _trace_event({"orchestrationTrace": {"invocationInput": {"actionGroupInvocationInput": {
+                "actionGroupName": "home-network-actions", "function": "query_knowledge_base",
+                "parameters": [{"name": "input_text", "type": "string", "value": "camera status API"}]}}}}, "HOMENET"),
+            _trace_event({"orchestrationTrace": {"observation": {"actionGroupInvocationOutput": {
+                "text": str({"retrieved_chunks": [{"text": c, "score": 0.8} for c in chunks[:3]]})}}}}, "HOMENET"),
+            _trace_event({"orchestrationTrace": {"modelInvocationOutput": _usage(5200, 140)}}, "HOMENET"),
+            _trace_event({"orchestrationTrace": {"invocationInput": {"actionGroupInvocationInput": {
+                "actionGroupName": "home-network-actions", "function": "generate_code",
+                "parameters": [{"name": "input_text", "type": "string", "value": "get the camera signal strength"}]}}}}, "HOMENET"),
+            _trace_event({"orchestrationTrace": {"observation": {"actionGroupInvocationOutput": {
+                "text": "{'original_generated_code': '```python\\n" + code + "```', 'status': 'success'}"}}}}, "HOMENET"),
+            _trace_event({"orchestrationTrace": {"modelInvocationOutput": _usage(6100, 320)}}, "HOMENET"),
+            _trace_event({"orchestrationTrace": {"observation": {"finalResponse": {"text": "Here is the code."}}}}, "HOMENET"),
+            _trace_event({"orchestrationTrace": {"observation": {"agentCollaboratorInvocationOutput": {
+                "agentCollaboratorName": "home-network-assistant", "output": {"text": "Here is the code.\nIt calls the status API."}}}}}),
+            _trace_event({"orchestrationTrace": {"modelInvocationOutput": _usage(3100, 210)}}),
+            _trace_event({"orchestrationTrace": {"observation": {"finalResponse": {"text": f"Turn {turn}: the porch camera code is ready."}}}}),
+            {"chunk": {"bytes": f"Turn {turn}: the porch camera code is ready.".encode("utf-8"), "attribution": {"citations": []}}},
+        ]
+        if images_per_turn:
+            seeds = [turn * images_per_turn + i if distinct_images else i for i in range(images_per_turn)]
+            events.append({"files": {"files": [
+                {"name": f"plot_{i}.png", "type": "image/png", "bytes": synthetic_png(image_size, image_size, seed)}
+                for i, seed in enumerate(seeds)]}})
+    return events
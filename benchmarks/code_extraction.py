@@ -0,0 +1,98 @@
+# This script compares the extraction of the generated code from the tool outputs of the
+# generate_code function, by extract_generated_code of utils/agent_events.py and by the
+# find/replace approach it replaced, on the latency per tool output and on the fraction of
+# outputs from which the code is recovered exactly. The tool outputs are built the way the
+# action group lambdas build them (the repr of the response dict), from code samples with
+# quotes, escapes and placeholders, and also as JSON and truncated.
+#
+#   python benchmarks/code_extraction.py --iterations 2000
+import sys
+import json
+import time
+import argparse
+import statistics
+from typing import Callable, Dict, List, Optional, Tuple
+from bench_utils import BASE_DIR
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.agent_events import extract_generated_code
+
+CODE_SAMPLES: Dict[str, str] = {
+    "double quotes": 'import requests\n\ndef get_status(device_id):\n    return requests.get(f"/devices/{device_id}/status").json()\n',
+    "apostrophes": "def greet(name):\n    # the device's name\n    print('hello ' + name)\n",
+    "both quotes": 'def describe(device):\n    return f"{device[\'name\']} is \'{device["state"]}\'"\n',
+    "escapes": 'import re\n\nPATTERN = re.compile(r"\\d+\\.\\d+")\nprint("a\\tb\\n")\npath = "C:\\\\temp"\n',
+    "base path": 'with open("$BASE_PATH$/output.csv") as f:\n\tprint(f.read())\n',
+    "large": "\n".join(f'def get_camera_{i}(device_id):\n    """Status of camera {i}"""\n'
+                       f'    return requests.get(f"/devices/cameras/{{device_id}}/{i}").json()\n' for i in range(40)),
+}
+
+def legacy_extract_generated_code(tool_output: str) -> Optional[str]:
+    """
+    The extraction that extract_generated_code replaced: the text between the marker and
+    the next quote, unescaped with one replace per escape
+    """
+    marker = "'original_generated_code': '"
+    if marker not in tool_output:
+        return None
+    code_start = tool_output.find(marker) + len(marker)
+    code_end = tool_output.find("'", code_start)
+    code = tool_output[code_start:code_end]
+    code = code.replace("```python", "").replace("```", "")
+    code = code.replace("\\\\\\$BASE_PATH\\\\\\$/", "")
+    code = code.replace('\\n', '\n')
+    code = code.replace('\\t', '\t')
+    code = code.replace('\\"', '"')
+    code = code.replace("\\'", "'")
+    code = code.replace("\\\\", "\\")
+    return code
+
+def tool_outputs() -> List[Tuple[str, str, str]]:
+    """
+    (name, tool output, expected code) of every code sample, as a repr, as JSON and truncated
+    """
+    cases = []
+    for name, code in CODE_SAMPLES.items():
+        response = {
+            "original_generated_code": f"```python\n{code}```",
+            "input_params": {"device_id": "cam-1"},
+            "status": "Code generated successfully"
+        }
+        expected = code.replace("$BASE_PATH$/", "")
+        cases.append((f"{name} (repr)", str(response), expected))
+        cases.append((f"{name} (json)", json.dumps(response), expected))
+        cases.append((f"{name} (truncated)", str(response)[:-30], expected))
+    return cases
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and accuracy of the generated code extraction")
+    parser.add_argument("--iterations", type=int, default=1000, help="extractions of every tool output")
+    args = parser.parse_args()
+
+    cases = tool_outputs()
+    extractors: Dict[str, Callable[[str], Optional[str]]] = {
+        "find/replace (previous)": legacy_extract_generated_code,
+        "extract_generated_code": extract_generated_code,
+    }
+    print(f"{len(cases)} tool outputs, {args.iterations} iterations\n")
+    print(f"{'case':<28}" + "".join(f"{name:>26}" for name in extractors))
+    for case, tool_output, expected in cases:
+        row = [("ok" if (extract(tool_output) or "").strip("\n") == expected.strip("\n") else "WRONG")
+               for extract in extractors.values()]
+        print(f"{case:<28}" + "".join(f"{cell:>26}" for cell in row))
+
+    print(f"\n{'extractor':<28}{'exact':>10}{'median us':>12}{'mean us':>10}")
+    for name, extract in extractors.items():
+        exact = sum(1 for _, tool_output, expected in cases
+                    if (extract(tool_output) or "").strip("\n") == expected.strip("\n"))
+        per_call_us = []
+        for _, tool_output, _ in cases:
+            st = time.perf_counter()
+            for _ in range(args.iterations):
+                extract(tool_output)
+            per_call_us.append((time.perf_counter() - st) * 1e6 / args.iterations)
+        print(f"{name:<28}{exact:>6}/{len(cases):<3}{statistics.median(per_call_us):>12.2f}"
+              f"{statistics.mean(per_call_us):>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# This script runs the deployment graph of utils/deploy_orchestrator.py with stand-in steps that
+# take the usual time of the real ones (collection creation, docker build and push, ingestion,
+# agent preparation), scaled down so that a deployment takes seconds. It deploys the stack one
+# step at a time, as the notebooks do, and with the steps of the home network and doorbell
+# branches and of the supervisor run concurrently, and prints the timing report of both in
+# simulated seconds. It then fails a step of the doorbell branch, reruns the deployment from the
+# state file and checks that only the failed step and the steps after it run again.
+#
+#   python benchmarks/deploy_orchestrator.py --time-scale 0.005
+import os
+import sys
+import time
+import argparse
+import tempfile
+from typing import Any, Dict, Optional
+from bench_utils import BASE_DIR
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.deploy_orchestrator import DeployOrchestrator, DeployFailure, MultiAgentStack
+
+# Simulated seconds of every step, measured on deployments of the notebooks
+STEP_DURATION_S: Dict[str, float] = {
+    "knowledge_base": 420,  # S3 bucket, IAM role, OpenSearch Serverless collection and index, knowledge base
+    "sync": 90,             # upload of the API spec and ingestion job
+    "kb_lambda": 25,
+    "prompt": 2,
+    "agent": 15,
+    "action_group": 240,    # docker build and push of the lambda image, lambda function, prepare
+    "lambda_env": 5,
+    "alias": 10,
+    "supervisor": 15,
+    "collaborators": 60,    # association and preparation with each sub-agent, alias
+}
+
+class StandInStack(MultiAgentStack):
+    """The steps of MultiAgentStack, each sleeping for its scaled duration instead of calling AWS"""
+
+    def __init__(self, time_scale: float, fail_step: Optional[str] = None):
+        super().__init__(agents=None, kbs={}, config_data={}, region="us-east-1", base_dir=str(BASE_DIR))
+        self.time_scale = time_scale
+        self.fail_step = fail_step
+        self.calls = []
+
+    def _stand_in(self, step: str, kind: str, output: Dict[str, Any]) -> Dict[str, Any]:
+        self.calls.append(step)
+        time.sleep(STEP_DURATION_S[kind] * self.time_scale)
+        if step == self.fail_step:
+            raise RuntimeError(f"simulated failure of {step}")
+        return output
+
+    def knowledge_base(self, branch, outputs):
+        return self._stand_in(f"{branch['name']}:knowledge_base", "knowledge_base",
+                              {"kb_id": f"KB{branch['name'][:4].upper()}", "ds_id": "DS01", "bucket": "bucket"})
+
+    def sync(self, branch, outputs):
+        return self._stand_in(f"{branch['name']}:sync", "sync", {"ingestion_job_ids": ["JOB01"]})
+
+    def kb_lambda(self, branch, outputs):
+        return self._stand_in(f"{branch['name']}:kb_lambda", "kb_lambda", {"function_arn": branch["kb_lambda_name"]})
+
+    def prompt(self, branch, outputs):
+        return self._stand_in(f"{branch['name']}:prompt", "prompt", {"prompt_id": "PROMPT01", "prompt_arn": "arn"})
+
+    def agent(self, branch, outputs):
+        return self._stand_in(f"{branch['name']}:agent", "agent", {"agent_id": f"AG{branch['name'][:4].upper()}"})
+
+    def action_group(self, branch, outputs):
+        return self._stand_in(f"{branch['name']}:action_group", "action_group",
+                              {"lambda_function_name": f"{branch['agent_name']}_lambda"})
+
+    def lambda_env(self, branch, outputs):
+        return self._stand_in(f"{branch['name']}:lambda_env", "lambda_env", {"variables": ["KB_ID"]})
+
+    def alias(self, branch, outputs):
+        agent_id = outputs[f"{branch['name']}:agent"]["agent_id"]
+        return self._stand_in(f"{branch['name']}:alias", "alias",
+                              {"agent_id": agent_id, "alias_id": "ALIAS01", "alias_arn": f"arn/{agent_id}/ALIAS01"})
+
+    def supervisor(self, outputs):
+        return self._stand_in("supervisor:agent", "supervisor", {"agent_id": "SUPERVISOR"})
+
+    def collaborators(self, outputs):
+        return self._stand_in("supervisor:collaborators", "collaborators",
+                              {"agent_id": "SUPERVISOR", "alias_id": "ALIAS01", "alias_arn": "arn/SUPERVISOR/ALIAS01"})
+
+def deploy(stack: StandInStack, state_fpath: str, max_workers: int, time_scale: float) -> DeployOrchestrator:
+    """Run the deployment with the clock in simulated seconds"""
+    orchestrator = DeployOrchestrator(stack.steps(), state_fpath, max_workers,
+                                      clock=lambda: time.monotonic() / time_scale)
+    try:
+        orchestrator.run(verbose=False)
+    except DeployFailure as e:
+        print(e)
+    return orchestrator
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs concurrent deployment of the stack with stand-in steps")
+    parser.add_argument("--time-scale", type=float, default=0.005, help="real seconds per simulated second")
+    parser.add_argument("--fail-step", default="doorbell:action_group")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        for name, max_workers in [("one step at a time, as the notebooks", 1), ("concurrent branches", 8)]:
+            print(f"=== {name}")
+            orchestrator = deploy(StandInStack(args.time_scale), os.path.join(state_dir, f"{max_workers}.json"),
+                                  max_workers, args.time_scale)
+            print(orchestrator.timing_report() + "\n")
+
+        print(f"=== failure of {args.fail_step} and rerun from the state file")
+        state_fpath = os.path.join(state_dir, "resume.json")
+        failing = StandInStack(args.time_scale, fail_step=args.fail_step)
+        deploy(failing, state_fpath, 8, args.time_scale)
+        resumed = StandInStack(args.time_scale)
+        orchestrator = deploy(resumed, state_fpath, 8, args.time_scale)
+        print(f"first run: {len(failing.calls)} steps, rerun: {len(resumed.calls)} steps ({', '.join(resumed.calls)})")
+        print(orchestrator.timing_report())
+
+if __name__ == "__main__":
+    main()
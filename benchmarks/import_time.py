@@ -0,0 +1,87 @@
+# This script measures the import time of the utils modules in fresh python interpreters
+# started with -X importtime, and checks that importing them makes no network calls (the
+# sockets of the child interpreter refuse to connect and the attempts are reported) and does
+# not import the rendering libraries, which are only needed when the console renderer prints.
+# The slowest imports reported by -X importtime are listed for the last module.
+#
+#   python benchmarks/import_time.py
+#   python benchmarks/import_time.py --modules utils.bedrock_agent_helper --runs 10
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import List, Tuple
+from bench_utils import BASE_DIR, RESULT_PREFIX, print_latency_table
+
+DEFAULT_MODULES = ["utils.agent_events", "utils.utils", "utils.bedrock_agent_helper"]
+# Libraries that must not be imported with the modules
+HEAVY_MODULES = ["matplotlib", "IPython", "rich", "termcolor", "requests", "numpy"]
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+# This code runs inside the fresh interpreter and prints the results as a JSON line
+_CHILD_CODE = """
+import sys, json, time, socket, importlib
+sys.path.insert(0, sys.argv[1])
+connects = []
+def _refuse(self, address, *args):
+    connects.append(str(address))
+    raise OSError("network access disabled by the import time benchmark")
+socket.socket.connect = _refuse
+socket.socket.connect_ex = _refuse
+st = time.perf_counter()
+importlib.import_module(sys.argv[2])
+import_s = time.perf_counter() - st
+heavy = [m for m in sys.argv[3].split(",") if m in sys.modules]
+print(RESULT_PREFIX + json.dumps({"import_s": import_s, "connects": connects, "heavy": heavy}))
+"""
+
+def run_import(module: str) -> Tuple[dict, List[Tuple[int, int, int, str]]]:
+    """
+    Import the module in a fresh interpreter with -X importtime, and return the result of
+    the child and the (self us, cumulative us, depth, name) entries reported by -X importtime
+    """
+    code = f"RESULT_PREFIX = {RESULT_PREFIX!r}\n" + _CHILD_CODE
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code, str(BASE_DIR), module,
+                                ",".join(HEAVY_MODULES)],
+                               capture_output=True, text=True, cwd=BASE_DIR)
+    line = next((l for l in completed.stdout.splitlines() if l.startswith(RESULT_PREFIX)), None)
+    if line is None:
+        raise RuntimeError(f"importing {module} failed:\n{completed.stderr[-2000:]}")
+    entries = []
+    for match in _IMPORTTIME_LINE.finditer(completed.stderr):
+        entries.append((int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+    return json.loads(line[len(RESULT_PREFIX):]), entries
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time of the utils modules, without network access")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports listed for the last module")
+    args = parser.parse_args()
+
+    rows, entries = {}, []
+    for module in args.modules:
+        results = []
+        for _ in range(args.runs):
+            result, entries = run_import(module)
+            results.append(result)
+        rows[module] = [r["import_s"] * 1000 for r in results]
+        connects = sorted({c for r in results for c in r["connects"]})
+        heavy = sorted({m for r in results for m in r["heavy"]})
+        print(f"{module}: network connections attempted: {connects or 'none'}, "
+              f"heavy modules imported: {heavy or 'none'}")
+    print()
+    print_latency_table(rows)
+
+    # entries of the last run, one per imported module, with its own and cumulative time
+    top = sorted(entries, key=lambda e: e[0], reverse=True)[:args.top]
+    total_ms = statistics.median(rows[args.modules[-1]])
+    print(f"\nslowest imports of {args.modules[-1]} by own time (-X importtime, median total {total_ms:.1f} ms):")
+    print(f"{'module':<48}{'self ms':>10}{'cumulative ms':>15}")
+    for self_us, cumulative_us, _, name in top:
+        print(f"{name:<48}{self_us / 1000:>10.1f}{cumulative_us / 1000:>15.1f}")
+
+if __name__ == "__main__":
+    main()
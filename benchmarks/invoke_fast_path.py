@@ -0,0 +1,113 @@
+# This script measures the per-event overhead of AgentsForAmazonBedrock.invoke without trace,
+# on the default path (typed events, console renderer, metrics aggregator and artifact writer)
+# and in fast mode (invoke(..., fast=True), which only joins the answer chunks and collects
+# the files), on recorded streams replayed by the ReplayClient of utils/event_recording.py.
+# The overhead is the time of invoke minus the time to read the same replayed stream with a
+# bare loop, divided by the number of stream events. The recordings are synthesized from the
+# synthetic supervisor stream without its trace events, as invoke_agent returns them without
+# trace, with the answer of every turn streamed in several chunks, and with its trace events
+# to compare with a traced invocation. The console output is discarded and the artifacts are
+# written to a temporary directory.
+#
+#   python benchmarks/invoke_fast_path.py --turns 10 --chunks-per-turn 20
+#   python benchmarks/invoke_fast_path.py --images-per-turn 1 --iterations 50
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import contextlib
+from pathlib import Path
+from typing import Callable, Dict, List
+from bench_utils import BASE_DIR, synthetic_agent_event_stream, print_latency_table
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.event_recording import write_recording, ReplayClient, RECORDING_SUFFIX
+
+def split_chunks(stream: List[dict], chunks_per_turn: int) -> List[dict]:
+    """Split the answer chunk of every turn into chunks_per_turn chunks, like a streamed final response"""
+    events = []
+    for event in stream:
+        if "chunk" not in event:
+            events.append(event)
+            continue
+        data = event["chunk"]["bytes"]
+        size = max(1, -(-len(data) // chunks_per_turn))
+        events += [{"chunk": {"bytes": data[i:i + size]}} for i in range(0, len(data), size)]
+    return events
+
+def synthesize_recording(path: Path, stream: List[dict]) -> ReplayClient:
+    write_recording(path, ((0.0, event) for event in stream),
+                    request={"agentId": "SUPERVISOR", "agentAliasId": "TSTALIASID", "inputText": "replay"})
+    return ReplayClient(path, mode="fast")
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-event overhead of invoke without trace, default path and fast mode")
+    parser.add_argument("--turns", type=int, default=10, help="supervisor turns of the synthesized recordings")
+    parser.add_argument("--chunks-per-turn", type=int, default=20, help="chunks the answer of every turn is streamed in")
+    parser.add_argument("--images-per-turn", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=30)
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="invoke_fast_path_"))
+    stream = split_chunks(synthetic_agent_event_stream(args.turns, images_per_turn=args.images_per_turn,
+                                                       image_size=64), args.chunks_per_turn)
+    no_trace_stream = [event for event in stream if "trace" not in event]
+    clients = {
+        "no trace": synthesize_recording(work_dir / f"no_trace{RECORDING_SUFFIX}", no_trace_stream),
+        "with trace": synthesize_recording(work_dir / f"trace{RECORDING_SUFFIX}", stream),
+    }
+
+    # the agents helper reads its configuration from the repository root
+    os.chdir(BASE_DIR)
+    from utils.bedrock_agent_helper import AgentsForAmazonBedrock
+    agents = {name: AgentsForAmazonBedrock(runtime_client=client) for name, client in clients.items()}
+    # fast mode runs first in an empty directory, which it must leave empty
+    fast_dir = work_dir / "fast"
+    fast_dir.mkdir()
+    os.chdir(fast_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        agents["no trace"].invoke("replay", "SUPERVISOR", fast=True)
+    created_by_fast = os.listdir(fast_dir)
+    os.chdir(work_dir)
+
+    def read_stream(name: str) -> None:
+        for _ in clients[name].invoke_agent(inputText="replay")["completion"]:
+            pass
+
+    runs: Dict[str, Callable[[], str]] = {
+        "stream read (no trace)": lambda: read_stream("no trace"),
+        "invoke (no trace)": lambda: agents["no trace"].invoke("replay", "SUPERVISOR", enable_trace=False),
+        "invoke fast (no trace)": lambda: agents["no trace"].invoke("replay", "SUPERVISOR", fast=True),
+        "stream read (with trace)": lambda: read_stream("with trace"),
+        "invoke (trace core)": lambda: agents["with trace"].invoke("replay", "SUPERVISOR", enable_trace=True),
+    }
+    latencies: Dict[str, List[float]] = {name: [] for name in runs}
+    answers = {}
+    printed = {}
+    for _ in range(args.iterations):
+        for name, run in runs.items():
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                st = time.perf_counter()
+                answers[name] = run()
+                latencies[name].append((time.perf_counter() - st) * 1000)
+            printed[name] = len(output.getvalue())
+    expected_answer = "".join(e["chunk"]["bytes"].decode("utf8") for e in no_trace_stream if "chunk" in e)
+    assert answers["invoke fast (no trace)"] == expected_answer
+
+    events = {"no trace": len(no_trace_stream), "with trace": len(stream)}
+    print(f"{args.turns} turns, {events['no trace']} stream events without trace and {events['with trace']} with trace, "
+          f"{args.iterations} iterations\n")
+    print_latency_table(latencies)
+    print(f"\n{'invocation':<28}{'overhead us/event':>20}{'chars printed':>15}")
+    for name in ["invoke (no trace)", "invoke fast (no trace)", "invoke (trace core)"]:
+        recording = "with trace" if "trace core" in name else "no trace"
+        overhead_ms = statistics.median(latencies[name]) - statistics.median(latencies[f"stream read ({recording})"])
+        print(f"{name:<28}{overhead_ms * 1000 / events[recording]:>20.2f}{printed[name]:>15}")
+    print(f"\nfiles and directories created by the fast mode: {created_by_fast or 'none'}")
+
+if __name__ == "__main__":
+    main()
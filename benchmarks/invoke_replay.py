@@ -0,0 +1,84 @@
+# This script benchmarks AgentsForAmazonBedrock.invoke and invoke_turn end to end on recorded
+# invoke_agent streams, replayed by the ReplayClient of utils/event_recording.py in place of
+# the bedrock agent runtime client, so the parsing, rendering and artifact writing are measured
+# deterministically without network access. The recordings are made with a RecordingClient,
+# or synthesized from the synthetic stream of supervisor turns with a fixed interval between
+# the events. The console output is discarded and the artifacts are written to a temporary
+# directory. In realtime mode the events are replayed at their recorded offsets.
+#
+#   python benchmarks/invoke_replay.py --turns 20
+#   python benchmarks/invoke_replay.py --recordings recordings/ --mode realtime --speed 10
+import io
+import os
+import sys
+import argparse
+import tempfile
+import contextlib
+import time
+from pathlib import Path
+from bench_utils import BASE_DIR, synthetic_agent_event_stream, print_latency_table
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.event_recording import write_recording, ReplayClient, REPLAY_MODES, RECORDING_SUFFIX
+
+def synthesize_recording(path: Path, turns: int, event_interval_s: float) -> Path:
+    """
+    Write a recording of the synthetic stream with event_interval_s seconds between the events
+    """
+    stream = synthetic_agent_event_stream(turns)
+    return write_recording(path, ((event_interval_s * (i + 1), event) for i, event in enumerate(stream)),
+                           request={"agentId": "SUPERVISOR", "agentAliasId": "TSTALIASID", "inputText": "replay"},
+                           response_s=event_interval_s)
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of invoke on replayed invoke_agent streams")
+    parser.add_argument("--recordings", default=None, help="recording file or directory, synthesized if not set")
+    parser.add_argument("--turns", type=int, default=20, help="supervisor turns of the synthesized recording")
+    parser.add_argument("--event-interval-ms", type=float, default=20.0, help="interval between synthesized events")
+    parser.add_argument("--mode", choices=REPLAY_MODES, default="fast")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed of the realtime mode")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--trace-level", default="core")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="invoke_replay_")
+    recordings = args.recordings
+    if recordings is None:
+        recordings = synthesize_recording(Path(work_dir) / f"synthetic{RECORDING_SUFFIX}", args.turns,
+                                          args.event_interval_ms / 1000)
+    client = ReplayClient(recordings, mode=args.mode, speed=args.speed)
+    num_events = sum(len(r) for r in client.recordings) / len(client.recordings)
+
+    # the agents helper reads its configuration from the repository root
+    os.chdir(BASE_DIR)
+    from utils.bedrock_agent_helper import AgentsForAmazonBedrock
+    agents = AgentsForAmazonBedrock(runtime_client=client)
+    os.chdir(work_dir)
+
+    latencies = {"invoke (no trace)": [], f"invoke (trace {args.trace_level})": [], "invoke_turn": []}
+    first_chunk_ms = []
+    for _ in range(args.iterations):
+        for recording in client.recordings:
+            input_text = recording.request.get("inputText", "replay")
+            agent_id = recording.request.get("agentId", "SUPERVISOR")
+            with contextlib.redirect_stdout(io.StringIO()):
+                st = time.perf_counter()
+                agents.invoke(input_text, agent_id, enable_trace=False)
+                latencies["invoke (no trace)"].append((time.perf_counter() - st) * 1000)
+                st = time.perf_counter()
+                _, metrics = agents.invoke(input_text, agent_id, enable_trace=True,
+                                           trace_level=args.trace_level, return_metrics=True)
+                latencies[f"invoke (trace {args.trace_level})"].append((time.perf_counter() - st) * 1000)
+                st = time.perf_counter()
+                result = agents.invoke_turn(input_text, agent_id)
+                latencies["invoke_turn"].append((time.perf_counter() - st) * 1000)
+            assert result["error"] is None, result["error"]
+            if metrics["time_to_first_chunk_s"] is not None:
+                first_chunk_ms.append(metrics["time_to_first_chunk_s"] * 1000)
+
+    print(f"{len(client.recordings)} recording(s) of {num_events:.0f} stream events on average, "
+          f"{args.mode} replay, {args.iterations} iterations")
+    print_latency_table({**latencies, "time to first chunk": first_chunk_ms})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# This script compares sending N queries to the knowledge base lambda one after the
+# other with a single batch request that runs the retrieve calls concurrently.
+# Without --kb-id, the retrieve calls are answered by a simulated client with a fixed
+# service latency so that the benchmark runs offline.
+#
+#   python benchmarks/kb_batch_queries.py --num-queries 4 --simulated-latency-ms 150
+#   python benchmarks/kb_batch_queries.py --kb-id <your-kb-id> --region us-east-1
+import json
+import time
+import argparse
+from bench_utils import HOME_NETWORK_KB_LAMBDA_FILE, SimulatedRetrieveClient, load_module, print_latency_table
+
+QUERIES = [
+    "What is the signal strength of my porch camera?",
+    "How much storage is left on my garage camera?",
+    "Is my front door camera online right now?",
+    "How do I restart my living room camera?",
+    "What is the firmware version of my backyard camera?",
+    "List all the cameras connected to my network",
+]
+
+def _invoke(module, body: dict) -> float:
+    st = time.perf_counter()
+    response = module.lambda_handler({'body': json.dumps(body)}, None)
+    assert response['statusCode'] == 200, response
+    return (time.perf_counter() - st) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Sequential vs batch queries to the KB lambda")
+    parser.add_argument("--lambda-file", default=HOME_NETWORK_KB_LAMBDA_FILE)
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--kb-id", default=None, help="knowledge base to query, a simulated client is used without it")
+    parser.add_argument("--simulated-latency-ms", type=float, default=150.0)
+    parser.add_argument("--num-queries", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    module = load_module(args.lambda_file)
+    # the repeated queries would be answered by the retrieval cache, see kb_retrieval_cache.py
+    module.retrieval_cache = None
+    kb_id = args.kb_id
+    if kb_id is None:
+        kb_id = "SIMULATEDKB"
+        module._bedrock_clients[args.region] = SimulatedRetrieveClient(latency_ms=args.simulated_latency_ms)
+    queries = [QUERIES[i % len(QUERIES)] for i in range(args.num_queries)]
+    base = {'kb_id': kb_id, 'region': args.region, 'projection': 'minimal'}
+
+    # first request creates the client and the thread pool
+    _invoke(module, {**base, 'queries': queries})
+    rows = {"sequential (N round trips)": [], "batch": [], "batch + merge": []}
+    for _ in range(args.repeats):
+        rows["sequential (N round trips)"].append(sum(_invoke(module, {**base, 'query': q}) for q in queries))
+        rows["batch"].append(_invoke(module, {**base, 'queries': queries}))
+        rows["batch + merge"].append(_invoke(module, {**base, 'queries': queries, 'merge': True}))
+    source = f"knowledge base {kb_id}" if args.kb_id else f"simulated retrieve latency of {args.simulated_latency_ms} ms"
+    print(f"{args.num_queries} queries, {source}, handler time only (excludes the lambda invoke round trips)")
+    print_latency_table(rows)
+
+if __name__ == "__main__":
+    main()
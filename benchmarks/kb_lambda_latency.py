@@ -0,0 +1,86 @@
+# This script measures the latency of the knowledge base lambda function.
+# The client section runs offline and compares creating a new bedrock client per
+# invocation with the per region client cache. The handler section needs a knowledge
+# base and measures, in fresh interpreters, the cold (first query), warm-ping and
+# warm (subsequent queries, or first query after a warm ping) handler latency.
+#
+#   python benchmarks/kb_lambda_latency.py
+#   python benchmarks/kb_lambda_latency.py --kb-id <your-kb-id> --region us-east-1
+import time
+import argparse
+from pathlib import Path
+from bench_utils import HOME_NETWORK_KB_LAMBDA_FILE, load_module, run_in_fresh_interpreter, print_latency_table
+
+# This code runs inside the fresh interpreter. When warm ping is requested, the handler
+# is pinged before the first query, the way a scheduled warm up rule would.
+_CHILD_CODE = """
+import sys, json, time
+sys.path.insert(0, sys.argv[1])
+from bench_utils import load_module, RESULT_PREFIX
+lambda_file, kb_id, region, query, calls, warm_ping = sys.argv[2:8]
+module = load_module(lambda_file)
+def timed(event):
+    st = time.perf_counter()
+    response = module.lambda_handler(event, None)
+    assert response['statusCode'] == 200, response
+    return (time.perf_counter() - st) * 1000
+ping_ms = timed({'warm_ping': True, 'region': region}) if warm_ping == 'true' else None
+event = {'body': json.dumps({'query': query, 'kb_id': kb_id, 'region': region})}
+first_ms = timed(event)
+warm_ms = [timed(event) for _ in range(int(calls))]
+print(RESULT_PREFIX + json.dumps({'ping_ms': ping_ms, 'first_ms': first_ms, 'warm_ms': warm_ms}))
+"""
+
+def bench_client_creation(lambda_file: str, region: str, iterations: int) -> dict:
+    """
+    Compare creating a new client per call with the module level client cache
+    """
+    module = load_module(lambda_file)
+    uncached_ms, cached_ms = [], []
+    for _ in range(iterations):
+        module._bedrock_clients.clear()
+        st = time.perf_counter()
+        module.get_bedrock_client(region)
+        uncached_ms.append((time.perf_counter() - st) * 1000)
+    for _ in range(iterations):
+        st = time.perf_counter()
+        module.get_bedrock_client(region)
+        cached_ms.append((time.perf_counter() - st) * 1000)
+    return {"client per invocation": uncached_ms, "cached client": cached_ms}
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold, warm and warm-ping latency of the KB lambda")
+    parser.add_argument("--lambda-file", default=HOME_NETWORK_KB_LAMBDA_FILE)
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--kb-id", default=None, help="knowledge base to query, the handler section is skipped without it")
+    parser.add_argument("--query", default="What is the signal strength of my porch camera?")
+    parser.add_argument("--runs", type=int, default=3, help="number of fresh interpreters per scenario")
+    parser.add_argument("--warm-calls", type=int, default=10)
+    parser.add_argument("--client-iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    print("Bedrock client creation (offline)")
+    print_latency_table(bench_client_creation(args.lambda_file, args.region, args.client_iterations))
+    if args.kb_id is None:
+        print("\nNo --kb-id provided, skipping the handler latency section")
+        return
+
+    bench_dir = str(Path(__file__).resolve().parent)
+    rows = {"cold (first query)": [], "warm-ping": [], "first query after ping": [], "warm query": []}
+    for warm_ping in ["false", "true"]:
+        for _ in range(args.runs):
+            result = run_in_fresh_interpreter(_CHILD_CODE, [bench_dir, args.lambda_file, args.kb_id, args.region,
+                                                            args.query, str(args.warm_calls), warm_ping],
+                                              # the warm queries would be answered by the retrieval cache
+                                              env={"RETRIEVAL_CACHE": "false"})
+            if warm_ping == "true":
+                rows["warm-ping"].append(result["ping_ms"])
+                rows["first query after ping"].append(result["first_ms"])
+            else:
+                rows["cold (first query)"].append(result["first_ms"])
+            rows["warm query"].extend(result["warm_ms"])
+    print(f"\nKB lambda handler latency for {args.kb_id} in {args.region}")
+    print_latency_table(rows)
+
+if __name__ == "__main__":
+    main()
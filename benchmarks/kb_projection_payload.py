@@ -0,0 +1,52 @@
+# This script compares the size of the knowledge base lambda response body and the
+# time spent encoding it (in the KB lambda) and decoding it (in the action lambda)
+# for each projection mode. The legacy row is the previous response, which contained
+# both the chunks and the raw retrieve response, encoded with the default separators.
+# It runs offline on a synthetic retrieve response built from the API spec.
+#
+#   python benchmarks/kb_projection_payload.py --num-results 5
+import json
+import time
+import argparse
+from bench_utils import (HOME_NETWORK_KB_LAMBDA_FILE, HOME_NETWORK_API_SPEC_FILE, load_module,
+                         synthetic_retrieve_response)
+
+def _legacy_body(module, response_ret: dict) -> str:
+    result = module.project_retrieval_results(response_ret, 'standard')
+    for chunk in result['chunks']:
+        del chunk['id']
+    result['raw_response'] = response_ret
+    return json.dumps(result)
+
+def _time_ms(fn, iterations: int) -> float:
+    st = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - st) * 1000 / iterations
+
+def main():
+    parser = argparse.ArgumentParser(description="Payload bytes per projection mode of the KB lambda")
+    parser.add_argument("--lambda-file", default=HOME_NETWORK_KB_LAMBDA_FILE)
+    parser.add_argument("--spec-file", default=HOME_NETWORK_API_SPEC_FILE)
+    parser.add_argument("--num-results", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    module = load_module(args.lambda_file)
+    response_ret = synthetic_retrieve_response(args.spec_file, args.num_results)
+    encoders = {"legacy": lambda: _legacy_body(module, response_ret)}
+    for projection in module.PROJECTIONS:
+        encoders[projection] = lambda p=projection: module.encode_body(module.project_retrieval_results(response_ret, p))
+
+    print(f"{args.num_results} chunks from {args.spec_file}")
+    print(f"{'projection':<12}{'bytes':>10}{'vs legacy':>12}{'encode ms':>12}{'decode ms':>12}")
+    legacy_bytes = len(encoders["legacy"]().encode("utf-8"))
+    for name, encode in encoders.items():
+        body = encode()
+        size = len(body.encode("utf-8"))
+        encode_ms = _time_ms(encode, args.iterations)
+        decode_ms = _time_ms(lambda: json.loads(body), args.iterations)
+        print(f"{name:<12}{size:>10}{size / legacy_bytes:>11.0%}{encode_ms:>12.4f}{decode_ms:>12.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# This script evaluates the rerank modes of the knowledge base lambda on the offline
+# evaluation set in retrieval_eval_set.json. Every query is answered by a lexical retriever
+# over the chunks of its API spec, which stands in for the knowledge base, and the retrieved
+# chunks are reranked with each mode. The recall is the fraction of the expected identifiers
+# (paths, schema and field names) found in the returned chunks, and the prompt size is the
+# number of characters (and approximate tokens) of chunk text that reaches generate_code.
+#
+#   python benchmarks/kb_rerank_eval.py
+#   python benchmarks/kb_rerank_eval.py --num-results 8 --chunk-chars 800
+import json
+import math
+import time
+import argparse
+from pathlib import Path
+from typing import Callable, Dict, List
+from bench_utils import BASE_DIR, HOME_NETWORK_KB_LAMBDA_FILE, load_module, chunk_text
+
+EVAL_SET_FILE: str = str(Path(__file__).resolve().parent / "retrieval_eval_set.json")
+# Approximate number of characters per token of the code generation model
+CHARS_PER_TOKEN: float = 4.0
+# Words ignored by the offline retriever
+STOP_WORDS = {"a", "an", "and", "are", "at", "by", "every", "for", "how", "i", "is", "it", "me", "much",
+              "my", "of", "on", "the", "to", "was", "what", "when", "with"}
+
+def _tf_idf_vector(module, text: str, idf: Dict[str, float]) -> Dict[str, float]:
+    vector = {term: weight * idf.get(term, 0.0) for term, weight in module.lexical_term_vector(text).items()
+              if term not in STOP_WORDS}
+    norm = math.sqrt(sum(w * w for w in vector.values()))
+    return {term: w / norm for term, w in vector.items()} if norm else {}
+
+def lexical_retrieve(module, chunks: List[str], query: str, num_results: int, spec_name: str) -> dict:
+    """
+    Retrieve response with the num_results chunks most similar to the query by the cosine
+    of their TF-IDF vectors
+    """
+    chunk_terms = [set(module.lexical_term_vector(chunk)) for chunk in chunks]
+    idf = {term: math.log(1 + len(chunks) / sum(1 for terms in chunk_terms if term in terms))
+           for term in set().union(*chunk_terms)}
+    query_vector = _tf_idf_vector(module, query, idf)
+    scored = sorted(((module.lexical_cosine_similarity(query_vector, _tf_idf_vector(module, chunk, idf)), i, chunk)
+                     for i, chunk in enumerate(chunks)), reverse=True)[:num_results]
+    uri = f"s3://localkb-bucket/{spec_name}"
+    return {
+        "retrievalResults": [{
+            "content": {"text": chunk, "type": "TEXT"},
+            "location": {"type": "S3", "s3Location": {"uri": uri}},
+            "score": round(score, 4),
+            "metadata": {"x-amz-bedrock-kb-source-uri": uri, "x-amz-bedrock-kb-chunk-id": f"{spec_name}-{i}"},
+        } for score, i, chunk in scored]
+    }
+
+def evaluate(module, eval_set: List[dict], rerank: Callable[[List[dict]], List[dict]],
+             num_results: int, chunk_chars: int) -> dict:
+    """
+    Mean number of chunks, prompt characters, recall and rerank latency of a rerank function
+    """
+    chunks_by_spec: Dict[str, List[str]] = {}
+    num_chunks, prompt_chars, recall, rerank_ms = [], [], [], []
+    for item in eval_set:
+        spec = item["spec"]
+        if spec not in chunks_by_spec:
+            chunks_by_spec[spec] = chunk_text((BASE_DIR / "data" / spec).read_text(), chunk_chars, chunk_chars // 5)
+        response_ret = lexical_retrieve(module, chunks_by_spec[spec], item["query"], num_results, spec)
+        st = time.perf_counter()
+        results = rerank(response_ret["retrievalResults"])
+        rerank_ms.append((time.perf_counter() - st) * 1000)
+        text = "".join(r["content"]["text"] for r in results)
+        num_chunks.append(len(results))
+        prompt_chars.append(len(text))
+        recall.append(sum(1 for expected in item["expected"] if expected in text) / len(item["expected"]))
+    n = len(eval_set)
+    return {
+        "chunks": sum(num_chunks) / n,
+        "prompt_chars": sum(prompt_chars) / n,
+        "recall": sum(recall) / n,
+        "full_recall": sum(1 for r in recall if r == 1.0) / n,
+        "rerank_ms": sum(rerank_ms) / n,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and prompt size of the KB lambda rerank modes")
+    parser.add_argument("--lambda-file", default=HOME_NETWORK_KB_LAMBDA_FILE)
+    parser.add_argument("--eval-set", default=EVAL_SET_FILE)
+    parser.add_argument("--num-results", type=int, default=5)
+    parser.add_argument("--chunk-chars", type=int, default=2000, help="chunk size of the offline retriever")
+    parser.add_argument("--gap-ratios", type=float, nargs="+", default=[0.25, 0.4, 0.6])
+    args = parser.parse_args()
+
+    module = load_module(args.lambda_file)
+    eval_set = json.loads(Path(args.eval_set).read_text())
+    modes: Dict[str, Callable[[List[dict]], List[dict]]] = {
+        mode: lambda results, m=mode: module.rerank_retrieval_results({"retrievalResults": results}, m)["retrievalResults"]
+        for mode in module.RERANK_MODES
+    }
+    for gap_ratio in args.gap_ratios:
+        modes[f"mmr gap={gap_ratio}"] = lambda results, g=gap_ratio: module.lexical_mmr_select(module.score_gap_cutoff(results, g))
+    modes["mmr no gap cutoff"] = lambda results: module.lexical_mmr_select(sorted(results, key=lambda r: r["score"], reverse=True))
+
+    print(f"{len(eval_set)} queries, {args.num_results} retrieved chunks of {args.chunk_chars} characters per query")
+    print(f"{'rerank':<20}{'chunks':>8}{'chars':>10}{'~tokens':>10}{'vs none':>10}{'recall':>9}{'full':>8}{'rerank ms':>11}")
+    baseline_chars = None
+    for name, rerank in modes.items():
+        row = evaluate(module, eval_set, rerank, args.num_results, args.chunk_chars)
+        baseline_chars = baseline_chars or row["prompt_chars"]
+        print(f"{name:<20}{row['chunks']:>8.2f}{row['prompt_chars']:>10.0f}{row['prompt_chars'] / CHARS_PER_TOKEN:>10.0f}"
+              f"{row['prompt_chars'] / baseline_chars:>9.0%}{row['recall']:>9.2f}{row['full_recall']:>8.2f}"
+              f"{row['rerank_ms']:>11.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# This script replays a workload of repeated and reworded queries against the knowledge
+# base lambda with and without its retrieval cache, and reports the hit ratio and the
+# retrieve latency saved. Without --kb-id the retrieve calls are answered by a simulated
+# client and the ingestion generation is pinned, so the benchmark runs offline.
+#
+#   python benchmarks/kb_retrieval_cache.py --requests 200
+#   python benchmarks/kb_retrieval_cache.py --kb-id <your-kb-id> --region us-east-1
+import json
+import time
+import random
+import argparse
+from bench_utils import HOME_NETWORK_KB_LAMBDA_FILE, SimulatedRetrieveClient, load_module, print_latency_table
+
+QUERIES = [
+    "What is the signal strength of my porch camera?",
+    "How much storage is left on my garage camera?",
+    "Is my front door camera online right now?",
+    "How do I restart my living room camera?",
+    "What is the firmware version of my backyard camera?",
+    "List all the cameras connected to my network",
+    "Change the motion sensitivity of my doorbell",
+    "Turn off notifications for my garage camera",
+]
+
+def make_workload(num_requests: int, seed: int) -> list:
+    """
+    Queries drawn with a skewed popularity, some of them with different casing and spacing
+    """
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(QUERIES))]
+    workload = []
+    for query in rng.choices(QUERIES, weights=weights, k=num_requests):
+        if rng.random() < 0.3:
+            query = "  " + query.upper().replace(" ", "  ")
+        workload.append(query)
+    return workload
+
+def run(module, workload: list, kb_id: str, region: str) -> list:
+    latencies = []
+    for query in workload:
+        st = time.perf_counter()
+        response = module.lambda_handler({'body': json.dumps({'query': query, 'kb_id': kb_id, 'region': region,
+                                                              'projection': 'minimal'})}, None)
+        latencies.append((time.perf_counter() - st) * 1000)
+        assert response['statusCode'] == 200, response
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Hit ratio and latency saved by the KB lambda retrieval cache")
+    parser.add_argument("--lambda-file", default=HOME_NETWORK_KB_LAMBDA_FILE)
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--kb-id", default=None, help="knowledge base to query, a simulated client is used without it")
+    parser.add_argument("--simulated-latency-ms", type=float, default=150.0)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    module = load_module(args.lambda_file)
+    kb_id = args.kb_id or "SIMULATEDKB"
+    if args.kb_id is None:
+        module._bedrock_clients[args.region] = SimulatedRetrieveClient(latency_ms=args.simulated_latency_ms)
+    workload = make_workload(args.requests, args.seed)
+
+    cache = module.RetrievalCache()
+    if args.kb_id is None:
+        # pin the generation instead of reading it from SSM
+        cache._generations[kb_id] = (0, float('inf'))
+    module.retrieval_cache = None
+    uncached = run(module, workload, kb_id, args.region)
+    module.retrieval_cache = cache
+    cached = run(module, workload, kb_id, args.region)
+
+    print(f"{args.requests} requests over {len(QUERIES)} distinct queries")
+    print_latency_table({"without cache": uncached, "with cache": cached})
+    stats = cache.stats()
+    print(f"\nhit ratio: {stats['hit_ratio']:.1%}, hits: {stats['hits']}, misses: {stats['misses']}, "
+          f"retrieve latency saved: {stats['saved_ms']:,.1f} ms, "
+          f"total time {sum(uncached):,.1f} ms -> {sum(cached):,.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# This script measures the two savings of the content-hashed lambda images of
+# utils/lambda_images.py without docker. First it replays a series of deploys of the home network
+# agent lambda (no change, an edit of the source, a library added, the libraries reordered, another
+# platform) against a LocalImageRegistry stand-in, and prints for every deploy whether the image is
+# built or skipped, the time to compute the tag and check the registry, and an estimate of the
+# deploy time with a build and push charged --build-s seconds. Then it lays out the task root of
+# the image (the lambda source as app.py, the admission controller and the installed libraries)
+# without and with the .pyc files compiled by the Dockerfile, and measures the cold import of the
+# lambda and its libraries in fresh interpreters that cannot write .pyc files, as on the read-only
+# task root of a function.
+#
+#   python benchmarks/lambda_image_cache.py --runs 10 --libraries requests
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import py_compile
+import compileall
+import importlib.util
+from pathlib import Path
+from typing import List
+from bench_utils import BASE_DIR, HOME_NETWORK_AGENT_LAMBDA_FILE, run_in_fresh_interpreter, print_latency_table
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.lambda_images import LAMBDA_BASE_IMAGE, LocalImageRegistry, image_tag
+
+ADMISSION_CONTROL_FILE = str(BASE_DIR / "utils" / "admission_control.py")
+# Packages installed with each library, copied from the local site-packages into the task root
+LIBRARY_PACKAGES = {"requests": ["requests", "urllib3", "idna", "charset_normalizer", "certifi"]}
+
+# This code runs inside the fresh interpreter and prints the import time as a JSON line
+_CHILD_CODE = """
+import sys, json, time, importlib
+sys.path.insert(0, sys.argv[1])
+sys.path.append(sys.argv[2])
+from bench_utils import RESULT_PREFIX
+st = time.perf_counter()
+import app
+for library in sys.argv[3:]:
+    importlib.import_module(library)
+print(RESULT_PREFIX + json.dumps({"import_s": time.perf_counter() - st}))
+"""
+
+def replay_deploys(build_s: float, libraries: List[str]) -> None:
+    """Deploys of the lambda against a local registry, with the image built only when its tag is new"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        source = Path(work_dir) / Path(HOME_NETWORK_AGENT_LAMBDA_FILE).name
+        shutil.copy(HOME_NETWORK_AGENT_LAMBDA_FILE, source)
+        registry = LocalImageRegistry(os.path.join(work_dir, "registry"))
+        deploys = [
+            ("first deploy", lambda: None, libraries, "linux/amd64"),
+            ("no change", lambda: None, libraries, "linux/amd64"),
+            ("source edited", lambda: source.write_text(source.read_text() + "\n# edited\n"), libraries, "linux/amd64"),
+            ("no change", lambda: None, libraries, "linux/amd64"),
+            ("library added", lambda: None, libraries + ["pyyaml"], "linux/amd64"),
+            ("libraries reordered", lambda: None, ["pyyaml"] + libraries, "linux/amd64"),
+            ("platform changed", lambda: None, libraries + ["pyyaml"], "linux/arm64"),
+        ]
+        print(f"{'deploy':<22}{'tag':<18}{'image':<8}{'tag and check ms':>18}{'estimated deploy s':>20}")
+        previous_total = total = 0.0
+        for name, change, deploy_libraries, platform in deploys:
+            change()
+            st = time.perf_counter()
+            tag = image_tag([str(source), ADMISSION_CONTROL_FILE], deploy_libraries, LAMBDA_BASE_IMAGE, platform)
+            exists = registry.has_image("lambda-home-network", tag)
+            check_ms = (time.perf_counter() - st) * 1000
+            if not exists:
+                registry.add_image("lambda-home-network", tag)
+            deploy_s = check_ms / 1000 + (0.0 if exists else build_s)
+            total += deploy_s
+            previous_total += build_s
+            print(f"{name:<22}{tag:<18}{'skip' if exists else 'build':<8}{check_ms:>18.3f}{deploy_s:>20.1f}")
+        print(f"\n{len(deploys)} deploys: {total:.0f}s with content-hashed tags, {previous_total:.0f}s when "
+              f"every deploy builds and pushes :latest")
+
+def task_root(root: Path, libraries: List[str], precompile: bool) -> None:
+    """The files of the task root of the image, with the .pyc files of the Dockerfile if precompile"""
+    shutil.copy(HOME_NETWORK_AGENT_LAMBDA_FILE, root / "app.py")
+    shutil.copy(ADMISSION_CONTROL_FILE, root / "admission_control.py")
+    for library in libraries:
+        for package in LIBRARY_PACKAGES.get(library, [library]):
+            spec = importlib.util.find_spec(package)
+            if spec is None or spec.origin is None:
+                raise SystemExit(f"{package} is not installed, it is needed to lay out the task root")
+            package_dir = Path(spec.origin).parent
+            shutil.copytree(package_dir, root / package_dir.name, ignore=shutil.ignore_patterns("__pycache__"))
+    if precompile:
+        compileall.compile_dir(str(root), quiet=1, invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+
+def main():
+    parser = argparse.ArgumentParser(description="Skipped image builds and precompiled .pyc files of the lambda images")
+    parser.add_argument("--build-s", type=float, default=180, help="estimated docker login, build and push of an image")
+    parser.add_argument("--libraries", nargs="*", default=["requests"])
+    parser.add_argument("--runs", type=int, default=10, help="number of fresh interpreters per task root")
+    args = parser.parse_args()
+
+    replay_deploys(args.build_s, args.libraries)
+
+    print(f"\ncold import of app.py and {', '.join(args.libraries)} from the task root, .pyc files not writable:")
+    timings = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, precompile in [("source only", False), ("precompiled .pyc", True)]:
+            root = Path(work_dir) / name.replace(" ", "_")
+            root.mkdir()
+            task_root(root, args.libraries, precompile)
+            # the lambda runtime sets the region, the lambda creates its clients on import
+            env = {"PYTHONDONTWRITEBYTECODE": "1", "AWS_DEFAULT_REGION": "us-east-1"}
+            timings[name] = [run_in_fresh_interpreter(_CHILD_CODE, [str(root), str(Path(__file__).parent), *args.libraries],
+                                                      env=env)["import_s"] * 1000
+                             for _ in range(args.runs)]
+    print_latency_table(timings)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# This script compares the artifacts that create_lambda can deploy an action group lambda as, for
+# a few library sets: a zip of the code with the libraries in a layer of pre-built wheels
+# (utils/lambda_packages.py), and the task root of a container image with the libraries and the
+# code compiled to .pyc files (utils/lambda_images.py, without the base image, which docker pulls
+# once per host). For every library set it prints the package type that create_lambda chooses,
+# the time to build the layer and to build it again from the cache, the zipped and unpacked size
+# of every artifact, and the cold import of the lambda and its libraries in fresh interpreters
+# that cannot write .pyc files, as on the read-only code directories of a function. The wheels
+# are installed with pip for the local python version so that they can be imported here.
+#
+#   python benchmarks/lambda_packaging.py --library-sets requests "requests pyyaml:yaml" numpy --runs 10
+import sys
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+import io
+from pathlib import Path
+from typing import List, Tuple
+from bench_utils import BASE_DIR, HOME_NETWORK_AGENT_LAMBDA_FILE, run_in_fresh_interpreter, print_latency_table
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.lambda_packages import (choose_package_type, build_library_layer, function_zip, zip_directory,
+                                   directory_size, precompile, FUNCTION_CODE_DIR)
+
+ADMISSION_CONTROL_FILE = str(BASE_DIR / "utils" / "admission_control.py")
+PLATFORM = "linux/amd64"
+# Runtime of the local python, so that the wheels and .pyc files can be used by this interpreter
+RUNTIME = f"python{sys.version_info.major}.{sys.version_info.minor}"
+
+# This code runs inside the fresh interpreter and prints the import time as a JSON line
+_CHILD_CODE = """
+import sys, json, time, importlib
+bench_dir, paths, modules = sys.argv[1], sys.argv[2].split(","), sys.argv[3:]
+sys.path[0:0] = paths
+sys.path.append(bench_dir)
+from bench_utils import RESULT_PREFIX
+st = time.perf_counter()
+import app
+for module in modules:
+    importlib.import_module(module)
+print(RESULT_PREFIX + json.dumps({"import_s": time.perf_counter() - st}))
+"""
+
+def parse_library_set(library_set: str) -> Tuple[List[str], List[str]]:
+    """'requests pyyaml:yaml' -> (['requests', 'pyyaml'], ['requests', 'yaml'])"""
+    specs = library_set.split()
+    return [s.split(":")[0] for s in specs], [s.split(":")[-1] for s in specs]
+
+def cold_imports(paths: List[Path], modules: List[str], runs: int) -> List[float]:
+    # the lambda runtime sets the region, the lambda creates its clients on import
+    env = {"PYTHONDONTWRITEBYTECODE": "1", "AWS_DEFAULT_REGION": "us-east-1"}
+    return [run_in_fresh_interpreter(_CHILD_CODE, [str(Path(__file__).parent), ",".join(map(str, paths)), *modules],
+                                     env=env)["import_s"] * 1000 for _ in range(runs)]
+
+def mb(size: int) -> str:
+    return f"{size / 1024 ** 2:.2f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Zip and layer vs image task root of the action group lambda")
+    parser.add_argument("--library-sets", nargs="+", default=["requests", "requests pyyaml:yaml", "numpy"],
+                        help="space separated pip names, with :module when the module name differs")
+    parser.add_argument("--runs", type=int, default=10, help="number of fresh interpreters per artifact")
+    args = parser.parse_args()
+
+    timings = {}
+    rows = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        cache_dir = Path(work_dir) / "layers"
+        for library_set in args.library_sets:
+            libraries, modules = parse_library_set(library_set)
+            st = time.perf_counter()
+            package_type, _ = choose_package_type(libraries, PLATFORM, RUNTIME, str(cache_dir))
+            build_s = time.perf_counter() - st
+            st = time.perf_counter()
+            layer_dir = build_library_layer(libraries, PLATFORM, RUNTIME, str(cache_dir))
+            cached_s = time.perf_counter() - st
+
+            # zip of the code, unpacked as the function directory, and the layer under /opt
+            code_zip = function_zip(HOME_NETWORK_AGENT_LAMBDA_FILE, [ADMISSION_CONTROL_FILE], RUNTIME)
+            function_dir = Path(work_dir) / f"function-{layer_dir.name}"
+            zipfile.ZipFile(io.BytesIO(code_zip)).extractall(function_dir)
+            layer_zip = zip_directory(layer_dir)
+
+            # task root of the image: the libraries and the code in one directory, compiled by the Dockerfile
+            task_root = Path(work_dir) / f"image-{layer_dir.name}"
+            shutil.copytree(layer_dir / "python", task_root)
+            shutil.copy(HOME_NETWORK_AGENT_LAMBDA_FILE, task_root / "app.py")
+            shutil.copy(ADMISSION_CONTROL_FILE, task_root / "admission_control.py")
+            precompile(task_root, RUNTIME, FUNCTION_CODE_DIR)
+
+            rows.append((library_set, package_type, build_s, cached_s, len(code_zip), directory_size(function_dir),
+                         len(layer_zip), directory_size(layer_dir), directory_size(task_root)))
+            timings[f"zip {library_set}"] = cold_imports([function_dir, layer_dir / "python"], modules, args.runs)
+            timings[f"image {library_set}"] = cold_imports([task_root], modules, args.runs)
+
+    print(f"{'libraries':<22}{'chosen':>7}{'layer build s':>15}{'cached s':>10}{'code zip MB':>13}{'code MB':>9}"
+          f"{'layer zip MB':>14}{'layer MB':>10}{'image root MB':>15}")
+    for library_set, package_type, build_s, cached_s, code_zip, code, layer_zip, layer, image in rows:
+        print(f"{library_set:<22}{package_type:>7}{build_s:>15.2f}{cached_s:>10.3f}{mb(code_zip):>13}{mb(code):>9}"
+              f"{mb(layer_zip):>14}{mb(layer):>10}{mb(image):>15}")
+    print(f"\ncold import of app.py and the libraries, .pyc files not writable, {RUNTIME} {PLATFORM}:")
+    print_latency_table(timings)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# This script load tests a supervisor agent through AgentsForAmazonBedrock.invoke_turn, to find
+# how many concurrent conversations the supervisor and its sub-agents sustain before they are
+# throttled. The concurrency is ramped step by step: at every step that many workers run the
+# conversations of the scenario one after the other, every conversation in a new session,
+# until the step duration is over. Every turn records its latency, time to first chunk,
+# throttling retries and error, and every step reports the p50/p90/p99 latencies and the
+# throughput, so that the throughput-vs-concurrency curve shows where the agents saturate.
+#
+# A scenario is a JSON lines file (or a JSON list) with one conversation per line, either one
+# turn ({"input_text": "..."}, with "prompt", "text" or "body" also accepted, so that a backlog
+# of requests seeds it) or several ({"turns": ["...", "..."]}), or a notebook from which the
+# prompts of the agents.invoke calls are taken.
+#
+# Without --agent-id the agents are replaced by the ReplayClient of utils/event_recording.py,
+# replaying the recordings of --recordings, or a recording synthesized from the synthetic
+# supervisor stream, in realtime, so the harness runs fully offline. --throttle-above makes the
+# stand-in throttle the calls made while that many streams are already open.
+#
+#   python benchmarks/load_test.py --concurrency 1 2 4 8 --step-duration-s 10
+#   python benchmarks/load_test.py --scenario run_multi_agent.ipynb --throttle-above 6
+#   python benchmarks/load_test.py --agent-id <supervisor id> --agent-alias-id <alias id> --concurrency 1 2 4
+import ast
+import io
+import sys
+import json
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+import contextlib
+from pathlib import Path
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from bench_utils import BASE_DIR, synthetic_agent_event_stream, percentile
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.event_recording import write_recording, ReplayClient, RECORDING_SUFFIX
+
+DEFAULT_SCENARIO = str(BASE_DIR / "benchmarks" / "load_test_scenario.jsonl")
+# Fields of a scenario line holding the text of a single turn conversation
+PROMPT_FIELDS = ("input_text", "prompt", "text", "body")
+
+def load_scenario(path: str) -> List[List[str]]:
+    """
+    Return the conversations of a scenario file, each a list of the input texts of its turns
+    """
+    if path.endswith(".ipynb"):
+        return [[prompt] for prompt in notebook_prompts(path)]
+    text = Path(path).read_text()
+    entries = json.loads(text) if path.endswith(".json") else [json.loads(l) for l in text.splitlines() if l.strip()]
+    conversations = []
+    for entry in entries:
+        if isinstance(entry, str):
+            conversations.append([entry])
+        elif "turns" in entry:
+            conversations.append([str(turn) for turn in entry["turns"]])
+        else:
+            prompt = next((entry[field] for field in PROMPT_FIELDS if entry.get(field)), None)
+            if prompt is not None:
+                conversations.append([str(prompt)])
+    if not conversations:
+        raise ValueError(f"No conversations in the scenario {path}")
+    return conversations
+
+def notebook_prompts(path: str) -> List[str]:
+    """
+    Return the input texts of the invoke calls of the code cells of a notebook
+    """
+    prompts = []
+    for cell in json.loads(Path(path).read_text())["cells"]:
+        if cell["cell_type"] != "code":
+            continue
+        # drop the cell magics, which are not python
+        source = "\n".join(l for l in "".join(cell["source"]).splitlines() if not l.lstrip().startswith(("%", "!")))
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            continue
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and getattr(node.func, "attr", None) in ("invoke", "invoke_turn") \
+                    and node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str):
+                prompts.append(node.args[0].value)
+    return prompts
+
+class ThrottlingStandIn:
+    """
+    Wrapper of a stand-in runtime client that raises a ThrottlingException for the
+    invoke_agent calls made while limit streams are open, like a service quota
+    """
+    def __init__(self, client, limit: int):
+        self._client = client
+        self.limit = limit
+        self.open_streams = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def invoke_agent(self, **kwargs) -> dict:
+        from botocore.exceptions import ClientError
+        with self._lock:
+            if self.open_streams >= self.limit:
+                self.throttled += 1
+                raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "InvokeAgent")
+            self.open_streams += 1
+        try:
+            response = self._client.invoke_agent(**kwargs)
+        except Exception:
+            self._release()
+            raise
+        return {**response, "completion": self._stream(response["completion"])}
+
+    def _stream(self, completion):
+        try:
+            yield from completion
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        with self._lock:
+            self.open_streams -= 1
+
+def synthesize_recording(path: Path, turns: int, event_interval_s: float) -> Path:
+    """
+    Write a recording of the synthetic stream with event_interval_s seconds between the events
+    """
+    stream = synthetic_agent_event_stream(turns)
+    return write_recording(path, ((event_interval_s * (i + 1), event) for i, event in enumerate(stream)),
+                           request={"agentId": "SUPERVISOR", "agentAliasId": "TSTALIASID"},
+                           response_s=event_interval_s)
+
+def run_step(agents, conversations: List[List[str]], concurrency: int, duration_s: float, agent_id: str,
+             agent_alias_id: str, enable_trace: bool, max_retries: int, throttle_pause_s: float) -> List[dict]:
+    """
+    Run the conversations on concurrency workers for duration_s seconds, a worker starting
+    its next conversation until the duration is over, and return the result of every turn.
+    A worker whose turn was throttled pauses for throttle_pause_s before its next conversation.
+    """
+    results: List[dict] = []
+    lock = threading.Lock()
+    next_conversation = [0]
+    step_started = time.perf_counter()
+    deadline = step_started + duration_s
+
+    def worker() -> None:
+        while time.perf_counter() < deadline:
+            with lock:
+                turns = conversations[next_conversation[0] % len(conversations)]
+                next_conversation[0] += 1
+            session_id = str(uuid.uuid4())
+            for turn, input_text in enumerate(turns):
+                started = time.perf_counter()
+                result = agents.invoke_turn(input_text, agent_id, agent_alias_id, session_id=session_id,
+                                            enable_trace=enable_trace, max_retries=max_retries)
+                metrics = result.get("metrics") or {}
+                record = {
+                    "concurrency": concurrency,
+                    "session_id": session_id,
+                    "turn": turn,
+                    "started_s": round(started - step_started, 3),
+                    "latency_s": result["latency_s"],
+                    "time_to_first_chunk_s": metrics.get("time_to_first_chunk_s"),
+                    "retries": result["retries"],
+                    "throttled": result["error"] is not None and "throttling" in result["error"].lower(),
+                    "error": result["error"],
+                    "input_tokens": result["input_tokens"],
+                    "output_tokens": result["output_tokens"]
+                }
+                with lock:
+                    results.append(record)
+                # the next turns of a conversation that failed are not sent
+                if result["error"] is not None:
+                    if record["throttled"]:
+                        time.sleep(throttle_pause_s)
+                    break
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return results
+
+def step_summary(results: List[dict], elapsed_s: float) -> dict:
+    """
+    Percentiles, throughput, throttles and errors of the turns of a step
+    """
+    ok = [r for r in results if r["error"] is None]
+    latencies = [r["latency_s"] * 1000 for r in ok]
+    first_chunks = [r["time_to_first_chunk_s"] * 1000 for r in ok if r["time_to_first_chunk_s"] is not None]
+
+    def _percentiles(values: List[float]) -> List[Optional[float]]:
+        return [percentile(values, p) if values else None for p in (50, 90, 99)]
+
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "throttled": sum(1 for r in results if r["throttled"]),
+        "throttle_retries": sum(r["retries"] for r in results),
+        "errors": sum(1 for r in results if r["error"] is not None and not r["throttled"]),
+        "latency_ms": _percentiles(latencies),
+        "time_to_first_chunk_ms": _percentiles(first_chunks),
+        "throughput_rps": len(ok) / elapsed_s if elapsed_s > 0 else 0.0,
+        "elapsed_s": elapsed_s
+    }
+
+def _format(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:,.0f}"
+
+def print_tables(summaries: Dict[int, dict]) -> None:
+    print(f"{'concurrency':>11}{'requests':>10}{'ok':>6}{'throttled':>11}{'retries':>9}{'errors':>8}"
+          f"{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'ttfc p50':>10}{'ttfc p90':>10}{'ttfc p99':>10}")
+    for concurrency, s in summaries.items():
+        print(f"{concurrency:>11}{s['requests']:>10}{s['ok']:>6}{s['throttled']:>11}{s['throttle_retries']:>9}"
+              f"{s['errors']:>8}" + "".join(f"{_format(v):>10}" for v in s["latency_ms"] + s["time_to_first_chunk_ms"]))
+    print(f"\n{'concurrency':>11}{'throughput req/s':>18}{'per worker':>12}  curve")
+    peak = max((s["throughput_rps"] for s in summaries.values()), default=0.0) or 1.0
+    for concurrency, s in summaries.items():
+        bar = "#" * int(round(40 * s["throughput_rps"] / peak))
+        print(f"{concurrency:>11}{s['throughput_rps']:>18.2f}{s['throughput_rps'] / concurrency:>12.2f}  {bar}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of a supervisor agent with a concurrency ramp")
+    parser.add_argument("--scenario", default=DEFAULT_SCENARIO, help="JSON lines, JSON or notebook file of prompts")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8], help="concurrency of every step")
+    parser.add_argument("--step-duration-s", type=float, default=10.0)
+    parser.add_argument("--agent-id", default=None, help="supervisor agent to load test, offline replay if not set")
+    parser.add_argument("--agent-alias-id", default="TSTALIASID")
+    parser.add_argument("--no-trace", action="store_true", help="invoke without trace, the tokens are not counted")
+    parser.add_argument("--max-retries", type=int, default=0, help="retries of the throttled turns, with backoff")
+    parser.add_argument("--throttle-pause-s", type=float, default=1.0,
+                        help="pause of a worker after a throttled turn, before its next conversation")
+    parser.add_argument("--max-throttle-rate", type=float, default=0.5,
+                        help="stop the ramp after a step with a larger fraction of throttled turns")
+    parser.add_argument("--output", default=None, help="JSON lines file of the result of every turn")
+    parser.add_argument("--recordings", default=None, help="recordings replayed offline, synthesized if not set")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed of the recordings")
+    parser.add_argument("--event-interval-ms", type=float, default=50.0, help="interval between synthesized events")
+    parser.add_argument("--throttle-above", type=int, default=None,
+                        help="offline: throttle the calls made while this many streams are open")
+    args = parser.parse_args()
+
+    conversations = load_scenario(args.scenario)
+    max_concurrency = max(args.concurrency)
+    runtime_client = None
+    agent_id = args.agent_id
+    if agent_id is None:
+        recordings = args.recordings
+        if recordings is None:
+            recordings = synthesize_recording(Path(tempfile.mkdtemp(prefix="load_test_")) / f"synthetic{RECORDING_SUFFIX}",
+                                              1, args.event_interval_ms / 1000)
+        runtime_client = ReplayClient(recordings, mode="realtime", speed=args.speed)
+        if args.throttle_above is not None:
+            runtime_client = ThrottlingStandIn(runtime_client, args.throttle_above)
+        agent_id = "SUPERVISOR"
+
+    from utils.bedrock_agent_helper import AgentsForAmazonBedrock
+    with contextlib.redirect_stdout(io.StringIO()):
+        agents = AgentsForAmazonBedrock(max_pool_connections=max(10, max_concurrency), runtime_client=runtime_client)
+    print(f"{len(conversations)} conversations ({sum(len(c) for c in conversations)} turns) from {args.scenario}, "
+          f"{'offline replay' if args.agent_id is None else f'agent {agent_id}/{args.agent_alias_id}'}, "
+          f"{args.step_duration_s:g}s per step\n")
+
+    summaries: Dict[int, dict] = {}
+    output = open(args.output, "w") if args.output else None
+    try:
+        for concurrency in args.concurrency:
+            st = time.perf_counter()
+            results = run_step(agents, conversations, concurrency, args.step_duration_s, agent_id,
+                               args.agent_alias_id, not args.no_trace, args.max_retries, args.throttle_pause_s)
+            summaries[concurrency] = step_summary(results, time.perf_counter() - st)
+            s = summaries[concurrency]
+            print(f"concurrency {concurrency}: {s['requests']} turns, {s['throughput_rps']:.2f} req/s, "
+                  f"{s['throttled']} throttled, {s['errors']} errors")
+            if output is not None:
+                for result in results:
+                    output.write(json.dumps(result) + "\n")
+            if s["requests"] and s["throttled"] / s["requests"] > args.max_throttle_rate:
+                print(f"stopping the ramp: more than {args.max_throttle_rate:.0%} of the turns were throttled")
+                break
+    finally:
+        if output is not None:
+            output.close()
+    print()
+    print_tables(summaries)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# This script benchmarks the local vector store backend. It builds one index per API spec
+# (the sources of the home network and doorbell knowledge bases) with create_local_index, then
+# measures the latency of query_knowledge_base with the local backend and the latency of the
+# knowledge base lambda handler with the local backend, and reports the recall of the expected API identifiers of the offline
+# evaluation set in the top results. It runs fully offline with the hashing embedding model.
+#
+#   python benchmarks/local_vector_store.py
+#   python benchmarks/local_vector_store.py --num-results 3 --iterations 200
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from bench_utils import BASE_DIR, HOME_NETWORK_KB_LAMBDA_FILE, load_module, print_latency_table
+
+sys.path.insert(0, str(BASE_DIR))
+# the local backend needs no region, do not look one up in the EC2 metadata
+os.environ.setdefault("AWS_EC2_METADATA_DISABLED", "true")
+from utils import utils
+
+EVAL_SET_FILE: str = str(Path(__file__).resolve().parent / "retrieval_eval_set.json")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build time, latency and recall of the local vector store backend")
+    parser.add_argument("--lambda-file", default=HOME_NETWORK_KB_LAMBDA_FILE)
+    parser.add_argument("--eval-set", default=EVAL_SET_FILE)
+    parser.add_argument("--num-results", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=100, help="passes over the evaluation set")
+    args = parser.parse_args()
+
+    eval_set = json.loads(Path(args.eval_set).read_text())
+    index_root = tempfile.mkdtemp(prefix="local_index_")
+    kb_info = {"retriever_backend": "local", "local_index_dir": index_root, "num_retrieved_results": args.num_results}
+    build_ms = {}
+    for spec in sorted({item["spec"] for item in eval_set}):
+        st = time.perf_counter()
+        manifest = utils.create_local_index(Path(spec).stem, [str(BASE_DIR / "data" / spec)], kb_info)
+        build_ms[spec] = (time.perf_counter() - st) * 1000
+        print(f"built {manifest['index_name']}: {manifest['num_chunks']} chunks, "
+              f"{manifest['dimensions']} dimensions in {build_ms[spec]:.1f} ms")
+
+    st = time.perf_counter()
+    for spec in build_ms:
+        utils.get_retriever(kb_info).get_store(Path(spec).stem)
+    load_ms = (time.perf_counter() - st) * 1000
+
+    recall = []
+    for item in eval_set:
+        result = utils.query_knowledge_base(item["query"], Path(item["spec"]).stem, kb_info)
+        assert result is not None, item["query"]
+        text = "".join(chunk["text"] for chunk in result["chunks"])
+        recall.append(sum(1 for expected in item["expected"] if expected in text) / len(item["expected"]))
+
+    retrieve_ms = []
+    for _ in range(args.iterations):
+        for item in eval_set:
+            st = time.perf_counter()
+            utils.query_knowledge_base(item["query"], Path(item["spec"]).stem, kb_info)
+            retrieve_ms.append((time.perf_counter() - st) * 1000)
+
+    # the lambda reads its backend from the environment when its module is loaded
+    os.environ["RETRIEVER_BACKEND"] = "local"
+    os.environ["LOCAL_INDEX_DIR"] = index_root
+    module = load_module(args.lambda_file)
+    handler_ms = []
+    for _ in range(args.iterations):
+        for item in eval_set:
+            event = {"body": json.dumps({"query": item["query"], "kb_id": Path(item["spec"]).stem,
+                                         "num_results": args.num_results, "projection": "minimal"})}
+            st = time.perf_counter()
+            response = module.lambda_handler(event, None)
+            handler_ms.append((time.perf_counter() - st) * 1000)
+            assert response["statusCode"] == 200, response
+
+    print(f"\nindex load (memory-mapped): {load_ms:.2f} ms, recall of the expected identifiers in the "
+          f"top {args.num_results}: {sum(recall) / len(recall):.2f} over {len(eval_set)} queries")
+    print_latency_table({
+        "query_knowledge_base (local)": retrieve_ms,
+        "KB lambda handler (local)": handler_ms,
+    })
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# This script counts the list calls made to resolve agent names to IDs while a multi-agent
+# system is deployed, with the lookup the helper used before (one list_agents call of at most
+# 100 agents per lookup, without pagination) and with the ResourceResolver of
+# utils/resource_resolver.py (one paginated list per TTL, updated with the created agents).
+# The lookups follow the deployment notebooks: every sub-agent is created and then looked up by
+# create_lambda, add_action_group_with_lambda, add_code_interpreter and prepare, and the
+# supervisor looks up every sub-agent in build_sub_agent_list and create_supervisor_agent. The
+# account is a stand-in bedrock agent client that already holds a number of other agents, and
+# every list call is charged a fixed latency to estimate the time spent listing.
+#
+#   python benchmarks/name_resolution.py --existing-agents 0 100 250 1000 --sub-agents 2
+import sys
+import time
+import argparse
+from typing import Dict, Optional
+from bench_utils import BASE_DIR
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.resource_resolver import ResourceResolver, AGENTS
+
+# Lookups of an agent by name made by the helper methods after the agent is created
+LOOKUPS_PER_SUB_AGENT = ("create_lambda", "add_action_group_with_lambda", "add_code_interpreter", "prepare")
+
+class StandInAgentClient:
+    """Stand-in of the list_agents and create_agent operations of the bedrock agent client"""
+    def __init__(self, existing_agents: int):
+        self.agents = [{"agentName": f"agent-{i:05d}", "agentId": f"ID{i:08d}"} for i in range(existing_agents)]
+        self.list_calls = 0
+
+    def list_agents(self, maxResults: int = 100, nextToken: Optional[str] = None) -> dict:
+        self.list_calls += 1
+        start = int(nextToken or 0)
+        response = {"agentSummaries": self.agents[start:start + maxResults]}
+        if start + maxResults < len(self.agents):
+            response["nextToken"] = str(start + maxResults)
+        return response
+
+    def create_agent(self, agentName: str) -> dict:
+        agent = {"agentName": agentName, "agentId": f"NEW{len(self.agents):08d}"}
+        self.agents.append(agent)
+        return {"agent": agent}
+
+def previous_lookup(client: StandInAgentClient, agent_name: str) -> Optional[str]:
+    """The lookup of get_agent_id_by_name before the resolver"""
+    agents = client.list_agents(maxResults=100)["agentSummaries"]
+    return next((agent["agentId"] for agent in agents if agent["agentName"] == agent_name), None)
+
+def deploy(existing_agents: int, sub_agents: int, use_resolver: bool) -> Dict[str, float]:
+    """Create the sub-agents and the supervisor and make the lookups of the deployment"""
+    client = StandInAgentClient(existing_agents)
+    resolver = ResourceResolver(client)
+    lookup = (lambda name: resolver.resolve(AGENTS, name)) if use_resolver else \
+        (lambda name: previous_lookup(client, name))
+    names = [f"sub-agent-{i}" for i in range(sub_agents)]
+    lookups = misses = 0
+    st = time.perf_counter()
+    for name in names + ["supervisor"]:
+        created = client.create_agent(name)["agent"]
+        if use_resolver:
+            resolver.add(AGENTS, created)
+        for _ in LOOKUPS_PER_SUB_AGENT:
+            lookups += 1
+            misses += lookup(name) is None
+        if name == "supervisor":
+            # build_sub_agent_list and create_supervisor_agent
+            for sub_agent in names * 2:
+                lookups += 1
+                misses += lookup(sub_agent) is None
+    return {"lookups": lookups, "misses": misses, "list_calls": client.list_calls,
+            "cpu_ms": (time.perf_counter() - st) * 1000}
+
+def main():
+    parser = argparse.ArgumentParser(description="List calls made by the agent name lookups of a deployment")
+    parser.add_argument("--existing-agents", type=int, nargs="+", default=[0, 100, 250, 1000])
+    parser.add_argument("--sub-agents", type=int, default=2)
+    parser.add_argument("--list-latency-ms", type=float, default=150,
+                        help="latency charged to every list_agents call")
+    args = parser.parse_args()
+
+    print(f"{args.sub_agents} sub-agents and a supervisor, {len(LOOKUPS_PER_SUB_AGENT)} lookups per agent and "
+          f"{2 * args.sub_agents} by the supervisor, {args.list_latency_ms:g} ms per list call\n")
+    print(f"{'existing agents':<17}{'lookup':<10}{'lookups':>9}{'not found':>11}{'list calls':>12}"
+          f"{'listing s':>11}{'cpu ms':>9}")
+    for existing_agents in args.existing_agents:
+        for name, use_resolver in [("previous", False), ("resolver", True)]:
+            result = deploy(existing_agents, args.sub_agents, use_resolver)
+            print(f"{existing_agents:<17}{name:<10}{result['lookups']:>9}{result['misses']:>11}"
+                  f"{result['list_calls']:>12}{result['list_calls'] * args.list_latency_ms / 1000:>11.2f}"
+                  f"{result['cpu_ms']:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# This script estimates the wall time the helpers spend waiting while the two knowledge bases and
+# the agents of the multi-agent system are provisioned, on a fake clock, with the fixed sleeps and
+# fixed interval polling of the helpers before utils/waiters.py and with its waiters. Every
+# resource becomes ready after a random time drawn from the ranges below (collections, indexes,
+# knowledge bases, ingestion jobs, IAM role propagation, agent creation and preparation), and the
+# same draws are replayed for both. With the waiters, the fixed sleeps are replaced by readiness
+# checks and retries with backoff, and the ingestion jobs of the two knowledge bases are waited
+# on together. The script prints the simulated wait per phase and the number of status polls.
+#
+#   python benchmarks/provisioning_waits.py --trials 200 --sub-agents 2
+import sys
+import random
+import argparse
+import statistics
+from typing import Dict, List, Tuple
+from bench_utils import BASE_DIR, percentile
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.waiters import WaitCondition, wait_all, wait_until, retry_until_ready
+
+# Seconds until each kind of resource is ready, drawn uniformly
+READY_AFTER_S: Dict[str, Tuple[float, float]] = {
+    "collection": (90, 240),
+    "data_access_rules": (5, 60),
+    "index": (1, 10),
+    "knowledge_base": (3, 30),
+    "ingestion_job": (20, 120),
+    "role_propagation": (2, 12),
+    "agent_create": (2, 8),
+    "agent_prepare": (3, 20),
+    "agent_alias": (3, 15),
+}
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.polls = 0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+class NotReady(Exception):
+    pass
+
+def draw(rng: random.Random, kind: str) -> float:
+    return rng.uniform(*READY_AFTER_S[kind])
+
+def fixed_poll(clock: FakeClock, ready_after_s: float, interval_s: float) -> None:
+    """Poll every interval_s until the resource is ready, as the previous helper loops"""
+    ready_at = clock.now + ready_after_s
+    clock.polls += 1
+    while clock.now < ready_at:
+        clock.sleep(interval_s)
+        clock.polls += 1
+
+def status(clock: FakeClock, ready_at: float):
+    def check() -> str:
+        clock.polls += 1
+        return "ACTIVE" if clock.now >= ready_at else "CREATING"
+    return check
+
+def attempt(clock: FakeClock, ready_at: float):
+    def call() -> str:
+        clock.polls += 1
+        if clock.now < ready_at:
+            raise NotReady()
+        return "ok"
+    return call
+
+def previous_helpers(durations: dict, clock: FakeClock) -> Dict[str, float]:
+    """Fixed sleeps and fixed interval polling, one resource at a time"""
+    phases = {}
+    start = clock.now
+    for kb in durations["kbs"]:
+        fixed_poll(clock, kb["collection"], 30)
+        clock.sleep(60)                                   # data access rules
+        clock.sleep(60)                                   # index creation
+        fixed_poll(clock, max(0.0, kb["index"] - 60), 1.5)  # create_knowledge_base @retry
+        clock.sleep(60)                                   # knowledge base creation
+    phases["knowledge bases"] = clock.now - start
+    start = clock.now
+    for kb in durations["kbs"]:
+        fixed_poll(clock, max(0.0, kb["knowledge_base"] - 60), 10)
+        fixed_poll(clock, kb["ingestion_job"], 5)
+    phases["ingestion"] = clock.now - start
+    start = clock.now
+    for agent in durations["agents"]:
+        clock.sleep(10)                                   # role creation
+        fixed_poll(clock, max(0.0, agent["role_propagation"] - 10), 4)  # create_agent retries
+        fixed_poll(clock, agent["agent_create"], 5)       # wait_agent_status_update before the action group
+        clock.sleep(5)                                    # role of the lambda function
+        clock.sleep(5)                                    # after create_lambda
+        fixed_poll(clock, agent["agent_prepare"], 5)      # wait_agent_status_update
+        clock.sleep(5)                                    # after prepare_agent
+        fixed_poll(clock, agent["agent_alias"], 5)        # wait_agent_alias_status_update
+    supervisor = durations["supervisor"]
+    clock.sleep(20)                                       # supervisor role
+    clock.sleep(15)                                       # supervisor creation
+    fixed_poll(clock, max(0.0, supervisor["agent_prepare"] - 5), 5)
+    clock.sleep(5)
+    phases["agents"] = clock.now - start
+    return phases
+
+def waiters(durations: dict, clock: FakeClock) -> Dict[str, float]:
+    """Readiness checks with backoff, the ingestion jobs waited on together"""
+    options = {"clock": clock, "sleep": clock.sleep}
+    retryable = lambda e: isinstance(e, NotReady)
+    phases = {}
+    start = clock.now
+    for kb in durations["kbs"]:
+        wait_until("collection", status(clock, clock.now + kb["collection"]), lambda s: s == "ACTIVE", **options)
+        retry_until_ready("index", attempt(clock, clock.now + kb["data_access_rules"]), retryable, **options)
+        wait_until("index", status(clock, clock.now + kb["index"]), lambda s: s == "ACTIVE", **options)
+        wait_until("knowledge base", status(clock, clock.now + kb["knowledge_base"]), lambda s: s == "ACTIVE", **options)
+    phases["knowledge bases"] = clock.now - start
+    start = clock.now
+    wait_all([WaitCondition(f"ingestion {i}", status(clock, clock.now + kb["ingestion_job"]), lambda s: s == "ACTIVE")
+              for i, kb in enumerate(durations["kbs"])], **options)
+    phases["ingestion"] = clock.now - start
+    start = clock.now
+    for agent in durations["agents"]:
+        retry_until_ready("create_agent", attempt(clock, clock.now + agent["role_propagation"]), retryable, **options)
+        wait_until("agent", status(clock, clock.now + agent["agent_create"]), lambda s: s == "ACTIVE", **options)
+        retry_until_ready("create_function", attempt(clock, clock.now + agent["role_propagation"]), retryable, **options)
+        wait_until("prepare", status(clock, clock.now + agent["agent_prepare"]), lambda s: s == "ACTIVE", **options)
+        wait_until("alias", status(clock, clock.now + agent["agent_alias"]), lambda s: s == "ACTIVE", **options)
+    supervisor = durations["supervisor"]
+    retry_until_ready("create_agent", attempt(clock, clock.now + supervisor["role_propagation"]), retryable, **options)
+    wait_until("supervisor", status(clock, clock.now + supervisor["agent_prepare"]), lambda s: s == "ACTIVE", **options)
+    phases["agents"] = clock.now - start
+    return phases
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated provisioning waits, fixed sleeps vs backoff waiters")
+    parser.add_argument("--trials", type=int, default=200)
+    parser.add_argument("--sub-agents", type=int, default=2)
+    parser.add_argument("--knowledge-bases", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    totals: Dict[str, Dict[str, List[float]]] = {"fixed sleeps": {}, "waiters": {}}
+    polls: Dict[str, List[int]] = {"fixed sleeps": [], "waiters": []}
+    for _ in range(args.trials):
+        durations = {
+            "kbs": [{kind: draw(rng, kind) for kind in ("collection", "data_access_rules", "index", "knowledge_base",
+                                                        "ingestion_job")} for _ in range(args.knowledge_bases)],
+            "agents": [{kind: draw(rng, kind) for kind in ("role_propagation", "agent_create", "agent_prepare",
+                                                           "agent_alias")} for _ in range(args.sub_agents)],
+            "supervisor": {kind: draw(rng, kind) for kind in ("role_propagation", "agent_prepare")},
+        }
+        for name, run in [("fixed sleeps", previous_helpers), ("waiters", waiters)]:
+            clock = FakeClock()
+            phases = run(durations, clock)
+            phases["total"] = clock.now
+            for phase, seconds in phases.items():
+                totals[name].setdefault(phase, []).append(seconds)
+            polls[name].append(clock.polls)
+
+    print(f"{args.trials} trials, {args.knowledge_bases} knowledge bases, {args.sub_agents} sub-agents and a supervisor\n")
+    print(f"{'phase':<18}{'fixed median s':>16}{'fixed p90 s':>13}{'waiters median s':>18}{'waiters p90 s':>15}")
+    for phase in totals["fixed sleeps"]:
+        fixed, waited = totals["fixed sleeps"][phase], totals["waiters"][phase]
+        print(f"{phase:<18}{statistics.median(fixed):>16.1f}{percentile(fixed, 90):>13.1f}"
+              f"{statistics.median(waited):>18.1f}{percentile(waited, 90):>15.1f}")
+    print(f"\nstatus polls per provisioning: fixed sleeps {statistics.median(polls['fixed sleeps']):.0f}, "
+          f"waiters {statistics.median(polls['waiters']):.0f} (median)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# This script measures how long the export of the metrics record of an invocation to the
+# TokenLedger of utils/token_ledger.py holds the invocation, with one transaction per record
+# (batch size 1) and with the rows of several records written in one transaction, and the
+# latency of the reports by agent and day on the resulting database. The metrics records are
+# built by the MetricsAggregator from the synthetic supervisor stream, with the models of
+# config.yaml for the steps whose trace does not name one, and the databases are written to
+# a temporary directory.
+#
+#   python benchmarks/token_ledger.py --records 500 --batch-sizes 1 10 50 200
+import os
+import sys
+import time
+import argparse
+import tempfile
+from typing import Dict, List
+from bench_utils import BASE_DIR, synthetic_agent_event_stream, print_latency_table
+
+sys.path.insert(0, str(BASE_DIR))
+from utils.utils import load_config
+from utils.agent_events import parse_event_stream, MetricsAggregator
+from utils.token_ledger import TokenLedger
+
+MULTI_AGENT_NAMES = {"HOMENET/ALIAS1": "home-network-assistant"}
+
+def metrics_record(session_id: str, models: Dict[str, str]) -> dict:
+    """Metrics record of a turn of the synthetic supervisor stream"""
+    metrics = MetricsAggregator("SUPERVISOR", "TSTALIASID", session_id, MULTI_AGENT_NAMES)
+    for event in parse_event_stream(synthetic_agent_event_stream(1)):
+        metrics.handle(event)
+    metrics.close()
+    record = metrics.summary()
+    for step in record["steps"]:
+        step["model"] = step["model"] or models.get(step["sub_agent"])
+    return record
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and report latency of the token ledger")
+    parser.add_argument("--records", type=int, default=500, help="metrics records exported per batch size")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--report-iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    config = load_config(BASE_DIR / "config.yaml") or {}
+    prices = config.get("token_ledger", {}).get("prices")
+    model_information = config.get("model_information", {})
+    models = {"supervisor": model_information.get("supervisor_agent_model"),
+              "home-network-assistant": model_information.get("home_network_sub_agent_model")}
+    records = [metrics_record(f"session-{i % 20}", models) for i in range(args.records)]
+    work_dir = tempfile.mkdtemp(prefix="token_ledger_")
+    print(f"{args.records} metrics records with {len(records[0]['steps'])} model invocations each\n")
+
+    export_ms: Dict[str, List[float]] = {}
+    totals = {}
+    ledger = None
+    for batch_size in args.batch_sizes:
+        ledger = TokenLedger(os.path.join(work_dir, f"ledger_{batch_size}.sqlite"), batch_size=batch_size,
+                             flush_interval_s=3600, prices=prices)
+        name = f"batch size {batch_size}"
+        export_ms[name] = []
+        st = time.perf_counter()
+        for record in records:
+            record_st = time.perf_counter()
+            ledger.export(record)
+            export_ms[name].append((time.perf_counter() - record_st) * 1000)
+        ledger.flush()
+        totals[name] = ((time.perf_counter() - st) * 1000, ledger.batches_written)
+        if batch_size != args.batch_sizes[-1]:
+            ledger.close()
+
+    print("time the invocation is held by the export of its metrics record:")
+    print_latency_table(export_ms)
+    print(f"\n{'batch size':<28}{'total ms':>10}{'transactions':>14}")
+    for name, (total_ms, batches) in totals.items():
+        print(f"{name:<28}{total_ms:>10.1f}{batches:>14}")
+
+    report_ms: Dict[str, List[float]] = {}
+    for by in ["agent", "day", ("day", "agent"), "model"]:
+        name = f"report by {by if isinstance(by, str) else ' and '.join(by)}"
+        report_ms[name] = []
+        for _ in range(args.report_iterations):
+            st = time.perf_counter()
+            rows = ledger.report(by=by)
+            report_ms[name].append((time.perf_counter() - st) * 1000)
+    print(f"\nreports on {ledger.rows_written} model invocations:")
+    print_latency_table(report_ms)
+    print()
+    for row in ledger.report(by="agent"):
+        print(row)
+    ledger.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# This file contains the fixtures shared by the tests. The tests run offline: the AWS clients
+# are replaced by stubs, and the waits by a fake clock whose sleep moves the time forward.
+#
+#   python -m pytest -q tests
+import sys
+from pathlib import Path
+
+import pytest
+
+# the utils package is imported from the root of the repository, like in the notebooks
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+class FakeClock:
+    """Clock of the waiters and controllers under test, moved forward by its sleep"""
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
@@ -0,0 +1,128 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from utils.admission_control import AdmissionController, AdmissionTimeout, BATCH, INTERACTIVE, is_throttling
+
+def throttling_error() -> ClientError:
+    return ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "Converse")
+
+def controller(clock, **budget) -> AdmissionController:
+    budgets = {
+        "default": {"rate": 4, "burst": 4, "min_rate": 0.5, "max_rate": 5, **budget},
+        "aimd": {"decrease_factor": 0.5, "additive_increase": 0.5, "increase_interval_s": 1.0},
+        "interactive_reserve": 0.25,
+        "max_wait_s": 60,
+    }
+    return AdmissionController(budgets, clock=clock, sleep=clock.sleep)
+
+def rate(admission: AdmissionController, api: str = "converse") -> float:
+    return next(m["rate"] for m in admission.metrics() if m["bucket"] == f"api:{api}")
+
+def test_throttle_cuts_the_rate_down_to_the_minimum(clock):
+    admission = controller(clock)
+    admission.acquire("converse")
+    admission.on_throttle("converse")
+    assert rate(admission) == 2.0
+    for _ in range(5):
+        admission.on_throttle("converse")
+    assert rate(admission) == 0.5
+
+def test_success_raises_the_rate_once_per_interval_up_to_the_maximum(clock):
+    admission = controller(clock)
+    admission.acquire("converse")
+    admission.on_success("converse")
+    assert rate(admission) == 4.0
+    clock.now += 1.0
+    admission.on_success("converse")
+    admission.on_success("converse")
+    assert rate(admission) == 4.5
+    for _ in range(5):
+        clock.now += 1.0
+        admission.on_success("converse")
+    assert rate(admission) == 5.0
+
+def test_throttle_empties_the_bucket(clock):
+    admission = controller(clock)
+    admission.acquire("converse")
+    admission.on_throttle("converse")
+    # no tokens left, the next call waits for one token at the cut rate of 2 per second
+    assert admission.acquire("converse") == pytest.approx(0.5)
+
+def test_batch_calls_leave_the_interactive_reserve(clock):
+    admission = controller(clock)
+    for _ in range(3):
+        admission.acquire("converse")
+    # 1 token left: an interactive call takes it, a batch call needs it plus the reserve of 1 token
+    with pytest.raises(AdmissionTimeout):
+        admission.acquire("converse", priority=BATCH, max_wait_s=0.1)
+    assert admission.acquire("converse", priority=INTERACTIVE, max_wait_s=0) == 0.0
+    # the batch call is admitted once the bucket refilled 2 tokens at 4 per second
+    assert admission.acquire("converse", priority=BATCH) == pytest.approx(0.5)
+
+def test_acquire_times_out_when_no_token_comes_in_time(clock):
+    admission = controller(clock, rate=1, burst=1)
+    admission.acquire("retrieve")
+    with pytest.raises(AdmissionTimeout):
+        admission.acquire("retrieve", max_wait_s=0.5)
+    metrics = admission.metrics()[0]
+    assert metrics["timeouts"] == 1
+    assert metrics["queue_depth"] == {INTERACTIVE: 0, BATCH: 0}
+    assert clock.sleeps == []
+
+def test_model_budget_applies_to_inference_profiles(clock):
+    admission = AdmissionController({"models": {"amazon.nova-pro-v1:0": {"rate": 1, "burst": 1}}},
+                                    clock=clock, sleep=clock.sleep)
+    admission.acquire("converse", model="us.amazon.nova-pro-v1:0")
+    assert admission.acquire("converse", model="amazon.nova-pro-v1:0") == pytest.approx(1.0)
+    assert {m["bucket"] for m in admission.metrics()} == {"api:converse", "model:amazon.nova-pro-v1:0"}
+
+def test_call_retries_a_throttled_stub_until_it_succeeds(clock):
+    admission = controller(clock)
+    calls = []
+
+    def converse(**kwargs):
+        calls.append(clock.now)
+        if len(calls) <= 2:
+            raise throttling_error()
+        return {"output": kwargs["messages"]}
+
+    assert admission.call("converse", converse, messages=["hi"]) == {"output": ["hi"]}
+    assert len(calls) == 3
+    metrics = admission.metrics()[0]
+    assert metrics["throttles"] == 2
+    # cut to 2 and 1, then raised by the success that came an interval after the last throttle
+    assert metrics["rate"] == 1.5
+    # the rate cut by each throttling response spaces out the retries
+    assert calls[1] - calls[0] == pytest.approx(0.5)
+    assert calls[2] - calls[1] == pytest.approx(1.0)
+
+def test_call_raises_once_the_retries_are_exhausted(clock):
+    admission = controller(clock)
+    calls = []
+
+    def converse():
+        calls.append(clock.now)
+        raise throttling_error()
+
+    with pytest.raises(ClientError):
+        admission.call("converse", converse, max_retries=2)
+    assert len(calls) == 3
+
+def test_call_does_not_retry_other_errors(clock):
+    admission = controller(clock)
+    calls = []
+
+    def converse():
+        calls.append(clock.now)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        admission.call("converse", converse)
+    assert len(calls) == 1
+    assert admission.metrics()[0]["throttles"] == 0
+
+def test_is_throttling():
+    assert is_throttling(throttling_error())
+    assert is_throttling(ClientError({"Error": {"Code": "TooManyRequestsException"}}, "InvokeModel"))
+    assert not is_throttling(ClientError({"Error": {"Code": "AccessDeniedException"}}, "InvokeModel"))
+    assert not is_throttling(ValueError("ThrottlingException"))
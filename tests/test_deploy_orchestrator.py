@@ -0,0 +1,215 @@
+import json
+import threading
+from pathlib import Path
+
+import pytest
+
+import utils.utils
+from utils.utils import load_config
+from utils.deploy_orchestrator import (BRANCHES, COMPLETED, FAILED, DeployFailure, DeployOrchestrator, DeployStep,
+                                       MultiAgentStack)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+def recorder(calls: list, output=None, fail: bool = False):
+    """Step run that records the outputs it was called with, and returns output or raises"""
+    def run(outputs):
+        calls.append(dict(outputs))
+        if fail:
+            raise RuntimeError("step failed")
+        return output
+    return run
+
+def diamond(calls: dict, fail=()) -> list:
+    """a -> (b, c) -> d, plus e that depends on nothing"""
+    dependencies = {"a": [], "b": ["a"], "c": ["a"], "d": ["b", "c"], "e": []}
+    for name in dependencies:
+        calls.setdefault(name, [])
+    return [DeployStep(name, recorder(calls[name], f"{name}-out", name in fail), depends_on)
+            for name, depends_on in dependencies.items()]
+
+def test_steps_run_after_their_dependencies(tmp_path):
+    calls = {}
+    orchestrator = DeployOrchestrator(diamond(calls), str(tmp_path / "state.json"))
+    outputs = orchestrator.run(verbose=False)
+    assert outputs == {name: f"{name}-out" for name in "abcde"}
+    # every step was run once, with the outputs of the steps it depends on
+    assert {name: len(c) for name, c in calls.items()} == {name: 1 for name in "abcde"}
+    assert set(calls["a"][0]) <= {"e"}
+    assert {"a"} <= set(calls["b"][0]) and {"a"} <= set(calls["c"][0])
+    assert {"a", "b", "c"} <= set(calls["d"][0])
+    order = orchestrator.order
+    for step in orchestrator.steps.values():
+        assert all(order.index(d) < order.index(step.name) for d in step.depends_on)
+
+def test_dependency_cycles_and_unknown_steps_are_rejected(tmp_path):
+    state_fpath = str(tmp_path / "state.json")
+    steps = [DeployStep("a", recorder([]), ["c"]), DeployStep("b", recorder([]), ["a"]),
+             DeployStep("c", recorder([]), ["b"])]
+    with pytest.raises(ValueError, match="Dependency cycle: a -> c -> b -> a"):
+        DeployOrchestrator(steps, state_fpath)
+    with pytest.raises(ValueError, match="unknown steps"):
+        DeployOrchestrator([DeployStep("a", recorder([]), ["missing"])], state_fpath)
+    with pytest.raises(ValueError, match="unique"):
+        DeployOrchestrator([DeployStep("a", recorder([])), DeployStep("a", recorder([]))], state_fpath)
+
+def test_failure_is_raised_once_the_running_steps_are_done(tmp_path):
+    state_fpath = tmp_path / "state.json"
+    slow_started, slow_done = threading.Event(), []
+
+    def fail_fast(outputs):
+        slow_started.wait(5)
+        raise RuntimeError("bucket already owned")
+
+    def slow(outputs):
+        slow_started.set()
+        threading.Event().wait(0.05)
+        slow_done.append(True)
+        return "slow-out"
+
+    dependent_calls = []
+    steps = [DeployStep("fail", fail_fast), DeployStep("slow", slow),
+             DeployStep("dependent", recorder(dependent_calls), ["fail"])]
+    with pytest.raises(DeployFailure) as error:
+        DeployOrchestrator(steps, str(state_fpath)).run(verbose=False)
+    assert list(error.value.errors) == ["fail"]
+    # the step that was running when the other one failed completed and was checkpointed
+    assert slow_done == [True]
+    state = json.loads(state_fpath.read_text())["steps"]
+    assert state["slow"]["status"] == COMPLETED
+    assert state["fail"]["status"] == FAILED
+    assert "bucket already owned" in state["fail"]["error"]
+    # the steps that depend on the failed step are not started
+    assert "dependent" not in state and dependent_calls == []
+
+def test_rerun_resumes_from_the_state_file(tmp_path):
+    state_fpath = str(tmp_path / "state.json")
+    calls = {}
+    with pytest.raises(DeployFailure):
+        DeployOrchestrator(diamond(calls, fail={"c"}), state_fpath).run(verbose=False)
+    assert calls["d"] == []
+    # the next run only runs the failed step and the steps after it, with the checkpointed outputs
+    calls = {}
+    orchestrator = DeployOrchestrator(diamond(calls), state_fpath)
+    outputs = orchestrator.run(verbose=False)
+    assert outputs == {name: f"{name}-out" for name in "abcde"}
+    assert {name for name, c in calls.items() if c} == {"c", "d"}
+    assert calls["d"][0]["a"] == "a-out"
+    assert "resumed" in orchestrator.timing_report()
+
+def test_force_runs_the_step_and_its_dependents_again(tmp_path):
+    state_fpath = str(tmp_path / "state.json")
+    DeployOrchestrator(diamond({}), state_fpath).run(verbose=False)
+    calls = {}
+    orchestrator = DeployOrchestrator(diamond(calls), state_fpath)
+    assert orchestrator.dependents(["b"]) == ["b", "d"]
+    orchestrator.run(force=["b"], verbose=False)
+    assert {name for name, c in calls.items() if c} == {"b", "d"}
+
+def test_critical_path_is_the_longest_chain_of_the_run(tmp_path, clock):
+    durations = {"a": 10, "b": 30, "c": 5, "d": 2, "e": 35}
+
+    def timed(name):
+        def run(outputs):
+            clock.sleep(durations[name])
+            return name
+        return run
+
+    dependencies = {"a": [], "b": ["a"], "c": ["a"], "d": ["b", "c"], "e": []}
+    # one worker, so that the steps move the fake clock one after the other
+    orchestrator = DeployOrchestrator([DeployStep(name, timed(name), deps) for name, deps in dependencies.items()],
+                                      str(tmp_path / "state.json"), max_workers=1, clock=clock)
+    orchestrator.run(verbose=False)
+    assert orchestrator.critical_path() == (["a", "b", "d"], 42)
+    assert orchestrator.wall_s == sum(durations.values())
+    report = orchestrator.timing_report()
+    assert "critical path: a -> b -> d" in report
+
+class StubAgents:
+    """Stand-in of AgentsForAmazonBedrock that records the agents, action groups and aliases it creates"""
+
+    def __init__(self):
+        self.created = []
+        self.lock = threading.Lock()
+        self._bedrock_agent_client = self
+        self._lambda_client = self
+
+    def _record(self, *call):
+        with self.lock:
+            self.created.append(call)
+
+    def create_prompt(self, name, **kwargs):
+        self._record("prompt", name)
+        return {"id": f"{name}-id", "arn": f"arn:prompt/{name}"}
+
+    def create_prompt_version(self, promptIdentifier):
+        pass
+
+    def create_agent(self, agent_name, *args, **kwargs):
+        self._record("agent", agent_name)
+        return f"{agent_name}-id", f"arn:agent/{agent_name}", f"arn:role/{agent_name}"
+
+    def wait_agent_status_update(self, agent_id):
+        pass
+
+    def add_action_group_with_lambda(self, agent_name, lambda_function_name, **kwargs):
+        assert Path(kwargs["source_code_file"]).exists()
+        self._record("action_group", agent_name)
+
+    def update_function_configuration(self, FunctionName, Environment):
+        self._record("lambda_env", FunctionName, Environment["Variables"]["KB_ID"])
+
+    def get_waiter(self, name):
+        return self
+
+    def wait(self, **kwargs):
+        pass
+
+    def create_agent_alias(self, agent_id, alias_name):
+        self._record("alias", agent_id)
+        return f"{agent_id}-alias", f"arn:alias/{agent_id}"
+
+    def wait_agent_alias_status_update(self, agent_id, alias_id):
+        pass
+
+    def associate_sub_agents(self, supervisor_agent_id, sub_agents_list):
+        self._record("collaborators", supervisor_agent_id, [a["sub_agent_alias_arn"] for a in sub_agents_list])
+        return f"{supervisor_agent_id}-alias", f"arn:alias/{supervisor_agent_id}"
+
+class StubKnowledgeBases:
+    """Stand-in of KnowledgeBasesForAmazonBedrock of one branch"""
+
+    def __init__(self, name):
+        self.name = name
+        self.synchronized = []
+
+    def create_or_retrieve_knowledge_base(self, kb_name, kb_description, bucket):
+        return f"{self.name}-kb", f"{self.name}-ds"
+
+    def synchronize_data_sources(self, kb_ds_ids):
+        self.synchronized += kb_ds_ids
+        return [{"ingestionJobId": f"{kb_id}-job"} for kb_id, _ in kb_ds_ids]
+
+def test_multi_agent_stack_deploys_both_branches_and_the_supervisor(tmp_path, monkeypatch):
+    uploads, kb_lambdas = [], []
+    monkeypatch.setattr(utils.utils, "create_s3_bucket_for_kb", lambda bucket, region: True)
+    monkeypatch.setattr(utils.utils, "upload_file_to_s3", lambda fpath, bucket: uploads.append(Path(fpath)))
+    monkeypatch.setattr(utils.utils, "create_kb_lambda",
+                        lambda **kwargs: kb_lambdas.append(kwargs) or f"arn:function/{kwargs['lambda_function_name']}")
+    agents = StubAgents()
+    kbs = {name: StubKnowledgeBases(name) for name in BRANCHES}
+    stack = MultiAgentStack(agents, kbs, load_config(str(BASE_DIR / "config.yaml")), "us-east-1", str(BASE_DIR))
+    outputs = DeployOrchestrator(stack.steps(), str(tmp_path / "state.json")).run(verbose=False)
+
+    for name, branch in BRANCHES.items():
+        assert outputs[f"{name}:knowledge_base"]["kb_id"] == f"{name}-kb"
+        assert kbs[name].synchronized == [(f"{name}-kb", f"{name}-ds")]
+        assert outputs[f"{name}:alias"]["alias_arn"] == f"arn:alias/{branch['agent_name']}-id"
+        assert ("lambda_env", f"{branch['agent_name']}_lambda", f"{name}-kb") in agents.created
+    assert all(fpath.exists() for fpath in uploads) and len(uploads) == len(BRANCHES)
+    assert sorted(kwargs["kb_id"] for kwargs in kb_lambdas) == sorted(f"{name}-kb" for name in BRANCHES)
+    # the supervisor is associated with the aliases of both sub-agents, once they are created
+    collaborators = [call for call in agents.created if call[0] == "collaborators"]
+    assert collaborators == [("collaborators", outputs["supervisor:agent"]["agent_id"],
+                              [outputs[f"{name}:alias"]["alias_arn"] for name in BRANCHES])]
+    assert agents.created[-1][0] == "collaborators"
@@ -0,0 +1,31 @@
+import pytest
+
+from utils.retrieval_fusion import DEFAULT_RRF_K, normalize_scores, reciprocal_rank_fusion
+from utils.utils import query_knowledge_bases
+
+def test_normalize_scores():
+    assert normalize_scores([]) == []
+    assert normalize_scores([{"score": 0.4}, {"score": 0.4}]) == [1.0, 1.0]
+    assert normalize_scores([{"score": 0.9}, {"score": 0.5}, {"score": 0.1}]) == pytest.approx([1.0, 0.5, 0.0])
+
+def test_chunks_of_several_knowledge_bases_are_fused_by_rank():
+    fused = reciprocal_rank_fusion({
+        "home-network": [{"text": "wifi", "score": 0.9}, {"text": "shared", "score": 0.5}],
+        "doorbell": [{"text": "chime", "score": 0.3}, {"text": "shared", "score": 0.2}],
+    })
+    assert [chunk["text"] for chunk in fused] == ["shared", "wifi", "chime"]
+    shared = fused[0]
+    # the first knowledge base that returned the chunk, its best normalized score and the sum of its ranks
+    assert shared["kb_id"] == "home-network"
+    assert shared["normalized_score"] == 0.0
+    assert shared["rrf_score"] == round(2 / (DEFAULT_RRF_K + 2), 6)
+    assert fused[1]["rrf_score"] == round(1 / (DEFAULT_RRF_K + 1), 6)
+    # ties on the fused score are broken by the normalized score
+    assert fused[1]["normalized_score"] == fused[2]["normalized_score"] == 1.0
+
+def test_rank_constant():
+    fused = reciprocal_rank_fusion({"kb": [{"text": "a", "score": 1}, {"text": "b", "score": 0}]}, k=1)
+    assert [chunk["rrf_score"] for chunk in fused] == [0.5, round(1 / 3, 6)]
+
+def test_query_knowledge_bases_without_knowledge_bases():
+    assert query_knowledge_bases("how do I reboot the router", [], {}) is None
@@ -0,0 +1,116 @@
+import random
+
+import pytest
+from botocore.exceptions import ClientError
+
+from utils.waiters import (Backoff, WaitCondition, WaiterFailure, WaiterTimeout, wait_all, wait_until,
+                           retry_until_ready, is_failed, is_role_not_ready, is_settled)
+
+def backoff(seed: int = 0, **kwargs) -> Backoff:
+    return Backoff(rng=random.Random(seed), **kwargs)
+
+def status_at(clock, ready_at: float, ready_status: str = "PREPARED", pending_status: str = "PREPARING"):
+    """Check of a resource that is ready from ready_at on, counting its polls"""
+    polls = []
+
+    def check():
+        polls.append(clock.now)
+        return ready_status if clock.now >= ready_at else pending_status
+
+    check.polls = polls
+    return check
+
+def test_backoff_grows_to_the_maximum_with_jitter():
+    delays = backoff(initial_delay_s=1, max_delay_s=8, jitter=0.5).delays()
+    values = [next(delays) for _ in range(6)]
+    for value, delay in zip(values, [1, 2, 4, 8, 8, 8]):
+        assert delay * 0.5 <= value <= delay
+    # the same seed gives the same delays
+    same_seed = backoff(initial_delay_s=1, max_delay_s=8, jitter=0.5).delays()
+    assert values == [next(same_seed) for _ in range(6)]
+
+def test_wait_until_returns_the_ready_status(clock):
+    check = status_at(clock, ready_at=5)
+    assert wait_until("agent", check, clock=clock, sleep=clock.sleep, backoff=backoff()) == "PREPARED"
+    assert 5 <= clock.now < 5 + 10
+    assert check.polls[0] == 0
+    # the polls are spaced by the growing delays of the backoff
+    gaps = [b - a for a, b in zip(check.polls, check.polls[1:])]
+    assert gaps == sorted(gaps)
+
+def test_wait_until_does_not_sleep_for_a_ready_resource(clock):
+    assert wait_until("alias", lambda: "PREPARED", clock=clock, sleep=clock.sleep) == "PREPARED"
+    assert clock.sleeps == []
+
+def test_wait_all_takes_as_long_as_the_slowest_resource(clock):
+    ready_at = {"agent": 12, "alias": 30, "knowledge base": 45, "collection": 60}
+    checks = {name: status_at(clock, at) for name, at in ready_at.items()}
+    statuses = wait_all([WaitCondition(name, check) for name, check in checks.items()],
+                        backoff=backoff(max_delay_s=10), clock=clock, sleep=clock.sleep)
+    assert statuses == {name: "PREPARED" for name in ready_at}
+    # waited on together: the slowest resource plus at most one poll delay, not the sum of 147s
+    assert 60 <= clock.now <= 70
+    for name, check in checks.items():
+        assert check.polls[-1] >= ready_at[name]
+
+def test_wait_all_raises_the_failure_of_a_resource(clock):
+    conditions = [
+        WaitCondition("agent", status_at(clock, 5), is_settled, is_failed),
+        WaitCondition("ingestion job", status_at(clock, 3, ready_status="FAILED"), is_settled, is_failed),
+    ]
+    with pytest.raises(WaiterFailure) as error:
+        wait_all(conditions, backoff=backoff(), clock=clock, sleep=clock.sleep)
+    assert error.value.name == "ingestion job"
+    assert error.value.status == "FAILED"
+    assert clock.now < 10
+
+def test_wait_all_raises_a_timeout_with_the_pending_statuses(clock):
+    conditions = [WaitCondition("agent", status_at(clock, 5)), WaitCondition("collection", status_at(clock, 1000))]
+    with pytest.raises(WaiterTimeout) as error:
+        wait_all(conditions, deadline_s=120, backoff=backoff(), clock=clock, sleep=clock.sleep)
+    assert error.value.pending == {"collection": "PREPARING"}
+    # the wait gives up before sleeping past the deadline
+    assert clock.now <= 120
+
+def role_not_ready() -> ClientError:
+    return ClientError({"Error": {"Code": "InvalidParameterValueException",
+                                  "Message": "The role defined for the function cannot be assumed by Lambda."}},
+                       "CreateFunction")
+
+def test_retry_until_ready_retries_until_the_role_can_be_assumed(clock):
+    attempts = []
+
+    def create_function():
+        attempts.append(clock.now)
+        if clock.now < 8:
+            raise role_not_ready()
+        return {"FunctionArn": "arn"}
+
+    assert retry_until_ready("lambda", create_function, is_role_not_ready, backoff=backoff(),
+                             clock=clock, sleep=clock.sleep) == {"FunctionArn": "arn"}
+    assert len(attempts) > 2
+    assert 8 <= clock.now < 8 + 10
+
+def test_retry_until_ready_raises_other_errors_at_once(clock):
+    def create_function():
+        raise ClientError({"Error": {"Code": "AccessDeniedException", "Message": "denied"}}, "CreateFunction")
+
+    with pytest.raises(ClientError):
+        retry_until_ready("lambda", create_function, is_role_not_ready, clock=clock, sleep=clock.sleep)
+    assert clock.sleeps == []
+
+def test_retry_until_ready_raises_a_timeout_at_the_deadline(clock):
+    def create_function():
+        raise role_not_ready()
+
+    with pytest.raises(WaiterTimeout) as error:
+        retry_until_ready("lambda", create_function, is_role_not_ready, deadline_s=30, backoff=backoff(),
+                          clock=clock, sleep=clock.sleep)
+    assert "InvalidParameterValueException" in error.value.pending["lambda"]
+    assert isinstance(error.value.__cause__, ClientError)
+    assert clock.now <= 30
+
+def test_status_predicates():
+    assert is_settled("PREPARED") and is_settled("FAILED") and not is_settled("CREATING")
+    assert is_failed("CREATE_FAILED") and not is_failed("ACTIVE")
+    assert not is_role_not_ready(ValueError("role cannot be assumed"))
@@ -0,0 +1,265 @@
+# This file contains a client-side admission controller of the Amazon Bedrock calls
+# (invoke_agent, converse, retrieve, invoke_model), shared by AgentsForAmazonBedrock, the
+# knowledge base helpers of utils/utils.py and the lambda functions, which get a copy of this
+# file in their container image. Every call takes a token from the bucket of its API, and from
+# the bucket of its model if the model has its own budget, so that the callers wait on the
+# client instead of sending calls the service throttles. The rate of a bucket is adjusted with
+# AIMD: it is cut by a factor on every throttling response and raised by a fixed step at most
+# once per interval while calls succeed. Interactive calls are admitted before batch calls, and
+# batch calls leave a share of the burst to the interactive ones. The budgets come from the
+# admission_control section of config.yaml, or from the ADMISSION_BUDGETS environment variable
+# (the same section as JSON) in the lambda functions.
+#
+#   controller = AdmissionController.from_config(config)
+#   response = controller.call("converse", client.converse, model="us.amazon.nova-pro-v1:0", modelId=..., messages=...)
+#   print(controller.metrics())
+#
+# This module only uses the standard library, so that the lambda functions can import it.
+import time
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+INTERACTIVE: str = "interactive"
+BATCH: str = "batch"
+PRIORITY_CLASSES: Tuple[str, ...] = (INTERACTIVE, BATCH)
+# Budget of the APIs and models without their own budget, in calls per second
+DEFAULT_BUDGET: Dict[str, float] = {"rate": 5.0, "burst": 10, "min_rate": 0.2, "max_rate": 50.0}
+DEFAULT_AIMD: Dict[str, float] = {"decrease_factor": 0.5, "additive_increase": 0.5, "increase_interval_s": 1.0}
+# Share of the burst of a bucket that batch calls leave to the interactive calls
+DEFAULT_INTERACTIVE_RESERVE: float = 0.25
+# Longest time a call waits to be admitted, and retries of a throttled call by AdmissionController.call
+DEFAULT_MAX_WAIT_S: float = 60.0
+DEFAULT_MAX_RETRIES: int = 3
+# Error codes of the throttling responses of the AWS APIs, in lower case
+_THROTTLING_CODES = ("throttlingexception", "toomanyrequestsexception", "throttling")
+# Prefixes of the cross-region inference profile IDs, removed to look up the budget of a model
+_INFERENCE_PROFILE_PREFIXES = ("us.", "eu.", "apac.", "us-gov.")
+
+class AdmissionTimeout(TimeoutError):
+    """Raised when a call cannot be admitted within its maximum wait"""
+
+def is_throttling(error: Exception) -> bool:
+    """
+    Whether the error is a throttling response, raised by a call or received in an EventStream
+    """
+    response = getattr(error, "response", None)
+    if not isinstance(response, dict):
+        return False
+    return response.get("Error", {}).get("Code", "").lower() in _THROTTLING_CODES
+
+class TokenBucket:
+    """Token bucket of an API or model, with the AIMD adjusted rate and its queue metrics"""
+
+    def __init__(self, name: str, budget: dict, aimd: dict, now: float):
+        self.name = name
+        self.rate = float(budget.get("rate", DEFAULT_BUDGET["rate"]))
+        self.burst = float(budget.get("burst", max(1.0, self.rate)))
+        self.min_rate = float(budget.get("min_rate", min(DEFAULT_BUDGET["min_rate"], self.rate)))
+        self.max_rate = float(budget.get("max_rate", max(DEFAULT_BUDGET["max_rate"], self.rate)))
+        self.decrease_factor = aimd["decrease_factor"]
+        self.additive_increase = aimd["additive_increase"]
+        self.increase_interval_s = aimd["increase_interval_s"]
+        self.tokens = self.burst
+        self.updated_at = now
+        self.increased_at = now
+        self.waiting = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.max_waiting = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.admitted = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.wait_s = {priority: 0.0 for priority in PRIORITY_CLASSES}
+        self.throttles = 0
+        self.timeouts = 0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def on_throttle(self, now: float) -> None:
+        """Multiplicative decrease, and no tokens left until the new rate refills them"""
+        self.refill(now)
+        self.throttles += 1
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self.tokens = min(self.tokens, 0.0)
+        self.increased_at = now
+
+    def on_success(self, now: float) -> None:
+        """Additive increase, at most once per increase interval"""
+        if now - self.increased_at >= self.increase_interval_s:
+            self.rate = min(self.max_rate, self.rate + self.additive_increase)
+            self.increased_at = now
+
+    def metrics(self) -> dict:
+        return {
+            "bucket": self.name,
+            "rate": round(self.rate, 3),
+            "burst": self.burst,
+            "tokens": round(self.tokens, 3),
+            "queue_depth": dict(self.waiting),
+            "max_queue_depth": dict(self.max_waiting),
+            "admitted": dict(self.admitted),
+            "mean_wait_s": {p: round(self.wait_s[p] / self.admitted[p], 4) if self.admitted[p] else 0.0
+                            for p in PRIORITY_CLASSES},
+            "throttles": self.throttles,
+            "timeouts": self.timeouts
+        }
+
+class AdmissionController:
+    """
+    Admits the calls to the Bedrock APIs at the rate of their token buckets. The budgets are
+    a dict with the budget of every API and model, each with its rate and burst and the range
+    of its AIMD adjusted rate, for example:
+        {"default": {"rate": 5, "burst": 10},
+         "apis": {"invoke_agent": {"rate": 2, "burst": 4, "min_rate": 0.1, "max_rate": 10}},
+         "models": {"amazon.nova-pro-v1:0": {"rate": 1, "burst": 2}},
+         "aimd": {"decrease_factor": 0.5, "additive_increase": 0.5, "increase_interval_s": 1},
+         "interactive_reserve": 0.25, "max_wait_s": 60}
+    The clock and sleep functions can be replaced, for example by a fake clock in tests.
+    """
+
+    def __init__(self, budgets: Optional[dict] = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        budgets = budgets or {}
+        self.default_budget = {**DEFAULT_BUDGET, **(budgets.get("default") or {})}
+        self.api_budgets: Dict[str, dict] = budgets.get("apis") or {}
+        self.model_budgets: Dict[str, dict] = budgets.get("models") or {}
+        self.aimd = {**DEFAULT_AIMD, **(budgets.get("aimd") or {})}
+        self.interactive_reserve = float(budgets.get("interactive_reserve", DEFAULT_INTERACTIVE_RESERVE))
+        self.max_wait_s = float(budgets.get("max_wait_s", DEFAULT_MAX_WAIT_S))
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional["AdmissionController"]:
+        """
+        Create the controller from the admission_control section of config.yaml, or return
+        None if the section is missing or not enabled
+        """
+        budgets = (config or {}).get("admission_control")
+        if not budgets or not budgets.get("enabled", True):
+            return None
+        return cls(budgets)
+
+    def _model_budget(self, model: Optional[str]) -> Optional[Tuple[str, dict]]:
+        if not model:
+            return None
+        for prefix in ("",) + _INFERENCE_PROFILE_PREFIXES:
+            if model.startswith(prefix) and model[len(prefix):] in self.model_budgets:
+                return model[len(prefix):], self.model_budgets[model[len(prefix):]]
+        return None
+
+    def _buckets_for(self, api: str, model: Optional[str]) -> List[TokenBucket]:
+        """Buckets a call takes a token from, the most specific last. Called with the lock held."""
+        keys = [(f"api:{api}", self.api_budgets.get(api) or self.default_budget)]
+        model_budget = self._model_budget(model)
+        if model_budget is not None:
+            keys.append((f"model:{model_budget[0]}", model_budget[1]))
+        buckets = []
+        for key, budget in keys:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(key, budget, self.aimd, self._clock())
+            buckets.append(self._buckets[key])
+        return buckets
+
+    def _try_take(self, buckets: List[TokenBucket], priority: str, now: float) -> float:
+        """Take a token from every bucket and return 0, or return the time to wait for them"""
+        wait = 0.0
+        for bucket in buckets:
+            bucket.refill(now)
+            needed = 1.0
+            if priority == BATCH:
+                # batch calls leave the reserve, and the next token, to the waiting interactive calls
+                needed = min(bucket.burst, needed + self.interactive_reserve * bucket.burst
+                             + bucket.waiting[INTERACTIVE])
+            if bucket.tokens < needed:
+                wait = max(wait, (needed - bucket.tokens) / bucket.rate)
+        if wait == 0.0:
+            for bucket in buckets:
+                bucket.tokens -= 1.0
+        return wait
+
+    def acquire(self, api: str, model: Optional[str] = None, priority: str = INTERACTIVE,
+                max_wait_s: Optional[float] = None) -> float:
+        """
+        Wait until the call is admitted by the buckets of its API and model
+        Args:
+            api (str): Name of the API, for example 'invoke_agent', 'converse' or 'retrieve'
+            model (str, optional): Model ID of the call, only limited if it has a budget
+            priority (str): INTERACTIVE or BATCH
+            max_wait_s (float, optional): Longest wait, defaults to the max_wait_s of the budgets
+        Returns:
+            float: The time the call waited, in seconds
+        Raises:
+            AdmissionTimeout: If the call cannot be admitted within max_wait_s
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"priority must be one of {PRIORITY_CLASSES}")
+        with self._lock:
+            buckets = self._buckets_for(api, model)
+            started = self._clock()
+            for bucket in buckets:
+                bucket.waiting[priority] += 1
+                bucket.max_waiting[priority] = max(bucket.max_waiting[priority], bucket.waiting[priority])
+        deadline = started + (self.max_wait_s if max_wait_s is None else max_wait_s)
+        try:
+            while True:
+                with self._lock:
+                    now = self._clock()
+                    wait = self._try_take(buckets, priority, now)
+                    if wait == 0.0:
+                        for bucket in buckets:
+                            bucket.admitted[priority] += 1
+                            bucket.wait_s[priority] += now - started
+                        return now - started
+                    if now + wait > deadline:
+                        for bucket in buckets:
+                            bucket.timeouts += 1
+                        raise AdmissionTimeout(f"{api} call not admitted within {deadline - started:.1f}s")
+                self._sleep(wait)
+        finally:
+            with self._lock:
+                for bucket in buckets:
+                    bucket.waiting[priority] -= 1
+
+    def on_throttle(self, api: str, model: Optional[str] = None) -> None:
+        """
+        Cut the rate of the most specific bucket of the call after a throttling response
+        """
+        with self._lock:
+            self._buckets_for(api, model)[-1].on_throttle(self._clock())
+
+    def on_success(self, api: str, model: Optional[str] = None) -> None:
+        """
+        Raise the rate of the most specific bucket of the call after a successful call
+        """
+        with self._lock:
+            self._buckets_for(api, model)[-1].on_success(self._clock())
+
+    def call(self, api: str, fn: Callable, *args, model: Optional[str] = None, priority: str = INTERACTIVE,
+             max_retries: int = DEFAULT_MAX_RETRIES, **kwargs):
+        """
+        Call fn(*args, **kwargs) once admitted, and retry it up to max_retries times when it is
+        throttled. The rate cut by the throttling response spaces out the retries.
+        """
+        for attempt in range(max_retries + 1):
+            self.acquire(api, model, priority)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if is_throttling(e):
+                    self.on_throttle(api, model)
+                    if attempt < max_retries:
+                        continue
+                raise
+            self.on_success(api, model)
+            return result
+
+    def metrics(self) -> List[dict]:
+        """
+        Return the rate, tokens, queue depth per priority class, admitted calls, mean wait,
+        throttles and timeouts of every bucket
+        """
+        with self._lock:
+            for bucket in self._buckets.values():
+                bucket.refill(self._clock())
+            return [bucket.metrics() for bucket in self._buckets.values()]
@@ -0,0 +1,801 @@
+# This file contains the typed events parsed from the EventStream returned by
+# invoke_agent, and the sinks that consume them. parse_event_stream yields the
+# events as the stream is read, and the sinks (console renderer, metrics aggregator
+# and artifact writers) handle them one at a time, so that callers of
+# AgentsForAmazonBedrock.invoke_events can consume the events programmatically
+# and AgentsForAmazonBedrock.invoke only composes the parser with its sinks.
+import io
+import os
+import re
+import ast
+import json
+import time
+import codecs
+import queue
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Classification returned by the routing classifier when no collaborator matches
+UNDECIDABLE_CLASSIFICATION = "undecidable"
+# Number of characters of the collaborator input text that are printed
+TRACE_TRUNCATION_LENGTH = 300
+# Key of the code in the tool output of the generate_code function of the action group lambdas,
+# which is the repr of a dict
+GENERATED_CODE_KEY = "original_generated_code"
+# Markdown code blocks, with or without a language on the line of the opening fence. The body is
+# matched as runs of non-backticks separated by single backticks, so that it fails in linear time
+# on an unclosed fence without the possessive quantifiers of Python 3.11+
+_CODE_FENCE = re.compile(r"```(?:[ \t]*[\w+.-]*[ \t]*\n)?([^`]*(?:`(?!``)[^`]*)*)```")
+# Placeholder of the code interpreter file paths, escaped or not
+_BASE_PATH_PLACEHOLDER = re.compile(r"\\*\$BASE_PATH\\*\$/")
+# Number of artifacts the background artifact writer holds before the stream consumer waits
+DEFAULT_ARTIFACT_QUEUE_SIZE = 64
+
+def colored(text: str, color: str) -> str:
+    """termcolor.colored, imported when the console renderer first prints, like rich and matplotlib"""
+    from termcolor import colored as _colored
+    return _colored(text, color)
+
+class AgentEvent:
+    """Base class of the events parsed from an invoke_agent EventStream. Every event
+    holds the stream event it was parsed from and the time it was parsed at.
+    """
+    __slots__ = ("raw", "timestamp")
+
+    def __init__(self, raw: dict):
+        self.raw = raw
+        self.timestamp = time.perf_counter()
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self._fields())
+        return f"{type(self).__name__}({fields})"
+
+    @classmethod
+    def _fields(cls) -> List[str]:
+        return [name for klass in reversed(cls.__mro__) for name in getattr(klass, "__slots__", ())
+                if name not in AgentEvent.__slots__]
+
+class TraceEvent(AgentEvent):
+    """Trace part of a stream event, emitted before the events parsed from the trace"""
+    __slots__ = ("trace", "sub_agent_alias_id")
+
+    def __init__(self, raw: dict, trace: dict, sub_agent_alias_id: Optional[str]):
+        super().__init__(raw)
+        self.trace = trace
+        self.sub_agent_alias_id = sub_agent_alias_id
+
+class ChunkEvent(AgentEvent):
+    """Chunk of the answer of the agent"""
+    __slots__ = ("text",)
+
+    def __init__(self, raw: dict, text: str):
+        super().__init__(raw)
+        self.text = text
+
+class RoutingEvent(AgentEvent):
+    """Input ('input') or classification ('output') of the routing classifier"""
+    __slots__ = ("phase", "classification", "input_tokens", "output_tokens")
+
+    def __init__(self, raw: dict, phase: str, classification: Optional[str] = None,
+                 input_tokens: int = 0, output_tokens: int = 0):
+        super().__init__(raw)
+        self.phase = phase
+        self.classification = classification
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+class RationaleEvent(AgentEvent):
+    """Rationale of the orchestration step"""
+    __slots__ = ("text",)
+
+    def __init__(self, raw: dict, text: str):
+        super().__init__(raw)
+        self.text = text
+
+class ToolInputEvent(AgentEvent):
+    """Invocation of an action group function ('action_group') or of the code interpreter ('code_interpreter')"""
+    __slots__ = ("kind", "function", "parameters", "code", "invocation_input")
+
+    def __init__(self, raw: dict, kind: str, function: Optional[str] = None, parameters: Optional[list] = None,
+                 code: Optional[str] = None, invocation_input: Optional[dict] = None):
+        super().__init__(raw)
+        self.kind = kind
+        self.function = function
+        self.parameters = parameters
+        self.code = code
+        self.invocation_input = invocation_input
+
+class ToolOutputEvent(AgentEvent):
+    """Output of an action group function, with the code extracted from generate_code outputs"""
+    __slots__ = ("text", "generated_code")
+
+    def __init__(self, raw: dict, text: str, generated_code: Optional[str] = None):
+        super().__init__(raw)
+        self.text = text
+        self.generated_code = generated_code
+
+class CollaboratorEvent(AgentEvent):
+    """Input sent to ('input') or output received from ('output') a sub-agent collaborator"""
+    __slots__ = ("phase", "name", "alias_ids", "text")
+
+    def __init__(self, raw: dict, phase: str, name: str, text: str, alias_ids: Optional[str] = None):
+        super().__init__(raw)
+        self.phase = phase
+        self.name = name
+        self.text = text
+        self.alias_ids = alias_ids
+
+class FinalResponseEvent(AgentEvent):
+    """Final response observed at the end of the orchestration"""
+    __slots__ = ("text",)
+
+    def __init__(self, raw: dict, text: str):
+        super().__init__(raw)
+        self.text = text
+
+class UsageEvent(AgentEvent):
+    """Tokens used by a model invocation of the 'routing', 'orchestration', 'pre_processing'
+    or 'post_processing' step, and the sub-agent that made it if any
+    """
+    __slots__ = ("source", "input_tokens", "output_tokens", "sub_agent_alias_id")
+
+    def __init__(self, raw: dict, source: str, input_tokens: int, output_tokens: int,
+                 sub_agent_alias_id: Optional[str] = None):
+        super().__init__(raw)
+        self.source = source
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.sub_agent_alias_id = sub_agent_alias_id
+
+class FileEvent(AgentEvent):
+    """File returned by the agent, for example an image generated by the code interpreter"""
+    __slots__ = ("name", "type", "data")
+
+    def __init__(self, raw: dict, name: str, type: str, data: bytes):
+        super().__init__(raw)
+        self.name = name
+        self.type = type
+        self.data = data
+
+class FailureEvent(AgentEvent):
+    """Failure reported in the trace"""
+    __slots__ = ("reason",)
+
+    def __init__(self, raw: dict, reason: str):
+        super().__init__(raw)
+        self.reason = reason
+
+def decode_tool_output(tool_output: str) -> Optional[dict]:
+    """Parse the text of an action group invocation output, which is the repr of the dict
+    returned by the action group lambdas, or JSON.
+
+    Args:
+        tool_output (str): Text of the action group invocation output.
+
+    Returns:
+        Optional[dict]: The parsed output, or None if it is not a dict.
+    """
+    text = tool_output.strip()
+    if not text.startswith("{"):
+        return None
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        try:
+            parsed = ast.literal_eval(text)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return None
+    return parsed if isinstance(parsed, dict) else None
+
+def _string_literal_at(text: str, start: int) -> str:
+    """Return the quoted string that starts at text[start], closed at the end of the text
+    if the text was truncated before its closing quote."""
+    quote = text[start]
+    end = start + 1
+    while True:
+        end = text.find(quote, end)
+        if end < 0:
+            return text[start:] + quote
+        # the quote is escaped if it follows an odd number of backslashes
+        backslashes = 0
+        while text[end - 1 - backslashes] == "\\":
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return text[start:end + 1]
+        end += 1
+
+def _decode_string_literal(literal: str) -> str:
+    """Decode the repr of a python string."""
+    body = literal[1:-1]
+    if "\\" not in body:
+        return body
+    if not any(escape in body for escape in ("\\x", "\\u", "\\U", "\\N")):
+        # without code point escapes, the escapes of a repr are decoded by escape_decode in C
+        return codecs.escape_decode(body.encode("utf-8"))[0].decode("utf-8")
+    try:
+        return ast.literal_eval(literal)
+    except (ValueError, SyntaxError):
+        return body
+
+def extract_code_blocks(text: str) -> str:
+    """Return the code of the markdown code blocks of the text, or the text if it has none."""
+    blocks = _CODE_FENCE.findall(text)
+    code = "\n\n".join(block.strip("\n") for block in blocks) if blocks else text.replace("```", "")
+    return _BASE_PATH_PLACEHOLDER.sub("", code) if "$BASE_PATH$" in code else code
+
+def extract_generated_code(tool_output: str) -> Optional[str]:
+    """Extract the generated code from the output of the generate_code function, or
+    return None if the tool output does not come from generate_code. The quoted value of
+    the code is located and decoded in one pass, also when the output was truncated, and
+    the output is parsed as a whole only if the value is not a quoted string.
+
+    Args:
+        tool_output (str): Text of the action group invocation output.
+
+    Returns:
+        Optional[str]: The generated code without its markdown fence and escapes.
+    """
+    key_start = tool_output.find(GENERATED_CODE_KEY)
+    if key_start < 0:
+        return None
+    # skip the closing quote of the key, the colon and the spaces up to the quote of the value
+    value_start = key_start + len(GENERATED_CODE_KEY) + 1
+    while value_start < len(tool_output) and tool_output[value_start] in ": \t\n":
+        value_start += 1
+    if value_start < len(tool_output) and tool_output[value_start] in "'\"":
+        if tool_output[value_start] == '"':
+            # JSON output, or a repr quoted with double quotes, decoded up to its closing quote in C
+            try:
+                return extract_code_blocks(json.decoder.scanstring(tool_output, value_start + 1)[0])
+            except ValueError:
+                pass
+        return extract_code_blocks(_decode_string_literal(_string_literal_at(tool_output, value_start)))
+    parsed = decode_tool_output(tool_output)
+    if parsed is not None and isinstance(parsed.get(GENERATED_CODE_KEY), str):
+        return extract_code_blocks(parsed[GENERATED_CODE_KEY])
+    return None
+
+# Step of the model invocations of every kind of trace
+_TRACE_STEPS = {"routingClassifierTrace": "routing", "orchestrationTrace": "orchestration",
+                "preProcessingTrace": "pre_processing", "postProcessingTrace": "post_processing"}
+
+def _foundation_model(trace: dict) -> Optional[tuple]:
+    """Return the (step, model ID) of the model invocation input of a trace, if it has one"""
+    for kind, step in _TRACE_STEPS.items():
+        model_input = trace.get(kind, {}).get('modelInvocationInput')
+        if model_input and model_input.get('foundationModel'):
+            return step, model_input['foundationModel']
+    return None
+
+def _usage(model_invocation_output: dict) -> tuple:
+    usage = model_invocation_output['metadata']['usage']
+    return usage['inputTokens'], usage['outputTokens']
+
+def _parse_trace(event: dict) -> Iterator[AgentEvent]:
+    sub_agent_alias_id = None
+    caller_chain = event['trace'].get('callerChain', [])
+    if len(caller_chain) > 1:
+        # get sub agent id by grabbing all text following the second '/' character
+        sub_agent_alias_id = caller_chain[1]['agentAliasArn'].split('/', 1)[1]
+    yield TraceEvent(event, event['trace'], sub_agent_alias_id)
+
+    trace = event['trace'].get('trace', {})
+    if 'routingClassifierTrace' in trace:
+        route = trace['routingClassifierTrace']
+        if 'modelInvocationInput' in route:
+            yield RoutingEvent(event, 'input')
+        if 'modelInvocationOutput' in route:
+            in_tokens, out_tokens = _usage(route['modelInvocationOutput'])
+            yield UsageEvent(event, 'routing', in_tokens, out_tokens)
+            raw_resp = json.loads(route['modelInvocationOutput']['rawResponse']['content'])
+            classification = raw_resp['content'][0]['text'].replace('<a>', '').replace('</a>', '')
+            yield RoutingEvent(event, 'output', classification, in_tokens, out_tokens)
+
+    if 'failureTrace' in trace:
+        yield FailureEvent(event, trace['failureTrace']['failureReason'])
+
+    if 'orchestrationTrace' in trace:
+        orch = trace['orchestrationTrace']
+        if 'rationale' in orch:
+            yield RationaleEvent(event, orch['rationale']['text'])
+        if 'invocationInput' in orch:
+            # NOTE: when agent determines invocations should happen in parallel
+            # the trace objects for invocation input still come back one at a time.
+            invocation_input = orch['invocationInput']
+            if 'actionGroupInvocationInput' in invocation_input:
+                action_input = invocation_input['actionGroupInvocationInput']
+                yield ToolInputEvent(event, 'action_group', function=action_input.get('function'),
+                                     parameters=action_input.get('parameters', []), invocation_input=action_input)
+            elif 'agentCollaboratorInvocationInput' in invocation_input:
+                collab_input = invocation_input['agentCollaboratorInvocationInput']
+                yield CollaboratorEvent(event, 'input', collab_input['agentCollaboratorName'],
+                                        collab_input['input']['text'],
+                                        collab_input['agentCollaboratorAliasArn'].split('/', 1)[1])
+            elif 'codeInterpreterInvocationInput' in invocation_input:
+                yield ToolInputEvent(event, 'code_interpreter',
+                                     code=invocation_input['codeInterpreterInvocationInput']['code'],
+                                     invocation_input=invocation_input['codeInterpreterInvocationInput'])
+        if 'observation' in orch:
+            observation = orch['observation']
+            if 'actionGroupInvocationOutput' in observation:
+                tool_output = observation['actionGroupInvocationOutput']['text']
+                yield ToolOutputEvent(event, tool_output, extract_generated_code(tool_output))
+            if 'agentCollaboratorInvocationOutput' in observation:
+                collab_output = observation['agentCollaboratorInvocationOutput']
+                yield CollaboratorEvent(event, 'output', collab_output['agentCollaboratorName'],
+                                        collab_output['output']['text'])
+            if 'finalResponse' in observation:
+                yield FinalResponseEvent(event, observation['finalResponse']['text'])
+        if 'modelInvocationOutput' in orch:
+            in_tokens, out_tokens = _usage(orch['modelInvocationOutput'])
+            yield UsageEvent(event, 'orchestration', in_tokens, out_tokens, sub_agent_alias_id)
+
+    elif 'preProcessingTrace' in trace:
+        if 'modelInvocationOutput' in trace['preProcessingTrace']:
+            in_tokens, out_tokens = _usage(trace['preProcessingTrace']['modelInvocationOutput'])
+            yield UsageEvent(event, 'pre_processing', in_tokens, out_tokens, sub_agent_alias_id)
+
+    elif 'postProcessingTrace' in trace:
+        if 'modelInvocationOutput' in trace['postProcessingTrace']:
+            in_tokens, out_tokens = _usage(trace['postProcessingTrace']['modelInvocationOutput'])
+            yield UsageEvent(event, 'post_processing', in_tokens, out_tokens, sub_agent_alias_id)
+
+def parse_event_stream(event_stream: Iterable[dict]) -> Iterator[AgentEvent]:
+    """Parse the EventStream of an invoke_agent response into typed events, yielded
+    as the stream events arrive.
+
+    Args:
+        event_stream (Iterable[dict]): The 'completion' of an invoke_agent response, or recorded stream events.
+
+    Returns:
+        Iterator[AgentEvent]: The parsed events, in stream order.
+    """
+    for event in event_stream:
+        if 'files' in event:
+            for file in event['files']['files']:
+                yield FileEvent(event, file['name'], file['type'], file['bytes'])
+        elif 'chunk' in event:
+            yield ChunkEvent(event, event['chunk']['bytes'].decode('utf8'))
+        if 'trace' in event:
+            yield from _parse_trace(event)
+
+class EventSink:
+    """Consumer of the parsed events. Sinks are called in order for every event."""
+
+    def handle(self, event: AgentEvent) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+class MetricsAggregator(EventSink):
+    """Builds the metrics record of an invocation: model invocations and tokens per step type
+    and per sub-agent, per-step timings, tool and collaborator latencies, time to first chunk
+    and total duration. The timings are taken from the times the events were parsed at, so
+    they include the time the stream took to deliver them.
+    """
+
+    def __init__(self, agent_id: Optional[str] = None, agent_alias_id: Optional[str] = None,
+                 session_id: Optional[str] = None, multi_agent_names: Optional[dict] = None):
+        self.agent_id = agent_id
+        self.agent_alias_id = agent_alias_id
+        self.session_id = session_id
+        self.multi_agent_names = multi_agent_names or {}
+        self.started_at = time.perf_counter()
+        self.started_at_epoch = time.time()
+        self.total_llm_calls = 0
+        self.total_in_tokens = 0
+        self.total_out_tokens = 0
+        self.tokens_by_source: Dict[str, Dict[str, int]] = {}
+        self.tokens_by_sub_agent: Dict[str, Dict[str, int]] = {}
+        self.event_counts: Dict[str, int] = {}
+        self.steps: List[dict] = []
+        self.tools: List[dict] = []
+        self.collaborators: List[dict] = []
+        self.time_to_first_chunk_s: Optional[float] = None
+        self.duration_s = 0.0
+        self._last_step_end = self.started_at
+        self._routing_started: Optional[float] = None
+        self._sub_agent: Optional[str] = None
+        self._pending_tools: List[ToolInputEvent] = []
+        self._pending_collaborators: Dict[str, List[float]] = {}
+        # model of the last model invocation input of every (sub-agent alias, step)
+        self._models: Dict[tuple, str] = {}
+
+    def _sub_agent_name(self, sub_agent_alias_id: Optional[str]) -> str:
+        if sub_agent_alias_id is None:
+            return "supervisor"
+        return self.multi_agent_names.get(sub_agent_alias_id, sub_agent_alias_id)
+
+    def handle(self, event: AgentEvent) -> None:
+        name = type(event).__name__
+        self.event_counts[name] = self.event_counts.get(name, 0) + 1
+        if isinstance(event, TraceEvent):
+            self._sub_agent = event.sub_agent_alias_id
+            model = _foundation_model(event.trace.get('trace', {}))
+            if model is not None:
+                self._models[(event.sub_agent_alias_id, model[0])] = model[1]
+        elif isinstance(event, ChunkEvent):
+            if self.time_to_first_chunk_s is None:
+                self.time_to_first_chunk_s = event.timestamp - self.started_at
+        elif isinstance(event, RoutingEvent):
+            if event.phase == 'input':
+                self._routing_started = event.timestamp
+        elif isinstance(event, UsageEvent):
+            self._handle_usage(event)
+        elif isinstance(event, ToolInputEvent):
+            # the output of the code interpreter is not in the trace, only action groups are timed
+            if event.kind == 'action_group':
+                self._pending_tools.append(event)
+        elif isinstance(event, ToolOutputEvent):
+            if self._pending_tools:
+                tool_input = self._pending_tools.pop(0)
+                self.tools.append({
+                    "tool": tool_input.function,
+                    "sub_agent": self._sub_agent_name(self._sub_agent),
+                    "latency_s": event.timestamp - tool_input.timestamp
+                })
+        elif isinstance(event, CollaboratorEvent):
+            if event.phase == 'input':
+                self._pending_collaborators.setdefault(event.name, []).append(event.timestamp)
+            elif self._pending_collaborators.get(event.name):
+                started = self._pending_collaborators[event.name].pop(0)
+                self.collaborators.append({"name": event.name, "latency_s": event.timestamp - started})
+
+    def _handle_usage(self, event: UsageEvent) -> None:
+        self.total_llm_calls += 1
+        self.total_in_tokens += event.input_tokens
+        self.total_out_tokens += event.output_tokens
+        source = self.tokens_by_source.setdefault(event.source, {"calls": 0, "in": 0, "out": 0})
+        source["calls"] += 1
+        source["in"] += event.input_tokens
+        source["out"] += event.output_tokens
+        sub_agent_name = self._sub_agent_name(event.sub_agent_alias_id)
+        sub_agent = self.tokens_by_sub_agent.setdefault(sub_agent_name, {"calls": 0, "in": 0, "out": 0})
+        sub_agent["calls"] += 1
+        sub_agent["in"] += event.input_tokens
+        sub_agent["out"] += event.output_tokens
+        # a routing step starts with the routing input, the other steps when the previous one ended
+        step_start = self._last_step_end
+        if event.source == 'routing' and self._routing_started is not None:
+            step_start = self._routing_started
+            self._routing_started = None
+        self.steps.append({
+            "step": event.source,
+            "sub_agent": sub_agent_name,
+            "model": self._models.get((event.sub_agent_alias_id, event.source)),
+            "offset_s": step_start - self.started_at,
+            "duration_s": event.timestamp - step_start,
+            "input_tokens": event.input_tokens,
+            "output_tokens": event.output_tokens
+        })
+        self._last_step_end = event.timestamp
+
+    def close(self) -> None:
+        self.duration_s = time.perf_counter() - self.started_at
+
+    def summary(self) -> dict:
+        """Return the metrics record of the invocation, see utils/metrics_exporters.py for its exporters"""
+        def _round(value: Optional[float]) -> Optional[float]:
+            return None if value is None else round(value, 3)
+
+        return {
+            "timestamp": self.started_at_epoch,
+            "agent_id": self.agent_id,
+            "agent_alias_id": self.agent_alias_id,
+            "session_id": self.session_id,
+            "llm_calls": self.total_llm_calls,
+            "input_tokens": self.total_in_tokens,
+            "output_tokens": self.total_out_tokens,
+            "tokens_by_source": self.tokens_by_source,
+            "tokens_by_sub_agent": self.tokens_by_sub_agent,
+            "steps": [{**step, "offset_s": _round(step["offset_s"]), "duration_s": _round(step["duration_s"])}
+                      for step in self.steps],
+            "tools": [{**tool, "latency_s": _round(tool["latency_s"])} for tool in self.tools],
+            "collaborators": [{**collab, "latency_s": _round(collab["latency_s"])} for collab in self.collaborators],
+            "time_to_first_chunk_s": _round(self.time_to_first_chunk_s),
+            "event_counts": self.event_counts,
+            "duration_s": round(self.duration_s, 3)
+        }
+
+class ArtifactWriter(EventSink):
+    """Writes the code generated by the agents and the files they return to disk"""
+
+    def __init__(self, directory: str = "agent_response", input_text: str = "", save_trace_files: bool = False):
+        self.directory = Path(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.input_text = input_text
+        self.save_trace_files = save_trace_files
+        self.now_as_str = time.strftime("%Y-%m-%d_%H_%M_%S")
+        self.written: List[str] = []
+        self._code_ctr = 0
+        self._image_ctr = 0
+        self._code_digests = set()
+
+    def handle(self, event: AgentEvent) -> None:
+        if isinstance(event, ToolInputEvent) and event.kind == 'code_interpreter' and event.code is not None:
+            self._code_ctr += 1
+            # remove bedrock agent specific code from here
+            code = f"```python\n{event.code}\n```".replace("$BASE_PATH$/", "")
+            self._write(self.directory / f"code_event_{self._code_ctr}.py", code.encode())
+        elif isinstance(event, ToolOutputEvent) and event.generated_code is not None:
+            # every unique code body is written once, named by its content hash
+            digest = hashlib.sha256(event.generated_code.encode()).hexdigest()[:16]
+            if digest in self._code_digests:
+                return
+            self._code_digests.add(digest)
+            safe_input = ''.join(c if c.isalnum() else '_' for c in self.input_text.lower())[:20]
+            filename = f"code_event_{digest}_{safe_input}.py"
+            try:
+                self._write(self.directory / filename, event.generated_code.encode())
+                print(f"\nCode saved to: {self.directory / filename}")
+            except Exception as e:
+                print(f"Error saving to primary location: {e}")
+                try:
+                    self._write(Path(os.getcwd()) / filename, event.generated_code.encode())
+                    print(f"Code saved to fallback location: {Path(os.getcwd()) / filename}")
+                except Exception as e2:
+                    print(f"Failed to save code even to fallback location: {e2}")
+        elif isinstance(event, FileEvent):
+            if event.type == 'image/png':
+                self._image_ctr += 1
+                self._write(self.directory / f"output_image_{self._image_ctr}.png", event.data)
+            else:
+                # Save other file types to local disk
+                unique_fname = Path(event.name).stem + "_" + self.now_as_str + Path(event.name).suffix
+                self._write(Path(unique_fname), event.data)
+                print(f"File '{event.name}' as {unique_fname} saved to disk.")
+            if self.save_trace_files:
+                os.makedirs('output', exist_ok=True)
+                self._write(Path('output') / event.name, event.data)
+
+    def _write(self, path: Path, data: bytes) -> None:
+        path.write_bytes(data)
+        self.written.append(str(path))
+
+class BackgroundArtifactWriter(EventSink):
+    """Writes the code generated by the agents and the files they return to a directory per
+    session, from a background thread, so that the stream is not consumed at the pace of
+    the disk. The payloads are handed to the thread through a bounded queue and named by
+    their content hash, so that identical payloads are written once per session and the
+    files of a turn never overwrite those of a previous turn. close waits for the writes.
+    """
+
+    def __init__(self, directory: str = "agent_response", session_id: Optional[str] = None,
+                 max_queue_size: int = DEFAULT_ARTIFACT_QUEUE_SIZE):
+        self.directory = Path(directory)
+        if session_id:
+            self.directory = self.directory / "".join(c if c.isalnum() or c in "-_" else "_" for c in session_id)
+        self.written: List[str] = []
+        self.errors: List[str] = []
+        self.duplicates = 0
+        self.bytes_written = 0
+        # time the stream consumer waited for room in the queue
+        self.enqueue_wait_s = 0.0
+        self._seen = set()
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+
+    def handle(self, event: AgentEvent) -> None:
+        if isinstance(event, ToolInputEvent) and event.kind == 'code_interpreter' and event.code is not None:
+            # remove bedrock agent specific code from here
+            code = f"```python\n{event.code}\n```".replace("$BASE_PATH$/", "")
+            self._submit("code_event", ".py", code.encode())
+        elif isinstance(event, ToolOutputEvent) and event.generated_code is not None:
+            self._submit("generated_code", ".py", event.generated_code.encode())
+        elif isinstance(event, FileEvent):
+            self._submit(Path(event.name).stem, Path(event.name).suffix, event.data)
+
+    def _submit(self, stem: str, suffix: str, data: bytes) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+            self._thread.start()
+        st = time.perf_counter()
+        self._queue.put((stem, suffix, data))
+        self.enqueue_wait_s += time.perf_counter() - st
+
+    def _run(self) -> None:
+        # the payloads are hashed here rather than in handle, which only holds the consumer for the put
+        self.directory.mkdir(parents=True, exist_ok=True)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            stem, suffix, data = item
+            digest = hashlib.sha256(data).hexdigest()[:16]
+            path = self.directory / f"{stem}_{digest}{suffix}"
+            # the payload was already written by this turn or a previous turn of the session
+            if digest in self._seen or path.exists():
+                self._seen.add(digest)
+                self.duplicates += 1
+                continue
+            self._seen.add(digest)
+            try:
+                tmp_path = path.with_name(f".{path.name}.tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+                self.written.append(str(path))
+                self.bytes_written += len(data)
+            except Exception as e:
+                self.errors.append(f"{path}: {e}")
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self.written:
+            print(f"Saved {len(self.written)} artifacts to: {self.directory}")
+        for error in self.errors:
+            print(f"Error saving artifact {error}")
+
+class ConsoleRenderer(EventSink):
+    """Prints the trace of the agent with the same format and trace levels as invoke"""
+
+    def __init__(self, enable_trace: bool = False, trace_level: str = "core", multi_agent_names: Optional[dict] = None,
+                 display_images: bool = True):
+        self.enable_trace = enable_trace
+        self.display_images = display_images
+        self.trace_level = trace_level
+        self.multi_agent_names = multi_agent_names or {}
+        self._sub_agent_name = "<collab-name-not-yet-provided>"
+        self._orch_step = 0
+        self._sub_step = 0
+        self._time_before_routing = time.perf_counter()
+        self._time_before_orchestration = time.perf_counter()
+        self._console = None
+
+    def _print_markdown(self, text: str) -> None:
+        from rich.console import Console
+        from rich.markdown import Markdown
+        if self._console is None:
+            self._console = Console()
+        self._console.print(Markdown(text))
+
+    def handle(self, event: AgentEvent) -> None:
+        if isinstance(event, FileEvent):
+            self._render_file(event)
+            return
+        if not self.enable_trace or isinstance(event, ChunkEvent):
+            return
+        level = self.trace_level
+        if isinstance(event, TraceEvent):
+            if level == "all":
+                print('---')
+                print(json.dumps(event.trace, indent=2, default=str))
+            elif event.sub_agent_alias_id is not None:
+                try:
+                    self._sub_agent_name = self.multi_agent_names[event.sub_agent_alias_id]
+                except KeyError:
+                    print("You haven't provided agents names. To do so provide a dictionary in the format {f'{agent_id}/{agent_alias_id}': f'{agent_name}'})")
+                    self._sub_agent_name = "<not-yet-provided>"
+        elif isinstance(event, RoutingEvent):
+            self._render_routing(event)
+        elif isinstance(event, FailureEvent):
+            print(colored(f"Agent error: {event.reason}", "red"))
+        elif isinstance(event, RationaleEvent):
+            if level in ["core", "outline"]:
+                print(colored(f"{event.text}", "blue"))
+        elif isinstance(event, ToolInputEvent):
+            if level in ["core", "outline"]:
+                self._render_tool_input(event)
+        elif isinstance(event, CollaboratorEvent):
+            self._render_collaborator(event)
+        elif isinstance(event, ToolOutputEvent):
+            if level == "core":
+                print(colored("--tool outputs:", "magenta"))
+                if event.generated_code is not None:
+                    self._print_markdown(f"\n**Generated code**\n```python\n{event.generated_code}\n```")
+                else:
+                    print(f"Tool output:")
+                    print(colored(f"  {event.text}", "magenta"))
+        elif isinstance(event, FinalResponseEvent):
+            if level == "core":
+                print(colored("Final response:", "cyan"))
+                self._print_lines(event.text, "cyan")
+        elif isinstance(event, UsageEvent):
+            self._render_usage(event)
+
+    def _render_routing(self, event: RoutingEvent) -> None:
+        if event.phase == 'input':
+            self._orch_step += 1
+            print(colored(f"---- Step {self._orch_step} ----", "green"))
+            self._time_before_routing = event.timestamp
+            print(colored("Classifying request to immediately route to one collaborator if possible.", "blue"))
+            return
+        if event.classification == UNDECIDABLE_CLASSIFICATION:
+            print(colored(f"Routing classifier did not find a matching collaborator. Reverting to 'SUPERVISOR' mode.", "magenta"))
+        elif event.classification == 'keep_previous_agent':
+            print(colored(f"Continuing conversation with previous collaborator.", "magenta"))
+        else:
+            self._sub_agent_name = event.classification
+            print(colored(f"Routing classifier chose collaborator: '{event.classification}'", "magenta"))
+        route_duration = event.timestamp - self._time_before_routing
+        print(colored(f"Routing classifier took {route_duration:,.1f}s, using {event.input_tokens+event.output_tokens} tokens "
+                      f"(in: {event.input_tokens}, out: {event.output_tokens}).\n", "yellow"))
+
+    def _render_tool_input(self, event: ToolInputEvent) -> None:
+        if event.kind == 'action_group':
+            if self.trace_level == "outline":
+                print(colored(f"Using tool: {event.function}", "magenta"))
+            else:
+                print(f"Action group information: {event.invocation_input}")
+                print(colored(f"Using tool: {event.function} with these inputs:", "magenta"))
+                if (len(event.parameters) == 1) and (event.parameters[0]['name'] == 'input_text'):
+                    print(colored(f"{event.parameters[0]['value']}", "magenta"))
+                else:
+                    print(colored(f"{event.parameters}\n", "magenta"))
+        elif self.trace_level == "outline":
+            print(colored(f"Using code interpreter", "magenta"))
+        else:
+            self._print_markdown(f"**Generated code**\n```python\n{event.code}\n```")
+
+    def _render_collaborator(self, event: CollaboratorEvent) -> None:
+        if event.phase == 'input':
+            if self.trace_level not in ["core", "outline"]:
+                return
+            self._sub_agent_name = event.name
+            if self.trace_level == "outline":
+                print(colored(f"Using sub-agent collaborator: '{event.name} [{event.alias_ids}]'", "magenta"))
+            else:
+                print(colored(f"Using sub-agent collaborator: '{event.name} [{event.alias_ids}]' passing input text:", "magenta"))
+                print(colored(f"{event.text[0:TRACE_TRUNCATION_LENGTH]}\n", "magenta"))
+        elif self.trace_level == "core":
+            print(colored(f"\n----sub-agent {event.name} output text:", "magenta"))
+            self._print_lines(event.text, "magenta")
+            print()
+
+    def _render_usage(self, event: UsageEvent) -> None:
+        in_tokens, out_tokens = event.input_tokens, event.output_tokens
+        if event.source == 'orchestration':
+            if event.sub_agent_alias_id is not None:
+                self._sub_step += 1
+                print(colored(f"---- Step {self._orch_step}.{self._sub_step} [using sub-agent name:{self._sub_agent_name}, id:{event.sub_agent_alias_id}] ----", "green"))
+            else:
+                self._orch_step += 1
+                self._sub_step = 0
+                print(colored(f"---- Step {self._orch_step} ----", "green"))
+            orch_duration = event.timestamp - self._time_before_orchestration
+            print(colored(f'Took {orch_duration:,.1f}s, using {in_tokens+out_tokens} tokens (in: {in_tokens}, out: {out_tokens}) to complete prior action, observe, orchestrate.', "yellow"))
+            # restart the clock for next step/sub-step
+            self._time_before_orchestration = event.timestamp
+        elif event.source == 'pre_processing':
+            print(colored("Pre-processing trace, agent came up with an initial plan.", "yellow"))
+            print(colored(f'Used LLM tokens, in: {in_tokens}, out: {out_tokens}', "yellow"))
+        elif event.source == 'post_processing':
+            print(colored("Agent post-processing complete.", "yellow"))
+            print(colored(f'Used LLM tokens, in: {in_tokens}, out: {out_tokens}', "yellow"))
+
+    def _render_file(self, event: FileEvent) -> None:
+        if self.enable_trace:
+            self._print_markdown("**Files**")
+            print(f"{event.name} ({event.type})")
+        if event.type == 'image/png' and self.display_images:
+            # Display PNG image using Matplotlib
+            import matplotlib.pyplot as plt
+            img = plt.imread(io.BytesIO(event.data))
+            plt.figure(figsize=(10, 10))
+            plt.imshow(img)
+            plt.axis('off')
+            plt.title(event.name)
+            plt.show()
+            plt.close()
+
+    @staticmethod
+    def _print_lines(text: str, color: str) -> None:
+        for line in text.split('\n'):
+            print(colored(f"  {line}", color))
+
+    def render_summary(self, metrics: MetricsAggregator, answer: str) -> None:
+        if not self.enable_trace:
+            return
+        if self.trace_level in ["core", "outline"]:
+            print(colored(f"Agent made a total of {metrics.total_llm_calls} LLM calls, " +\
+                          f"using {metrics.total_in_tokens+metrics.total_out_tokens} tokens " +\
+                          f"(in: {metrics.total_in_tokens}, out: {metrics.total_out_tokens})" +\
+                          f", and took {metrics.duration_s:,.1f} total seconds", "yellow"))
+        if self.trace_level == "all":
+            print(f"Returning agent answer as: {answer}")
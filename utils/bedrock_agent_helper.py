@@ -32,44 +32,73 @@ import ast
 import boto3
 import json
 import time
+import base64
+import hashlib
 import uuid
+import random
+import shutil
+import tempfile
+import asyncio
 import zipfile
+import threading
+import weakref
 from utils.utils import *
 import subprocess
 from dateutil.tz import tzutc
 import os
 import datetime
 from io import BytesIO
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple, Iterator
 import re
 from boto3.session import Session
 from botocore.config import Config
+from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
-from IPython.display import display, Markdown
+from concurrent.futures import ThreadPoolExecutor
 
 # from IPython.display import display, Markdown
 # import matplotlib.pyplot as plt
 # import matplotlib.image as mpimg
 
-from termcolor import colored
-from rich.console import Console
-from rich.markdown import Markdown
+from utils.agent_events import (AgentEvent, ChunkEvent, EventSink, ConsoleRenderer, MetricsAggregator,
+                                ArtifactWriter, BackgroundArtifactWriter, parse_event_stream, UNDECIDABLE_CLASSIFICATION,
+                                TRACE_TRUNCATION_LENGTH)
+from utils.metrics_exporters import MetricsExporter
+from utils.session_manager import DEFAULT_IDLE_SESSION_TTL_S
+from utils.admission_control import AdmissionController, INTERACTIVE, BATCH, is_throttling
+from utils.lambda_images import (LAMBDA_BASE_IMAGE, EcrImageRegistry, image_tag as lambda_image_tag,
+                                 requirements as lambda_requirements, dockerfile as lambda_dockerfile)
+from utils.lambda_packages import (ZIP as LAMBDA_ZIP, PLATFORMS as LAMBDA_PLATFORMS, choose_package_type,
+                                   build_library_layer, function_zip, zip_directory)
+from utils.resource_resolver import ResourceResolver, AGENTS, AGENT_ALIASES
+from utils.waiters import (WaitCondition, wait_all, retry_until_ready, is_role_not_ready, DELETED,
+                           DEFAULT_DEADLINE_S)
 
 PYTHON_TIMEOUT = 180
 PYTHON_RUNTIME = "python3.12"
 DEFAULT_ALIAS = "TSTALIASID"
 DEFAULT_CI_ACTION_GROUP_NAME = "CodeInterpreterAction"
-UNDECIDABLE_CLASSIFICATION = "undecidable"
 ROUTER_MODEL = "us.anthropic.claude-3-haiku-20240307-v1:0"
-TRACE_TRUNCATION_LENGTH = 300
+# Size of the connection pool of the bedrock agent runtime client, which also bounds the
+# number of sessions that invoke_many and ainvoke run concurrently
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+# Retries of an agent turn rejected with a ThrottlingException, with full jitter exponential backoff
+DEFAULT_MAX_THROTTLING_RETRIES = 5
+THROTTLING_BACKOFF_BASE_S = 1.0
+THROTTLING_BACKOFF_MAX_S = 30.0
 
 # Define the number of days for memory storage for the agent
 MEMORY_STORAGE_DAYS: int = 30
-sts_client = boto3.client('sts')
-ACCOUNT_ID = sts_client.get_caller_identity()['Account']
-AWS_REGION = get_aws_region()
+
+# The account ID and the region used to be resolved when this module was imported. They
+# are now resolved on first access of these module attributes (see get_account_id and
+# get_aws_region in utils/utils.py), so that importing the module does not make network calls.
+def __getattr__(name: str):
+    if name == "ACCOUNT_ID":
+        return get_account_id()
+    if name == "AWS_REGION":
+        return get_aws_region()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # TODO: Take advantage of a default execution role so that we do not need to have lengthy
@@ -166,26 +195,62 @@ class AgentsForAmazonBedrock:
     """Provides an easy to use wrapper for Agents for Amazon Bedrock.
     """
 
-    def __init__(self):
-        """Constructs an instance."""
+    def __init__(self, max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS, runtime_client=None,
+                 admission_controller: Optional[AdmissionController] = None,
+                 resolver: Optional[ResourceResolver] = None):
+        """Constructs an instance.
+
+        Args:
+            max_pool_connections (int, optional): Size of the connection pool of the bedrock agent
+                runtime client, and maximum number of concurrent sessions of invoke_many and ainvoke.
+            runtime_client (optional): Client used in place of the bedrock agent runtime client, for
+                example a RecordingClient or a ReplayClient of utils/event_recording.py. Defaults to None.
+            admission_controller (AdmissionController, optional): Controller that admits the invoke_agent
+                calls at the rate of their budget, see utils/admission_control.py, for example
+                AdmissionController.from_config(config). Defaults to None, where every call is sent at once.
+            resolver (ResourceResolver, optional): Cached resolver of the agent and alias names to their IDs,
+                see utils/resource_resolver.py, which can be shared with KnowledgeBasesForAmazonBedrock.
+                Defaults to a new resolver on the bedrock agent client.
+        """
         self._boto_session = Session() 
-        self._region = AWS_REGION
-        self._account_id = boto3.client("sts").get_caller_identity()["Account"]
+        self._region = get_aws_region()
 
         self._bedrock_agent_client = boto3.client("bedrock-agent", region_name=self._region)
+        self._resolver = resolver or ResourceResolver(self._bedrock_agent_client)
 
-        long_invoke_time_config = Config(read_timeout=600)
-        self._bedrock_agent_runtime_client = boto3.client(
+        self._max_pool_connections = max_pool_connections
+        long_invoke_time_config = Config(read_timeout=600, max_pool_connections=max_pool_connections)
+        self._bedrock_agent_runtime_client = runtime_client or boto3.client(
             "bedrock-agent-runtime", config=long_invoke_time_config, region_name=self._region)
+        self._admission_controller = admission_controller
+        # Thread pool of ainvoke and the per session locks that keep the turns of a session in order
+        self._invoke_executor = None
+        # The locks are weakly referenced, so that the lock of a session is dropped once no turn holds or waits for it
+        self._session_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+        self._session_locks_guard = threading.Lock()
+        self._async_session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        # Metrics record of the last call to invoke, see MetricsAggregator.summary
+        self.last_invoke_metrics = None
+        # Files returned by the last call to invoke in fast mode, as in the files of the EventStream
+        self.last_invoke_files: List[dict] = []
 
         self._sts_client = boto3.client("sts", region_name=self._region)
         self._iam_client = boto3.client("iam", region_name=self._region)
         self._lambda_client = boto3.client("lambda", region_name=self._region)
+        self._ecr_client = boto3.client("ecr", region_name=self._region)
+        self._layer_lock = threading.Lock()
         self._s3_client = boto3.client("s3", region_name=self._region)
         self._dynamodb_client = boto3.client('dynamodb', region_name=self._region)
         self._dynamodb_resource = boto3.resource('dynamodb', region_name=self._region)
 
-        self._suffix = f"{self._region}-{self._account_id}"
+    @property
+    def _account_id(self) -> str:
+        # resolved with STS on first use, so that invoking agents does not need it
+        return get_account_id()
+
+    @property
+    def _suffix(self) -> str:
+        return f"{self._region}-{self._account_id}"
 
     def get_region(self) -> str:
         """Returns the region for this instance."""
@@ -237,8 +302,8 @@ class AgentsForAmazonBedrock:
                 AssumeRolePolicyDocument=_assume_role_policy_document_json
             )
 
-            # Pause to make sure role is created
-            time.sleep(10)
+            # Wait until the role can be read back, Lambda can assume it once it has propagated
+            self._iam_client.get_waiter("role_exists").wait(RoleName=_lambda_function_role_name)
         except:
             _lambda_iam_role = self._iam_client.get_role(RoleName=_lambda_function_role_name)
         # attach Lambda basic execution policy to the role
@@ -424,15 +489,10 @@ class AgentsForAmazonBedrock:
         Returns:
             str: Latest alias ID
         """
-        _agent_aliases = self._bedrock_agent_client.list_agent_aliases(
-            agentId=agent_id,
-            maxResults=100
-        )
-
         _latest_alias_id = ""
         _latest_update = datetime.datetime(1970, 1, 1, 0, 0, 0, tzinfo=tzutc())
 
-        for _summary in _agent_aliases['agentAliasSummaries']:
+        for _summary in self._resolver.index(AGENT_ALIASES, agent_id).values():
             # print(_summary)
             _curr_update = _summary['updatedAt']
             if _curr_update > _latest_update:
@@ -468,24 +528,19 @@ class AgentsForAmazonBedrock:
         _alias_arn = _agent_alias["agentAlias"]["agentAliasArn"]
         return _alias_arn
 
-    def get_agent_id_by_name(self, agent_name: str) -> str:
-        """Gets the Agent ID for the specified Agent.
+    def get_agent_id_by_name(self, agent_name: str, refresh: bool = False) -> str:
+        """Gets the Agent ID for the specified Agent. The agents are listed once and cached by
+        the resolver of this instance, see utils/resource_resolver.py.
 
         Args:
             agent_name (str): Name of the agent whose ID is to be returned
+            refresh (bool, optional): Whether to list the agents again, for example after an agent
+                was created outside of this instance. Defaults to False.
 
         Returns:
             str: Agent ID, or None if not found
         """
-        _get_agents_resp = self._bedrock_agent_client.list_agents(maxResults=100)
-        _agents_json = _get_agents_resp["agentSummaries"]
-        _target_agent = next(
-            (agent for agent in _agents_json if agent["agentName"] == agent_name), None
-        )
-        if _target_agent is None:
-            return None
-        else:
-            return _target_agent["agentId"]
+        return self._resolver.resolve(AGENTS, agent_name, refresh=refresh)
 
     def associate_kb_with_agent(self, agent_id, description, kb_id):
         """Associates a Knowledge Base with an Agent, and prepares the agent.
@@ -579,11 +634,19 @@ class AgentsForAmazonBedrock:
         additional_function_iam_policy: Dict = None,
         sub_agent_arns: List[str] = None,
         dynamo_args: List[str] = None,
-        lambda_function_libraries: List[str] = None
+        lambda_function_libraries: List[str] = None,
+        admission_budgets: Dict = None,
+        image_registry=None,
+        package_type: str = None
     ) -> str:
         """
         Creates a new Lambda function that implements a set of actions for an Agent Action Group.
-        Always uses a Docker-based build/push approach before creating the Lambda container image.
+        The function is packaged as a zip of its code, with its libraries in a layer shared by the
+        functions with the same libraries, unless the libraries are too large for a layer or have
+        no wheels for the platform, see utils/lambda_packages.py. Otherwise it uses a Docker-based
+        build/push approach before creating the Lambda container image. The image is tagged with
+        the hash of its content and only built and pushed if the registry does not have that tag
+        yet, see utils/lambda_images.py.
 
         Args:
             agent_name (str): Name of the existing Agent that this Lambda will support.
@@ -592,6 +655,14 @@ class AgentsForAmazonBedrock:
             additional_function_iam_policy (Dict, optional): Additional IAM policy to attach. Defaults to None.
             sub_agent_arns (List[str], optional): ARNs of sub-agents this Lambda may invoke.
             dynamo_args (List[str], optional): [table_name, partition_key, sort_key] for DynamoDB.
+            admission_budgets (Dict, optional): Budgets of the Bedrock calls of the Lambda, the
+                admission_control section of config.yaml, see utils/admission_control.py. Defaults to None.
+            image_registry (optional): Registry checked for the tag of the image before building it,
+                for example a LocalImageRegistry of utils/lambda_images.py. Defaults to the ECR
+                repository of the function.
+            package_type (str, optional): "Zip" or "Image" to force a package type. Defaults to None,
+                where an existing function keeps its package type and the package type of a new
+                function is chosen from the size of the libraries.
 
         Returns:
             str: ARN of the new Lambda function.
@@ -605,6 +676,8 @@ class AgentsForAmazonBedrock:
         env_variables = {"Variables": {}}
         if sub_agent_arns:
             env_variables["Variables"]["SUB_AGENT_IDS"] = self._make_agent_string(sub_agent_arns)
+        if admission_budgets:
+            env_variables["Variables"]["ADMISSION_BUDGETS"] = json.dumps(admission_budgets)
 
         # Create or update the IAM Role
         if dynamo_args:
@@ -623,79 +696,172 @@ class AgentsForAmazonBedrock:
         else:
             lambda_role = self._create_lambda_iam_role(agent_name, sub_agent_arns)
 
-        # 1) Generate a Dockerfile that copies your Lambda code into the container
-        # This docker file contains the information on the custom libraries to install
-        print(f"Generating Dockerfile for {lambda_function_name}...")
-
-        # Handle case when there are libraries provided by the user to be installed
-        # in the custom container set up
         libraries = lambda_function_libraries if lambda_function_libraries else []
-        pip_install_command = " ".join(libraries)
-        # Login to access the public aws ecr gallery
-        auth_command = f"aws ecr-public get-login-password --region us-east-1 | docker login --username AWS --password-stdin public.ecr.aws"
-        subprocess.run(auth_command, shell=True, check=True)
-        # These are the docker file contents that will be used. It uses a standard python:3.11 base image
-        # from the public ecr gallery
-        dockerfile_content = f"""FROM public.ecr.aws/lambda/python:3.13.2025.01.07.15
-                            RUN pip install {pip_install_command}
-                            COPY {source_code_file} app.py
-                            CMD ["app.lambda_handler"]
-                            """
-        with open("Dockerfile", "w") as dockerfile:
+        # The admission controller of the Bedrock calls is packaged next to the Lambda code
+        admission_control_file = str(Path(__file__).parent / "admission_control.py")
+        # 1) Choose between a zip package, with the libraries in a shared layer, and an image
+        layer_dir = None
+        if package_type is None:
+            # an existing function keeps its package type, which cannot be changed by an update
+            package_type = self._lambda_package_type(lambda_function_name)
+        if package_type is None:
+            package_type, layer_dir = choose_package_type(libraries, platform, PYTHON_RUNTIME)
+        elif package_type == LAMBDA_ZIP and libraries:
+            layer_dir = build_library_layer(libraries, platform, PYTHON_RUNTIME)
+        print(f"Packaging {lambda_function_name} as {package_type}")
+        function_kwargs = {"PackageType": package_type, "Architectures": [LAMBDA_PLATFORMS[platform][1]]}
+        if package_type == LAMBDA_ZIP:
+            function_kwargs.update({
+                "Code": {"ZipFile": function_zip(source_code_file, [admission_control_file], PYTHON_RUNTIME)},
+                "Runtime": PYTHON_RUNTIME,
+                "Handler": "app.lambda_handler",
+                "Layers": [self._library_layer_arn(layer_dir, libraries, platform)] if layer_dir else [],
+            })
+        else:
+            # Tag the image with the hash of its content, and skip the build and push if the registry has it
+            image_tag = lambda_image_tag([source_code_file, admission_control_file], libraries, LAMBDA_BASE_IMAGE,
+                                         platform)
+            repo_name = f"lambda-{lambda_function_name.lower()}"
+            ecr_repo_uri = f"{self._account_id}.dkr.ecr.{self._region}.amazonaws.com/{repo_name}"
+            image_uri = f"{ecr_repo_uri}:{image_tag}"
+            image_registry = image_registry or EcrImageRegistry(self._ecr_client)
+            if image_registry.has_image(repo_name, image_tag):
+                print(f"Image {image_uri} already exists, skipping the build and push of {lambda_function_name}")
+            else:
+                self._build_and_push_lambda_image(lambda_function_name, source_code_file, [admission_control_file],
+                                                  libraries, platform, repo_name, image_tag, ecr_repo_uri)
+                image_registry.add_image(repo_name, image_tag)
+            function_kwargs["Code"] = {"ImageUri": image_uri}
+
+        # 2) Now create the Lambda function, retried with backoff until Lambda can assume the new role.
+        # If it exists, its code and configuration are only updated when they changed, so that a deploy
+        # with no change does not reset its execution environments
+        try:
+            response = retry_until_ready(
+                f"lambda function {lambda_function_name}",
+                lambda: self._lambda_client.create_function(
+                    FunctionName=lambda_function_name,
+                    Role=lambda_role,
+                    Timeout=PYTHON_TIMEOUT,
+                    Environment=env_variables,
+                    **function_kwargs
+                ),
+                is_role_not_ready
+            )
+            print(f"Created the lambda function {lambda_function_name}")
+            # Allow the agent to invoke the Lambda
+            self._allow_agent_lambda(_agent_id, lambda_function_name)
+        except self._lambda_client.exceptions.ResourceConflictException:
+            response = self._update_lambda_function(lambda_function_name, function_kwargs, env_variables)
+        return response["FunctionArn"]
+
+    def _lambda_package_type(self, lambda_function_name: str) -> Optional[str]:
+        """Returns the package type of an existing Lambda function, or None if it does not exist"""
+        try:
+            return self._lambda_client.get_function(FunctionName=lambda_function_name)["Configuration"]["PackageType"]
+        except self._lambda_client.exceptions.ResourceNotFoundException:
+            return None
+
+    def _library_layer_arn(self, layer_dir: Path, libraries: List[str], platform: str) -> str:
+        """
+        Returns the ARN of the layer of a library set, published from the layer directory if no
+        version of it exists yet. The layer is named after the hash of the library set, so the
+        functions with the same libraries share it.
+        """
+        layer_name = f"lambda-libraries-{layer_dir.name}"
+        # held while the layer is looked up and published, so that functions created at once publish it once
+        with self._layer_lock:
+            versions = self._lambda_client.list_layer_versions(LayerName=layer_name)["LayerVersions"]
+            if versions:
+                return versions[0]["LayerVersionArn"]
+            print(f"Publishing the layer {layer_name} of {sorted(set(libraries))}")
+            return self._lambda_client.publish_layer_version(
+                LayerName=layer_name,
+                Description=", ".join(sorted(set(libraries)))[:256],
+                Content={"ZipFile": zip_directory(layer_dir)},
+                CompatibleRuntimes=[PYTHON_RUNTIME],
+                CompatibleArchitectures=[LAMBDA_PLATFORMS[platform][1]]
+            )["LayerVersionArn"]
+
+    def _build_and_push_lambda_image(self, lambda_function_name: str, source_code_file: str, extra_files: List[str],
+                                     libraries: List[str], platform: str, repo_name: str, image_tag: str,
+                                     ecr_repo_uri: str) -> None:
+        """Builds the image of a Lambda function with the multi-stage Dockerfile and pushes it to ECR"""
+        # Every function is built in its own directory, so that several functions can be built at once
+        build_dir = Path(tempfile.mkdtemp(prefix=f"build-{lambda_function_name}-"))
+        source_code_name = Path(source_code_file).name
+        shutil.copy(source_code_file, build_dir / source_code_name)
+        for extra_file in extra_files:
+            shutil.copy(extra_file, build_dir / Path(extra_file).name)
+        with open(build_dir / "requirements.txt", "w") as requirements_file:
+            requirements_file.write(lambda_requirements(libraries))
+        dockerfile_content = lambda_dockerfile(source_code_name, [Path(f).name for f in extra_files])
+        with open(build_dir / "Dockerfile", "w") as dockerfile:
             dockerfile.write(dockerfile_content)
         print(f"Dockerfile generated for {lambda_function_name}:\n{dockerfile_content}")
 
-        # 2) Build and push to ECR. Once this is built and push to ECR, the ECR arn will be used to create
-        # the lambda function
+        # Build and push to ECR. Once this is built and push to ECR, the image URI will be used to create
+        # the lambda function. The login to the public ecr gallery pulls the base image
         print(f"Building and pushing {lambda_function_name} to ECR...")
-        repo_name = f"lambda-{lambda_function_name.lower()}"
-        image_name = f"{repo_name}:latest"
-        ecr_repo_uri = f"{ACCOUNT_ID}.dkr.ecr.{AWS_REGION}.amazonaws.com/{repo_name}"
-
         build_and_push_script_content = f"""#!/bin/bash
                 set -e
-                REGION={AWS_REGION}
-                ACCOUNT_ID={ACCOUNT_ID}
+                REGION={self._region}
+                ACCOUNT_ID={self._account_id}
                 REPO_NAME={repo_name}
-                IMAGE_NAME={image_name}
-                IMAGE_URI={ecr_repo_uri}
+                IMAGE_NAME={repo_name}:{image_tag}
+                IMAGE_URI={ecr_repo_uri}:{image_tag}
                 ARCH={platform}
-                aws configure set region $REGION
+                aws ecr-public get-login-password --region us-east-1 | docker login --username AWS --password-stdin public.ecr.aws
                 aws ecr get-login-password --region $REGION | docker login --username AWS --password-stdin $ACCOUNT_ID.dkr.ecr.$REGION.amazonaws.com
-                aws ecr describe-repositories --repository-names $REPO_NAME > /dev/null 2>&1 || aws ecr create-repository --repository-name $REPO_NAME
-                docker build --platform $ARCH . -t $IMAGE_NAME
+                aws ecr describe-repositories --region $REGION --repository-names $REPO_NAME > /dev/null 2>&1 || aws ecr create-repository --region $REGION --repository-name $REPO_NAME
+                DOCKER_BUILDKIT=1 docker build --platform $ARCH . -t $IMAGE_NAME
                 docker tag $IMAGE_NAME $IMAGE_URI
                 docker push $IMAGE_URI
                 """
-
-        with open("build_and_push.sh", "w") as script_file:
+        with open(build_dir / "build_and_push.sh", "w") as script_file:
             script_file.write(build_and_push_script_content)
         print(f"build_and_push.sh generated for {lambda_function_name}:\n{build_and_push_script_content}")
-        # Make the build and push script executable
-        subprocess.run(["chmod", "+x", "build_and_push.sh"], check=True)
-
-        # (Optional) Re-open and print the file exactly as written
-        with open("build_and_push.sh", "r") as script_file:
-            print("build_and_push.sh contents on disk:\n", script_file.read())
-
-        # 3) execute the build and push script to build the container and push it to ECR
-        subprocess.run(["./build_and_push.sh"], check=True)
-        # 3) Wait briefly to let IAM propagate the new policy
-        time.sleep(5)
-
-        # 4) Now create the Lambda function
-        response = self._lambda_client.create_function(
-            FunctionName=lambda_function_name,
-            Role=lambda_role,
-            Code={"ImageUri": f"{ecr_repo_uri}:latest"},
-            PackageType="Image",
-            Timeout=PYTHON_TIMEOUT,
-            Environment=env_variables,
-        )
-        print(f"Created the lambda function {lambda_function_name}")
-        # Allow the agent to invoke the Lambda
-        self._allow_agent_lambda(_agent_id, lambda_function_name)
-        return response["FunctionArn"]
+        # Make the build and push script executable, and execute it to build the container and push it to ECR
+        subprocess.run(["chmod", "+x", "build_and_push.sh"], check=True, cwd=build_dir)
+        try:
+            subprocess.run(["./build_and_push.sh"], check=True, cwd=build_dir)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    def _update_lambda_function(self, lambda_function_name: str, function_kwargs: Dict, env_variables: Dict) -> dict:
+        """Updates the code and configuration of an existing Lambda function, if they changed"""
+        function = self._lambda_client.get_function(FunctionName=lambda_function_name)
+        configuration = function["Configuration"]
+        if configuration["PackageType"] != function_kwargs["PackageType"]:
+            raise ValueError(f"The lambda function {lambda_function_name} is packaged as {configuration['PackageType']}, "
+                             f"delete it with delete_lambda to deploy it as {function_kwargs['PackageType']}")
+        response = configuration
+        updated = False
+        code = function_kwargs["Code"]
+        if "ImageUri" in code:
+            code_changed = function["Code"].get("ImageUri") != code["ImageUri"]
+        else:
+            code_changed = configuration["CodeSha256"] != base64.b64encode(hashlib.sha256(code["ZipFile"]).digest()).decode()
+        if code_changed:
+            print(f"Updating the code of the lambda function {lambda_function_name}")
+            response = self._lambda_client.update_function_code(FunctionName=lambda_function_name, **code)
+            self._lambda_client.get_waiter("function_updated_v2").wait(FunctionName=lambda_function_name)
+            updated = True
+        layers = [layer["Arn"] for layer in configuration.get("Layers", [])]
+        # the variables set after the function was created (the prompt, knowledge base and model
+        # settings of the notebooks and of the deploy orchestrator) are kept
+        current_variables = configuration.get("Environment", {}).get("Variables", {})
+        variables = {**current_variables, **env_variables["Variables"]}
+        if variables != current_variables or layers != function_kwargs.get("Layers", layers):
+            print(f"Updating the configuration of the lambda function {lambda_function_name}")
+            response = self._lambda_client.update_function_configuration(
+                FunctionName=lambda_function_name, Environment={"Variables": variables},
+                **({"Layers": function_kwargs["Layers"]} if "Layers" in function_kwargs else {}))
+            self._lambda_client.get_waiter("function_updated_v2").wait(FunctionName=lambda_function_name)
+            updated = True
+        if not updated:
+            print(f"The lambda function {lambda_function_name} is up to date")
+        return response
 
 
 
@@ -758,15 +924,8 @@ class AgentsForAmazonBedrock:
         Returns:
             str: ARN of the IAM role, or None if not found
         """
-        _get_agents_resp = self._bedrock_agent_client.list_agents(maxResults=100)
-        _agents_json = _get_agents_resp["agentSummaries"]
-        _target_agent = next(
-            (agent for agent in _agents_json if agent["agentName"] == agent_name), None
-        )
-        if _target_agent is not None:
-            # pprint.pp(_target_agent)
-            _agent_id = _target_agent["agentId"]
-
+        _agent_id = self.get_agent_id_by_name(agent_name)
+        if _agent_id is not None:
             _get_agent_resp = self._bedrock_agent_client.get_agent(agentId=_agent_id)
             return _get_agent_resp["agent"]["agentResourceRoleArn"]
         else:
@@ -784,9 +943,7 @@ class AgentsForAmazonBedrock:
         """
 
         # first find the agent ID from the agent Name
-        _get_agents_resp = self._bedrock_agent_client.list_agents(maxResults=100)
-        _agents_json = _get_agents_resp['agentSummaries']
-        _target_agent = next((agent for agent in _agents_json if agent["agentName"] == agent_name), None)
+        _target_agent = self._resolver.summary(AGENTS, agent_name)
 
         if _target_agent is None:
             print(f"Agent {agent_name} not found")
@@ -803,17 +960,17 @@ class AgentsForAmazonBedrock:
                 print(f"Deleting aliases for agent {_agent_id}...")
 
             try:
-                _agent_aliases = self._bedrock_agent_client.list_agent_aliases(
-                    agentId=_agent_id,
-                    maxResults=100
-                )
-                for alias in _agent_aliases['agentAliasSummaries']:
+                _alias_ids = []
+                for alias in self._resolver.index(AGENT_ALIASES, _agent_id, refresh=True).values():
                     alias_id = alias['agentAliasId']
                     print(f'Deleting alias {alias_id} from agent {_agent_id}')
                     response = self._bedrock_agent_client.delete_agent_alias(
                         agentAliasId=alias_id,
                         agentId=_agent_id
                     )
+                    _alias_ids.append(alias_id)
+                self.wait_agent_aliases_status_update([(_agent_id, _alias_id) for _alias_id in _alias_ids],
+                                                      verbose=verbose)
             except Exception as e:
                 print(f"Error deleting aliases: {e}")
                 pass
@@ -824,11 +981,12 @@ class AgentsForAmazonBedrock:
 
             if verbose:
                 print(f"Deleting agent: {_agent_id}...")
-            time.sleep(5)
             self._bedrock_agent_client.delete_agent(
                 agentId=_agent_id
                 )
-            time.sleep(5)
+            self._resolver.remove(AGENTS, agent_name)
+            self._resolver.invalidate(AGENT_ALIASES, _agent_id)
+            self.wait_agent_status_update(_agent_id)
             
         # TODO: add delete_lambda_flag parameter to optionall take care of
         # deleting the lambda function associated with the agent.
@@ -945,8 +1103,8 @@ class AgentsForAmazonBedrock:
                 AssumeRolePolicyDocument=_assume_role_policy_document_json,
             )
 
-            # Pause to make sure role is created
-            time.sleep(10)
+            # Wait until the role can be read back, create_agent retries until Bedrock can assume it
+            self._iam_client.get_waiter("role_exists").wait(RoleName=_agent_role_name)
 
             if verbose:
                 print(
@@ -990,9 +1148,6 @@ class AgentsForAmazonBedrock:
                     RoleName=_agent_role_name,
                 )
 
-                # Pause to make sure role is updated
-                time.sleep(10)
-
             # TODO: scope down GR access to a single GR passed as param
             # # Support Guardrail access
             # _gr_policy_doc = {
@@ -1017,44 +1172,81 @@ class AgentsForAmazonBedrock:
 
             return _agent_role["Role"]["Arn"]
 
-    def wait_agent_status_update(self, agent_id):
-        response = self._bedrock_agent_client.get_agent(agentId=agent_id)
-        agent_status = response["agent"]["agentStatus"]
-        _waited_at_least_once = False
-        while agent_status.endswith("ING"):
-            print(f"Waiting for agent status to change. Current status {agent_status}")
-            time.sleep(5)
-            _waited_at_least_once = True
-            try:
-                response = self._bedrock_agent_client.get_agent(agentId=agent_id)
-                agent_status = response["agent"]["agentStatus"]
-            except self._bedrock_agent_client.exceptions.ResourceNotFoundException:
-                agent_status = "DELETED"
-        if _waited_at_least_once:
-            print(f"Agent id {agent_id} current status: {agent_status}")
-
-    def wait_agent_alias_status_update(self, agent_id, agent_alias_id, verbose=False):
-        response = self._bedrock_agent_client.get_agent_alias(
-            agentId=agent_id, agentAliasId=agent_alias_id
-        )
-        agent_alias_status = response["agentAlias"]["agentAliasStatus"]
-        while agent_alias_status.endswith("ING"):
-            if verbose:
-                print(
-                    f"Waiting for agent ALIAS status to change. Current status {agent_alias_status}"
-                )
-            time.sleep(5)
-            try:
-                response = self._bedrock_agent_client.get_agent_alias(
-                    agentId=agent_id, agentAliasId=agent_alias_id
-                )
-                agent_alias_status = response["agentAlias"]["agentAliasStatus"]
-            except self._bedrock_agent_client.exceptions.ResourceNotFoundException:
-                agent_status = "DELETED"
+    def _agent_status(self, agent_id: str) -> str:
+        try:
+            return self._bedrock_agent_client.get_agent(agentId=agent_id)["agent"]["agentStatus"]
+        except self._bedrock_agent_client.exceptions.ResourceNotFoundException:
+            return DELETED
+
+    def _agent_alias_status(self, agent_id: str, agent_alias_id: str) -> str:
+        try:
+            return self._bedrock_agent_client.get_agent_alias(
+                agentId=agent_id, agentAliasId=agent_alias_id
+            )["agentAlias"]["agentAliasStatus"]
+        except self._bedrock_agent_client.exceptions.ResourceNotFoundException:
+            return DELETED
+
+    def wait_agent_status_update(self, agent_id, deadline_s: float = DEFAULT_DEADLINE_S):
+        """Waits until the agent is not in a transitional status (CREATING, PREPARING, UPDATING,
+        DELETING), polling it with exponential backoff, see utils/waiters.py.
+
+        Args:
+            agent_id (str): Id of the agent
+            deadline_s (float, optional): Longest wait, after which a WaiterTimeout is raised.
+        """
+        return self.wait_agents_status_update([agent_id], deadline_s)[agent_id]
+
+    def wait_agents_status_update(self, agent_ids: List[str], deadline_s: float = DEFAULT_DEADLINE_S) -> Dict[str, str]:
+        """Waits until none of the agents is in a transitional status. The agents are polled
+        together, each with its own exponential backoff, so the wait lasts as long as the slowest agent.
+
+        Args:
+            agent_ids (List[str]): Ids of the agents
+            deadline_s (float, optional): Longest wait, after which a WaiterTimeout is raised.
+
+        Returns:
+            Dict[str, str]: Status of every agent by id
+        """
+        _statuses = wait_all([WaitCondition(_agent_id, lambda _agent_id=_agent_id: self._agent_status(_agent_id))
+                              for _agent_id in dict.fromkeys(agent_ids)], deadline_s, verbose=True)
+        return _statuses
+
+    def wait_agent_alias_status_update(self, agent_id, agent_alias_id, verbose=False,
+                                       deadline_s: float = DEFAULT_DEADLINE_S):
+        """Waits until the agent alias is not in a transitional status, polling it with exponential backoff.
+
+        Args:
+            agent_id (str): Id of the agent
+            agent_alias_id (str): Id of the alias
+            verbose (bool, optional): Whether to print the status while waiting. Defaults to False.
+            deadline_s (float, optional): Longest wait, after which a WaiterTimeout is raised.
+        """
+        _status = self.wait_agent_aliases_status_update([(agent_id, agent_alias_id)], verbose, deadline_s)
         if verbose:
             print(
-                f"Agent id {agent_id}, Alias {agent_alias_id} current status: {agent_alias_status}"
+                f"Agent id {agent_id}, Alias {agent_alias_id} current status: {_status[(agent_id, agent_alias_id)]}"
             )
+        return _status[(agent_id, agent_alias_id)]
+
+    def wait_agent_aliases_status_update(self, agent_alias_ids: List[Tuple[str, str]], verbose: bool = False,
+                                         deadline_s: float = DEFAULT_DEADLINE_S) -> Dict[Tuple[str, str], str]:
+        """Waits until none of the agent aliases is in a transitional status, polling them together.
+
+        Args:
+            agent_alias_ids (List[Tuple[str, str]]): (agent id, alias id) of every alias
+            verbose (bool, optional): Whether to print the status while waiting. Defaults to False.
+            deadline_s (float, optional): Longest wait, after which a WaiterTimeout is raised.
+
+        Returns:
+            Dict[Tuple[str, str], str]: Status of every alias by (agent id, alias id)
+        """
+        _conditions = [WaitCondition(f"{_agent_id}/{_alias_id}",
+                                     lambda _agent_id=_agent_id, _alias_id=_alias_id:
+                                     self._agent_alias_status(_agent_id, _alias_id))
+                       for _agent_id, _alias_id in dict.fromkeys(agent_alias_ids)]
+        _statuses = wait_all(_conditions, deadline_s, verbose=verbose)
+        return {(_agent_id, _alias_id): _statuses[f"{_agent_id}/{_alias_id}"]
+                for _agent_id, _alias_id in agent_alias_ids}
 
     def associate_sub_agents(self, supervisor_agent_id, sub_agents_list):
         for sub_agent in sub_agents_list:
@@ -1078,6 +1270,7 @@ class AgentsForAmazonBedrock:
         supervisor_agent_alias = self._bedrock_agent_client.create_agent_alias(
             agentAliasName="multi-agent", agentId=supervisor_agent_id
         )
+        self._resolver.add(AGENT_ALIASES, supervisor_agent_alias["agentAlias"], supervisor_agent_id)
         supervisor_agent_alias_id = supervisor_agent_alias["agentAlias"]["agentAliasId"]
         supervisor_agent_alias_arn = supervisor_agent_alias["agentAlias"][
             "agentAliasArn"
@@ -1147,11 +1340,6 @@ class AgentsForAmazonBedrock:
             print(f"Created agent IAM role: {_role_arn}...")
             print(f"Creating agent: {agent_name} with model: {model_id}...")
 
-        _num_tries = 0
-        _agent_created = False
-        _create_agent_response = None
-        _agent_id = None
-
         _kwargs = {}
 
         if routing_classifier_model is not None:
@@ -1168,43 +1356,28 @@ class AgentsForAmazonBedrock:
             _kwargs['guardrailConfiguration'] = {
                 "guardrailIdentifier": guardrail_id,
                 "guardrailVersion": "DRAFT"}
-            
-        while not _agent_created and _num_tries <= 2:
-            try:
-                if verbose:
-                    print(f"kwargs: {_kwargs}")
-                _create_agent_response = self._bedrock_agent_client.create_agent(
-                    agentName=agent_name,
-                    agentResourceRoleArn=_role_arn,
-                    description=agent_description.replace(
-                        "\n", ""
-                    ),  # console doesn't like newlines for subsequent editing
-                    idleSessionTTLInSeconds=1800,
-                    foundationModel=model_id,
-                    instruction=agent_instructions,
-                    agentCollaboration=agent_collaboration,
-                    **_kwargs,
-                )
-                _agent_id = _create_agent_response["agent"]["agentId"]
-                if verbose:
-                    print(f"Created agent, resulting id: {_agent_id}")
-                    _get_resp = self._bedrock_agent_client.get_agent(agentId=_agent_id)
-                    print(_get_resp)
-                _agent_created = True
 
-            except Exception as e:
-                if verbose:
-                    print(
-                        f"Error creating agent: {e}\n. Retrying in case it was just waiting to be deleted."
-                    )
-                _num_tries += 1
-                if _num_tries <= 2:
-                    time.sleep(4)
-                    pass
-                else:
-                    if verbose:
-                        print(f"Giving up on agent creation after 2 tries.")
-                    raise e
+        if verbose:
+            print(f"kwargs: {_kwargs}")
+        # retried with backoff until Bedrock can assume the new role
+        _create_agent_response = retry_until_ready(f"agent {agent_name}", lambda: self._bedrock_agent_client.create_agent(
+            agentName=agent_name,
+            agentResourceRoleArn=_role_arn,
+            description=agent_description.replace(
+                "\n", ""
+            ),  # console doesn't like newlines for subsequent editing
+            idleSessionTTLInSeconds=DEFAULT_IDLE_SESSION_TTL_S,
+            foundationModel=model_id,
+            instruction=agent_instructions,
+            agentCollaboration=agent_collaboration,
+            **_kwargs,
+        ), is_role_not_ready)
+        _agent_id = _create_agent_response["agent"]["agentId"]
+        self._resolver.add(AGENTS, _create_agent_response["agent"])
+        if verbose:
+            print(f"Created agent, resulting id: {_agent_id}")
+            _get_resp = self._bedrock_agent_client.get_agent(agentId=_agent_id)
+            print(_get_resp)
 
         if code_interpretation:
             # possible time.sleep(15) needed here
@@ -1225,7 +1398,7 @@ class AgentsForAmazonBedrock:
         _resp = self._bedrock_agent_client.prepare_agent(
                agentId=_agent_id
             )
-        time.sleep(5) # make sure agent is ready to be invoked as soon as we return
+        self.wait_agent_status_update(_agent_id) # make sure agent is ready to be invoked as soon as we return
         return
     
     def create_agent_alias(self, agent_id: str, alias_name: str) -> Tuple[str, str]:
@@ -1239,6 +1412,7 @@ class AgentsForAmazonBedrock:
         agent_alias = self._bedrock_agent_client.create_agent_alias(
             agentAliasName=alias_name, agentId=agent_id
         )
+        self._resolver.add(AGENT_ALIASES, agent_alias["agentAlias"], agent_id)
         agent_alias_id = agent_alias["agentAlias"]["agentAliasId"]
         agent_alias_arn = agent_alias["agentAlias"]["agentAliasArn"]
         return agent_alias_id, agent_alias_arn
@@ -1266,7 +1440,7 @@ class AgentsForAmazonBedrock:
         # check the response and if successful, prepare the agent
         if _agent_action_group_resp["ResponseMetadata"]["HTTPStatusCode"] == 200:
             _resp = self._bedrock_agent_client.prepare_agent(agentId=_agent_id)
-            time.sleep(5)  # make sure agent is ready to be invoked as soon as we return
+            self.wait_agent_status_update(_agent_id)  # make sure agent is ready to be invoked as soon as we return
         else:
             print(f"Error adding code interpreter to agent: {_agent_action_group_resp}")
         return
@@ -1284,7 +1458,8 @@ class AgentsForAmazonBedrock:
             dynamo_args: List[str] = None,
             verbose: bool = False, 
             lambda_function_libraries: List[str] = None,
-            platform: str = "linux/amd64"
+            platform: str = "linux/amd64",
+            package_type: str = None
     ) -> None:
         """Adds an action group to an existing agent, creates a Lambda function to
         implement that action group, and prepares the agent so it is ready to be
@@ -1299,6 +1474,9 @@ class AgentsForAmazonBedrock:
             agent_action_group_description (str): description of the agent action group
             additional_function_iam_policy (Dict, Optional): additional IAM policy to attach to the Lambda function
             sub_agent_arns (List[str], Optional): list of ARNs of sub-agents (if any) to permit the Lambda to invoke
+            package_type (str, Optional): "Zip" or "Image" to force the package type of the Lambda function,
+                by default an existing function keeps its own and a new one is chosen from the size
+                of its libraries, see create_lambda
         """
 
         _agent_id = self.get_agent_id_by_name(agent_name)
@@ -1316,7 +1494,8 @@ class AgentsForAmazonBedrock:
                 additional_function_iam_policy=additional_function_iam_policy,
                 sub_agent_arns=sub_agent_arns,
                 dynamo_args=dynamo_args,
-                lambda_function_libraries=lambda_function_libraries
+                lambda_function_libraries=lambda_function_libraries,
+                package_type=package_type
             )
 
         self.wait_agent_status_update(_agent_id)
@@ -1337,7 +1516,7 @@ class AgentsForAmazonBedrock:
         # check the response and if successful, prepare the agent
         if _agent_action_group_resp["ResponseMetadata"]["HTTPStatusCode"] == 200:
             _resp = self._bedrock_agent_client.prepare_agent(agentId=_agent_id)
-            time.sleep(5)  # make sure agent is ready to be invoked as soon as we return
+            self.wait_agent_status_update(_agent_id)  # make sure agent is ready to be invoked as soon as we return
         else:
             print(f"Error adding code interpreter to agent: {_agent_action_group_resp}")
         return
@@ -1368,7 +1547,7 @@ class AgentsForAmazonBedrock:
             description=agent_action_group_description,
         )
         _resp = self._bedrock_agent_client.prepare_agent(agentId=agent_id)
-        time.sleep(5)  # make sure agent is ready to be invoked as soon as we return
+        self.wait_agent_status_update(agent_id)  # make sure agent is ready to be invoked as soon as we return
         return
 
     def get_function_defs(self, agent_name: str) -> List[dict]:
@@ -1486,15 +1665,14 @@ class AgentsForAmazonBedrock:
                 supervisor_agent_name, model_ids
             )
 
-        time.sleep(20)
-
-        _response = self._bedrock_agent_client.create_agent(
+        # retried with backoff until Bedrock can assume the new role
+        _response = retry_until_ready(f"agent {supervisor_agent_name}", lambda: self._bedrock_agent_client.create_agent(
             agentName=supervisor_agent_name,
             agentResourceRoleArn=_supervisor_role_arn,
             description=supervisor_description.replace(
                 "\n", ""
             ),  # console doesn't like newlines for subsequent editing
-            idleSessionTTLInSeconds=1800,
+            idleSessionTTLInSeconds=DEFAULT_IDLE_SESSION_TTL_S,
             foundationModel=model_ids[0],
             promptOverrideConfiguration={
                 "promptConfigurations": [
@@ -1508,10 +1686,11 @@ class AgentsForAmazonBedrock:
                 ]
             },
             instruction=supervisor_instructions,
-        )
+        ), is_role_not_ready)
         _supervisor_agent_arn = _response["agent"]["agentArn"]
         _supervisor_agent_id = _response["agent"]["agentId"]
-        time.sleep(15)
+        self._resolver.add(AGENTS, _response["agent"])
+        self.wait_agent_status_update(_supervisor_agent_id)
 
         # Associate the KB with the supervisor agent
         if kb_arn is not None:
@@ -1604,17 +1783,67 @@ class AgentsForAmazonBedrock:
 
         return _fully_cited_answer
 
+    def invoke_events(
+            self,
+            input_text: str,
+            agent_id: str,
+            agent_alias_id: str = "TSTALIASID",
+            session_id: str = None,
+            session_state: dict = {},
+            enable_trace: bool = False,
+            end_session: bool = False,
+            priority: str = INTERACTIVE,
+    ) -> Iterator[AgentEvent]:
+        """Invokes an agent and yields the typed events parsed from its EventStream as
+        they arrive, see utils/agent_events.py for the event types.
+
+        Args:
+            input_text (str): The text to be processed by the agent.
+            agent_id (str): The ID of the agent to invoke.
+            agent_alias_id (str, optional): The alias ID of the agent to invoke. Defaults to "TSTALIASID".
+            session_id (str, optional): The ID of the session. Defaults to a new UUID.
+            session_state (dict, optional): The state of the session. Defaults to an empty dict.
+            enable_trace (bool, optional): Whether to enable trace. Defaults to False.
+            end_session (bool, optional): Whether to end the session. Defaults to False.
+            priority (str, optional): Priority class of the call for the admission controller,
+                INTERACTIVE or BATCH. Defaults to INTERACTIVE.
+
+        Returns:
+            Iterator[AgentEvent]: The events of the agent response, in stream order.
+        """
+        session_id = session_id or str(uuid.uuid4())
+        _agent_resp = self._invoke_agent(
+            priority,
+            inputText=input_text,
+            agentId=agent_id,
+            agentAliasId=agent_alias_id,
+            sessionId=session_id,
+            sessionState=session_state,
+            enableTrace=enable_trace,
+            endSession=end_session,
+        )
+        if _agent_resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            raise Exception(f"API Response was not 200: {_agent_resp}")
+        yield from parse_event_stream(_agent_resp["completion"])
+
     def invoke(
             self,
             input_text: str,
             agent_id: str,
             agent_alias_id: str = "TSTALIASID",
-            session_id: str = str(uuid.uuid1()),
+            session_id: str = None,
             session_state: dict = {},
             enable_trace: bool = False,
             end_session: bool = False,
             trace_level: str = "core",
             multi_agent_names: dict = {},
+            sinks: List[EventSink] = None,
+            metrics_exporters: List[MetricsExporter] = None,
+            return_metrics: bool = False,
+            background_artifacts: bool = False,
+            display_images: bool = True,
+            fast: bool = False,
+            priority: str = INTERACTIVE,
     ):
         """Invokes an agent with a given input text, while optional parameters
         also let you leverage an agent session, or target a specific agent alias.
@@ -1628,17 +1857,37 @@ class AgentsForAmazonBedrock:
             enable_trace (bool, optional): Whether to enable trace. Defaults to False.
             end_session (bool, optional): Whether to end the session. Defaults to False.
             trace_level (str, optional): The level of trace. Defaults to "none". Possible values are "none", "all", "core".
+            sinks (List[EventSink], optional): Additional sinks that receive every event after the
+                console renderer, metrics aggregator and artifact writer.
+            metrics_exporters (List[MetricsExporter], optional): Exporters of the metrics record of the
+                invocation, see utils/metrics_exporters.py, or the token ledger of utils/token_ledger.py.
+                Defaults to None.
+            return_metrics (bool, optional): Whether to return the metrics record with the answer.
+                The record of the last invocation is also kept in last_invoke_metrics. Defaults to False.
+            background_artifacts (bool, optional): Whether to write the generated code and the returned
+                files from a background thread to agent_response/<session_id>, named by content hash,
+                instead of writing them while the stream is consumed. Defaults to False.
+            display_images (bool, optional): Whether to display the returned images. Defaults to True.
+            fast (bool, optional): Whether to only return the answer, for production calls. The trace is
+                disabled, the answer chunks are concatenated and the returned files are kept in
+                last_invoke_files, with nothing printed, rendered or written to disk and no sinks.
+                The metrics record only has the time to first chunk and the duration. Defaults to False.
+            priority (str, optional): Priority class of the call for the admission controller,
+                INTERACTIVE or BATCH. Defaults to INTERACTIVE.
 
         Returns:
-            str: The answer from the agent.
+            str: The answer from the agent, the cited text of its chunks concatenated like in fast mode
+                and invoke_turn, or a tuple of the answer and the metrics record
+                (per-step timings, per sub-agent tokens, tool latencies, time to first chunk and
+                total duration) when return_metrics is True.
         """
-        # To upload files to the agent, for use in the sandbox use sessionState:
-        import base64
-        import datetime
-        from pathlib import Path
-        _time_before_call = datetime.datetime.now()
-
-        _agent_resp = self._bedrock_agent_runtime_client.invoke_agent(
+        session_id = session_id or str(uuid.uuid4())
+        _metrics = MetricsAggregator(agent_id, agent_alias_id, session_id, multi_agent_names)
+        if fast:
+            return self._invoke_fast(input_text, agent_id, agent_alias_id, session_id, session_state,
+                                     end_session, _metrics, metrics_exporters, return_metrics, priority)
+        _agent_resp = self._invoke_agent(
+            priority,
             inputText=input_text,
             agentId=agent_id,
             agentAliasId=agent_alias_id,
@@ -1663,367 +1912,44 @@ class AgentsForAmazonBedrock:
             _error_message = f"API Response was not 200: {_agent_resp}"
             if enable_trace and trace_level == "all":
                 print(_error_message)
+            if return_metrics:
+                _metrics.close()
+                return _error_message, _metrics.summary()
             return _error_message
 
-        _total_in_tokens = 0
-        _total_out_tokens = 0
-        _total_llm_calls = 0
-        _orch_step = 0
-        _sub_step = 0
-        _time_before_orchestration = datetime.datetime.now()
-        
-        _agent_answer = ""
-        _event_stream = _agent_resp['completion']
-
-        # Create the directory using the sessionId
-        import io
-        from pathlib import Path
-        from datetime import datetime
-        now_as_str = str(datetime.now()).replace(" ", "_").replace(":", "_")
-        dirname = "agent_response"
-        session_directory_path = Path(dirname)
-        if not os.path.exists(session_directory_path):
-            os.makedirs(session_directory_path) 
-        print(f"Session directory is: {session_directory_path}")
-        #The response of this operation contains an EventStream member. 
-        event_stream = _agent_resp["completion"]
-
-        # When iterated the EventStream will yield events.
-        event_ctr = 0
-        chunk_ctr = 0
-        file_ctr = 0
-        image_ctr = 0
-        other_file_ctr= 0
-        final_code = ""
+        session_directory_path = "agent_response"
+        _renderer = ConsoleRenderer(enable_trace, trace_level, multi_agent_names, display_images)
+        if background_artifacts:
+            _artifacts = BackgroundArtifactWriter(session_directory_path, session_id)
+        else:
+            _artifacts = ArtifactWriter(session_directory_path, input_text, save_trace_files=enable_trace)
+        print(f"Session directory is: {_artifacts.directory}")
+        _sinks = [_renderer, _metrics, _artifacts] + (sinks or [])
 
+        _agent_answer = ""
         try:
-            _sub_agent_name = "<collab-name-not-yet-provided>"
-            for _event in _event_stream: 
-                _sub_agent_alias_id = None 
-                if 'files' in _event:
-                    file_ctr += 1
-                    print(f"event_ctr={event_ctr+1}, received file in event, file_ctr={file_ctr+1}")
-                    files = _event['files']['files']
-                    for i, file in enumerate(files):
-                        #print(f"file={file}")
-                        print(f"event_ctr={event_ctr+1}, file_ctr={file_ctr+1}, i={i}")
-                        name = file['name']
-                        type = file['type']
-                        bytes_data = file['bytes']
-                        
-                        # It the file is a PNG image then we can display it...
-                        if type == 'image/png':
-                            image_ctr += 1
-                            print(f"event_ctr={event_ctr+1}, file_ctr={file_ctr+1}, image_ctr={image_ctr+1}")
-                            fname = os.path.join(session_directory_path, f"output_image_{event_ctr+1}.png")
-                            print(f"fname is: {fname}")
-                            Path(fname).write_bytes(bytes_data)
-                            # Display PNG image using Matplotlib
-                            img = plt.imread(io.BytesIO(bytes_data))
-                            plt.figure(figsize=(10, 10))
-                            plt.imshow(img)
-                            plt.axis('off')
-                            plt.title(name)
-                            plt.show()
-                            plt.close()
-                            
-                        # If the file is NOT a PNG then we save it to disk...
-                        else:
-                            other_file_ctr += 1
-                            print(f"event_ctr={event_ctr+1}, file_ctr={file_ctr+1}, other_file_ctr={other_file_ctr+1}")
-
-                            # Save other file types to local disk
-                            unique_fname = Path(name).stem + "_" + now_as_str + Path(name).suffix
-                            with open(unique_fname, 'wb') as f:
-                                f.write(bytes_data)
-                            print(f"File '{name}' as {unique_fname} saved to disk.")
-                elif 'chunk' in _event:
-                    _data = _event['chunk']['bytes']
-                    _agent_answer = _data.decode('utf8')
-                    _agent_answer = self._make_fully_cited_answer(_agent_answer, _event, enable_trace, trace_level)
-
-                if 'trace' in _event and enable_trace:
-                    if trace_level == "all":
-                        print('---')
-                    else:
-                        if 'callerChain' in _event['trace']:
-                            if len(_event['trace']['callerChain']) > 1:
-                                _sub_agent_alias_arn = _event['trace']['callerChain'][1]['agentAliasArn']
-                                # get sub agent id by grabbing all text following the second '/' character
-                                _sub_agent_alias_id = _sub_agent_alias_arn.split('/', 1)[1]
-                                try:
-                                    _sub_agent_name = multi_agent_names[_sub_agent_alias_id]
-                                except:
-                                    print("You haven't provided agents names. To do so provide a dictionary in the format {f'{agent_id}/{agent_alias_id}': f'{agent_name}'})")
-                                    _sub_agent_name = "<not-yet-provided>"
-
-                        # if 'collaboratorName' in _event['trace']:
-                        #     _sub_agent_name = _event['trace']['collaboratorName'] 
-                        # else:
-                        #     _sub_agent_name = "<collab-name-not-yet-provided>"
-
-                    if 'routingClassifierTrace' in _event['trace']['trace']:
-                        _route = _event['trace']['trace']['routingClassifierTrace']
-
-                        if 'modelInvocationInput' in _route:
-                            _orch_step +=1 
-                            print(colored(f"---- Step {_orch_step} ----", "green"))
-                            _time_before_routing = datetime.datetime.now()
-                            print(colored("Classifying request to immediately route to one collaborator if possible.", "blue"))
-
-                        if 'modelInvocationOutput' in _route:
-                            _llm_usage = _route['modelInvocationOutput']['metadata']['usage']
-                            _in_tokens = _llm_usage['inputTokens']
-                            _total_in_tokens += _in_tokens 
-
-                            _out_tokens = _llm_usage['outputTokens']
-                            _total_out_tokens += _out_tokens
-
-                            _total_llm_calls += 1
-                            _route_duration = datetime.datetime.now() - _time_before_routing
-
-                            _raw_resp_str = _route['modelInvocationOutput']['rawResponse']['content']
-                            _raw_resp = json.loads(_raw_resp_str)
-                            _classification = _raw_resp['content'][0]['text'].replace('<a>', '').replace('</a>', '')
-
-                            if _classification == UNDECIDABLE_CLASSIFICATION:
-                                print(colored(f"Routing classifier did not find a matching collaborator. Reverting to 'SUPERVISOR' mode.", "magenta"))
-                            elif _classification == 'keep_previous_agent':
-                                print(colored(f"Continuing conversation with previous collaborator.", "magenta"))
-                                # # since we replaced the typical orchestration step with a simple routing
-                                # # classification, bump the step count.
-                                # _orch_step += 1
-                            else:
-                                _sub_agent_name = _classification
-                                print(colored(f"Routing classifier chose collaborator: '{_classification}'", "magenta"))
-                                # # since we replaced the typical orchestration step with a simple routing
-                                # # classification, bump the step count.
-                                # _orch_step += 1
-                            print(colored(f"Routing classifier took {_route_duration.total_seconds():,.1f}s, using {_in_tokens+_out_tokens} tokens (in: {_in_tokens}, out: {_out_tokens}).\n", "yellow"))
-
-                    if 'failureTrace' in _event['trace']['trace']:
-                        print(colored(f"Agent error: {_event['trace']['trace']['failureTrace']['failureReason']}", "red"))
-
-                    if 'orchestrationTrace' in _event['trace']['trace']:
-                        _orch = _event['trace']['trace']['orchestrationTrace']
-
-                        if trace_level in ["core", "outline"]:
-                            if "rationale" in _orch:
-                                _rationale = _orch['rationale']
-                                print(colored(f"{_rationale['text']}", "blue"))
-
-                            if "invocationInput" in _orch:
-                                # NOTE: when agent determines invocations should happen in parallel
-                                # the trace objects for invocation input still come back one at a time.
-                                _input = _orch['invocationInput']
-
-                                if 'actionGroupInvocationInput' in _input:
-                                    if trace_level == "outline":
-                                        print(colored(f"Using tool: {_input['actionGroupInvocationInput']['function']}", "magenta"))
-                                    else:
-                                        print(f"Action group information: {_input['actionGroupInvocationInput']}")
-                                        print(colored(f"Using tool: {_input['actionGroupInvocationInput']['function']} with these inputs:", "magenta"))
-                                        if (len(_input['actionGroupInvocationInput']['parameters']) == 1) and (_input['actionGroupInvocationInput']['parameters'][0]['name'] == 'input_text'):
-                                            print(colored(f"{_input['actionGroupInvocationInput']['parameters'][0]['value']}", "magenta"))
-                                        else:
-                                            print(colored(f"{_input['actionGroupInvocationInput']['parameters']}\n", "magenta"))
-
-                                elif 'agentCollaboratorInvocationInput' in _input:
-                                    _collab_name = _input['agentCollaboratorInvocationInput']['agentCollaboratorName']
-                                    _sub_agent_name = _collab_name
-                                    _collab_input_text = _input['agentCollaboratorInvocationInput']['input']['text']
-                                    _collab_arn = _input['agentCollaboratorInvocationInput']['agentCollaboratorAliasArn']
-                                    _collab_ids = _collab_arn.split('/', 1)[1]
-
-                                    if trace_level == "outline":
-                                        print(colored(f"Using sub-agent collaborator: '{_collab_name} [{_collab_ids}]'", "magenta"))
-                                    else:
-                                        print(colored(f"Using sub-agent collaborator: '{_collab_name} [{_collab_ids}]' passing input text:", "magenta"))
-                                        print(colored(f"{_collab_input_text[0:TRACE_TRUNCATION_LENGTH]}\n", "magenta"))
-
-                                elif 'codeInterpreterInvocationInput' in _input:
-                                    if trace_level == "outline":
-                                        print(colored(f"Using code interpreter", "magenta"))
-                                    else:
-                                        console = Console()
-                                        _gen_code = _input['codeInterpreterInvocationInput']['code']
-                                        _code = f"```python\n{_gen_code}\n```"
-                                        if _code is not None:
-                                            fname = os.path.join(session_directory_path, f"code_event_{event_ctr+1}.py")
-                                            from pathlib import Path
-                                            # remove bedrock agent specific code from here
-                                            code = _code.replace("$BASE_PATH$/", "")
-                                            final_code += "\n" + code
-                                            Path(fname).write_text(code)
-                                        console.print(Markdown(f"**Generated code**\n{_code}"))
-
-                            if "observation" in _orch:
-                                if trace_level == "core":
-                                    _output = _orch['observation']
-                                    if 'actionGroupInvocationOutput' in _output:
-                                        tool_output = _output['actionGroupInvocationOutput']['text']
-                                        print(colored("--tool outputs:", "magenta"))
-                                        
-                                        # Parse the tool_output to check if it's a generate_code response
-                                        try:
-                                            if "'original_generated_code':" in tool_output:  # This indicates it's from generate_code function
-                                                safe_input = input_text.lower()
-                                                safe_input = ''.join(c if c.isalnum() else '_' for c in safe_input)[:20]
-                                                unique_id = str(uuid.uuid4()) 
-                                                filename = f"code_event_{unique_id}_{safe_input}.py"
-                                                fname = os.path.join(session_directory_path, filename)
-                                                
-                                                code_start = tool_output.find("'original_generated_code': '") + len("'original_generated_code': '")
-                                                code_end = tool_output.find("'", code_start)
-                                                code = tool_output[code_start:code_end]
-                                                
-                                                # handle code formatting
-                                                code = code.replace("```python", "").replace("```", "")
-                                                code = code.replace("\\\\\\$BASE_PATH\\\\\\$/", "")
-                                                code = code.replace('\\n', '\n')
-                                                code = code.replace('\\t', '\t')
-                                                code = code.replace('\\"', '"')
-                                                code = code.replace("\\'", "'")
-                                                code = code.replace("\\\\", "\\")
-                                                
-                                                Path(fname).write_text(code)
-                                                print(f"\nCode saved to: {fname}")
-                                                console = Console()
-                                                _code = f"```python\n{code}\n```"
-                                                console.print(Markdown(f"\n**Generated code**\n{_code}"))
-                                            else:
-                                                print(f"Tool output:")
-                                                print(colored(f"  {tool_output}", "magenta"))
-                                    
-                                        except Exception as e:
-                                            print(f"Error saving to primary location: {e}")
-                                            try:
-                                                fallback_fname = os.path.join(os.getcwd(), filename)
-                                                Path(fallback_fname).write_text(code)
-                                                print(f"Code saved to fallback location: {fallback_fname}")
-                                            except Exception as e2:
-                                                print(f"Failed to save code even to fallback location: {e2}")
-                                    if 'agentCollaboratorInvocationOutput' in _output:
-                                        _collab_name = _output['agentCollaboratorInvocationOutput']['agentCollaboratorName']
-                                        _collab_output_text = _output['agentCollaboratorInvocationOutput']['output']['text']
-                                        print(colored(f"\n----sub-agent {_collab_name} output text:", "magenta"))
-                                        if '\n' in _collab_output_text:
-                                            for line in _collab_output_text.split('\n'):
-                                                print(colored(f"  {line}", "magenta"))
-                                        else:
-                                            print(colored(f"  {_collab_output_text}", "magenta"))
-                                        print()
-
-                                    if 'finalResponse' in _output:
-                                        final_response = _output['finalResponse']['text']
-                                        print(colored("Final response:", "cyan"))
-                                        if '\n' in final_response:
-                                            for line in final_response.split('\n'):
-                                                print(colored(f"  {line}", "cyan"))
-                                        else:
-                                            print(colored(f"  {final_response}", "cyan"))
-
-                        # if 'modelInvocationInput' in _orch:
-                        #     if _sub_agent_alias_id is not None:
-                        #         _sub_step += 1
-                        #         print(colored(f"---- Step {_orch_step}.{_sub_step} [using sub-agent name:{_sub_agent_name}, id:{_sub_agent_alias_id}] ----", "green"))
-                        #     else:
-                        #         _orch_step += 1
-                        #         _sub_step = 0
-                        #         print(colored(f"---- Step {_orch_step} ----", "green"))
-
-                        if 'modelInvocationOutput' in _orch:
-                            if _sub_agent_alias_id is not None:
-                                _sub_step += 1
-                                print(colored(f"---- Step {_orch_step}.{_sub_step} [using sub-agent name:{_sub_agent_name}, id:{_sub_agent_alias_id}] ----", "green"))
-                            else:
-                                _orch_step += 1
-                                _sub_step = 0
-                                print(colored(f"---- Step {_orch_step} ----", "green"))
-
-                            _llm_usage = _orch['modelInvocationOutput']['metadata']['usage']
-                            _in_tokens = _llm_usage['inputTokens']
-                            _total_in_tokens += _in_tokens 
-
-                            _out_tokens = _llm_usage['outputTokens']
-                            _total_out_tokens += _out_tokens
-
-                            _total_llm_calls += 1
-                            import datetime
-                            _orch_duration = datetime.datetime.now() - _time_before_orchestration
-
-                            print(colored(f'Took {_orch_duration.total_seconds():,.1f}s, using {_in_tokens+_out_tokens} tokens (in: {_in_tokens}, out: {_out_tokens}) to complete prior action, observe, orchestrate.', "yellow"))
-
-                            # restart the clock for next step/sub-step
-                            _time_before_orchestration = datetime.datetime.now()
-
-                    elif 'preProcessingTrace' in _event['trace']['trace']:
-                        _pre = _event['trace']['trace']['preProcessingTrace']
-                        if 'modelInvocationOutput' in _pre:
-                            _llm_usage = _pre['modelInvocationOutput']['metadata']['usage']
-                            _in_tokens = _llm_usage['inputTokens']
-                            _total_in_tokens += _in_tokens 
-
-                            _out_tokens = _llm_usage['outputTokens']
-                            _total_out_tokens += _out_tokens
-
-                            _total_llm_calls += 1
-
-                            print(colored("Pre-processing trace, agent came up with an initial plan.", "yellow"))
-                            print(colored(f'Used LLM tokens, in: {_in_tokens}, out: {_out_tokens}', "yellow"))
-
-                    elif 'postProcessingTrace' in _event['trace']['trace']:
-                        _post = _event['trace']['trace']['postProcessingTrace']
-                        if 'modelInvocationOutput' in _post:
-                            _llm_usage = _post['modelInvocationOutput']['metadata']['usage']
-                            _in_tokens = _llm_usage['inputTokens']
-                            _total_in_tokens += _in_tokens 
-
-                            _out_tokens = _llm_usage['outputTokens']
-                            _total_out_tokens += _out_tokens
-
-                            _total_llm_calls += 1
-                            print(colored("Agent post-processing complete.", "yellow"))
-                            print(colored(f'Used LLM tokens, in: {_in_tokens}, out: {_out_tokens}', "yellow"))
-
-                    if trace_level == "all":
-                        print(json.dumps(_event['trace'], indent=2))
-
-                if 'files' in _event.keys() and enable_trace:
-                    console = Console()
-                    files_event = _event['files']
-                    console.print(Markdown("**Files**"))
-
-                    files_list = files_event['files']
-                    for this_file in files_list:
-                        print(f"{this_file['name']} ({this_file['type']})")
-                        file_bytes = this_file['bytes']
-
-                        # save bytes to file, given the name of file and the bytes 
-                        file_name = os.path.join('output', this_file['name'])
-                        with open(file_name, 'wb') as f:
-                            f.write(file_bytes)
-                        # if this_file['type'] == 'image/png' or this_file['type'] == 'image/jpeg':
-                        #     img = mpimg.imread(file_name)
-                        #     # plt.imshow(img)
-                        #     # plt.show()
-
-            if enable_trace:
-                duration = datetime.datetime.now() - _time_before_call
-
-                if trace_level in ["core", "outline"]:
-                    print(colored(f"Agent made a total of {_total_llm_calls} LLM calls, " +\
-                                  f"using {_total_in_tokens+_total_out_tokens} tokens " +\
-                                  f"(in: {_total_in_tokens}, out: {_total_out_tokens})" +\
-                                  f", and took {duration.total_seconds():,.1f} total seconds", "yellow"))
-
-                if trace_level == "all":
-                    print(f"Returning agent answer as: {_agent_answer}")
-            # Create the file path by joining the session directory and the desired file name
-            file_path = os.path.join(session_directory_path, "final_code.py")
-            print(f"final code file path is : {file_path}")
+            try:
+                for _event in parse_event_stream(_agent_resp["completion"]):
+                    if isinstance(_event, ChunkEvent):
+                        _agent_answer += self._make_fully_cited_answer(_event.text, _event.raw, enable_trace, trace_level)
+                    for _sink in _sinks:
+                        _sink.handle(_event)
+            except BaseException:
+                # the sinks are closed before re-raising, so that the thread of the background
+                # artifact writer is stopped when parsing the stream or a sink fails
+                self._close_sinks(_sinks)
+                raise
+            _close_error = self._close_sinks(_sinks)
+            if _close_error is not None:
+                raise _close_error
+            _renderer.render_summary(_metrics, _agent_answer)
+            self.last_invoke_metrics = _metrics.summary()
+            for _exporter in metrics_exporters or []:
+                _exporter.export(self.last_invoke_metrics)
+            if return_metrics:
+                return _agent_answer, self.last_invoke_metrics
             return _agent_answer
-        
+
         except Exception as e:
             print(f"Caught exception while processing input to invokeAgent:\n")
             print(f"  for input text:\n{input_text}\n")
@@ -2031,12 +1957,282 @@ class AgentsForAmazonBedrock:
             print(f"  request ID: {_agent_resp['ResponseMetadata']['RequestId']}, retries: {_agent_resp['ResponseMetadata']['RetryAttempts']}\n")
             print(f"Error: {e}")
             raise Exception("Unexpected exception: ", e)
-        
+
+    @staticmethod
+    def _close_sinks(sinks: List[EventSink]) -> Optional[Exception]:
+        """Closes every sink, even when one of them fails to close, and returns the first error"""
+        _error = None
+        for _sink in sinks:
+            try:
+                _sink.close()
+            except Exception as e:
+                _error = _error or e
+        return _error
+
+    def _invoke_fast(
+            self,
+            input_text: str,
+            agent_id: str,
+            agent_alias_id: str,
+            session_id: str,
+            session_state: dict,
+            end_session: bool,
+            metrics: MetricsAggregator,
+            metrics_exporters: Optional[List[MetricsExporter]],
+            return_metrics: bool,
+            priority: str = INTERACTIVE,
+    ):
+        """The fast mode of invoke: consumes the raw EventStream without parsing it into typed
+        events, joining the bytes of the answer chunks and collecting the returned files."""
+        _agent_resp = self._invoke_agent(
+            priority,
+            inputText=input_text,
+            agentId=agent_id,
+            agentAliasId=agent_alias_id,
+            sessionId=session_id,
+            sessionState=session_state,
+            enableTrace=False,
+            endSession=end_session,
+        )
+        if _agent_resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            _answer = f"API Response was not 200: {_agent_resp}"
+        else:
+            _parts: List[bytes] = []
+            _files: List[dict] = []
+            for _event in _agent_resp["completion"]:
+                _chunk = _event.get("chunk")
+                if _chunk is not None:
+                    if not _parts:
+                        metrics.time_to_first_chunk_s = time.perf_counter() - metrics.started_at
+                    if "citations" in _chunk.get("attribution", {}):
+                        _parts.append(self._make_fully_cited_answer(
+                            _chunk["bytes"].decode("utf8"), _event).encode("utf8"))
+                    else:
+                        _parts.append(_chunk["bytes"])
+                elif "files" in _event:
+                    _files.extend(_event["files"]["files"])
+            _answer = b"".join(_parts).decode("utf8")
+            self.last_invoke_files = _files
+        metrics.close()
+        if return_metrics or metrics_exporters:
+            self.last_invoke_metrics = metrics.summary()
+            for _exporter in metrics_exporters or []:
+                _exporter.export(self.last_invoke_metrics)
+            if return_metrics:
+                return _answer, self.last_invoke_metrics
+        return _answer
+
+    def _invoke_agent(self, priority: str = INTERACTIVE, **kwargs) -> dict:
+        """Calls invoke_agent on the runtime client once the admission controller, if any,
+        admits the call. The rate of the invoke_agent budget is cut when the call or its
+        EventStream is throttled, and raised when the EventStream is read to the end."""
+        if self._admission_controller is None:
+            return self._bedrock_agent_runtime_client.invoke_agent(**kwargs)
+        _controller = self._admission_controller
+        _controller.acquire("invoke_agent", priority=priority)
+        try:
+            _agent_resp = self._bedrock_agent_runtime_client.invoke_agent(**kwargs)
+        except Exception as e:
+            if is_throttling(e):
+                _controller.on_throttle("invoke_agent")
+            raise
+
+        def _completion(event_stream):
+            try:
+                yield from event_stream
+            except Exception as e:
+                if is_throttling(e):
+                    _controller.on_throttle("invoke_agent")
+                raise
+            _controller.on_success("invoke_agent")
+
+        return dict(_agent_resp, completion=_completion(_agent_resp["completion"]))
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        with self._session_locks_guard:
+            _lock = self._session_locks.get(session_id)
+            if _lock is None:
+                _lock = self._session_locks[session_id] = threading.Lock()
+            return _lock
+
+    def invoke_turn(
+            self,
+            input_text: str,
+            agent_id: str,
+            agent_alias_id: str = DEFAULT_ALIAS,
+            session_id: str = None,
+            session_state: dict = None,
+            enable_trace: bool = True,
+            end_session: bool = False,
+            max_retries: int = DEFAULT_MAX_THROTTLING_RETRIES,
+            priority: str = INTERACTIVE,
+    ) -> dict:
+        """Invokes an agent for one turn without printing, retrying with jittered exponential
+        backoff when the turn is throttled, and returns the answer with the latency and tokens
+        of the turn. Concurrent calls for the same session are run one at a time.
+
+        Args:
+            input_text (str): The text to be processed by the agent.
+            agent_id (str): The ID of the agent to invoke.
+            agent_alias_id (str, optional): The alias ID of the agent to invoke. Defaults to DEFAULT_ALIAS.
+            session_id (str, optional): The ID of the session. Defaults to a new UUID.
+            session_state (dict, optional): The state of the session. Defaults to an empty dict.
+            enable_trace (bool, optional): Whether to enable trace, needed to count the tokens. Defaults to True.
+            end_session (bool, optional): Whether to end the session. Defaults to False.
+            max_retries (int, optional): Maximum number of retries of a throttled turn.
+            priority (str, optional): Priority class of the turn for the admission controller,
+                INTERACTIVE or BATCH. Defaults to INTERACTIVE.
+
+        Returns:
+            dict: The session ID, input text, answer, latency, tokens, retries and error of the turn,
+                and the metrics record of its last attempt.
+        """
+        session_id = session_id or str(uuid.uuid4())
+        result = {
+            "session_id": session_id,
+            "input_text": input_text,
+            "answer": None,
+            "latency_s": 0.0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "llm_calls": 0,
+            "retries": 0,
+            "error": None,
+            "metrics": None
+        }
+        with self._session_lock(session_id):
+            _start = time.perf_counter()
+            while True:
+                _metrics = MetricsAggregator(agent_id, agent_alias_id, session_id)
+                _answer = ""
+                try:
+                    for _event in self.invoke_events(input_text, agent_id, agent_alias_id, session_id,
+                                                     session_state or {}, enable_trace, end_session, priority):
+                        _metrics.handle(_event)
+                        if isinstance(_event, ChunkEvent):
+                            _answer += _event.text
+                    _metrics.close()
+                    result.update({
+                        "answer": _answer,
+                        "input_tokens": _metrics.total_in_tokens,
+                        "output_tokens": _metrics.total_out_tokens,
+                        "llm_calls": _metrics.total_llm_calls,
+                        "metrics": _metrics.summary()
+                    })
+                    break
+                except Exception as e:
+                    if is_throttling(e) and result["retries"] < max_retries:
+                        result["retries"] += 1
+                        if self._admission_controller is not None:
+                            # the rate cut by the throttling response spaces out the retry
+                            continue
+                        # full jitter: sleep a random time up to the exponential backoff
+                        time.sleep(random.uniform(0, min(THROTTLING_BACKOFF_MAX_S,
+                                                         THROTTLING_BACKOFF_BASE_S * 2 ** result["retries"])))
+                        continue
+                    result["error"] = f"{type(e).__name__}: {e}"
+                    break
+            result["latency_s"] = round(time.perf_counter() - _start, 3)
+        return result
+
+    def invoke_many(
+            self,
+            requests: List[dict],
+            max_concurrency: int = None,
+            max_retries: int = DEFAULT_MAX_THROTTLING_RETRIES,
+            stop_session_on_error: bool = True,
+            priority: str = BATCH,
+    ) -> dict:
+        """Runs many agent turns concurrently. The turns of a session run one after the other in
+        the order of the requests, while different sessions run in parallel on at most
+        max_concurrency threads, bounded by the connection pool of the runtime client.
+
+        Args:
+            requests (List[dict]): One dict per turn with the arguments of invoke_turn, at least
+                'input_text' and 'agent_id'. Turns without a 'session_id' get their own session.
+            max_concurrency (int, optional): Maximum number of sessions run concurrently.
+                Defaults to the size of the connection pool.
+            max_retries (int, optional): Maximum number of retries of a throttled turn.
+            stop_session_on_error (bool, optional): Whether the remaining turns of a session are
+                skipped after one of its turns failed. Defaults to True.
+            priority (str, optional): Priority class of the turns without their own 'priority' for the
+                admission controller, so that they leave a share of the budget to interactive calls.
+                Defaults to BATCH.
+
+        Returns:
+            dict: 'results' with the result of every turn in the order of the requests, see invoke_turn,
+            and 'sessions' with the number of turns, latency, tokens and errors of every session.
+        """
+        _requests = [dict(r, session_id=r.get("session_id") or str(uuid.uuid4())) for r in requests]
+        _turns_by_session: Dict[str, List[int]] = {}
+        for _index, _request in enumerate(_requests):
+            _turns_by_session.setdefault(_request["session_id"], []).append(_index)
+
+        _results: List[dict] = [None] * len(_requests)
+
+        def _run_session(indices: List[int]) -> None:
+            _failed = False
+            for _index in indices:
+                if _failed and stop_session_on_error:
+                    _results[_index] = {"session_id": _requests[_index]["session_id"],
+                                        "input_text": _requests[_index]["input_text"],
+                                        "answer": None, "latency_s": 0.0, "input_tokens": 0,
+                                        "output_tokens": 0, "llm_calls": 0, "retries": 0,
+                                        "error": "Skipped after a failed turn of the session"}
+                    continue
+                _results[_index] = self.invoke_turn(**dict({"priority": priority}, **_requests[_index]),
+                                                    max_retries=max_retries)
+                _failed = _results[_index]["error"] is not None
+
+        _workers = min(max_concurrency or self._max_pool_connections, self._max_pool_connections)
+        with ThreadPoolExecutor(max_workers=max(1, _workers), thread_name_prefix="invoke") as _executor:
+            list(_executor.map(_run_session, _turns_by_session.values()))
+
+        _sessions = {}
+        for _session_id, _indices in _turns_by_session.items():
+            _session_results = [_results[i] for i in _indices]
+            _sessions[_session_id] = {
+                "turns": len(_indices),
+                "latency_s": round(sum(r["latency_s"] for r in _session_results), 3),
+                "input_tokens": sum(r["input_tokens"] for r in _session_results),
+                "output_tokens": sum(r["output_tokens"] for r in _session_results),
+                "retries": sum(r["retries"] for r in _session_results),
+                "errors": sum(1 for r in _session_results if r["error"] is not None)
+            }
+        return {"results": _results, "sessions": _sessions}
+
+    async def ainvoke(self, input_text: str, agent_id: str, **kwargs) -> dict:
+        """Asynchronous version of invoke_turn, run on a thread pool bounded by the connection
+        pool of the runtime client. Concurrent calls for the same session run in call order.
+
+        Args:
+            input_text (str): The text to be processed by the agent.
+            agent_id (str): The ID of the agent to invoke.
+            **kwargs: The other arguments of invoke_turn.
+
+        Returns:
+            dict: The result of the turn, see invoke_turn.
+        """
+        if self._invoke_executor is None:
+            self._invoke_executor = ThreadPoolExecutor(max_workers=self._max_pool_connections,
+                                                       thread_name_prefix="ainvoke")
+        _session_id = kwargs.pop("session_id", None) or str(uuid.uuid4())
+        # asyncio locks are fair, so the waiting turns of a session run in call order
+        _lock = self._async_session_locks.get(_session_id)
+        if _lock is None:
+            _lock = self._async_session_locks[_session_id] = asyncio.Lock()
+        async with _lock:
+            _loop = asyncio.get_running_loop()
+            return await _loop.run_in_executor(
+                self._invoke_executor,
+                lambda: self.invoke_turn(input_text, agent_id, session_id=_session_id, **kwargs)
+            )
+
     def invoke_roc(self,
                     input_text: str, 
                     agent_id: str, 
                     agent_alias_id: str=DEFAULT_ALIAS, 
-                    session_id: str=str(uuid.uuid1()), 
+                    session_id: str=None, 
                     function_call: str=None,
                     function_call_result: str=None,
                     enable_trace: bool=False, 
@@ -2057,8 +2253,9 @@ class AgentsForAmazonBedrock:
         Returns:
             str: The answer from the agent.
         """
+        session_id = session_id or str(uuid.uuid4())
         if function_call is not None:
-            _agent_resp = self._bedrock_agent_runtime_client.invoke_agent(
+            _agent_resp = self._invoke_agent(
                 inputText=input_text,
                 agentId=agent_id,
                 agentAliasId=agent_alias_id, 
@@ -2077,7 +2274,7 @@ class AgentsForAmazonBedrock:
                 endSession= end_session
             )
         else:
-            _agent_resp = self._bedrock_agent_runtime_client.invoke_agent(
+            _agent_resp = self._invoke_agent(
                 inputText=input_text,
                 agentId=agent_id,
                 agentAliasId=agent_alias_id, 
@@ -2163,7 +2360,7 @@ class AgentsForAmazonBedrock:
         # Update the agent.
         _update_agent_response = self._bedrock_agent_client.update_agent(**_agent_details)
 
-        time.sleep(3)
+        self.wait_agent_status_update(_agent_id)
         
         #Prepare Agent
         self._bedrock_agent_client.prepare_agent(agentId=_agent_id)
@@ -0,0 +1,506 @@
+# This file contains the deployment of the multi-agent system as a dependency graph of steps, in
+# place of running the notebooks one after the other. The steps of the home network and doorbell
+# branches (knowledge base, data sync, knowledge base lambda, code generation prompt, agent, action
+# group lambda, alias) only depend on the steps of their own branch, and the supervisor agent is
+# created while the branches are deployed, so the DeployOrchestrator runs every step as soon as
+# the steps it depends on are done, on a thread pool. The output of every completed step is
+# checkpointed to a JSON state file, and a rerun after a failure or an interruption resumes from
+# the steps that are not completed. At the end it prints the duration of every step and the
+# critical path, the chain of dependent steps that sets the duration of the deployment.
+#
+#   python -m utils.deploy_orchestrator --state-file deploy_state.json
+#   python -m utils.deploy_orchestrator --state-file deploy_state.json --force doorbell:agent
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from globals import *
+
+DEFAULT_STATE_FNAME: str = "deploy_state.json"
+# Enough for the steps that start together: the knowledge base, prompt and agent of both branches and the supervisor
+DEFAULT_MAX_WORKERS: int = 8
+COMPLETED: str = "COMPLETED"
+FAILED: str = "FAILED"
+
+class DeployStep:
+    """
+    A step of the deployment: run is called with the outputs of the completed steps by name and
+    returns the output of the step, which is checkpointed and must be JSON serializable
+    """
+
+    def __init__(self, name: str, run: Callable[[Dict[str, Any]], Any], depends_on: Iterable[str] = ()):
+        self.name = name
+        self.run = run
+        self.depends_on = tuple(depends_on)
+
+class DeployFailure(RuntimeError):
+    """Raised when steps of the deployment fail, after the steps that were running are done"""
+
+    def __init__(self, errors: Dict[str, Exception]):
+        self.errors = errors
+        super().__init__("Failed steps: " + ", ".join(f"{name} ({type(e).__name__}: {e})"
+                                                     for name, e in errors.items()))
+
+class DeployOrchestrator:
+    """
+    Runs the steps of a deployment in the order of their dependencies, each one as soon as the
+    steps it depends on are completed, and checkpoints them to state_fpath. The clock can be
+    replaced, for example by a fake clock in tests.
+    """
+
+    def __init__(self, steps: List[DeployStep], state_fpath: str = DEFAULT_STATE_FNAME,
+                 max_workers: int = DEFAULT_MAX_WORKERS, clock: Callable[[], float] = time.monotonic):
+        self.steps = {step.name: step for step in steps}
+        if len(self.steps) != len(steps):
+            raise ValueError("Step names must be unique")
+        for step in steps:
+            unknown = [name for name in step.depends_on if name not in self.steps]
+            if unknown:
+                raise ValueError(f"Step {step.name} depends on unknown steps {unknown}")
+        self.order = self._topological_order()
+        self.state_fpath = state_fpath
+        self.max_workers = max_workers
+        self._clock = clock
+        self.state = self.load_state()
+        # name -> (start, duration) in seconds since the start of the last run, of the steps it ran
+        self.timings: Dict[str, Tuple[float, float]] = {}
+        self.wall_s = 0.0
+
+    def _topological_order(self) -> List[str]:
+        """Names of the steps with every step after the steps it depends on, or ValueError on a cycle"""
+        order, visiting, done = [], set(), set()
+
+        def visit(name: str, path: List[str]) -> None:
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+            visiting.add(name)
+            for dependency in self.steps[name].depends_on:
+                visit(dependency, path + [name])
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.steps:
+            visit(name, [])
+        return order
+
+    def dependents(self, names: Iterable[str]) -> List[str]:
+        """The steps and every step that depends on them, directly or not, in topological order"""
+        selected = set(names)
+        for name in self.order:
+            if any(dependency in selected for dependency in self.steps[name].depends_on):
+                selected.add(name)
+        return [name for name in self.order if name in selected]
+
+    def load_state(self) -> Dict[str, dict]:
+        """The checkpointed steps by name, empty if there is no state file yet"""
+        if not os.path.exists(self.state_fpath):
+            return {}
+        with open(self.state_fpath) as f:
+            return json.load(f).get("steps", {})
+
+    def _save_state(self) -> None:
+        """Write the state file atomically, so that an interrupted write leaves the previous checkpoint"""
+        tmp_fpath = f"{self.state_fpath}.tmp"
+        with open(tmp_fpath, "w") as f:
+            json.dump({"steps": self.state}, f, indent=2, default=str)
+        os.replace(tmp_fpath, self.state_fpath)
+
+    def outputs(self) -> Dict[str, Any]:
+        """Outputs of the completed steps by name"""
+        return {name: s["output"] for name, s in self.state.items() if s.get("status") == COMPLETED}
+
+    def run(self, force: Iterable[str] = (), verbose: bool = True) -> Dict[str, Any]:
+        """
+        Run the steps that are not completed in the state file
+        Args:
+            force (Iterable[str]): Steps to run again even if completed, with the steps that depend on them
+            verbose (bool): Whether to print the steps as they start and end
+        Returns:
+            Dict[str, Any]: Outputs of all the steps by name
+        Raises:
+            DeployFailure: If steps failed, once the running steps are done. The completed steps are
+                checkpointed and skipped by the next run.
+        """
+        for name in self.dependents(force):
+            self.state.pop(name, None)
+        pending = [name for name in self.order if self.state.get(name, {}).get("status") != COMPLETED]
+        if verbose:
+            resumed = len(self.order) - len(pending)
+            print(f"Deploying {len(pending)} steps" + (f", {resumed} completed in {self.state_fpath}" if resumed else ""))
+        self.timings = {}
+        errors: Dict[str, Exception] = {}
+        started = self._clock()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                completed = self.outputs()
+                if not errors:
+                    for name in [n for n in pending if all(d in completed for d in self.steps[n].depends_on)]:
+                        pending.remove(name)
+                        if verbose:
+                            print(f"Starting {name}")
+                        running[executor.submit(self._run_step, name, completed)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    start, duration, output, error = future.result()
+                    self.timings[name] = (start - started, duration)
+                    entry = {"duration_s": round(duration, 3),
+                             "finished_at": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+                    if error is None:
+                        self.state[name] = {"status": COMPLETED, "output": output, **entry}
+                    else:
+                        errors[name] = error
+                        self.state[name] = {"status": FAILED, "error": f"{type(error).__name__}: {error}", **entry}
+                    self._save_state()
+                    if verbose:
+                        print(f"{'Completed' if error is None else 'Failed'} {name} in {duration:.1f}s")
+        self.wall_s = self._clock() - started
+        if errors:
+            raise DeployFailure(errors)
+        return self.outputs()
+
+    def _run_step(self, name: str, outputs: Dict[str, Any]) -> Tuple[float, float, Any, Optional[Exception]]:
+        start = self._clock()
+        try:
+            output = self.steps[name].run(outputs)
+            return start, self._clock() - start, output, None
+        except Exception as e:
+            return start, self._clock() - start, None, e
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """
+        The chain of dependent steps with the longest total duration in the last run, the steps
+        completed by an earlier run counting for zero, and its duration
+        """
+        finish: Dict[str, float] = {}
+        previous: Dict[str, Optional[str]] = {}
+        for name in self.order:
+            dependencies = self.steps[name].depends_on
+            before = max(dependencies, key=lambda d: finish[d], default=None)
+            previous[name] = before
+            finish[name] = (finish[before] if before else 0.0) + self.timings.get(name, (0.0, 0.0))[1]
+        last = max(finish, key=finish.get, default=None)
+        path = []
+        while last is not None:
+            path.append(last)
+            last = previous[last]
+        path.reverse()
+        return path, (finish[path[-1]] if path else 0.0)
+
+    def timing_report(self) -> str:
+        """Start and duration of every step of the last run, with the critical path"""
+        path, path_s = self.critical_path()
+        lines = [f"{'step':<36}{'start s':>10}{'duration s':>12}  critical path"]
+        for name in sorted(self.order, key=lambda n: self.timings.get(n, (-1.0, 0.0))[0]):
+            if name in self.timings:
+                start, duration = self.timings[name]
+                lines.append(f"{name:<36}{start:>10.1f}{duration:>12.1f}  {'*' if name in path else ''}")
+            else:
+                status = "resumed" if self.state.get(name, {}).get("status") == COMPLETED else "not run"
+                lines.append(f"{name:<36}{status:>10}{'':>12}")
+        serial_s = sum(duration for _, duration in self.timings.values())
+        lines.append(f"\nwall time {self.wall_s:.1f}s, critical path {path_s:.1f}s, "
+                     f"sum of the step durations {serial_s:.1f}s")
+        lines.append("critical path: " + " -> ".join(path))
+        return "\n".join(lines)
+
+# The two sub-agent branches of the multi-agent system, as deployed by the notebooks of
+# 0_home_network_assistant and 1_doorbell_assistant
+BRANCHES: Dict[str, Dict[str, str]] = {
+    "home_network": {
+        "dir": "0_home_network_assistant",
+        "bucket": "home_network_knowledge_bucket",
+        "api_spec": "home_network_api_spec",
+        "kb_name": HOME_NETWORK_KB_NAME,
+        "kb_description": HOME_NETWORK_KB_DESCRIPTION,
+        "kb_lambda_name": HOME_NETWORK_KB_LAMBDA_FUNCTION_NAME,
+        "kb_lambda_source": HOME_NETWORK_KB_LAMBDA_FUNCTION,
+        "kb_lambda_env": "HOME_NETWORK_KB_LAMBDA_FUNCTION_NAME",
+        "auth_token_env": "HOME_NETWORK_AUTH_TOKEN",
+        "prompt_name": "prompt-for-home-network-code-gen",
+        "prompt": "home_network_code_generation_prompt",
+        "agent_name": HOME_NETWORK_AGENT_NAME,
+        "agent_description": """You are a Home Network assistant agent.
+You help generate code for Home Network API operations based on user questions and knowledge base content.""",
+        "agent_instructions": "home_network_agent_instructions",
+        "model": "home_network_sub_agent_model",
+        "agent_lambda_source": HOME_NETWORK_AGENT_LAMBDA_FUNCTION_NAME,
+        "action_group": HOME_NETWORK_ACTION_GROUP_NAME,
+        "collaborator_name": "HomeNetworkingCollaborator",
+        "collaborator_instruction": "Route any home networking specific user queries to this agent. This agent specializes in home networking related questions.",
+    },
+    "doorbell": {
+        "dir": "1_doorbell_assistant",
+        "bucket": "doorbell_knowledge_bucket",
+        "api_spec": "doorbell_api_spec",
+        "kb_name": DOORBELL_KB_NAME,
+        "kb_description": DOORBELL_KB_DESCRIPTION,
+        "kb_lambda_name": DOORBELL_KB_LAMBDA_FUNCTION_NAME,
+        "kb_lambda_source": DOORBELL_KB_LAMBDA_FUNCTION,
+        "kb_lambda_env": "DOORBELL_KB_LAMBDA_FUNCTION_NAME",
+        "auth_token_env": "DOORBELL_AUTH_TOKEN",
+        "prompt_name": "prompt-for-doorbell-code-gen",
+        "prompt": "doorbell_code_generation_prompt",
+        "agent_name": DOORBELL_AGENT_NAME,
+        "agent_description": """You are a Doorbell configuration assistant bot.
+You help generate code for Doorbell configuration API operations based on user questions and knowledge base content.""",
+        "agent_instructions": "doorbell_agent_instructions",
+        "model": "doorbell_sub_agent_model",
+        "agent_lambda_source": DOORBELL_AGENT_LAMBDA_FUNCTION_NAME,
+        "action_group": DOORBELL_ACTION_GROUP_NAME,
+        "collaborator_name": "DoorbellConfigurationCollaborator",
+        "collaborator_instruction": "Route any doorbell configuration specific user queries to this agent. This agent specializes in doorbell configuration related questions.",
+    },
+}
+
+# Functions of the action group of both sub-agents, implemented by their agent lambda functions
+AGENT_FUNCTIONS: List[Dict] = [
+    {
+        "name": "query_knowledge_base",
+        "description": "Queries the knowledge base with the user's query to fetch relevant API documentation and returns the relevant chunks",
+        "parameters": {
+            "query": {"description": "This is the user's query", "required": True, "type": "string"}
+        }
+    },
+    {
+        "name": "generate_code",
+        "description": "Generates Python code based on the knowledge base content and user query",
+        "parameters": {
+            "chunks": {"description": "List of relevant content chunks from the knowledge base", "required": True, "type": "array"},
+            "query": {"description": "The original user query to provide context for code generation", "required": True, "type": "string"},
+            "input_params": {"description": "JSON string containing input parameters needed to execute the generated code", "required": True, "type": "string"}
+        }
+    },
+    {
+        "name": "save_generated_code",
+        "description": "Saves the generated Python code to a temporary file",
+        "parameters": {
+            "code_content": {"description": "The generated Python code to be saved", "required": True, "type": "string"}
+        }
+    },
+    {
+        "name": "execute_generated_code",
+        "description": "Executes the saved Python code and returns the execution results",
+        "parameters": {
+            "file_path": {"description": "Path to the saved Python code file to execute", "required": True, "type": "string"}
+        }
+    }
+]
+
+SUPERVISOR_DESCRIPTION: str = """
+        You are a home networking and doorbell configuration API expert. You are able to respond to user queries and provide the information to their questions.
+    """
+SUPERVISOR_INSTRUCTIONS: str = """
+        You are a home networking and doorbell configuration API expert. You are able to respond to user queries and provide the information to their questions.
+        You are able to perform actions and route requests to collaborator home networking and doorbell configuration sub agents that are responsible for returning you with the information on
+        respective API specs and based on the user question.
+        Resist the temptation to ask the user for input. Only do so after you have exhausted available actions.
+        Never ask the user for information that you already can retrieve yourself through available actions.
+    """
+
+class MultiAgentStack:
+    """
+    The steps of the notebooks that deploy the multi-agent system, with AgentsForAmazonBedrock and
+    one KnowledgeBasesForAmazonBedrock per branch, since it holds the OpenSearch client of the
+    collection it creates. Every step is a method that takes the branch and the outputs of the
+    completed steps, so that a subclass can replace them, for example with stand-ins in tests.
+    """
+
+    def __init__(self, agents, kbs: Dict[str, Any], config_data: Dict, region: str, base_dir: str):
+        self.agents = agents
+        self.kbs = kbs
+        self.config_data = config_data
+        self.region = region
+        self.base_dir = base_dir
+
+    def _read(self, *parts: str) -> str:
+        with open(os.path.join(self.base_dir, *parts)) as f:
+            return f.read().strip()
+
+    def knowledge_base(self, branch: dict, outputs: Dict[str, Any]) -> dict:
+        from utils.utils import create_s3_bucket_for_kb
+        bucket = self.config_data['dir_paths']['knowledge_base_info'][branch["bucket"]]
+        if not create_s3_bucket_for_kb(bucket, self.region):
+            raise RuntimeError(f"Failed to create or verify the S3 bucket {bucket}")
+        kb_id, ds_id = self.kbs[branch["name"]].create_or_retrieve_knowledge_base(branch["kb_name"], branch["kb_description"], bucket)
+        return {"kb_id": kb_id, "ds_id": ds_id, "bucket": bucket}
+
+    def sync(self, branch: dict, outputs: Dict[str, Any]) -> dict:
+        from utils.utils import upload_file_to_s3
+        kb_info = outputs[f"{branch['name']}:knowledge_base"]
+        dir_paths = self.config_data['dir_paths']
+        upload_file_to_s3(os.path.join(self.base_dir, dir_paths['data_prefix'], dir_paths['api_specs'][branch["api_spec"]]),
+                          kb_info["bucket"])
+        jobs = self.kbs[branch["name"]].synchronize_data_sources([(kb_info["kb_id"], kb_info["ds_id"])])
+        return {"ingestion_job_ids": [job["ingestionJobId"] for job in jobs]}
+
+    def kb_lambda(self, branch: dict, outputs: Dict[str, Any]) -> dict:
+        from utils.utils import create_kb_lambda
+        function_arn = create_kb_lambda(
+            lambda_function_name=branch["kb_lambda_name"],
+            source_code_file=os.path.join(self.base_dir, branch["dir"], branch["kb_lambda_source"]),
+            region=self.region,
+            kb_id=outputs[f"{branch['name']}:knowledge_base"]["kb_id"],
+            admission_budgets=self.config_data.get('admission_control')
+        )
+        return {"function_arn": function_arn}
+
+    def prompt(self, branch: dict, outputs: Dict[str, Any]) -> dict:
+        dir_paths = self.config_data['dir_paths']
+        prompt_text = self._read(dir_paths['code_gen_prompts_prefix'], dir_paths['code_gen_prompts'][branch["prompt"]])
+        client = self.agents._bedrock_agent_client
+        response = client.create_prompt(
+            name=branch["prompt_name"],
+            description=f"Code generation prompt template that is used by the {branch['agent_name']} agent to generate code",
+            variants=[{
+                "name": "variantOne",
+                "templateConfiguration": {"text": {"inputVariables": [{"name": "input"}, {"name": "output"}],
+                                                   "text": prompt_text}},
+                "templateType": "TEXT"
+            }],
+            defaultVariant="variantOne"
+        )
+        client.create_prompt_version(promptIdentifier=response["id"])
+        return {"prompt_id": response["id"], "prompt_arn": response["arn"]}
+
+    def agent(self, branch: dict, outputs: Dict[str, Any]) -> dict:
+        dir_paths = self.config_data['dir_paths']
+        agent_id, _, _ = self.agents.create_agent(
+            branch["agent_name"],
+            branch["agent_description"],
+            self._read(dir_paths['agent_instructions_prefix'], dir_paths['agent_instructions'][branch["agent_instructions"]]),
+            self.config_data['model_information'][branch["model"]],
+            kb_arns=[],
+            code_interpretation=False
+        )
+        self.agents.wait_agent_status_update(agent_id)
+        return {"agent_id": agent_id}
+
+    def action_group(self, branch: dict, outputs: Dict[str, Any]) -> dict:
+        self.agents.add_action_group_with_lambda(
+            agent_name=branch["agent_name"],
+            lambda_function_name=f"{branch['agent_name']}_lambda",
+            source_code_file=os.path.join(self.base_dir, branch["dir"], branch["agent_lambda_source"]),
+            agent_functions=AGENT_FUNCTIONS,
+            agent_action_group_name=branch["action_group"],
+            agent_action_group_description="Functions to query KB, generate and execute code",
+            lambda_function_libraries=self.config_data['lambda_docker_set_up']['libraries'],
+            platform=self.config_data['lambda_docker_set_up']['platform']
+        )
+        return {"lambda_function_name": f"{branch['agent_name']}_lambda"}
+
+    def lambda_env(self, branch: dict, outputs: Dict[str, Any]) -> dict:
+        name = branch["name"]
+        environment_variables = {
+            branch["kb_lambda_env"]: branch["kb_lambda_name"],
+            'KB_ID': outputs[f"{name}:knowledge_base"]["kb_id"],
+            'REGION': self.region,
+            'CODE_GEN_PROMPT_ID': outputs[f"{name}:prompt"]["prompt_id"],
+            branch["auth_token_env"]: os.getenv(branch["auth_token_env"], ""),
+        } | self.config_data['code_generation_model_information']
+        self.agents._lambda_client.update_function_configuration(
+            FunctionName=outputs[f"{name}:action_group"]["lambda_function_name"],
+            Environment={'Variables': environment_variables}
+        )
+        self.agents._lambda_client.get_waiter('function_updated_v2').wait(
+            FunctionName=outputs[f"{name}:action_group"]["lambda_function_name"])
+        return {"variables": sorted(environment_variables)}
+
+    def alias(self, branch: dict, outputs: Dict[str, Any]) -> dict:
+        agent_id = outputs[f"{branch['name']}:agent"]["agent_id"]
+        alias_id, alias_arn = self.agents.create_agent_alias(agent_id, 'v1')
+        self.agents.wait_agent_alias_status_update(agent_id, alias_id)
+        return {"agent_id": agent_id, "alias_id": alias_id, "alias_arn": alias_arn}
+
+    def supervisor(self, outputs: Dict[str, Any]) -> dict:
+        agent_id, _, _ = self.agents.create_agent(
+            MULTI_AGENT_NAME,
+            SUPERVISOR_DESCRIPTION,
+            SUPERVISOR_INSTRUCTIONS,
+            f"us.{BEDROCK_MODEL_NOVA_LITE}",
+            agent_collaboration='SUPERVISOR'
+        )
+        self.agents.wait_agent_status_update(agent_id)
+        return {"agent_id": agent_id}
+
+    def collaborators(self, outputs: Dict[str, Any]) -> dict:
+        sub_agents_list = [{
+            'sub_agent_alias_arn': outputs[f"{name}:alias"]["alias_arn"],
+            'sub_agent_instruction': branch["collaborator_instruction"],
+            'sub_agent_association_name': branch["collaborator_name"],
+            'relay_conversation_history': 'TO_COLLABORATOR'
+        } for name, branch in BRANCHES.items()]
+        alias_id, alias_arn = self.agents.associate_sub_agents(outputs["supervisor:agent"]["agent_id"], sub_agents_list)
+        return {"agent_id": outputs["supervisor:agent"]["agent_id"], "alias_id": alias_id, "alias_arn": alias_arn}
+
+    @staticmethod
+    def _branch_step(method: Callable[[dict, Dict[str, Any]], Any], branch: dict) -> Callable[[Dict[str, Any]], Any]:
+        return lambda outputs: method(branch, outputs)
+
+    def steps(self) -> List[DeployStep]:
+        """The steps of both branches and of the supervisor, with their dependencies"""
+        steps = []
+        for name, branch in BRANCHES.items():
+            branch = {**branch, "name": name}
+            step = functools.partial(self._branch_step, branch=branch)
+            steps += [
+                DeployStep(f"{name}:knowledge_base", step(self.knowledge_base)),
+                DeployStep(f"{name}:sync", step(self.sync), [f"{name}:knowledge_base"]),
+                DeployStep(f"{name}:kb_lambda", step(self.kb_lambda), [f"{name}:knowledge_base"]),
+                DeployStep(f"{name}:prompt", step(self.prompt)),
+                DeployStep(f"{name}:agent", step(self.agent)),
+                DeployStep(f"{name}:action_group", step(self.action_group), [f"{name}:agent"]),
+                DeployStep(f"{name}:lambda_env", step(self.lambda_env),
+                           [f"{name}:action_group", f"{name}:kb_lambda", f"{name}:prompt"]),
+                DeployStep(f"{name}:alias", step(self.alias), [f"{name}:lambda_env", f"{name}:sync"]),
+            ]
+        steps += [
+            DeployStep("supervisor:agent", self.supervisor),
+            DeployStep("supervisor:collaborators", self.collaborators,
+                       ["supervisor:agent"] + [f"{name}:alias" for name in BRANCHES]),
+        ]
+        return steps
+
+def main():
+    parser = argparse.ArgumentParser(description="Deploy the multi-agent system, resuming from the state file")
+    parser.add_argument("--state-file", default=DEFAULT_STATE_FNAME)
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--force", nargs="*", default=[], help="steps to run again, with the steps that depend on them")
+    args = parser.parse_args()
+
+    import boto3
+    from utils.utils import load_config, get_aws_region
+    from utils.resource_resolver import ResourceResolver
+    from utils.bedrock_agent_helper import AgentsForAmazonBedrock
+    from utils.knowledge_base_helper import KnowledgeBasesForAmazonBedrock
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config_data = load_config(os.path.join(base_dir, CONFIG_FNAME))
+    region = get_aws_region()
+    # the helpers share one name index, the steps of both branches add the resources they create to it
+    resolver = ResourceResolver(boto3.client("bedrock-agent", region_name=region))
+    stack = MultiAgentStack(AgentsForAmazonBedrock(resolver=resolver),
+                            {name: KnowledgeBasesForAmazonBedrock(resolver=resolver) for name in BRANCHES},
+                            config_data, region, base_dir)
+    orchestrator = DeployOrchestrator(stack.steps(), args.state_file, args.max_workers)
+    try:
+        outputs = orchestrator.run(force=args.force)
+        print(json.dumps(outputs["supervisor:collaborators"], indent=2))
+    except DeployFailure as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        print(orchestrator.timing_report())
+
+if __name__ == "__main__":
+    main()
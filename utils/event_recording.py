@@ -0,0 +1,249 @@
+# This file contains the recorder and the replay client of invoke_agent responses. The
+# RecordingClient wraps the bedrock agent runtime client and writes every EventStream it
+# returns to a recording, and the ReplayClient stands in for the bedrock agent runtime
+# client and answers invoke_agent calls with recorded streams, so that the parsing and
+# rendering of AgentsForAmazonBedrock.invoke can be benchmarked without network access.
+#
+# A recording is a gzipped JSON lines file. The first line is a header with the request,
+# the response metadata and the time invoke_agent took to return, and every following line
+# holds a stream event with its offset in seconds from the invoke_agent call:
+#   {"format": "invoke_agent_stream", "version": 1, "request": {...}, "response_metadata": {...}, "response_s": 0.41}
+#   {"t": 1.873, "event": {"trace": {...}}}
+#   {"t": 9.532, "event": {"chunk": {"bytes": {"__bytes__": "SGVsbG8="}}}}
+#   {"t": 9.533, "end": true}
+# The bytes payloads (chunks and files) are base64 encoded and the datetimes in ISO format.
+# An error raised by the stream is recorded in the last line and raised again on replay.
+#
+#   agents = AgentsForAmazonBedrock(runtime_client=RecordingClient(runtime_client, "recordings"))
+#   agents = AgentsForAmazonBedrock(runtime_client=ReplayClient("recordings", mode="fast"))
+import gzip
+import json
+import time
+import uuid
+import base64
+import datetime
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+RECORDING_FORMAT: str = "invoke_agent_stream"
+RECORDING_VERSION: int = 1
+RECORDING_SUFFIX: str = ".jsonl.gz"
+REPLAY_MODES = ("fast", "realtime")
+# Fields of the invoke_agent request kept in the header of a recording
+_RECORDED_REQUEST_FIELDS = ("agentId", "agentAliasId", "sessionId", "inputText", "enableTrace", "endSession")
+
+def encode_event(value):
+    """
+    Convert a stream event to JSON serializable values, with its bytes base64 encoded
+    """
+    if isinstance(value, dict):
+        return {k: encode_event(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_event(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    return value
+
+def decode_event(value):
+    """
+    Inverse of encode_event
+    """
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if "__bytes__" in value:
+                return base64.b64decode(value["__bytes__"])
+            if "__datetime__" in value:
+                return datetime.datetime.fromisoformat(value["__datetime__"])
+        return {k: decode_event(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode_event(v) for v in value]
+    return value
+
+def _error_details(error: Exception) -> dict:
+    details = {"type": type(error).__name__, "message": str(error)}
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        details["code"] = response.get("Error", {}).get("Code")
+        details["message"] = response.get("Error", {}).get("Message", details["message"])
+        details["operation_name"] = getattr(error, "operation_name", None)
+    return details
+
+def write_recording(path: Union[str, Path],
+                    events: Iterable[Tuple[float, dict]],
+                    request: Optional[dict] = None,
+                    response_metadata: Optional[dict] = None,
+                    response_s: float = 0.0,
+                    end_s: Optional[float] = None,
+                    error: Optional[dict] = None) -> Path:
+    """
+    Write a recording of an invoke_agent response
+    Args:
+        path (Union[str, Path]): File of the recording, conventionally ending with RECORDING_SUFFIX
+        events (Iterable[Tuple[float, dict]]): Stream events with their offsets in seconds from the invoke_agent call
+        request (dict, optional): Parameters of the invoke_agent call
+        response_metadata (dict, optional): ResponseMetadata of the invoke_agent response
+        response_s (float): Time invoke_agent took to return
+        end_s (float, optional): Offset of the end of the stream, defaults to the offset of the last event
+        error (dict, optional): Error raised by the stream after the last event
+    Returns:
+        Path: The path of the recording
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    header = {
+        "format": RECORDING_FORMAT,
+        "version": RECORDING_VERSION,
+        "recorded_at": time.time(),
+        "request": {k: v for k, v in (request or {}).items() if k in _RECORDED_REQUEST_FIELDS},
+        "response_metadata": encode_event(response_metadata or {"HTTPStatusCode": 200, "RetryAttempts": 0}),
+        "response_s": round(response_s, 6)
+    }
+    last_offset = response_s
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps(header, separators=(",", ":")) + "\n")
+        for offset, event in events:
+            last_offset = offset
+            f.write(json.dumps({"t": round(offset, 6), "event": encode_event(event)}, separators=(",", ":")) + "\n")
+        end = {"t": round(last_offset if end_s is None else end_s, 6), "end": True}
+        if error is not None:
+            end["error"] = error
+        f.write(json.dumps(end, separators=(",", ":")) + "\n")
+    return path
+
+class Recording:
+    """
+    Recording loaded in memory, with its stream events decoded
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("format") != RECORDING_FORMAT:
+                raise ValueError(f"{self.path} is not a recording of an invoke_agent response")
+            lines = [json.loads(line) for line in f if line.strip()]
+        self.request = header.get("request", {})
+        self.response_metadata = decode_event(header.get("response_metadata", {}))
+        self.response_s = header.get("response_s", 0.0)
+        self.events: List[Tuple[float, dict]] = [(line["t"], decode_event(line["event"])) for line in lines
+                                                 if "event" in line]
+        end = lines[-1] if lines and lines[-1].get("end") else {}
+        self.end_s = end.get("t", self.events[-1][0] if self.events else self.response_s)
+        self.error = end.get("error")
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+class _RecordingStream:
+    """Iterates over an EventStream and writes the recording when the stream ends"""
+
+    def __init__(self, stream: Iterable[dict], started_at: float, path: Path, request: dict,
+                 response_metadata: dict, response_s: float):
+        self._stream = stream
+        self._started_at = started_at
+        self.path = path
+        self._request = request
+        self._response_metadata = response_metadata
+        self._response_s = response_s
+
+    def __iter__(self) -> Iterator[dict]:
+        events = []
+        error = None
+        try:
+            for event in self._stream:
+                events.append((time.perf_counter() - self._started_at, event))
+                yield event
+        except Exception as e:
+            error = _error_details(e)
+            raise
+        finally:
+            write_recording(self.path, events, self._request, self._response_metadata, self._response_s,
+                            time.perf_counter() - self._started_at, error)
+
+class RecordingClient:
+    """
+    Wrapper of the bedrock agent runtime client that records the EventStream of every
+    invoke_agent response to a file in directory. The other methods are passed through.
+    """
+    def __init__(self, client, directory: Union[str, Path] = "recordings"):
+        self._client = client
+        self.directory = Path(directory)
+        self.recordings: List[Path] = []
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def invoke_agent(self, **kwargs) -> dict:
+        started_at = time.perf_counter()
+        response = self._client.invoke_agent(**kwargs)
+        response_s = time.perf_counter() - started_at
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = self.directory / f"{timestamp}_{kwargs.get('sessionId', 'session')}_{uuid.uuid4().hex[:8]}{RECORDING_SUFFIX}"
+        with self._lock:
+            self.recordings.append(path)
+        return {**response, "completion": _RecordingStream(response["completion"], started_at, path, kwargs,
+                                                           response["ResponseMetadata"], response_s)}
+
+class ReplayClient:
+    """
+    Stand-in of the bedrock agent runtime client that answers invoke_agent calls with
+    recorded streams. A call is answered with the next recording of the same input text if
+    there is one, and with the next recording otherwise. In 'realtime' mode the events are
+    yielded at their recorded offsets divided by speed, in 'fast' mode as fast as possible.
+    """
+    def __init__(self, recordings: Union[str, Path, List[Union[str, Path, Recording]]],
+                 mode: str = "fast", speed: float = 1.0):
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"mode must be one of {REPLAY_MODES}")
+        if isinstance(recordings, (str, Path)):
+            recordings = sorted(Path(recordings).glob(f"*{RECORDING_SUFFIX}")) \
+                if Path(recordings).is_dir() else [recordings]
+        self.recordings: List[Recording] = [r if isinstance(r, Recording) else Recording(r) for r in recordings]
+        if not self.recordings:
+            raise ValueError("No recordings to replay")
+        self.mode = mode
+        self.speed = speed
+        self.calls = 0
+        self._next_by_input = {}
+        self._lock = threading.Lock()
+
+    def _select(self, input_text: Optional[str]) -> Recording:
+        with self._lock:
+            matches = [r for r in self.recordings if r.request.get("inputText") == input_text] or self.recordings
+            i = self._next_by_input.get(input_text, 0)
+            self._next_by_input[input_text] = i + 1
+            self.calls += 1
+            return matches[i % len(matches)]
+
+    def _sleep_until(self, started_at: float, offset: float) -> None:
+        if self.mode == "realtime":
+            remaining = started_at + offset / self.speed - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _stream(self, recording: Recording, started_at: float) -> Iterator[dict]:
+        for offset, event in recording.events:
+            self._sleep_until(started_at, offset)
+            yield event
+        if recording.error is not None:
+            self._sleep_until(started_at, recording.end_s)
+            if recording.error.get("code"):
+                from botocore.exceptions import ClientError
+                raise ClientError({"Error": {"Code": recording.error["code"], "Message": recording.error["message"]}},
+                                  recording.error.get("operation_name") or "InvokeAgent")
+            raise RuntimeError(f"{recording.error['type']}: {recording.error['message']}")
+
+    def invoke_agent(self, **kwargs) -> dict:
+        started_at = time.perf_counter()
+        recording = self._select(kwargs.get("inputText"))
+        self._sleep_until(started_at, recording.response_s)
+        metadata = {**recording.response_metadata, "RequestId": str(uuid.uuid4())}
+        return {
+            "ResponseMetadata": metadata,
+            "contentType": "application/json",
+            "sessionId": kwargs.get("sessionId"),
+            "completion": self._stream(recording, started_at)
+        }
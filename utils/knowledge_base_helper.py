@@ -25,10 +25,13 @@ import json
 import boto3
 import time
 from botocore.exceptions import ClientError
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth, RequestError
+from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth, RequestError, AuthorizationException
 import pprint
 from retrying import retry
 import random
+from utils.resource_resolver import ResourceResolver, KNOWLEDGE_BASES, DATA_SOURCES
+from utils.waiters import (WaitCondition, wait_all, wait_until, retry_until_ready, is_settled, is_failed,
+                           DEFAULT_DEADLINE_S)
 
 valid_embedding_models = [
     "cohere.embed-multilingual-v3", "cohere.embed-english-v3", "amazon.titan-embed-text-v1",
@@ -36,6 +39,11 @@ valid_embedding_models = [
 ]
 pp = pprint.PrettyPrinter(indent=2)
 
+# Prefix of the SSM parameters holding the ingestion generation of each knowledge base.
+# Every completed ingestion job overwrites the parameter, which bumps its version, and the
+# knowledge base lambdas invalidate their retrieval cache when that version changes.
+KB_GENERATION_PARAMETER_PREFIX = "/bedrock-kb"
+
 
 def interactive_sleep(seconds: int):
     """
@@ -59,9 +67,12 @@ class KnowledgeBasesForAmazonBedrock:
         - Deletion of all resources created
     """
 
-    def __init__(self, suffix=None):
+    def __init__(self, suffix=None, resolver: ResourceResolver = None):
         """
         Class initializer
+        Args:
+            resolver (ResourceResolver): cached resolver of the knowledge base and data source names to their IDs,
+            see utils/resource_resolver.py, which can be shared with AgentsForAmazonBedrock. Defaults to a new resolver
         """
         boto3_session = boto3.session.Session()
         self.region_name = "us-east-1" if boto3_session.region_name is None else boto3_session.region_name
@@ -71,11 +82,13 @@ class KnowledgeBasesForAmazonBedrock:
         self.identity = boto3.client('sts',region_name=self.region_name).get_caller_identity()['Arn']
         self.aoss_client = boto3_session.client('opensearchserverless',region_name=self.region_name)
         self.s3_client = boto3.client('s3',region_name=self.region_name)
+        self.ssm_client = boto3.client('ssm', region_name=self.region_name)
         self.bedrock_agent_client = boto3.client('bedrock-agent',region_name=self.region_name)
         self.bedrock_agent_client = boto3.client(
             'bedrock-agent',
             region_name=self.region_name
         )
+        self.resolver = resolver or ResourceResolver(self.bedrock_agent_client)
         credentials = boto3.Session().get_credentials()
         self.awsauth = AWSV4SignerAuth(credentials, self.region_name, 'aoss')
         self.oss_client = None
@@ -100,20 +113,10 @@ class KnowledgeBasesForAmazonBedrock:
             kb_id: str - Knowledge base id
             ds_id: str - Data Source id
         """
-        kb_id = None
         ds_id = None
-        kbs_available = self.bedrock_agent_client.list_knowledge_bases(
-            maxResults=100,
-        )
-        for kb in kbs_available["knowledgeBaseSummaries"]:
-            if kb_name == kb["name"]:
-                kb_id = kb["knowledgeBaseId"]
+        kb_id = self.resolver.resolve(KNOWLEDGE_BASES, kb_name)
         if kb_id is not None:
-            ds_available = self.bedrock_agent_client.list_data_sources(
-                knowledgeBaseId=kb_id,
-                maxResults=100,
-            )
-            for ds in ds_available["dataSourceSummaries"]:
+            for ds in self.resolver.index(DATA_SOURCES, kb_id).values():
                 if kb_id == ds["knowledgeBaseId"]:
                     ds_id = ds["dataSourceId"]
             print(f"Knowledge Base {kb_name} already exists.")
@@ -178,9 +181,9 @@ class KnowledgeBasesForAmazonBedrock:
                 collection_arn, index_name, data_bucket_name, embedding_model,
                 kb_name, kb_description, bedrock_kb_execution_role
             )
-            interactive_sleep(60)
-            print("========================================================================================")
             kb_id = knowledge_base['knowledgeBaseId']
+            self.wait_knowledge_bases([kb_id])
+            print("========================================================================================")
             ds_id = data_source["dataSourceId"]
         return kb_id, ds_id
 
@@ -499,23 +502,20 @@ class KnowledgeBasesForAmazonBedrock:
         print(host)
         # wait for collection creation
         # This can take couple of minutes to finish
-        response = self.aoss_client.batch_get_collection(names=[vector_store_name])
-        # Periodically check collection status
-        while (response['collectionDetails'][0]['status']) == 'CREATING':
-            print('Creating collection...')
-            interactive_sleep(30)
-            response = self.aoss_client.batch_get_collection(names=[vector_store_name])
+        wait_until(
+            f"collection {vector_store_name}",
+            lambda: self.aoss_client.batch_get_collection(names=[vector_store_name])['collectionDetails'][0]['status'],
+            is_settled, is_failed, verbose=True
+        )
         print('\nCollection successfully created:')
-        pp.pprint(response["collectionDetails"])
+        pp.pprint(self.aoss_client.batch_get_collection(names=[vector_store_name])["collectionDetails"])
         # create opensearch serverless access policy and attach it to Bedrock execution role
         try:
-            created = self.create_oss_policy_attach_bedrock_execution_role(
+            # It can take up to a minute for data access rules to be enforced, create_vector_index
+            # retries the index creation until they are
+            self.create_oss_policy_attach_bedrock_execution_role(
                 collection_id, oss_policy_name, bedrock_kb_execution_role
             )
-            if created:
-                # It can take up to a minute for data access rules to be enforced
-                print("Sleeping for a minute to ensure data access rules have been enforced")
-                interactive_sleep(60)
             return host, collection, collection_id, collection_arn
         except Exception as e:
             print("Policy already exists")
@@ -554,14 +554,18 @@ class KnowledgeBasesForAmazonBedrock:
             }
         }
 
-        # Create index
+        # Create index, retried with backoff while the data access rules of the collection are not enforced
         try:
-            response = self.oss_client.indices.create(index=index_name, body=json.dumps(body_json))
+            response = retry_until_ready(
+                f"index {index_name}",
+                lambda: self.oss_client.indices.create(index=index_name, body=json.dumps(body_json)),
+                lambda e: isinstance(e, AuthorizationException)
+            )
             print('\nCreating index:')
             pp.pprint(response)
 
-            # index creation can take up to a minute
-            interactive_sleep(60)
+            # wait until the index is visible, create_knowledge_base retries while it cannot use it
+            wait_until(f"index {index_name}", lambda: self.oss_client.indices.exists(index=index_name), bool)
         except RequestError as e:
             # you can delete the index if its already exists
             # oss_client.indices.delete(index=index_name)
@@ -639,15 +643,11 @@ class KnowledgeBasesForAmazonBedrock:
                 }
             )
             kb = create_kb_response["knowledgeBase"]
+            self.resolver.add(KNOWLEDGE_BASES, kb)
             pp.pprint(kb)
         except self.bedrock_agent_client.exceptions.ConflictException:
-            kbs = self.bedrock_agent_client.list_knowledge_bases(
-                maxResults=100
-            )
-            kb_id = None
-            for kb in kbs['knowledgeBaseSummaries']:
-                if kb['name'] == kb_name:
-                    kb_id = kb['knowledgeBaseId']
+            # the knowledge base was created since the knowledge bases were listed
+            kb_id = self.resolver.resolve(KNOWLEDGE_BASES, kb_name, refresh=True)
             response = self.bedrock_agent_client.get_knowledge_base(knowledgeBaseId=kb_id)
             kb = response['knowledgeBase']
             pp.pprint(kb)
@@ -668,12 +668,11 @@ class KnowledgeBasesForAmazonBedrock:
                 }
             )
             ds = create_ds_response["dataSource"]
+            self.resolver.add(DATA_SOURCES, ds, kb['knowledgeBaseId'])
             pp.pprint(ds)
         except self.bedrock_agent_client.exceptions.ConflictException:
-            ds_id = self.bedrock_agent_client.list_data_sources(
-                knowledgeBaseId=kb['knowledgeBaseId'],
-                maxResults=100
-            )['dataSourceSummaries'][0]['dataSourceId']
+            ds_id = next(iter(self.resolver.index(DATA_SOURCES, kb['knowledgeBaseId'], refresh=True).values()))[
+                'dataSourceId']
             get_ds_response = self.bedrock_agent_client.get_data_source(
                 dataSourceId=ds_id,
                 knowledgeBaseId=kb['knowledgeBaseId']
@@ -682,6 +681,22 @@ class KnowledgeBasesForAmazonBedrock:
             pp.pprint(ds)
         return kb, ds
 
+    def wait_knowledge_bases(self, kb_ids: list, deadline_s: float = DEFAULT_DEADLINE_S) -> dict:
+        """
+        Wait until none of the knowledge bases is in a transitional status (CREATING, UPDATING, DELETING),
+        polling them together with exponential backoff, see utils/waiters.py
+        Args:
+            kb_ids: knowledge base ids
+            deadline_s: longest wait, after which a WaiterTimeout is raised
+
+        Returns:
+            statuses: dict - status of every knowledge base by id
+        """
+        return wait_all([
+            WaitCondition(kb_id, lambda kb_id=kb_id: self.get_kb(kb_id)['knowledgeBase']['status'], is_settled, is_failed)
+            for kb_id in dict.fromkeys(kb_ids)
+        ], deadline_s, verbose=True)
+
     def synchronize_data(self, kb_id, ds_id):
         """
         Start an ingestion job to synchronize data from an S3 bucket to the Knowledge Base
@@ -690,28 +705,85 @@ class KnowledgeBasesForAmazonBedrock:
             kb_id: knowledge base id
             ds_id: data source id
         """
-        # ensure that the kb is available
-        i_status = ['CREATING', 'DELETING', 'UPDATING']
-        while self.bedrock_agent_client.get_knowledge_base(knowledgeBaseId=kb_id)['knowledgeBase']['status'] in i_status:
-            time.sleep(10)
-        # Start an ingestion job
-        start_job_response = self.bedrock_agent_client.start_ingestion_job(
-            knowledgeBaseId=kb_id,
-            dataSourceId=ds_id
-        )
-        job = start_job_response["ingestionJob"]
-        pp.pprint(job)
-        # Get job
-        while job['status'] != 'COMPLETE' and job['status'] != 'FAILED':
-            get_job_response = self.bedrock_agent_client.get_ingestion_job(
+        return self.synchronize_data_sources([(kb_id, ds_id)])[0]
+
+    def synchronize_data_sources(self, kb_ds_ids: list, deadline_s: float = DEFAULT_DEADLINE_S) -> list:
+        """
+        Start the ingestion jobs of several data sources at once, for example of the home network and
+        doorbell knowledge bases, and wait for all of them to be completed
+        Args:
+            kb_ds_ids: (knowledge base id, data source id) of every data source
+            deadline_s: longest wait of the knowledge bases and of the ingestion jobs
+
+        Returns:
+            jobs: list - last state of the ingestion job of every data source
+        """
+        # ensure that the kbs are available
+        self.wait_knowledge_bases([kb_id for kb_id, _ in kb_ds_ids], deadline_s)
+        # Start the ingestion jobs
+        jobs = {}
+        for kb_id, ds_id in kb_ds_ids:
+            start_job_response = self.bedrock_agent_client.start_ingestion_job(
+                knowledgeBaseId=kb_id,
+                dataSourceId=ds_id
+            )
+            jobs[(kb_id, ds_id)] = start_job_response["ingestionJob"]
+            pp.pprint(jobs[(kb_id, ds_id)])
+
+        def get_job(kb_id: str, ds_id: str) -> str:
+            jobs[(kb_id, ds_id)] = self.bedrock_agent_client.get_ingestion_job(
                 knowledgeBaseId=kb_id,
                 dataSourceId=ds_id,
-                ingestionJobId=job["ingestionJobId"]
+                ingestionJobId=jobs[(kb_id, ds_id)]["ingestionJobId"]
+            )["ingestionJob"]
+            return jobs[(kb_id, ds_id)]['status']
+
+        # Get jobs
+        wait_all([
+            WaitCondition(f"ingestion job of {kb_id}/{ds_id}", lambda kb_id=kb_id, ds_id=ds_id: get_job(kb_id, ds_id),
+                          lambda status: status in ('COMPLETE', 'FAILED', 'STOPPED'))
+            for kb_id, ds_id in kb_ds_ids
+        ], deadline_s)
+        for (kb_id, ds_id), job in jobs.items():
+            pp.pprint(job)
+            if job['status'] == 'COMPLETE':
+                generation = self.bump_ingestion_generation(kb_id, job["ingestionJobId"])
+                print(f"Knowledge Base {kb_id} is now at ingestion generation {generation}")
+        return [jobs[(kb_id, ds_id)] for kb_id, ds_id in kb_ds_ids]
+
+    def bump_ingestion_generation(self, kb_id: str, ingestion_job_id: str) -> int:
+        """
+        Record a completed ingestion job by overwriting the generation parameter of the knowledge base,
+        which invalidates the entries cached by the knowledge base lambdas
+        Args:
+            kb_id: knowledge base id
+            ingestion_job_id: id of the completed ingestion job
+
+        Returns:
+            generation: int - new version of the generation parameter
+        """
+        response = self.ssm_client.put_parameter(
+            Name=f"{KB_GENERATION_PARAMETER_PREFIX}/{kb_id}/ingestion-generation",
+            Description=f"Last completed ingestion job of the knowledge base {kb_id}",
+            Value=ingestion_job_id,
+            Type='String',
+            Overwrite=True
+        )
+        return response['Version']
+
+    def get_ingestion_generation(self, kb_id: str) -> int:
+        """
+        Get the ingestion generation of the knowledge base, 0 if no ingestion job was recorded
+        Args:
+            kb_id: knowledge base id
+        """
+        try:
+            response = self.ssm_client.get_parameter(
+                Name=f"{KB_GENERATION_PARAMETER_PREFIX}/{kb_id}/ingestion-generation"
             )
-            job = get_job_response["ingestionJob"]
-            interactive_sleep(5)
-        pp.pprint(job)
-        #interactive_sleep(40)
+            return response['Parameter']['Version']
+        except self.ssm_client.exceptions.ParameterNotFound:
+            return 0
 
     def get_kb(self, kb_id):
         """
@@ -735,14 +807,8 @@ class KnowledgeBasesForAmazonBedrock:
             delete_iam_roles_and_policies (bool): boolean to indicate if IAM roles and Policies should also be deleted
             delete_aoss: boolean to indicate if amazon opensearch serverless resources should also be deleted
         """
-        kbs_available = self.bedrock_agent_client.list_knowledge_bases(
-            maxResults=100,
-        )
-        kb_id = None
         ds_id = None
-        for kb in kbs_available["knowledgeBaseSummaries"]:
-            if kb_name == kb["name"]:
-                kb_id = kb["knowledgeBaseId"]
+        kb_id = self.resolver.resolve(KNOWLEDGE_BASES, kb_name)
         kb_details = self.bedrock_agent_client.get_knowledge_base(
             knowledgeBaseId=kb_id
         )
@@ -779,11 +845,7 @@ class KnowledgeBasesForAmazonBedrock:
             if dp['name'].startswith(kb_name):
                 access_policy_name = dp['name']
 
-        ds_available = self.bedrock_agent_client.list_data_sources(
-            knowledgeBaseId=kb_id,
-            maxResults=100,
-        )
-        for ds in ds_available["dataSourceSummaries"]:
+        for ds in self.resolver.index(DATA_SOURCES, kb_id).values():
             if kb_id == ds["knowledgeBaseId"]:
                 ds_id = ds["dataSourceId"]
         ds_details = self.bedrock_agent_client.get_data_source(
@@ -804,6 +866,8 @@ class KnowledgeBasesForAmazonBedrock:
             self.bedrock_agent_client.delete_knowledge_base(
                 knowledgeBaseId=kb_id
             )
+            self.resolver.remove(KNOWLEDGE_BASES, kb_name)
+            self.resolver.invalidate(DATA_SOURCES, kb_id)
             print("Knowledge Base deleted successfully!")
         except Exception as e:
             print(e)
@@ -0,0 +1,109 @@
+# This file contains the content-hashed container images of the action group lambda functions
+# built by AgentsForAmazonBedrock.create_lambda. The image tag is a hash of everything that goes
+# into the image (the lambda source, the files copied next to it, the libraries, the base image,
+# the platform and the Dockerfile template), so that a registry that already holds the tag
+# already holds the image, and a deploy with no change skips the docker login, build and push
+# and leaves the function on its image. The Dockerfile has two stages: the libraries are
+# installed in a layer that only depends on the requirements, so that a code change does not
+# install them again, and the libraries and the code are compiled to .pyc files, which the
+# read-only task root of the function cannot cache at run time, so that cold starts do not
+# compile them.
+#
+#   tag = image_tag([source_code_file, "admission_control.py"], ["requests"], LAMBDA_BASE_IMAGE, "linux/amd64")
+#   if not EcrImageRegistry(boto3.client("ecr")).has_image(repo_name, tag):
+#       ... docker build and push f"{repo_uri}:{tag}"
+import os
+import hashlib
+from pathlib import Path
+from typing import List, Optional
+from botocore.exceptions import ClientError
+
+LAMBDA_BASE_IMAGE: str = "public.ecr.aws/lambda/python:3.13.2025.01.07.15"
+# Part of every tag, to change when the Dockerfile template changes so that all the images are rebuilt
+DOCKERFILE_VERSION: str = "2"
+# Hex characters of the sha256 kept in the tag
+IMAGE_TAG_LENGTH: int = 16
+
+def requirements(libraries: Optional[List[str]]) -> str:
+    """requirements.txt of the libraries, sorted so that their order does not change the image"""
+    return "".join(f"{library}\n" for library in sorted(set(libraries or [])))
+
+def image_tag(files: List[str], libraries: Optional[List[str]], base_image: str, platform: str) -> str:
+    """
+    Tag of the image built from the files, libraries, base image and platform
+    Args:
+        files (List[str]): The files copied into the image, the lambda source first
+        libraries (List[str], optional): The libraries installed in the image
+        base_image (str): The base image of both stages
+        platform (str): The platform of the image, for example linux/amd64
+    Returns:
+        str: The first IMAGE_TAG_LENGTH hex characters of the sha256 of all of them
+    """
+    digest = hashlib.sha256()
+    for part in (DOCKERFILE_VERSION, base_image, platform, requirements(libraries)):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    for file in files:
+        # the name in the image matters, the directory the file is copied from does not
+        digest.update(Path(file).name.encode())
+        digest.update(b"\0")
+        digest.update(Path(file).read_bytes())
+        digest.update(b"\0")
+    return digest.hexdigest()[:IMAGE_TAG_LENGTH]
+
+def dockerfile(source_code_name: str, extra_files: List[str], base_image: str = LAMBDA_BASE_IMAGE) -> str:
+    """
+    Multi-stage Dockerfile of the lambda function, to build with requirements.txt, the lambda
+    source and the extra files in the build context
+    """
+    copies = "\n".join(f"COPY {name} /build/code/{name}" for name in extra_files)
+    return f"""FROM {base_image} AS build
+COPY requirements.txt /build/requirements.txt
+RUN mkdir -p /build/libraries && \\
+    if [ -s /build/requirements.txt ]; then \\
+        pip install --no-cache-dir --target /build/libraries -r /build/requirements.txt; \\
+    fi && \\
+    python -m compileall -q --invalidation-mode unchecked-hash /build/libraries
+COPY {source_code_name} /build/code/app.py
+{copies}
+RUN python -m compileall -q --invalidation-mode unchecked-hash /build/code
+
+FROM {base_image}
+COPY --from=build /build/libraries ${{LAMBDA_TASK_ROOT}}
+COPY --from=build /build/code ${{LAMBDA_TASK_ROOT}}
+CMD ["app.lambda_handler"]
+"""
+
+class EcrImageRegistry:
+    """The image tags of the ECR repositories of the account"""
+
+    def __init__(self, ecr_client):
+        self._ecr_client = ecr_client
+
+    def has_image(self, repo_name: str, tag: str) -> bool:
+        try:
+            self._ecr_client.describe_images(repositoryName=repo_name, imageIds=[{"imageTag": tag}])
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("ImageNotFoundException", "RepositoryNotFoundException"):
+                return False
+            raise
+
+    def add_image(self, repo_name: str, tag: str) -> None:
+        """Nothing to record, the pushed image is in the repository"""
+
+class LocalImageRegistry:
+    """
+    Stand-in of the registry that records the tags of the built images as empty files under
+    root_dir, for example to build the images without pushing them or in benchmarks
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = Path(root_dir)
+
+    def has_image(self, repo_name: str, tag: str) -> bool:
+        return (self.root_dir / repo_name / tag).exists()
+
+    def add_image(self, repo_name: str, tag: str) -> None:
+        os.makedirs(self.root_dir / repo_name, exist_ok=True)
+        (self.root_dir / repo_name / tag).touch()
@@ -0,0 +1,139 @@
+# This file contains the zip deployment path of the action group lambda functions created by
+# AgentsForAmazonBedrock.create_lambda, next to the container images of utils/lambda_images.py.
+# Zip functions start faster than images and need no docker or ECR, so a function is deployed as
+# a zip of its code with its libraries in a lambda layer, unless the libraries are too large for a
+# layer or have no wheels for the platform, in which case it is deployed as an image. The layer is
+# built once per library set: pip installs pre-built wheels of the platform and python version of
+# the runtime into a local cache directory named after the hash of the library set, and the
+# published layer version carries the same hash, so that the functions with the same libraries
+# (the home network and doorbell lambdas) share one layer.
+#
+#   package_type, layer_dir = choose_package_type(["requests"], "linux/amd64", "python3.12")
+#   if package_type == ZIP: ... publish zip_directory(layer_dir) once, create the function with function_zip(...)
+import io
+import os
+import sys
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import compileall
+import py_compile
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+ZIP: str = "Zip"
+IMAGE: str = "Image"
+# Largest unpacked layer, Lambda allows 250 MB for the code of a zip function and its layers
+LAYER_MAX_UNPACKED_BYTES: int = 200 * 1024 * 1024
+# Largest zip uploaded with the create and publish calls, larger ones are deployed as images
+ZIP_UPLOAD_MAX_BYTES: int = 50 * 1024 * 1024
+DEFAULT_LAYER_CACHE_DIR: str = os.path.join(os.path.expanduser("~"), ".cache", "lambda-layers")
+# Directories of the function code and of the layer libraries in the execution environment
+FUNCTION_CODE_DIR: str = "/var/task"
+LAYER_PYTHON_DIR: str = "/opt/python"
+# Wheel platform tag and Lambda architecture of the docker platforms of create_lambda
+PLATFORMS = {
+    "linux/amd64": ("manylinux2014_x86_64", "x86_64"),
+    "linux/arm64": ("manylinux2014_aarch64", "arm64"),
+}
+
+def library_set_hash(libraries: List[str], platform: str, runtime: str) -> str:
+    """Hash of a library set, the same for the same libraries in any order"""
+    key = "\n".join([platform, runtime] + sorted(set(libraries)))
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def _python_version(runtime: str) -> str:
+    """'3.12' for the python3.12 runtime"""
+    return runtime.replace("python", "")
+
+def precompile(path: Path, runtime: str, ddir: str) -> None:
+    """
+    Compile the .py files under path to .pyc files, which the read-only code directories of a
+    function cannot cache at run time. Only done when the local python is the one of the runtime,
+    as a .pyc file is specific to a python version. The .pyc files name their sources under ddir,
+    the directory of the files in the execution environment, and not under the local path, so
+    that the same sources give the same .pyc files wherever they are compiled.
+    """
+    if f"{sys.version_info.major}.{sys.version_info.minor}" == _python_version(runtime):
+        compileall.compile_dir(str(path), ddir=ddir, quiet=1,
+                               invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+
+def build_library_layer(libraries: List[str], platform: str, runtime: str,
+                        cache_dir: str = DEFAULT_LAYER_CACHE_DIR) -> Path:
+    """
+    Install the wheels of the libraries for the platform and runtime into a layer directory, or
+    return the one already built for the library set
+    Returns:
+        Path: The layer directory, with the libraries under python/ as Lambda expects them
+    Raises:
+        subprocess.CalledProcessError: If a library has no wheel for the platform and python version
+    """
+    layer_dir = Path(cache_dir) / library_set_hash(libraries, platform, runtime)
+    if (layer_dir / "python").is_dir():
+        return layer_dir
+    build_dir = Path(f"{layer_dir}.build")
+    shutil.rmtree(build_dir, ignore_errors=True)
+    subprocess.run([sys.executable, "-m", "pip", "install", "--quiet", "--no-compile", "--disable-pip-version-check",
+                    "--target", str(build_dir / "python"), "--platform", PLATFORMS[platform][0],
+                    "--implementation", "cp", "--python-version", _python_version(runtime),
+                    "--only-binary=:all:", *sorted(set(libraries))], check=True)
+    precompile(build_dir / "python", runtime, LAYER_PYTHON_DIR)
+    # the build directory only takes the name of the layer once complete, so that an interrupted build is not reused
+    os.replace(build_dir, layer_dir)
+    return layer_dir
+
+def directory_size(path: Path) -> int:
+    """Bytes of the files under path, as unpacked by Lambda"""
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+def zip_directory(path: Path) -> bytes:
+    """
+    Zip of the files under path, with the paths relative to it. The entries have a fixed date, so
+    that the same files give the same zip and the same CodeSha256 of the function.
+    """
+    s = io.BytesIO()
+    with zipfile.ZipFile(s, "w", zipfile.ZIP_DEFLATED) as z:
+        for file in sorted(Path(path).rglob("*")):
+            if file.is_file():
+                info = zipfile.ZipInfo(file.relative_to(path).as_posix(), date_time=(1980, 1, 1, 0, 0, 0))
+                info.external_attr = (0o755 if os.access(file, os.X_OK) else 0o644) << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                z.writestr(info, file.read_bytes())
+    return s.getvalue()
+
+def function_zip(source_code_file: str, extra_files: List[str], runtime: str) -> bytes:
+    """
+    Zip of the code of a function: the lambda source as app.py, like in the images, and the
+    extra files next to it, with their .pyc files when the local python is the one of the runtime
+    """
+    with tempfile.TemporaryDirectory() as code_dir:
+        shutil.copy(source_code_file, Path(code_dir) / "app.py")
+        for extra_file in extra_files:
+            shutil.copy(extra_file, Path(code_dir) / Path(extra_file).name)
+        precompile(Path(code_dir), runtime, FUNCTION_CODE_DIR)
+        return zip_directory(Path(code_dir))
+
+def choose_package_type(libraries: Optional[List[str]], platform: str, runtime: str,
+                        cache_dir: str = DEFAULT_LAYER_CACHE_DIR) -> Tuple[str, Optional[Path]]:
+    """
+    Choose between a zip function, with a layer of its libraries if it has some, and an image
+    Returns:
+        Tuple[str, Optional[Path]]: ZIP and the layer directory (None without libraries), or IMAGE
+            and None when the libraries are larger than a layer or have no wheels for the platform
+    """
+    if not libraries:
+        return ZIP, None
+    try:
+        layer_dir = build_library_layer(libraries, platform, runtime, cache_dir)
+    except subprocess.CalledProcessError:
+        print(f"No wheels of {libraries} for {platform} and {runtime}, deploying as an image")
+        return IMAGE, None
+    size = directory_size(layer_dir)
+    # the zip is only larger than the upload limit if the unpacked files are
+    if size > LAYER_MAX_UNPACKED_BYTES or (size > ZIP_UPLOAD_MAX_BYTES and
+                                           len(zip_directory(layer_dir)) > ZIP_UPLOAD_MAX_BYTES):
+        print(f"The libraries {libraries} take {size / 1024 ** 2:.0f} MB, deploying as an image")
+        return IMAGE, None
+    return ZIP, layer_dir
@@ -0,0 +1,218 @@
+# This file contains a local vector store that can be used in place of a Bedrock
+# knowledge base. An index is built from the same sources as the knowledge bases
+# (the API specs in the data directory) and stored as a directory containing:
+#   - embeddings.npy: float32 matrix of the normalized chunk embeddings, memory-mapped on load
+#   - chunks.json: text, location and metadata of every chunk
+#   - manifest.json: embedding model, dimensions and sources of the index
+# The LocalRetrieveClient answers retrieve calls in the format of the bedrock agent
+# runtime retrieve API, with a brute-force inner product search over the embeddings,
+# so it can replace the bedrock agent runtime client in `query_knowledge_base`.
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+# set a logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Embedding model of the indexes built without network access. Every term of the text is
+# hashed into one of HASHING_DIMENSIONS buckets, so no model is needed to embed the chunks
+# or the queries. Any Titan text embeddings model id can be used instead.
+HASHING_EMBEDDING_MODEL: str = "hashing"
+HASHING_DIMENSIONS: int = 1024
+TITAN_EMBEDDING_DIMENSIONS: int = 1024
+# Chunking of the sources, approximating the 512 token / 20% overlap chunking
+# strategy of the knowledge bases
+DEFAULT_CHUNK_CHARS: int = 2000
+DEFAULT_OVERLAP_CHARS: int = 400
+EMBEDDINGS_FILE: str = "embeddings.npy"
+CHUNKS_FILE: str = "chunks.json"
+MANIFEST_FILE: str = "manifest.json"
+# Words, camel case parts of identifiers and numbers
+_TERM_PATTERN = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|[0-9]+')
+# Bedrock runtime clients of the Titan embeddings cached per region, so that every embedded
+# query does not create a client
+_bedrock_runtime_clients: Dict[str, object] = {}
+_bedrock_runtime_clients_lock = threading.Lock()
+
+def hashing_embed(texts: List[str], dimensions: int = HASHING_DIMENSIONS) -> np.ndarray:
+    """
+    Embed the texts with signed feature hashing of their terms and sublinear term frequencies
+    Args:
+        texts (List[str]): Texts to embed
+        dimensions (int): Number of dimensions of the embeddings
+    Returns:
+        np.ndarray: float32 matrix of L2 normalized embeddings, one row per text
+    """
+    embeddings = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        counts: Dict[str, int] = {}
+        for term in _TERM_PATTERN.findall(text):
+            term = term.lower()
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            digest = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+            sign = 1.0 if digest & 1 else -1.0
+            embeddings[row, (digest >> 1) % dimensions] += sign * (1.0 + np.log(count))
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1.0, norms)
+
+def get_bedrock_runtime_client(region: str):
+    """
+    Return the cached Bedrock runtime client for the region, creating it on first use
+    """
+    with _bedrock_runtime_clients_lock:
+        client = _bedrock_runtime_clients.get(region)
+        if client is None:
+            import boto3
+            client = boto3.client("bedrock-runtime", region_name=region)
+            _bedrock_runtime_clients[region] = client
+        return client
+
+def titan_embed(texts: List[str], model_id: str, region: str,
+                dimensions: int = TITAN_EMBEDDING_DIMENSIONS) -> np.ndarray:
+    """
+    Embed the texts with a Titan text embeddings model on Bedrock
+    """
+    bedrock_runtime = get_bedrock_runtime_client(region)
+    embeddings = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        body = {"inputText": text}
+        if "v2" in model_id:
+            body.update({"dimensions": dimensions, "normalize": True})
+        response = bedrock_runtime.invoke_model(modelId=model_id, body=json.dumps(body))
+        embeddings[row] = json.loads(response["body"].read())["embedding"]
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1.0, norms)
+
+def embed(texts: List[str], embedding_model: str, dimensions: int, region: Optional[str] = None) -> np.ndarray:
+    """
+    Embed the texts with the embedding model of an index
+    """
+    if embedding_model == HASHING_EMBEDDING_MODEL:
+        return hashing_embed(texts, dimensions)
+    return titan_embed(texts, embedding_model, region, dimensions)
+
+def chunk_text(text: str, chunk_chars: int = DEFAULT_CHUNK_CHARS, overlap_chars: int = DEFAULT_OVERLAP_CHARS) -> List[str]:
+    """
+    Fixed size chunks with overlap
+    """
+    stride = chunk_chars - overlap_chars
+    return [text[i:i + chunk_chars] for i in range(0, max(1, len(text) - overlap_chars), stride)]
+
+def build_index(source_files: List[Union[str, Path]],
+                index_dir: Union[str, Path],
+                index_name: str = "local",
+                embedding_model: str = HASHING_EMBEDDING_MODEL,
+                dimensions: Optional[int] = None,
+                region: Optional[str] = None,
+                chunk_chars: int = DEFAULT_CHUNK_CHARS,
+                overlap_chars: int = DEFAULT_OVERLAP_CHARS) -> dict:
+    """
+    Chunk and embed the source files and write the index to index_dir
+    Args:
+        source_files (List[Union[str, Path]]): Files to index, for example data/home_network_openapi_spec.json
+        index_dir (Union[str, Path]): Directory the index is written to
+        index_name (str): Name of the index, used in the chunk ids like a knowledge base id
+        embedding_model (str): HASHING_EMBEDDING_MODEL or a Titan text embeddings model id
+        dimensions (int, optional): Number of dimensions of the embeddings
+        region (str, optional): AWS region of the embedding model, not used by the hashing model
+        chunk_chars (int): Number of characters per chunk
+        overlap_chars (int): Number of characters shared by consecutive chunks
+    Returns:
+        dict: Manifest of the index
+    """
+    if dimensions is None:
+        dimensions = HASHING_DIMENSIONS if embedding_model == HASHING_EMBEDDING_MODEL else TITAN_EMBEDDING_DIMENSIONS
+    st = time.perf_counter()
+    chunks = []
+    for source_file in source_files:
+        source = Path(source_file)
+        for i, text in enumerate(chunk_text(source.read_text(), chunk_chars, overlap_chars)):
+            chunks.append({
+                "text": text,
+                "location": {"type": "CUSTOM", "customDocumentLocation": {"id": source.name}},
+                "metadata": {
+                    "x-amz-bedrock-kb-source-uri": source.name,
+                    "x-amz-bedrock-kb-chunk-id": f"{index_name}-{source.stem}-{i}",
+                    "x-amz-bedrock-kb-data-source-id": index_name
+                }
+            })
+    embeddings = embed([chunk["text"] for chunk in chunks], embedding_model, dimensions, region)
+    index_path = Path(index_dir)
+    index_path.mkdir(parents=True, exist_ok=True)
+    np.save(index_path / EMBEDDINGS_FILE, embeddings)
+    (index_path / CHUNKS_FILE).write_text(json.dumps(chunks))
+    manifest = {
+        "index_name": index_name,
+        "embedding_model": embedding_model,
+        "dimensions": dimensions,
+        "num_chunks": len(chunks),
+        "sources": [Path(f).name for f in source_files],
+        "chunk_chars": chunk_chars,
+        "overlap_chars": overlap_chars
+    }
+    (index_path / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+    logger.info(f"Built the local index {index_name} with {len(chunks)} chunks in "
+                f"{time.perf_counter() - st:.2f}s at {index_path}")
+    return manifest
+
+class LocalVectorStore:
+    """
+    Index loaded from disk with its embeddings memory-mapped, searched by brute-force inner product
+    """
+    def __init__(self, index_dir: Union[str, Path], region: Optional[str] = None):
+        index_path = Path(index_dir)
+        self.manifest = json.loads((index_path / MANIFEST_FILE).read_text())
+        self.chunks = json.loads((index_path / CHUNKS_FILE).read_text())
+        self.embeddings = np.load(index_path / EMBEDDINGS_FILE, mmap_mode="r")
+        self.region = region
+
+    def search(self, query: str, num_results: int = 5) -> List[dict]:
+        """
+        Return the num_results chunks most similar to the query, by descending score
+        """
+        query_embedding = embed([query], self.manifest["embedding_model"], self.manifest["dimensions"], self.region)[0]
+        scores = self.embeddings @ query_embedding
+        num_results = min(num_results, len(scores))
+        if num_results <= 0:
+            return []
+        top = np.argpartition(-scores, num_results - 1)[:num_results]
+        top = top[np.argsort(-scores[top])]
+        return [{**self.chunks[i], "score": round(float(scores[i]), 6)} for i in top]
+
+class LocalRetrieveClient:
+    """
+    Drop-in replacement of the bedrock agent runtime client for retrieve calls. The knowledge
+    base id of a call is the name of an index directory under root_dir, and every index is
+    loaded on first use.
+    """
+    def __init__(self, root_dir: Union[str, Path], region: Optional[str] = None):
+        self.root_dir = Path(root_dir)
+        self.region = region
+        self._stores: Dict[str, LocalVectorStore] = {}
+
+    def get_store(self, knowledge_base_id: str) -> LocalVectorStore:
+        store = self._stores.get(knowledge_base_id)
+        if store is None:
+            store = LocalVectorStore(self.root_dir / knowledge_base_id, self.region)
+            self._stores[knowledge_base_id] = store
+        return store
+
+    def retrieve(self, knowledgeBaseId: str, retrievalQuery: dict, retrievalConfiguration: dict, **kwargs) -> dict:
+        num_results = retrievalConfiguration.get("vectorSearchConfiguration", {}).get("numberOfResults", 5)
+        results = self.get_store(knowledgeBaseId).search(retrievalQuery["text"], num_results)
+        return {
+            "retrievalResults": [{
+                "content": {"text": chunk["text"], "type": "TEXT"},
+                "location": chunk["location"],
+                "score": chunk["score"],
+                "metadata": chunk["metadata"]
+            } for chunk in results]
+        }
@@ -0,0 +1,140 @@
+# This file contains the exporters of the metrics records built by the MetricsAggregator
+# of utils/agent_events.py for every invocation of an agent. The records can be appended
+# to a JSON lines file, one record per line, or aggregated into counters and histograms
+# written in the Prometheus text format, so that the file can be collected by the textfile
+# collector of the node exporter and used to build latency dashboards.
+#
+#   exporters = [JsonLinesExporter("metrics/invocations.jsonl"),
+#                PrometheusTextfileExporter("metrics/bedrock_agents.prom")]
+#   agents.invoke(input_text, agent_id, metrics_exporters=exporters)
+import os
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+# Upper bounds in seconds of the buckets of the latency histograms
+DEFAULT_LATENCY_BUCKETS: Tuple[float, ...] = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+DEFAULT_METRIC_PREFIX: str = "bedrock_agent"
+
+class MetricsExporter:
+    """Consumer of the metrics records of the invocations"""
+
+    def export(self, record: dict) -> None:
+        raise NotImplementedError
+
+class JsonLinesExporter(MetricsExporter):
+    """Appends every metrics record to a JSON lines file"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, record: dict) -> None:
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + "}"
+
+class PrometheusTextfileExporter(MetricsExporter):
+    """Aggregates the metrics records into counters and histograms and rewrites a file in the
+    Prometheus text format after every record. The file is replaced atomically, so that a
+    collector never reads a partial file. The metrics are labelled by agent and by step,
+    sub-agent or tool, and are kept for the lifetime of the exporter.
+    """
+
+    def __init__(self, path: Union[str, Path], prefix: str = DEFAULT_METRIC_PREFIX,
+                 buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.buckets = tuple(sorted(buckets))
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._histograms: Dict[str, Dict[tuple, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _inc(self, name: str, help_text: str, labels: dict, value: float = 1) -> None:
+        self._help[name] = help_text
+        series = self._counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def _observe(self, name: str, help_text: str, labels: dict, value: float) -> None:
+        self._help[name] = help_text
+        series = self._histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        if key not in series:
+            series[key] = _Histogram(self.buckets)
+        series[key].observe(value)
+
+    def export(self, record: dict) -> None:
+        agent = {"agent_id": record.get("agent_id") or "unknown"}
+        p = self.prefix
+        with self._lock:
+            self._inc(f"{p}_invocations_total", "Invocations of the agent", agent)
+            self._observe(f"{p}_invoke_duration_seconds", "Total duration of the invocations", agent,
+                          record["duration_s"])
+            if record.get("time_to_first_chunk_s") is not None:
+                self._observe(f"{p}_time_to_first_chunk_seconds", "Time from the invocation to the first answer chunk",
+                              agent, record["time_to_first_chunk_s"])
+            for step in record.get("steps", []):
+                step_labels = {**agent, "step": step["step"], "sub_agent": step["sub_agent"]}
+                self._inc(f"{p}_llm_calls_total", "Model invocations", step_labels)
+                self._inc(f"{p}_tokens_total", "Tokens used by the model invocations",
+                          {**step_labels, "direction": "input"}, step["input_tokens"])
+                self._inc(f"{p}_tokens_total", "Tokens used by the model invocations",
+                          {**step_labels, "direction": "output"}, step["output_tokens"])
+                self._observe(f"{p}_step_duration_seconds", "Duration of the routing, orchestration, "
+                              "pre-processing and post-processing steps", step_labels, step["duration_s"])
+            for tool in record.get("tools", []):
+                self._observe(f"{p}_tool_latency_seconds", "Latency of the action group functions",
+                              {**agent, "tool": tool["tool"] or "unknown", "sub_agent": tool["sub_agent"]},
+                              tool["latency_s"])
+            for collab in record.get("collaborators", []):
+                self._observe(f"{p}_collaborator_latency_seconds", "Latency of the sub-agent collaborators",
+                              {**agent, "collaborator": collab["name"]}, collab["latency_s"])
+            self._write(self.render())
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text format"""
+        lines: List[str] = []
+        for name, series in self._counters.items():
+            lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} counter"]
+            lines += [f"{name}{_format_labels(key)} {value:g}" for key, value in series.items()]
+        for name, series in self._histograms.items():
+            lines += [f"# HELP {name} {self._help[name]}", f"# TYPE {name} histogram"]
+            for key, histogram in series.items():
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def _write(self, text: str) -> None:
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(text)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,125 @@
+# This file contains a cached resolver of the names of Agents for Amazon Bedrock resources
+# (agents, agent aliases, knowledge bases and data sources) to their IDs, shared by
+# AgentsForAmazonBedrock and KnowledgeBasesForAmazonBedrock. The resources of a kind are loaded
+# with one paginated list call into a dict from name to summary, which answers the lookups until
+# its TTL expires. The helpers add the resources they create to the loaded dicts and remove the
+# ones they delete, so that deploying several agents lists each kind of resource once instead of
+# once per lookup.
+#
+#   resolver = ResourceResolver(boto3.client("bedrock-agent"))
+#   agent_id = resolver.resolve(AGENTS, "home-network-assistant")
+#   alias_id = resolver.resolve(AGENT_ALIASES, "multi-agent", parent_id=supervisor_id)
+import time
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+AGENTS: str = "agents"
+AGENT_ALIASES: str = "agent_aliases"
+KNOWLEDGE_BASES: str = "knowledge_bases"
+DATA_SOURCES: str = "data_sources"
+# Seconds a loaded list of resources answers the lookups before it is listed again
+DEFAULT_RESOLVER_TTL_S: float = 300.0
+# Largest page of the list operations of the bedrock agent client
+LIST_PAGE_SIZE: int = 100
+
+# List operation, key of the summaries in its response, name and ID keys of a summary, and
+# parameter of the parent resource (the agent of an alias, the knowledge base of a data source)
+_RESOURCE_KINDS: Dict[str, Tuple[str, str, str, str, Optional[str]]] = {
+    AGENTS: ("list_agents", "agentSummaries", "agentName", "agentId", None),
+    AGENT_ALIASES: ("list_agent_aliases", "agentAliasSummaries", "agentAliasName", "agentAliasId", "agentId"),
+    KNOWLEDGE_BASES: ("list_knowledge_bases", "knowledgeBaseSummaries", "name", "knowledgeBaseId", None),
+    DATA_SOURCES: ("list_data_sources", "dataSourceSummaries", "name", "dataSourceId", "knowledgeBaseId"),
+}
+
+class ResourceResolver:
+    """
+    Name to ID index of the agents, agent aliases, knowledge bases and data sources of an account
+    and region. The aliases and data sources are indexed per agent and knowledge base (parent_id).
+    The clock can be replaced, for example by a fake clock in tests.
+    """
+
+    def __init__(self, bedrock_agent_client, ttl_s: float = DEFAULT_RESOLVER_TTL_S,
+                 clock: Callable[[], float] = time.monotonic):
+        self._client = bedrock_agent_client
+        self.ttl_s = ttl_s
+        self._clock = clock
+        # (kind, parent_id) -> (time loaded, name -> summary)
+        self._indexes: Dict[Tuple[str, Optional[str]], Tuple[float, Dict[str, dict]]] = {}
+        # held while a list is loaded, so that concurrent lookups wait for one load
+        self._lock = threading.RLock()
+        # number of list calls (pages) made, to check how many lookups hit the loaded lists
+        self.list_calls = 0
+
+    def _list_all(self, kind: str, parent_id: Optional[str]) -> List[dict]:
+        """Summaries of all the pages of the list operation of the kind of resource"""
+        operation, summaries_key, _, _, parent_param = _RESOURCE_KINDS[kind]
+        kwargs = {"maxResults": LIST_PAGE_SIZE}
+        if parent_param is not None:
+            kwargs[parent_param] = parent_id
+        summaries = []
+        while True:
+            response = getattr(self._client, operation)(**kwargs)
+            self.list_calls += 1
+            summaries.extend(response.get(summaries_key, []))
+            if not response.get("nextToken"):
+                return summaries
+            kwargs["nextToken"] = response["nextToken"]
+
+    def index(self, kind: str, parent_id: Optional[str] = None, refresh: bool = False) -> Dict[str, dict]:
+        """
+        Return the summaries of the resources of a kind by name, listed again when refresh is
+        True or when the TTL of the loaded list expired
+        Args:
+            kind (str): AGENTS, AGENT_ALIASES, KNOWLEDGE_BASES or DATA_SOURCES
+            parent_id (str, optional): ID of the agent of the aliases, or of the knowledge base of the data sources
+            refresh (bool): Whether to list the resources even if the loaded list has not expired
+        Returns:
+            Dict[str, dict]: Summary of every resource by name, as returned by the list operation
+        """
+        if _RESOURCE_KINDS[kind][4] is not None and parent_id is None:
+            raise ValueError(f"{kind} are listed per {_RESOURCE_KINDS[kind][4]}, parent_id is required")
+        key = (kind, parent_id)
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is None or refresh or self._clock() - entry[0] >= self.ttl_s:
+                name_key = _RESOURCE_KINDS[kind][2]
+                entry = (self._clock(), {summary[name_key]: summary for summary in self._list_all(kind, parent_id)})
+                self._indexes[key] = entry
+            return entry[1]
+
+    def summary(self, kind: str, name: str, parent_id: Optional[str] = None, refresh: bool = False) -> Optional[dict]:
+        """Return the summary of the named resource, or None if not found"""
+        return self.index(kind, parent_id, refresh).get(name)
+
+    def resolve(self, kind: str, name: str, parent_id: Optional[str] = None, refresh: bool = False) -> Optional[str]:
+        """Return the ID of the named resource, or None if not found"""
+        summary = self.summary(kind, name, parent_id, refresh)
+        return None if summary is None else summary[_RESOURCE_KINDS[kind][3]]
+
+    def add(self, kind: str, resource: dict, parent_id: Optional[str] = None) -> None:
+        """
+        Add a resource created by a helper, for example the 'agent' of a create_agent response,
+        to the loaded list of its kind. Nothing is done if the list is not loaded, as its next
+        load includes the resource.
+        """
+        with self._lock:
+            entry = self._indexes.get((kind, parent_id))
+            if entry is not None:
+                entry[1][resource[_RESOURCE_KINDS[kind][2]]] = resource
+
+    def remove(self, kind: str, name: str, parent_id: Optional[str] = None) -> None:
+        """Remove a resource deleted by a helper from the loaded list of its kind"""
+        with self._lock:
+            entry = self._indexes.get((kind, parent_id))
+            if entry is not None:
+                entry[1].pop(name, None)
+
+    def invalidate(self, kind: Optional[str] = None, parent_id: Optional[str] = None) -> None:
+        """
+        Drop the loaded lists of a kind of resource, only the one of parent_id if given,
+        or all the loaded lists if kind is None
+        """
+        with self._lock:
+            for key in list(self._indexes):
+                if kind is None or (key[0] == kind and (parent_id is None or key[1] == parent_id)):
+                    del self._indexes[key]
@@ -0,0 +1,57 @@
+# This file contains the fusion of the chunks retrieved from several knowledge bases, shared by
+# query_knowledge_bases in utils/utils.py and the knowledge base lambda functions, which get a copy
+# of this file next to their source code (see create_kb_lambda in utils/utils.py). The scores of
+# the knowledge bases are not comparable, so the chunks are merged by reciprocal rank fusion: each
+# chunk scores 1 / (k + rank) in every list it appears in, and the scores are summed.
+#
+#   chunks = reciprocal_rank_fusion({home_network_kb_id: home_network_chunks, doorbell_kb_id: doorbell_chunks})
+#
+# This module only uses the standard library, so that the lambda functions can import it.
+from typing import Dict, List
+
+# Constant of the reciprocal rank fusion. Larger values flatten the difference between the top
+# ranks of the lists
+DEFAULT_RRF_K: int = 60
+
+def normalize_scores(chunks: List[dict]) -> List[float]:
+    """
+    Min-max normalize the scores of the chunks of one knowledge base to [0, 1], so that
+    scores from knowledge bases with different score distributions can be compared
+    """
+    scores = [chunk.get('score', 0) for chunk in chunks]
+    if not scores:
+        return []
+    low, high = min(scores), max(scores)
+    if high == low:
+        return [1.0] * len(scores)
+    return [(score - low) / (high - low) for score in scores]
+
+def reciprocal_rank_fusion(ranked_chunks: Dict[str, List[dict]], k: int = DEFAULT_RRF_K) -> List[dict]:
+    """
+    Merge the ranked chunks of several knowledge bases with reciprocal rank fusion. Every chunk
+    is tagged with the knowledge base it comes from and its normalized score. A chunk returned
+    by several knowledge bases is kept once, with the sum of its reciprocal ranks.
+    Args:
+        ranked_chunks (Dict[str, List[dict]]): Chunks of each knowledge base id, by descending score
+        k (int): Rank constant of the fusion
+    Returns:
+        List[dict]: Fused chunks by descending fused score, ties broken by normalized score
+    """
+    fused: Dict[str, dict] = {}
+    for kb_id, chunks in ranked_chunks.items():
+        for rank, (chunk, normalized_score) in enumerate(zip(chunks, normalize_scores(chunks)), start=1):
+            existing = fused.get(chunk['text'])
+            if existing is None:
+                fused[chunk['text']] = {
+                    **chunk,
+                    'kb_id': kb_id,
+                    'normalized_score': round(normalized_score, 4),
+                    'rrf_score': 1.0 / (k + rank)
+                }
+            else:
+                existing['rrf_score'] += 1.0 / (k + rank)
+                if normalized_score > existing['normalized_score']:
+                    existing['normalized_score'] = round(normalized_score, 4)
+    for chunk in fused.values():
+        chunk['rrf_score'] = round(chunk['rrf_score'], 6)
+    return sorted(fused.values(), key=lambda chunk: (chunk['rrf_score'], chunk['normalized_score']), reverse=True)
@@ -0,0 +1,208 @@
+# This file contains a manager of the sessions of the agents invoked with
+# AgentsForAmazonBedrock. Every conversation gets its own session, created on first use
+# and reused for the following turns of the conversation, so that unrelated calls never
+# share a session and its conversation history. A session idle for longer than the idle
+# session TTL of the agents is replaced by a new one, sessions that are done are ended with
+# an endSession call, and the turns and tokens of every session are tracked to report the
+# growth of the prompt with the conversation history.
+#
+#   sessions = SessionManager(agents)
+#   answer = sessions.invoke("What devices are on my network?", agent_id, key="user-1", enable_trace=True)
+#   answer = sessions.invoke("Which one uses the most bandwidth?", agent_id, key="user-1", enable_trace=True)
+#   print(sessions.report())
+#   sessions.close()
+import time
+import uuid
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Idle session TTL of the agents created by AgentsForAmazonBedrock (idleSessionTTLInSeconds)
+DEFAULT_IDLE_SESSION_TTL_S: int = 1800
+# Margin before the TTL after which a session is no longer reused, so that a turn
+# started just before the TTL does not land in a session expired by the service
+SESSION_TTL_MARGIN_S: int = 60
+# Input text of the turn sent to end a session
+END_SESSION_INPUT_TEXT: str = "Thank you, that is all."
+
+class AgentSession:
+    """A session of an agent with the turns and tokens it used"""
+
+    def __init__(self, agent_id: str, agent_alias_id: str, key: Optional[str] = None,
+                 session_id: Optional[str] = None):
+        self.session_id = session_id or str(uuid.uuid4())
+        self.agent_id = agent_id
+        self.agent_alias_id = agent_alias_id
+        self.key = key
+        self.created_at = time.time()
+        self.last_used_at = self.created_at
+        self.ended = False
+        self.expired = False
+        # input and output tokens and duration of every turn
+        self.turns: List[dict] = []
+
+    def idle_s(self, now: Optional[float] = None) -> float:
+        return (now or time.time()) - self.last_used_at
+
+    def record_turn(self, metrics: Optional[dict]) -> None:
+        """Record a turn from the metrics record of its invocation"""
+        self.last_used_at = time.time()
+        metrics = metrics or {}
+        self.turns.append({
+            "input_tokens": metrics.get("input_tokens", 0),
+            "output_tokens": metrics.get("output_tokens", 0),
+            "llm_calls": metrics.get("llm_calls", 0),
+            "duration_s": metrics.get("duration_s", 0.0)
+        })
+
+    def summary(self) -> dict:
+        """Turns, tokens and token growth of the session. The growth is the mean increase of
+        the input tokens of a turn over the previous turn, mostly due to the conversation
+        history the agent sends to the model.
+        """
+        input_tokens = [turn["input_tokens"] for turn in self.turns]
+        growth = (input_tokens[-1] - input_tokens[0]) / (len(input_tokens) - 1) if len(input_tokens) > 1 else 0.0
+        return {
+            "session_id": self.session_id,
+            "agent_id": self.agent_id,
+            "agent_alias_id": self.agent_alias_id,
+            "key": self.key,
+            "turns": len(self.turns),
+            "input_tokens": sum(input_tokens),
+            "output_tokens": sum(turn["output_tokens"] for turn in self.turns),
+            "input_tokens_by_turn": input_tokens,
+            "input_token_growth_per_turn": round(growth, 1),
+            "duration_s": round(sum(turn["duration_s"] for turn in self.turns), 3),
+            "age_s": round(time.time() - self.created_at, 1),
+            "idle_s": round(self.idle_s(), 1),
+            "ended": self.ended,
+            "expired": self.expired
+        }
+
+class SessionManager:
+    """
+    Creates, reuses and ends the sessions of the agents invoked through an
+    AgentsForAmazonBedrock instance. A session is identified by the agent, its alias and
+    a key of the caller's choosing, for example a user or conversation ID. Turns without
+    a key get a new session that is ended after the turn.
+    """
+    def __init__(self, agents, idle_ttl_s: int = DEFAULT_IDLE_SESSION_TTL_S,
+                 ttl_margin_s: int = SESSION_TTL_MARGIN_S):
+        self._agents = agents
+        self.idle_ttl_s = idle_ttl_s
+        self.ttl_margin_s = ttl_margin_s
+        self._sessions: Dict[Tuple[str, str, str], AgentSession] = {}
+        # every session created by the manager, including the expired and ended ones
+        self._history: List[AgentSession] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _expired(self, session: AgentSession, now: float) -> bool:
+        return session.idle_s(now) >= self.idle_ttl_s - self.ttl_margin_s
+
+    def get_session(self, agent_id: str, agent_alias_id: str = "TSTALIASID", key: Optional[str] = None) -> AgentSession:
+        """
+        Return the live session of the key, or a new session if the key has none, if its
+        session was ended or if it was idle for longer than the idle TTL
+        Args:
+            agent_id (str): The ID of the agent
+            agent_alias_id (str): The alias ID of the agent
+            key (str, optional): Key of the conversation, a new session is created every call if None
+        Returns:
+            AgentSession: The session to invoke the agent with
+        """
+        with self._lock:
+            now = time.time()
+            pool_key = (agent_id, agent_alias_id, key)
+            session = self._sessions.get(pool_key) if key is not None else None
+            if session is not None and self._expired(session, now):
+                session.expired = True
+                self._end(session)
+            if session is None or session.ended:
+                session = AgentSession(agent_id, agent_alias_id, key)
+                self._history.append(session)
+                if key is not None:
+                    self._sessions[pool_key] = session
+            return session
+
+    def invoke(self, input_text: str, agent_id: str, agent_alias_id: str = "TSTALIASID",
+               key: Optional[str] = None, end_session: Optional[bool] = None, **kwargs) -> str:
+        """
+        Invoke the agent in the session of the key with AgentsForAmazonBedrock.invoke and
+        record the turn. The tokens of the turn are only counted when enable_trace is True.
+        Args:
+            input_text (str): The text to be processed by the agent
+            agent_id (str): The ID of the agent
+            agent_alias_id (str): The alias ID of the agent
+            key (str, optional): Key of the conversation. Without a key the session is ended with the turn.
+            end_session (bool, optional): Whether to end the session with the turn
+            **kwargs: Other arguments of AgentsForAmazonBedrock.invoke
+        Returns:
+            str: The answer from the agent
+        """
+        session = self.get_session(agent_id, agent_alias_id, key)
+        end_session = key is None if end_session is None else end_session
+        answer, metrics = self._agents.invoke(input_text, agent_id, agent_alias_id, session_id=session.session_id,
+                                              end_session=end_session, return_metrics=True, **kwargs)
+        with self._lock:
+            session.record_turn(metrics)
+            if end_session:
+                self._end(session)
+        return answer
+
+    def _end(self, session: AgentSession) -> None:
+        session.ended = True
+        if self._sessions.get((session.agent_id, session.agent_alias_id, session.key)) is session:
+            del self._sessions[(session.agent_id, session.agent_alias_id, session.key)]
+
+    def end_session(self, session: AgentSession) -> None:
+        """
+        End a session with an invoke_agent call with endSession, unless it already ended
+        or expired. The agent answers the call, so the call is recorded as a turn.
+        """
+        with self._lock:
+            if session.ended or self._expired(session, time.time()):
+                # a session already ended keeps its expired flag, set when it was ended
+                if not session.ended:
+                    session.expired = True
+                self._end(session)
+                return
+            self._end(session)
+        result = self._agents.invoke_turn(END_SESSION_INPUT_TEXT, session.agent_id, session.agent_alias_id,
+                                          session_id=session.session_id, enable_trace=False, end_session=True)
+        with self._lock:
+            session.record_turn(result.get("metrics"))
+
+    def expire_idle(self) -> List[AgentSession]:
+        """
+        Forget the sessions idle for longer than the idle TTL, which the service already expired
+        Returns:
+            List[AgentSession]: The expired sessions
+        """
+        with self._lock:
+            now = time.time()
+            expired = [s for s in self._sessions.values() if self._expired(s, now)]
+            for session in expired:
+                session.expired = True
+                self._end(session)
+            return expired
+
+    def close(self) -> None:
+        """
+        End every live session
+        """
+        with self._lock:
+            live = list(self._sessions.values())
+        for session in live:
+            self.end_session(session)
+
+    def report(self) -> List[dict]:
+        """
+        Return the summary of every session created by the manager, see AgentSession.summary
+        """
+        with self._lock:
+            return [session.summary() for session in self._history]
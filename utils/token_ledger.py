@@ -0,0 +1,247 @@
+# This file contains a persistent ledger of the tokens and cost of the model invocations
+# seen in the traces of the agents. The TokenLedger is a metrics exporter: every step of the
+# metrics record of an invocation (see MetricsAggregator in utils/agent_events.py) becomes a
+# row with its session, agent or collaborator, step, model, tokens and duration, stored in an
+# indexed SQLite database. Rows are buffered and written in one transaction per batch, so
+# that an invocation does not wait on the disk for each of its model invocations. The query
+# API reports the p50/p95 latency and tokens, and the cost from a configurable price table,
+# by agent, day, model, step or session.
+#
+#   ledger = TokenLedger.from_config(config)
+#   agents.invoke(input_text, agent_id, enable_trace=True, metrics_exporters=[ledger])
+#   for row in ledger.report(by=("day", "agent")):
+#       print(row)
+#   ledger.close()
+import time
+import atexit
+import sqlite3
+import datetime
+import threading
+from pathlib import Path
+from itertools import groupby
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from utils.metrics_exporters import MetricsExporter
+
+DEFAULT_LEDGER_PATH: str = "metrics/token_ledger.sqlite"
+# Rows buffered before they are written, and the longest time a row stays in the buffer
+DEFAULT_BATCH_SIZE: int = 50
+DEFAULT_FLUSH_INTERVAL_S: float = 5.0
+# Prefixes of the cross-region inference profile IDs, removed to look up the price of a model
+_INFERENCE_PROFILE_PREFIXES = ("us.", "eu.", "apac.", "us-gov.")
+# Columns the reports can be grouped by
+REPORT_GROUPS: Dict[str, str] = {"agent": "agent", "day": "day", "model": "model", "step": "step",
+                                 "session": "session_id", "agent_id": "agent_id"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS model_invocations (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    day TEXT NOT NULL,
+    session_id TEXT,
+    agent_id TEXT,
+    agent_alias_id TEXT,
+    agent TEXT NOT NULL,
+    step TEXT NOT NULL,
+    model TEXT,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    duration_s REAL
+);
+CREATE INDEX IF NOT EXISTS idx_model_invocations_day_agent ON model_invocations (day, agent);
+CREATE INDEX IF NOT EXISTS idx_model_invocations_agent ON model_invocations (agent, day);
+CREATE INDEX IF NOT EXISTS idx_model_invocations_session ON model_invocations (session_id);
+CREATE INDEX IF NOT EXISTS idx_model_invocations_model ON model_invocations (model, day);
+"""
+_COLUMNS = ("timestamp", "day", "session_id", "agent_id", "agent_alias_id", "agent", "step", "model",
+            "input_tokens", "output_tokens", "duration_s")
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Percentile q (0-100) of sorted values, interpolated between the closest ranks"""
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+class TokenLedger(MetricsExporter):
+    """
+    SQLite ledger of the model invocations of the agents, written in batches. Pass it in the
+    metrics_exporters of AgentsForAmazonBedrock.invoke, with enable_trace=True so that the
+    trace reports the tokens. The prices are in USD per 1,000 input and output tokens by model
+    ID, for example {"amazon.nova-pro-v1:0": {"input": 0.0008, "output": 0.0032}}.
+    """
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_LEDGER_PATH, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval_s: float = DEFAULT_FLUSH_INTERVAL_S,
+                 prices: Optional[Dict[str, Dict[str, float]]] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.prices = prices or {}
+        self.rows_written = 0
+        self.batches_written = 0
+        self._buffer: List[tuple] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL lets the reports read while an invocation writes
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        # the buffered rows are written when the interpreter exits, for example a notebook
+        # kernel that is shut down without closing the ledger
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "TokenLedger":
+        """
+        Create the ledger from the token_ledger section of config.yaml
+        """
+        ledger_config = (config or {}).get('token_ledger', {}) or {}
+        return cls(ledger_config.get('path', DEFAULT_LEDGER_PATH),
+                   ledger_config.get('batch_size', DEFAULT_BATCH_SIZE),
+                   ledger_config.get('flush_interval_s', DEFAULT_FLUSH_INTERVAL_S),
+                   ledger_config.get('prices'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def export(self, record: dict) -> None:
+        """
+        Buffer a row for every model invocation of the metrics record, and write the buffer
+        when it holds batch_size rows or its oldest row is older than flush_interval_s
+        """
+        timestamp = record.get("timestamp") or time.time()
+        rows = []
+        for step in record.get("steps", []):
+            step_timestamp = timestamp + (step.get("offset_s") or 0.0)
+            rows.append((step_timestamp,
+                         datetime.datetime.fromtimestamp(step_timestamp, datetime.timezone.utc).strftime("%Y-%m-%d"),
+                         record.get("session_id"), record.get("agent_id"), record.get("agent_alias_id"),
+                         step["sub_agent"], step["step"], step.get("model"),
+                         step["input_tokens"], step["output_tokens"], step.get("duration_s")))
+        with self._lock:
+            if not self._buffer:
+                self._last_flush = time.monotonic()
+            self._buffer.extend(rows)
+            if len(self._buffer) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval_s:
+                self._flush()
+
+    def _flush(self) -> None:
+        if self._buffer:
+            with self._connection:
+                self._connection.executemany(
+                    f"INSERT INTO model_invocations ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    self._buffer)
+            self.rows_written += len(self._buffer)
+            self.batches_written += 1
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def flush(self) -> None:
+        """
+        Write the buffered rows
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """
+        Write the buffered rows and close the database
+        """
+        atexit.unregister(self.close)
+        with self._lock:
+            if self._closed:
+                return
+            self._flush()
+            self._connection.close()
+            self._closed = True
+
+    def price(self, model: Optional[str]) -> Optional[Dict[str, float]]:
+        """
+        Return the prices per 1,000 tokens of a model, looked up by its ID and by the ID without
+        the inference profile prefix, or None if the price table does not have the model
+        """
+        if not model:
+            return None
+        if model in self.prices:
+            return self.prices[model]
+        for prefix in _INFERENCE_PROFILE_PREFIXES:
+            if model.startswith(prefix) and model[len(prefix):] in self.prices:
+                return self.prices[model[len(prefix):]]
+        return None
+
+    def cost(self, model: Optional[str], input_tokens: int, output_tokens: int) -> Optional[float]:
+        """
+        Return the cost in USD of the tokens of a model, or None if its price is unknown
+        """
+        price = self.price(model)
+        if price is None:
+            return None
+        return (input_tokens * price.get("input", 0.0) + output_tokens * price.get("output", 0.0)) / 1000
+
+    def report(self, by: Union[str, Sequence[str]] = "agent", since: Optional[str] = None,
+               until: Optional[str] = None, agent_id: Optional[str] = None) -> List[dict]:
+        """
+        Report the model invocations grouped by the given columns
+        Args:
+            by (Union[str, Sequence[str]]): One or more of REPORT_GROUPS: 'agent' (the supervisor or
+                collaborator name), 'day' (UTC), 'model', 'step', 'session' or 'agent_id'
+            since (str, optional): First day of the report, as YYYY-MM-DD
+            until (str, optional): Last day of the report, as YYYY-MM-DD
+            agent_id (str, optional): Report only the invocations of this supervisor or agent ID
+        Returns:
+            List[dict]: A row per group with its model invocations, input and output tokens, p50/p95
+                duration and tokens per model invocation, and cost in USD of the model invocations
+                whose model has a price, the others are counted in unpriced_calls
+        """
+        groups = [by] if isinstance(by, str) else list(by)
+        unknown = [g for g in groups if g not in REPORT_GROUPS]
+        if unknown:
+            raise ValueError(f"Unknown report groups {unknown}, use {list(REPORT_GROUPS)}")
+        columns = [REPORT_GROUPS[g] for g in groups]
+        conditions, parameters = [], []
+        for condition, value in (("day >= ?", since), ("day <= ?", until), ("agent_id = ?", agent_id)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT {', '.join(columns)}, model, input_tokens, output_tokens, duration_s "
+                f"FROM model_invocations {where} ORDER BY {', '.join(columns)}", parameters).fetchall()
+
+        report = []
+        for key, group_rows in groupby(rows, key=lambda row: row[:len(columns)]):
+            group_rows = list(group_rows)
+            durations = sorted(row[-1] for row in group_rows if row[-1] is not None)
+            tokens = sorted(row[-3] + row[-2] for row in group_rows)
+            costs = [self.cost(row[-4], row[-3], row[-2]) for row in group_rows]
+            report.append({
+                **dict(zip(groups, key)),
+                "calls": len(group_rows),
+                "input_tokens": sum(row[-3] for row in group_rows),
+                "output_tokens": sum(row[-2] for row in group_rows),
+                "p50_duration_s": _percentile(durations, 50),
+                "p95_duration_s": _percentile(durations, 95),
+                "p50_tokens": _percentile(tokens, 50),
+                "p95_tokens": _percentile(tokens, 95),
+                "cost_usd": round(sum((c for c in costs if c is not None), 0.0), 6),
+                "unpriced_calls": sum(1 for c in costs if c is None)
+            })
+        return report
+
+    def total_cost(self, since: Optional[str] = None, until: Optional[str] = None) -> Tuple[float, int]:
+        """
+        Return the cost in USD of the priced model invocations between two days, and the number
+        of model invocations without a price
+        """
+        rows = self.report(by="model", since=since, until=until)
+        return round(sum(row["cost_usd"] for row in rows), 6), sum(row["unpriced_calls"] for row in rows)
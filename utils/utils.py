@@ -8,12 +8,15 @@ import time
 import boto3
 import zipfile
 import logging
-import requests
+import functools
 from globals import *
 from io import BytesIO
 from pathlib import Path
-from typing import Union, Dict, Optional
+from typing import Union, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
+from utils.waiters import retry_until_ready, is_role_not_ready
+from utils.retrieval_fusion import DEFAULT_RRF_K, normalize_scores, reciprocal_rank_fusion
 
 # set a logger
 logger = logging.getLogger(__name__)
@@ -22,17 +25,28 @@ logger.setLevel(logging.INFO)
 PYTHON_TIMEOUT: int = 180
 PYTHON_RUNTIME: str = "python3.12"
 
+# Default region of the module level clients when no region is configured
+DEFAULT_REGION: str = "us-east-1"
+
+@functools.lru_cache(maxsize=None)
 def get_aws_region() -> Optional[str]:
-    """Retrieve the AWS region from boto3 session, environment variables, or EC2 metadata."""
+    """Retrieve the AWS region from boto3 session, environment variables, or EC2 metadata.
+    The region is resolved on first call and cached. The EC2 metadata service is only
+    queried when no region is configured, and not when AWS_EC2_METADATA_DISABLED is set."""
+    region = None
     # Check if region is set in Boto3 session
     try:
         session = boto3.Session()
         region = session.region_name
         if region:
             print(f"Using region from boto3 session: {region}")
+            return region
     except Exception as e:
         print(f"Error fetching region from boto3: {e}")
+    if os.environ.get("AWS_EC2_METADATA_DISABLED", "").lower() == "true":
+        return region
     # Try fetching from EC2 Instance Metadata Service (IMDSv2)
+    import requests
     try:
         token = requests.put(
             "http://169.254.169.254/latest/api/token",
@@ -49,13 +63,40 @@ def get_aws_region() -> Optional[str]:
         print("Could not retrieve region from EC2 metadata.")
     return region
 
-region_name = get_aws_region()
-region_name = "us-east-1" if region_name is None else region_name
-# Initialize S3 client
-s3_client = boto3.client('s3', region_name=region_name)
-# Initialize the bedrock runtime client. This is used to 
-# query search results from the KBs
-bedrock_agent_runtime_client = boto3.client('bedrock-agent-runtime', region_name=region_name) 
+@functools.lru_cache(maxsize=None)
+def get_account_id() -> str:
+    """Retrieve the AWS account ID of the caller with STS, on first call, and cache it."""
+    return boto3.client('sts').get_caller_identity()['Account']
+
+def get_region_name() -> str:
+    """Region of the module level clients: the AWS region, or DEFAULT_REGION if none is found."""
+    region = get_aws_region()
+    return DEFAULT_REGION if region is None else region
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client():
+    """S3 client, created on first use"""
+    return boto3.client('s3', region_name=get_region_name())
+
+@functools.lru_cache(maxsize=None)
+def get_bedrock_agent_runtime_client():
+    """Bedrock agent runtime client, created on first use. This is used to
+    query search results from the KBs"""
+    return boto3.client('bedrock-agent-runtime', region_name=get_region_name())
+
+# The region and the clients used to be created when this module was imported. They are
+# now created on first access of these module attributes, so that importing the module
+# does not make network calls.
+_LAZY_ATTRIBUTES = {
+    "region_name": get_region_name,
+    "s3_client": get_s3_client,
+    "bedrock_agent_runtime_client": get_bedrock_agent_runtime_client,
+}
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def load_config(config_file: Union[Path, str]) -> Optional[Dict]:
     """
@@ -83,7 +124,7 @@ def upload_file_to_s3(file_path, bucket_name):
     file_name = os.path.basename(file_path)
     try:
         logger.info(f"Uploading file {file_name} to bucket {bucket_name}")
-        s3_client.upload_file(file_path, bucket_name, file_name)
+        get_s3_client().upload_file(file_path, bucket_name, file_name)
         logger.info(f"Successfully uploaded {file_name}")
     except Exception as e:
         logger.info(f"Error uploading file: {str(e)}")
@@ -104,7 +145,7 @@ def create_s3_bucket_for_kb(s3_bucket_name: str, region: str) -> bool:
         # First try to check if bucket exists
         try:
             s3_bucket_exists: bool = False
-            s3_client.head_bucket(Bucket=s3_bucket_name)
+            get_s3_client().head_bucket(Bucket=s3_bucket_name)
             logger.info(f"Bucket {s3_bucket_name} already exists and is accessible")
             s3_bucket_exists=True
         except ClientError as e:
@@ -114,16 +155,16 @@ def create_s3_bucket_for_kb(s3_bucket_name: str, region: str) -> bool:
         # Bucket doesn't exist, create it
         logger.info(f"Creating S3 bucket {s3_bucket_name} in region {region}")
         if region == 'us-east-1':
-            s3_client.create_bucket(Bucket=s3_bucket_name)
+            get_s3_client().create_bucket(Bucket=s3_bucket_name)
         else:
-            s3_client.create_bucket(
+            get_s3_client().create_bucket(
                 Bucket=s3_bucket_name,
                 CreateBucketConfiguration={
                     'LocationConstraint': region
                 }
             )   
         # Verify the bucket was created successfully by checking it exists
-        s3_client.head_bucket(Bucket=s3_bucket_name)
+        get_s3_client().head_bucket(Bucket=s3_bucket_name)
         logger.info(f"Successfully created and verified S3 bucket {s3_bucket_name}")
         s3_bucket_exists=True
     except ClientError as e:
@@ -139,11 +180,41 @@ def create_s3_bucket_for_kb(s3_bucket_name: str, region: str) -> bool:
         logger.error(f"Unexpected error creating/verifying S3 bucket: {str(e)}")
     return s3_bucket_exists
 
+def create_retrieval_cache_table(table_name: str, region: str) -> None:
+    """
+    Create the DynamoDB table used as the shared tier of the knowledge base lambda
+    retrieval cache, with a time to live on the expires_at attribute
+
+    Args:
+        table_name (str): Name of the DynamoDB table
+        region (str): AWS region of the table
+    """
+    dynamodb_client = boto3.client('dynamodb', region_name=region)
+    try:
+        dynamodb_client.create_table(
+            TableName=table_name,
+            KeySchema=[{'AttributeName': 'cache_key', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'cache_key', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        dynamodb_client.get_waiter('table_exists').wait(TableName=table_name)
+        logger.info(f"Created the retrieval cache table {table_name}")
+    except dynamodb_client.exceptions.ResourceInUseException:
+        logger.info(f"Retrieval cache table {table_name} already exists")
+    dynamodb_client.update_time_to_live(
+        TableName=table_name,
+        TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+    )
+
 def create_kb_lambda(
     lambda_function_name: str,
     source_code_file: str,
     region: str,
-    kb_id: str) -> str:
+    kb_id: str,
+    retrieval_cache_table: Optional[str] = None,
+    local_index_dir: Optional[str] = None,
+    layers: Optional[List[str]] = None,
+    admission_budgets: Optional[Dict] = None) -> str:
     """
     Creates a Lambda function for knowledge base queries
     
@@ -152,6 +223,14 @@ def create_kb_lambda(
         source_code_file (str): Name of the file containing the Lambda source code
         region (str): AWS region for the Lambda
         kb_id (str): Knowledge base ID
+        retrieval_cache_table (str, optional): DynamoDB table shared by the execution environments
+            of the lambda as a second tier of its retrieval cache, see create_retrieval_cache_table
+        local_index_dir (str, optional): Directory of the local indexes built with create_local_index.
+            The indexes are packaged with the lambda, which then answers queries from them instead
+            of the knowledge base. The local backend needs numpy, for example from one of the layers
+        layers (List[str], optional): ARNs of the lambda layers to add to the function
+        admission_budgets (Dict, optional): Budgets of the retrieve and invoke_model calls of the lambda,
+            the admission_control section of the config file, see utils/admission_control.py
     
     Returns:
         str: ARN of the created Lambda function
@@ -165,6 +244,29 @@ def create_kb_lambda(
 
         # Create IAM role for Lambda
         role_name = f"{lambda_function_name}-role"
+        # The lambda reads the ingestion generation of the knowledge base to invalidate its retrieval cache
+        policy_statements = [
+            {
+                "Effect": "Allow",
+                "Action": [
+                    "ssm:GetParameter"
+                ],
+                "Resource": [
+                    f"arn:aws:ssm:{region}:{account_id}:parameter/bedrock-kb/{kb_id}/*"
+                ]
+            }
+        ]
+        if retrieval_cache_table:
+            policy_statements.append({
+                "Effect": "Allow",
+                "Action": [
+                    "dynamodb:GetItem",
+                    "dynamodb:PutItem"
+                ],
+                "Resource": [
+                    f"arn:aws:dynamodb:{region}:{account_id}:table/{retrieval_cache_table}"
+                ]
+            })
         try:
             role = iam.create_role(
                 RoleName=role_name,
@@ -178,46 +280,6 @@ def create_kb_lambda(
                 })
             )
 
-            iam.put_role_policy(
-                RoleName=role_name,
-                PolicyName=f"{lambda_function_name}-policy",
-                PolicyDocument=json.dumps({
-                    "Version": "2012-10-17",
-                    "Statement": [
-                        {
-                            "Effect": "Allow",
-                            "Action": [
-                                "logs:CreateLogGroup",
-                                "logs:CreateLogStream",
-                                "logs:PutLogEvents"
-                            ],
-                            "Resource": [
-                                f"arn:aws:logs:{region}:{account_id}:log-group:/aws/lambda/{lambda_function_name}:*"
-                            ]
-                        },
-                        {
-                            "Effect": "Allow",
-                            "Action": [
-                                "bedrock:*",
-                                "bedrock-runtime:*",
-                                "bedrock-agent-runtime:*"
-                            ],
-                            "Resource": "*"
-                        },
-                        {
-                            "Effect": "Allow",
-                            "Action": [
-                                "bedrock:Retrieve",
-                            ],
-                            "Resource": [
-                                f"arn:aws:bedrock:{region}:{account_id}:knowledge-base/{kb_id}",
-                                f"arn:aws:bedrock:{region}:{account_id}:knowledge-base/{kb_id}/*"
-                            ]
-                        }
-                    ]
-                })
-            )
-
             # Attach AWS managed policies
             managed_policies = [
                 "arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole",
@@ -230,18 +292,65 @@ def create_kb_lambda(
                     PolicyArn=policy
                 )
 
-            # Wait for role to propagate
-            time.sleep(10)
+            # Wait until the role can be read back, create_function retries until Lambda can assume it
+            iam.get_waiter('role_exists').wait(RoleName=role_name)
 
         except iam.exceptions.EntityAlreadyExistsException:
             # If role exists, get its ARN
             role = iam.get_role(RoleName=role_name)
 
+        # The inline policy is put on an existing role too, so that a redeployed lambda gets the
+        # statements added since its role was created
+        iam.put_role_policy(
+            RoleName=role_name,
+            PolicyName=f"{lambda_function_name}-policy",
+            PolicyDocument=json.dumps({
+                "Version": "2012-10-17",
+                "Statement": [
+                    {
+                        "Effect": "Allow",
+                        "Action": [
+                            "logs:CreateLogGroup",
+                            "logs:CreateLogStream",
+                            "logs:PutLogEvents"
+                        ],
+                        "Resource": [
+                            f"arn:aws:logs:{region}:{account_id}:log-group:/aws/lambda/{lambda_function_name}:*"
+                        ]
+                    },
+                    {
+                        "Effect": "Allow",
+                        "Action": [
+                            "bedrock:*",
+                            "bedrock-runtime:*",
+                            "bedrock-agent-runtime:*"
+                        ],
+                        "Resource": "*"
+                    },
+                    {
+                        "Effect": "Allow",
+                        "Action": [
+                            "bedrock:Retrieve",
+                        ],
+                        "Resource": [
+                            f"arn:aws:bedrock:{region}:{account_id}:knowledge-base/{kb_id}",
+                            f"arn:aws:bedrock:{region}:{account_id}:knowledge-base/{kb_id}/*"
+                        ]
+                    }
+                ] + policy_statements
+            })
+        )
+
         # Package the Lambda code
-        _base_filename = source_code_file.split(".py")[0]
+        _base_filename = Path(source_code_file).stem
         s = BytesIO()
         with zipfile.ZipFile(s, "w") as z:
-            z.write(f"{source_code_file}")
+            z.write(source_code_file, Path(source_code_file).name)
+            z.write(Path(__file__).parent / "admission_control.py", "admission_control.py")
+            z.write(Path(__file__).parent / "retrieval_fusion.py", "retrieval_fusion.py")
+            if local_index_dir:
+                for index_file in sorted(Path(local_index_dir).glob("*/*")):
+                    z.write(index_file, f"local_index/{index_file.parent.name}/{index_file.name}")
         zip_content = s.getvalue()
 
         # Set environment variables
@@ -251,16 +360,27 @@ def create_kb_lambda(
                 "REGION": region
             }
         }
+        if retrieval_cache_table:
+            env_variables["Variables"]["RETRIEVAL_CACHE_TABLE"] = retrieval_cache_table
+        if local_index_dir:
+            env_variables["Variables"]["RETRIEVER_BACKEND"] = "local"
+        if admission_budgets:
+            env_variables["Variables"]["ADMISSION_BUDGETS"] = json.dumps(admission_budgets)
 
-        # Create Lambda function
-        lambda_function = lambda_client.create_function(
-            FunctionName=lambda_function_name,
-            Runtime=PYTHON_RUNTIME,
-            Timeout=PYTHON_TIMEOUT,
-            Role=role['Role']['Arn'],
-            Code={"ZipFile": zip_content},
-            Handler=f"{_base_filename}.lambda_handler",
-            Environment=env_variables
+        # Create Lambda function, retried with backoff until Lambda can assume the new role
+        lambda_function = retry_until_ready(
+            f"lambda function {lambda_function_name}",
+            lambda: lambda_client.create_function(
+                FunctionName=lambda_function_name,
+                Runtime=PYTHON_RUNTIME,
+                Timeout=PYTHON_TIMEOUT,
+                Role=role['Role']['Arn'],
+                Code={"ZipFile": zip_content},
+                Handler=f"{_base_filename}.lambda_handler",
+                Environment=env_variables,
+                Layers=layers or []
+            ),
+            is_role_not_ready
         )
 
         print(f"Lambda function created successfully: {lambda_function['FunctionArn']}")
@@ -270,11 +390,50 @@ def create_kb_lambda(
         print(f"Error creating Lambda function: {str(e)}")
         raise
 
-def query_knowledge_base(query: str, kb_id: str, kb_info: Dict) -> Optional[dict]:
+# Local vector store clients per index directory, created on first use by get_retriever
+_local_retrievers: Dict[str, "LocalRetrieveClient"] = {}
+
+def get_retriever(kb_info: Dict):
+    """
+    Return the client that answers the retrieve calls of query_knowledge_base. The
+    'retriever_backend' of the knowledge base information selects the bedrock agent
+    runtime client ('bedrock', default) or a local vector store client ('local') that
+    reads the indexes under 'local_index_dir' and does not need network access
+    """
+    if kb_info.get('retriever_backend', 'bedrock') != 'local':
+        return get_bedrock_agent_runtime_client()
+    # numpy is only imported when the local backend is used
+    from utils.local_vector_store import LocalRetrieveClient
+    index_dir = kb_info.get('local_index_dir', 'local_index')
+    if index_dir not in _local_retrievers:
+        _local_retrievers[index_dir] = LocalRetrieveClient(index_dir, get_region_name())
+    return _local_retrievers[index_dir]
+
+def create_local_index(index_name: str, source_files: List[str], kb_info: Dict,
+                       embedding_model: str = "hashing") -> dict:
+    """
+    Build a local index from the source files (for example the API specs of a knowledge base)
+    under the 'local_index_dir' of the knowledge base information. The index can then be queried
+    with query_knowledge_base using index_name as the knowledge base id and the 'local' backend.
+    The 'hashing' embedding model runs offline, a Titan text embeddings model id can be used instead
+    """
+    from utils.local_vector_store import build_index
+    index_dir = Path(kb_info.get('local_index_dir', 'local_index')) / index_name
+    manifest = build_index(source_files, index_dir, index_name, embedding_model, region=get_region_name())
+    # drop the loaded copy of a previous version of the index
+    _local_retrievers.pop(kb_info.get('local_index_dir', 'local_index'), None)
+    return manifest
+
+def query_knowledge_base(query: str, kb_id: Union[str, List[str]], kb_info: Dict,
+                         admission_controller=None) -> Optional[dict]:
     """
     Query the knowledge base using Retrieve API and return results
     Args:
         query (str): The query to send to the knowledge base
+        kb_id (Union[str, List[str]]): Knowledge base ID, or a list of knowledge base IDs that are
+        queried concurrently and whose chunks are fused (see query_knowledge_bases)
+        admission_controller (AdmissionController, optional): Controller that admits the retrieve
+        calls at the rate of their budget and retries them when throttled, see utils/admission_control.py
     Returns:
         dict: Dictionary containing retrieved chunks and their scores
         {
@@ -282,9 +441,14 @@ def query_knowledge_base(query: str, kb_id: str, kb_info: Dict) -> Optional[dict
             'raw_response': complete API response
         }
     """
+    if isinstance(kb_id, list):
+        return query_knowledge_bases(query, kb_id, kb_info, admission_controller)
     try:
         result: Optional[dict] = None
-        response_ret = bedrock_agent_runtime_client.retrieve(
+        retrieve = get_retriever(kb_info).retrieve
+        if admission_controller is not None:
+            retrieve = functools.partial(admission_controller.call, "retrieve", retrieve)
+        response_ret = retrieve(
             knowledgeBaseId=kb_id,
             retrievalQuery={
                 'text': query
@@ -314,17 +478,85 @@ def query_knowledge_base(query: str, kb_id: str, kb_info: Dict) -> Optional[dict
         result = None
     return result
 
-def query_lambda(query: str, region: str, kb_id: str, lambda_fn_name: str):
+def query_knowledge_bases(query: str, kb_ids: List[str], kb_info: Dict,
+                          admission_controller=None) -> Optional[dict]:
+    """
+    Query several knowledge bases concurrently and fuse their chunks with reciprocal rank fusion
+    Args:
+        query (str): The query to send to the knowledge bases
+        kb_ids (List[str]): Knowledge base IDs, for example the home network and doorbell knowledge bases
+        kb_info (Dict): Knowledge base information from the config file
+        admission_controller (AdmissionController, optional): Controller of the retrieve calls, see query_knowledge_base
+    Returns:
+        dict: Dictionary containing the fused chunks, each tagged with its 'kb_id', and the
+        complete API response of each knowledge base, or None if no knowledge base could be queried
+        {
+            'chunks': list of fused text chunks,
+            'raw_responses': complete API response per knowledge base ID
+        }
+    """
+    kb_ids = list(dict.fromkeys(kb_ids))
+    if not kb_ids:
+        return None
+    # create the client before the workers, as the boto3 default session is not thread safe
+    get_retriever(kb_info)
+    with ThreadPoolExecutor(max_workers=len(kb_ids)) as executor:
+        results = dict(zip(kb_ids, executor.map(lambda kb: query_knowledge_base(query, kb, kb_info, admission_controller), kb_ids)))
+    ranked_chunks = {
+        kb: sorted(result['chunks'], key=lambda chunk: chunk['score'], reverse=True)
+        for kb, result in results.items() if result is not None
+    }
+    if not ranked_chunks:
+        return None
+    return {
+        'chunks': reciprocal_rank_fusion(ranked_chunks, kb_info.get('rrf_k', DEFAULT_RRF_K)),
+        'raw_responses': {kb: results[kb]['raw_response'] for kb in ranked_chunks}
+    }
+
+def query_lambda(query: str, region: str, kb_id: Union[str, List[str]], lambda_fn_name: str,
+                 projection: str = "standard", rerank: str = "none"):
     """
-    Simple Lambda test function that matches local testing style
+    Simple Lambda test function that matches local testing style. The projection
+    ('minimal', 'standard' or 'debug') decides which fields the lambda returns per chunk
+    and the rerank mode ('none' or 'mmr') whether low scoring and redundant chunks are dropped.
+    If kb_id is a list, the lambda queries all the knowledge bases concurrently and returns
+    their fused chunks tagged with the knowledge base they come from
     """
     lambda_client = boto3.client('lambda', region_name=region)
     payload = {
         'body': json.dumps({
             'query': query,
+            ('kb_ids' if isinstance(kb_id, list) else 'kb_id'): kb_id,
+            'region': region,
+            'num_results': 5,
+            'projection': projection,
+            'rerank': rerank
+        })
+    }
+    response = lambda_client.invoke(
+        FunctionName=lambda_fn_name,
+        InvocationType='RequestResponse',
+        Payload=json.dumps(payload)
+    )
+    return json.loads(json.loads(response['Payload'].read())['body'])
+
+def query_lambda_batch(queries: List[str], region: str, kb_id: str, lambda_fn_name: str,
+                       projection: str = "standard", merge: bool = False, rerank: str = "none") -> dict:
+    """
+    Send several queries to the knowledge base lambda in a single invocation. The lambda runs
+    the retrieve calls concurrently and returns the per query results in the same order,
+    and the merged and deduplicated chunks of all queries if merge is set
+    """
+    lambda_client = boto3.client('lambda', region_name=region)
+    payload = {
+        'body': json.dumps({
+            'queries': queries,
             'kb_id': kb_id,
             'region': region,
-            'num_results': 5
+            'num_results': 5,
+            'projection': projection,
+            'merge': merge,
+            'rerank': rerank
         })
     }
     response = lambda_client.invoke(
@@ -332,4 +564,4 @@ def query_lambda(query: str, region: str, kb_id: str, lambda_fn_name: str):
         InvocationType='RequestResponse',
         Payload=json.dumps(payload)
     )
-    return json.loads(json.loads(response['Payload'].read())['body'])
\ No newline at end of file
+    return json.loads(json.loads(response['Payload'].read())['body'])
@@ -0,0 +1,166 @@
+# This file contains the waiters of the helpers, which poll the status of the resources they
+# create (agents, agent aliases, knowledge bases, ingestion jobs, OpenSearch Serverless
+# collections) until they are ready. Every resource is polled with exponential backoff and
+# jitter, starting with short delays so that fast transitions are seen early, and several
+# resources are waited on together by one scheduler that polls each of them when its own delay
+# expires, so that waiting for N resources takes as long as the slowest one instead of the sum.
+# Every wait has an overall deadline. The clock, sleep and random functions can be replaced,
+# for example by a fake clock in tests.
+#
+#   wait_all([WaitCondition(f"agent {agent_id}", lambda: get_status(agent_id), is_settled, is_failed)
+#             for agent_id in agent_ids], deadline_s=600)
+import time
+import random
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+DEFAULT_INITIAL_DELAY_S: float = 1.0
+DEFAULT_MAX_DELAY_S: float = 10.0
+DEFAULT_MULTIPLIER: float = 2.0
+# Overall deadline of a wait, long enough for an OpenSearch Serverless collection
+DEFAULT_DEADLINE_S: float = 900.0
+# Status of a resource that no longer exists, returned by the checks when the get call fails with
+# ResourceNotFoundException
+DELETED: str = "DELETED"
+
+class WaiterTimeout(TimeoutError):
+    """Raised when resources are not ready by the deadline of the wait, with their last status"""
+
+    def __init__(self, pending: Dict[str, Any], deadline_s: float):
+        self.pending = pending
+        super().__init__(f"Not ready after {deadline_s:.0f}s: " +
+                         ", ".join(f"{name} ({status})" for name, status in pending.items()))
+
+class WaiterFailure(RuntimeError):
+    """Raised when a resource reaches a failed status while it is waited on"""
+
+    def __init__(self, name: str, status: Any):
+        self.name = name
+        self.status = status
+        super().__init__(f"{name} failed with status {status}")
+
+def is_settled(status: str) -> bool:
+    """Whether a status is not transitional (CREATING, PREPARING, UPDATING, DELETING, ...)"""
+    return not status.endswith("ING")
+
+def is_failed(status: str) -> bool:
+    return status in ("FAILED", "CREATE_FAILED", "DELETE_FAILED")
+
+def is_role_not_ready(error: Exception) -> bool:
+    """
+    Whether the error is a service that cannot assume a new IAM role yet, for example the
+    'The role defined for the function cannot be assumed by Lambda' error of create_function
+    """
+    response = getattr(error, "response", None)
+    if not isinstance(response, dict):
+        return False
+    message = response.get("Error", {}).get("Message", "").lower()
+    return "role" in message and any(word in message for word in ("assume", "propagat", "trust"))
+
+class Backoff:
+    """
+    Delays between the polls of a resource: the delay is multiplied at every poll up to
+    max_delay_s, and a random share of it (jitter, between 0 and 1) is removed so that the
+    polls of resources created together do not stay in step
+    """
+
+    def __init__(self, initial_delay_s: float = DEFAULT_INITIAL_DELAY_S, max_delay_s: float = DEFAULT_MAX_DELAY_S,
+                 multiplier: float = DEFAULT_MULTIPLIER, jitter: float = 0.5, rng: random.Random = None):
+        self.initial_delay_s = initial_delay_s
+        self.max_delay_s = max_delay_s
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self._rng = rng or random.Random()
+
+    def delays(self) -> Iterator[float]:
+        delay = self.initial_delay_s
+        while True:
+            yield delay * (1.0 - self.jitter * self._rng.random())
+            delay = min(self.max_delay_s, delay * self.multiplier)
+
+class WaitCondition:
+    """
+    A resource to wait on: check returns its current status, ready tells whether the wait is
+    over for that status and failed whether the resource will never be ready
+    """
+
+    def __init__(self, name: str, check: Callable[[], Any], ready: Callable[[Any], bool] = is_settled,
+                 failed: Optional[Callable[[Any], bool]] = None):
+        self.name = name
+        self.check = check
+        self.ready = ready
+        self.failed = failed
+
+def wait_all(conditions: List[WaitCondition], deadline_s: float = DEFAULT_DEADLINE_S, backoff: Backoff = None,
+             clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep,
+             verbose: bool = False) -> Dict[str, Any]:
+    """
+    Wait until all the resources are ready, polling each one with its own backoff
+    Args:
+        conditions (List[WaitCondition]): The resources to wait on
+        deadline_s (float): Longest time to wait for all of them
+        backoff (Backoff, optional): Delays between the polls of a resource, defaults to Backoff()
+        verbose (bool): Whether to print the status of the resources that are not ready
+    Returns:
+        Dict[str, Any]: The last status of every resource by name
+    Raises:
+        WaiterFailure: If a resource reaches a failed status
+        WaiterTimeout: If some resources are not ready by the deadline
+    """
+    backoff = backoff or Backoff()
+    started = clock()
+    deadline = started + deadline_s
+    statuses: Dict[str, Any] = {}
+    # name -> (time of the next poll, delays of the resource)
+    pending: Dict[str, tuple] = {}
+    by_name = {condition.name: condition for condition in conditions}
+    for condition in conditions:
+        pending[condition.name] = (started, backoff.delays())
+    while pending:
+        name = min(pending, key=lambda n: pending[n][0])
+        next_poll, delays = pending[name]
+        now = clock()
+        if next_poll > now:
+            if next_poll > deadline:
+                raise WaiterTimeout({n: statuses.get(n) for n in pending}, deadline_s)
+            sleep(next_poll - now)
+        condition = by_name[name]
+        statuses[name] = condition.check()
+        if condition.failed is not None and condition.failed(statuses[name]):
+            raise WaiterFailure(name, statuses[name])
+        if condition.ready(statuses[name]):
+            del pending[name]
+            continue
+        if verbose:
+            print(f"Waiting for {name}, current status {statuses[name]}")
+        pending[name] = (clock() + next(delays), delays)
+    return statuses
+
+def wait_until(name: str, check: Callable[[], Any], ready: Callable[[Any], bool] = is_settled,
+               failed: Optional[Callable[[Any], bool]] = None, **kwargs) -> Any:
+    """
+    Wait until one resource is ready and return its last status, see wait_all for the other arguments
+    """
+    return wait_all([WaitCondition(name, check, ready, failed)], **kwargs)[name]
+
+def retry_until_ready(name: str, call: Callable[[], Any], retryable: Callable[[Exception], bool],
+                      deadline_s: float = DEFAULT_DEADLINE_S, backoff: Backoff = None,
+                      clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> Any:
+    """
+    Call until the call does not raise a retryable error, with backoff between the attempts. This
+    replaces the fixed pauses for resources whose readiness is only seen by using them, like an IAM
+    role that the service cannot assume until it has propagated.
+    Raises:
+        WaiterTimeout: If the call still raises a retryable error at the deadline
+    """
+    started = clock()
+    delays = (backoff or Backoff()).delays()
+    while True:
+        try:
+            return call()
+        except Exception as e:
+            if not retryable(e):
+                raise
+            delay = next(delays)
+            if clock() + delay > started + deadline_s:
+                raise WaiterTimeout({name: f"{type(e).__name__}: {e}"}, deadline_s) from e
+            sleep(delay)